@@ -0,0 +1,14 @@
+"""
+Houlihan Lokey FDD Automation - Local Tools
+============================================
+Python companions to the Snowflake deployment in ``sql/``. They run on an
+analyst workstation and follow the same business rules as the SQL objects.
+schedule_engine, ingest, synth and benchmark work without a warehouse.
+
+Modules:
+- schedule_engine: in-process reproduction of the Database tab export
+- ingest: streaming validation of large trial balance exports into Parquet parts
+- portfolio: concurrent generate_fdd_schedules runs across many deals
+- synth: synthetic multi-deal trial balances for load and performance tests
+- benchmark: per-stage timings and peak memory on DuckDB, checked against a baseline
+"""
@@ -0,0 +1,650 @@
+"""
+Houlihan Lokey FDD Automation - Pipeline Benchmark
+===================================================
+Times the data path of the FDD pipeline on synthetic data, on a workstation,
+so scaling problems show up before a client's deal does.
+
+Each stage reproduces, in embedded DuckDB, the SQL of the Snowflake object it
+is named after:
+
+- ``load``: ``COPY INTO trial_balance_raw`` / ``account_mappings`` plus the
+  ``balance_tolerance_dollars`` check of ``load_trial_balance``
+- ``sign_convention``: ``refresh_schedule_trial_balance`` (``classify_display_sign``)
+- ``pivot``: ``refresh_database_tab`` and the ``build_database_tab_sql`` pivot
+- ``variance``: ``v_variance_candidates`` and the per-deal selection of
+  ``generate_ai_insights`` (Cortex is not called)
+- ``data_quality``: the full-scan path of ``validate_data_quality`` against the
+  ``dq_rules`` seed
+- ``export``: ``export_partitioned`` (gzip CSV files per deal)
+
+DuckDB is a stand-in engine. Absolute timings say nothing about warehouse
+credits. Relative changes between runs on the same machine do show when a
+change to the SQL or the data shape makes a stage slower or hungrier.
+
+Every stage records wall-clock seconds and the peak resident memory of the
+process while it ran. With ``--repeat``, the median time and the highest
+peak are kept. The results are written as JSON. ``--save-baseline`` stores
+them as a baseline. ``--baseline`` compares a run with a stored baseline
+and exits with 1 when a stage is slower than ``--tolerance`` or uses more
+memory than ``--memory-tolerance`` (relative to the baseline). It also exits
+with 1 when a stage fails, for example when it runs out of memory.
+
+Usage:
+    python -m fdd_tools.benchmark --preset smoke --save-baseline bench/baseline_smoke.json
+    python -m fdd_tools.benchmark --preset smoke --baseline bench/baseline_smoke.json
+    python -m fdd_tools.benchmark --preset portfolio --memory-limit 16GB --out bench/portfolio.json
+    python -m fdd_tools.benchmark --data build/synth_200 --repeat 1     # data from fdd_tools.synth
+
+Baselines are only comparable on the same machine, DuckDB version and
+scenario. A baseline for a different scenario is rejected.
+
+Requires duckdb (see fdd_tools/environment.yml).
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from fdd_tools.synth import MAPPINGS_FILE, TB_FILE, SynthError, SynthSpec, generate
+
+# Scenarios. "portfolio" is the 200-deal x 5,000-account target (24M rows)
+PRESETS = {
+    "smoke": {"deals": 2, "accounts": 100, "periods": 24, "entities": 1},
+    "medium": {"deals": 20, "accounts": 1000, "periods": 24, "entities": 2},
+    "large": {"deals": 50, "accounts": 5000, "periods": 24, "entities": 1},
+    "portfolio": {"deals": 200, "accounts": 5000, "periods": 24, "entities": 1},
+}
+
+STAGES = ["load", "sign_convention", "pivot", "variance", "data_quality", "export"]
+
+# Defaults mirror the seeded values in sql/00_system_config.sql
+DEFAULT_SETTINGS = {
+    "balance_tolerance_dollars": 0.10,
+    "min_variance_amount": 5000.00,
+    "variance_threshold_pct": 0.20,
+    "max_ai_insights": 15,
+    "max_pivot_periods": 24,
+    "dq_outlier_zscore": 4,
+}
+
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MEMORY_TOLERANCE = 0.25
+# Stages this fast are dominated by timer and scheduler noise
+DEFAULT_NOISE_SECONDS = 0.05
+DEFAULT_NOISE_MB = 16
+
+# dq_rules seed in sql/03_data_procedures.sql
+DQ_RULES = [
+    ("Trial Balance Existence", "tb_rows", 1, None, "CRITICAL", None, None),
+    ("Account Mapping Completeness", "unmapped_accounts", None, 0, "WARNING", 5, "ERROR"),
+    ("Period Continuity", "missing_periods", None, 0, "WARNING", None, None),
+    ("Revenue Sign Check", "revenue_sign_rows", None, 0, "WARNING", None, None),
+    ("Duplicate Records", "duplicate_rows", None, 0, "ERROR", None, None),
+    ("Account Outliers", "outlier_rows", None, 0, "WARNING", None, None),
+    ("Entity Completeness", "missing_entity_periods", None, 0, "WARNING", None, None),
+]
+
+SAMPLE_INTERVAL_SECONDS = 0.01
+
+
+class BenchmarkError(Exception):
+    """The benchmark cannot run or cannot be compared (missing duckdb, data or baseline)."""
+
+
+# =====================================================
+# MEMORY SAMPLING
+# =====================================================
+
+def _rss_bytes():
+    """Current resident set size, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss_bytes():
+    """Process high-water mark (ru_maxrss is KB on Linux, bytes on macOS)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakMemory:
+    """Samples RSS on a background thread while the block runs.
+
+    DuckDB allocates outside the Python heap, so tracemalloc would not see
+    it. Where /proc is missing, the process high-water mark is reported,
+    which never goes down between stages.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes() or 0)
+
+    def __enter__(self):
+        self.peak = _rss_bytes() or 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        current = _rss_bytes()
+        self.peak = max(self.peak, current) if current is not None else (_max_rss_bytes() or 0)
+        return False
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / (1024 * 1024), 1)
+
+
+# =====================================================
+# STAGES
+# =====================================================
+
+def _quote(path):
+    return "'" + path.replace("'", "''") + "'"
+
+
+def stage_load(con, data_dir, settings):
+    con.execute(f"""
+        CREATE OR REPLACE TABLE trial_balance_raw AS
+        SELECT *, account_number || ' - ' || account_name AS unique_id
+        FROM read_csv({_quote(os.path.join(data_dir, TB_FILE))}, header = true,
+            nullstr = ['NULL', 'null', '', 'N/A', 'n/a'],
+            columns = {{
+                'deal_id': 'VARCHAR', 'deal_name': 'VARCHAR', 'entity': 'VARCHAR',
+                'period_date': 'DATE', 'account_number': 'VARCHAR', 'account_name': 'VARCHAR',
+                'debit_amount': 'DECIMAL(18,2)', 'credit_amount': 'DECIMAL(18,2)',
+                'net_amount': 'DECIMAL(18,2)'
+            }})
+    """)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE account_mappings AS
+        SELECT *,
+            CASE
+                WHEN statement_type = 'IS' AND mapping_level_1 = 'Revenue' THEN 'NEGATE'
+                WHEN statement_type = 'BS' AND mapping_level_1 = 'Assets'
+                     AND (account_name ILIKE '%accumulated depreciation%'
+                          OR account_name ILIKE '%allowance%'
+                          OR account_name ILIKE '%reserve%') THEN 'AS_IS'
+                ELSE 'ABS'
+            END AS display_sign_rule,
+            TRUE AS is_active
+        FROM read_csv({_quote(os.path.join(data_dir, MAPPINGS_FILE))}, header = true,
+            nullstr = ['NULL', 'null', '', 'N/A', 'n/a'],
+            columns = {{
+                'deal_id': 'VARCHAR', 'account_number': 'VARCHAR', 'account_name': 'VARCHAR',
+                'account_category': 'VARCHAR', 'statement_type': 'VARCHAR',
+                'mapping_level_1': 'VARCHAR', 'mapping_level_2': 'VARCHAR', 'mapping_level_3': 'VARCHAR',
+                'sort_order_l1': 'DECIMAL(10,2)', 'sort_order_l2': 'DECIMAL(10,2)', 'sort_order_l3': 'DECIMAL(10,2)'
+            }})
+    """)
+    rows, unbalanced = con.execute(f"""
+        SELECT (SELECT COUNT(*) FROM trial_balance_raw), COUNT(*) FILTER (WHERE imbalance > {settings['balance_tolerance_dollars']})
+        FROM (
+            SELECT deal_id, period_date, ABS(SUM(debit_amount) - SUM(credit_amount)) AS imbalance
+            FROM trial_balance_raw
+            GROUP BY deal_id, period_date
+        )
+    """).fetchone()
+    return {"rows": rows, "unbalanced_periods": unbalanced}
+
+
+def stage_sign_convention(con, data_dir, settings):
+    con.execute("""
+        CREATE OR REPLACE TABLE trial_balance_for_schedules AS
+        SELECT
+            t.deal_id, t.deal_name, t.entity, t.period_date, t.account_number, t.account_name, t.unique_id,
+            t.debit_amount, t.credit_amount, t.net_amount AS net_amount_raw,
+            CASE m.display_sign_rule
+                WHEN 'NEGATE' THEN t.net_amount * -1
+                WHEN 'AS_IS' THEN t.net_amount
+                ELSE ABS(t.net_amount)
+            END AS amount_for_display,
+            m.display_sign_rule, m.account_category, m.statement_type,
+            m.mapping_level_1, m.mapping_level_2, m.mapping_level_3,
+            m.sort_order_l1, m.sort_order_l2, m.sort_order_l3
+        FROM trial_balance_raw t
+        JOIN account_mappings m
+            ON t.deal_id = m.deal_id AND t.account_number = m.account_number
+        WHERE m.is_active = TRUE
+    """)
+    return {"rows": con.execute("SELECT COUNT(*) FROM trial_balance_for_schedules").fetchone()[0]}
+
+
+def stage_pivot(con, data_dir, settings):
+    con.execute(f"""
+        CREATE OR REPLACE TABLE database_tab_periods AS
+        SELECT
+            deal_id,
+            ROW_NUMBER() OVER (PARTITION BY deal_id ORDER BY period_date) AS period_rank,
+            period_date,
+            strftime(period_date, '%b-%Y') AS period_label
+        FROM (
+            SELECT DISTINCT deal_id, period_date
+            FROM trial_balance_raw
+            QUALIFY DENSE_RANK() OVER (PARTITION BY deal_id ORDER BY period_date DESC) <= {int(settings['max_pivot_periods'])}
+        )
+    """)
+    con.execute("""
+        CREATE OR REPLACE TABLE database_tab_cache AS
+        SELECT
+            t.deal_id, t.deal_name, t.entity, t.account_number, t.account_name, t.unique_id,
+            t.mapping_level_1, t.mapping_level_2, t.mapping_level_3, t.statement_type,
+            t.sort_order_l1, t.sort_order_l2, p.period_rank, p.period_label,
+            MAX(t.amount_for_display) AS amount_for_display
+        FROM trial_balance_for_schedules t
+        JOIN database_tab_periods p
+            ON p.deal_id = t.deal_id
+            AND p.period_date = t.period_date
+        GROUP BY ALL
+    """)
+    width = con.execute("SELECT COALESCE(MAX(period_rank), 0) FROM database_tab_periods").fetchone()[0]
+    suffixes = [(n, f"{n:02d}") for n in range(1, width + 1)]
+    labels = ", ".join(f"MAX(CASE WHEN period_rank = {n} THEN period_label END) AS period_{s}_label" for n, s in suffixes)
+    amounts = ", ".join(f"MAX(CASE WHEN period_rank = {n} THEN amount_for_display END) AS period_{s}" for n, s in suffixes)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE database_tab AS
+        SELECT
+            deal_id, deal_name, entity, account_number, account_name, unique_id,
+            mapping_level_1, mapping_level_2, mapping_level_3, statement_type,
+            sort_order_l1, sort_order_l2, {labels}, {amounts}
+        FROM database_tab_cache
+        GROUP BY 1,2,3,4,5,6,7,8,9,10,11,12
+    """)
+    return {"rows": con.execute("SELECT COUNT(*) FROM database_tab").fetchone()[0], "periods": width}
+
+
+def stage_variance(con, data_dir, settings):
+    con.execute(f"""
+        CREATE OR REPLACE TABLE variance_prompts AS
+        WITH v_variance_candidates AS (
+            SELECT
+                t1.deal_id, t1.entity, t1.period_date, t1.account_number, t1.account_name,
+                t1.net_amount, t2.net_amount AS prior_net_amount, t2.period_date AS prior_period_date,
+                ABS(t2.net_amount) AS prior_abs_amount,
+                ABS((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0)) AS variance_ratio,
+                ROUND((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0) * 100, 2) AS var_pct
+            FROM trial_balance_raw t1
+            JOIN trial_balance_raw t2
+                ON t1.deal_id = t2.deal_id
+                AND t1.account_number = t2.account_number
+                AND t1.entity = t2.entity
+                AND t2.period_date = CAST(t1.period_date - INTERVAL 1 MONTH AS DATE)
+        )
+        SELECT
+            *,
+            CASE
+                WHEN ABS(var_pct) > 50 THEN 'high'
+                WHEN ABS(var_pct) > 30 THEN 'medium'
+                ELSE 'low'
+            END AS severity
+        FROM v_variance_candidates
+        WHERE prior_abs_amount > {settings['min_variance_amount']}
+          AND variance_ratio > {settings['variance_threshold_pct']}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY deal_id ORDER BY ABS(var_pct) DESC) <= {int(settings['max_ai_insights'])}
+    """)
+    return {"rows": con.execute("SELECT COUNT(*) FROM variance_prompts").fetchone()[0]}
+
+
+def stage_data_quality(con, data_dir, settings):
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE dq_rows AS
+        SELECT
+            t.deal_id, t.period_date, t.account_number,
+            COALESCE(t.entity, '') AS entity,
+            t.net_amount,
+            m.account_number IS NULL AS is_unmapped,
+            COALESCE(m.is_revenue AND t.net_amount > 0, FALSE) AS is_revenue_debit
+        FROM trial_balance_raw t
+        LEFT JOIN (
+            SELECT deal_id, account_number, BOOL_OR(mapping_level_1 = 'Revenue') AS is_revenue
+            FROM account_mappings
+            GROUP BY deal_id, account_number
+        ) m ON m.deal_id = t.deal_id AND m.account_number = t.account_number
+    """)
+    con.execute("""
+        CREATE OR REPLACE TABLE dq_account_baselines AS
+        SELECT deal_id, account_number, entity,
+               AVG(net_amount) AS mean_amount, STDDEV_SAMP(net_amount) AS stddev_amount, COUNT(*) AS periods
+        FROM dq_rows
+        GROUP BY deal_id, account_number, entity
+    """)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE dq_period_metrics AS
+        SELECT
+            r.deal_id,
+            r.period_date,
+            COUNT(*) AS tb_rows,
+            list(DISTINCT r.account_number) FILTER (WHERE r.is_unmapped) AS unmapped_accounts,
+            COUNT(*) FILTER (WHERE r.is_revenue_debit) AS revenue_sign_rows,
+            COUNT(*) - COUNT(DISTINCT (r.account_number, r.entity)) AS duplicate_rows,
+            COUNT(*) FILTER (WHERE b.stddev_amount > 0
+                             AND ABS(r.net_amount - b.mean_amount) > {settings['dq_outlier_zscore']} * b.stddev_amount) AS outlier_rows,
+            list(DISTINCT r.entity) AS entities
+        FROM dq_rows r
+        LEFT JOIN dq_account_baselines b
+            ON b.deal_id = r.deal_id
+            AND b.account_number = r.account_number
+            AND b.entity = r.entity
+        GROUP BY r.deal_id, r.period_date
+    """)
+    rules = ", ".join(
+        "(" + ", ".join("NULL" if v is None else repr(v) for v in rule) + ")" for rule in DQ_RULES
+    )
+    con.execute(f"""
+        CREATE OR REPLACE TABLE dq_results AS
+        WITH deal_metrics AS (
+            SELECT
+                deal_id,
+                SUM(tb_rows) AS tb_rows,
+                len(list_distinct(flatten(list(COALESCE(unmapped_accounts, []))))) AS unmapped_accounts,
+                DATEDIFF('month', MIN(period_date), MAX(period_date)) + 1 - COUNT(*) AS missing_periods,
+                SUM(revenue_sign_rows) AS revenue_sign_rows,
+                SUM(duplicate_rows) AS duplicate_rows,
+                SUM(outlier_rows) AS outlier_rows,
+                len(list_distinct(flatten(list(entities)))) * COUNT(*) - SUM(len(entities)) AS missing_entity_periods
+            FROM dq_period_metrics
+            GROUP BY deal_id
+        ),
+        metrics AS (
+            UNPIVOT deal_metrics ON COLUMNS(* EXCLUDE (deal_id)) INTO NAME metric_name VALUE metric_value
+        ),
+        rules (rule_name, metric_name, min_pass, max_pass, fail_severity, escalate_at, escalated_severity) AS (
+            VALUES {rules}
+        ),
+        evaluated AS (
+            SELECT
+                m.deal_id, r.*, m.metric_value,
+                COALESCE(m.metric_value >= COALESCE(r.min_pass, m.metric_value)
+                         AND m.metric_value <= COALESCE(r.max_pass, m.metric_value), FALSE) AS passed
+            FROM rules r
+            JOIN metrics m ON m.metric_name = r.metric_name
+        )
+        SELECT
+            deal_id, rule_name AS check_name, metric_value, passed,
+            CASE
+                WHEN passed THEN 'INFO'
+                WHEN escalate_at IS NOT NULL AND metric_value >= escalate_at THEN escalated_severity
+                ELSE fail_severity
+            END AS severity
+        FROM evaluated
+    """)
+    checks, failed = con.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE NOT passed) FROM dq_results").fetchone()
+    return {"rows": checks, "failed_checks": failed}
+
+
+def stage_export(con, data_dir, settings, export_dir):
+    shutil.rmtree(export_dir, ignore_errors=True)
+    con.execute(f"""
+        COPY (
+            SELECT * FROM database_tab
+            ORDER BY deal_id, sort_order_l1 NULLS LAST, sort_order_l2 NULLS LAST, account_number NULLS LAST
+        ) TO {_quote(export_dir)} (FORMAT CSV, HEADER, COMPRESSION GZIP, PARTITION_BY (deal_id))
+    """)
+    files = [os.path.join(root, name) for root, _, names in os.walk(export_dir) for name in names]
+    return {
+        "rows": con.execute("SELECT COUNT(*) FROM database_tab").fetchone()[0],
+        "files": len(files),
+        "bytes": sum(os.path.getsize(f) for f in files),
+    }
+
+
+# =====================================================
+# RUNNER
+# =====================================================
+
+def _connect(work_dir, threads=None, memory_limit=None):
+    try:
+        import duckdb
+    except ImportError as exc:
+        raise BenchmarkError("The benchmark requires duckdb (see fdd_tools/environment.yml)") from exc
+    con = duckdb.connect()
+    con.execute(f"SET temp_directory = {_quote(os.path.join(work_dir, 'spill'))}")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    if memory_limit:
+        con.execute(f"SET memory_limit = {_quote(memory_limit)}")
+    return con, duckdb.__version__
+
+
+def run_pipeline(data_dir, work_dir, settings=None, threads=None, memory_limit=None):
+    """Run every stage once on a fresh in-memory database.
+
+    Returns ``{stage: {"status", "seconds", "peak_rss_mb", ...details}}``. A
+    failed stage records its error, and the stages after it are not run.
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    con, _ = _connect(work_dir, threads, memory_limit)
+    stages = {
+        "load": stage_load,
+        "sign_convention": stage_sign_convention,
+        "pivot": stage_pivot,
+        "variance": stage_variance,
+        "data_quality": stage_data_quality,
+        "export": lambda c, d, s: stage_export(c, d, s, os.path.join(work_dir, "export")),
+    }
+    results = {}
+    try:
+        for name in STAGES:
+            memory = PeakMemory()
+            started = time.perf_counter()
+            try:
+                with memory:
+                    details = stages[name](con, data_dir, settings)
+            except Exception as exc:  # out of memory, disk full, SQL errors at scale
+                results[name] = {"status": "FAILED", "error": str(exc).splitlines()[0],
+                                 "seconds": round(time.perf_counter() - started, 4), "peak_rss_mb": memory.peak_mb}
+                break
+            results[name] = dict(status="OK", seconds=round(time.perf_counter() - started, 4),
+                                 peak_rss_mb=memory.peak_mb, **details)
+    finally:
+        con.close()
+    return results
+
+
+def summarize(runs):
+    """Fold repeated runs: median seconds, highest peak memory, details of the last run."""
+    summary = {}
+    for name in STAGES:
+        attempts = [run[name] for run in runs if name in run]
+        if not attempts:
+            continue
+        if any(a["status"] != "OK" for a in attempts):
+            summary[name] = next(a for a in attempts if a["status"] != "OK")
+            continue
+        stage = dict(attempts[-1])
+        stage["seconds"] = round(statistics.median(a["seconds"] for a in attempts), 4)
+        stage["peak_rss_mb"] = max(a["peak_rss_mb"] for a in attempts)
+        stage["runs"] = [a["seconds"] for a in attempts]
+        summary[name] = stage
+    return summary
+
+
+def benchmark(spec=None, data_dir=None, work_dir=None, repeat=3, threads=None, memory_limit=None, settings=None):
+    """Generate (or reuse) a data set, run the pipeline ``repeat`` times and return the results dict."""
+    own_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="fdd_bench_")
+    try:
+        generate_seconds = None
+        if data_dir is None:
+            data_dir = os.path.join(work_dir, "data")
+            manifest = generate(spec or SynthSpec(), data_dir)
+            generate_seconds = manifest["elapsed_seconds"]
+        manifest_path = os.path.join(data_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            raise BenchmarkError(f"{data_dir} has no manifest.json; generate it with fdd_tools.synth")
+        with open(manifest_path, encoding="utf-8") as handle:
+            manifest = json.load(handle)
+
+        runs = [run_pipeline(data_dir, work_dir, settings, threads, memory_limit) for _ in range(max(1, repeat))]
+        stages = summarize(runs)
+        con, engine_version = _connect(work_dir)
+        con.close()
+
+        # The generator knows which periods it unbalanced; the load check must agree
+        load = stages.get("load", {})
+        expected = len(manifest["unbalanced_periods"])
+        if load.get("status") == "OK" and load["unbalanced_periods"] != expected:
+            load["status"] = "FAILED"
+            load["error"] = f"balance check found {load['unbalanced_periods']} unbalanced periods, generator made {expected}"
+
+        return {
+            "scenario": {key: manifest["spec"][key] for key in ("deals", "accounts", "periods", "entities",
+                                                              "imbalance_rate", "seed")},
+            "rows": manifest["rows"],
+            "engine": {"name": "duckdb", "version": engine_version, "threads": threads, "memory_limit": memory_limit},
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} cpus)",
+            "repeat": max(1, repeat),
+            "generate_seconds": generate_seconds,
+            "stages": stages,
+            "total_seconds": round(sum(s["seconds"] for s in stages.values()), 4),
+            "failed": any(s["status"] != "OK" for s in stages.values()) or len(stages) < len(STAGES),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+    finally:
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE, memory_tolerance=DEFAULT_MEMORY_TOLERANCE,
+                        noise_seconds=DEFAULT_NOISE_SECONDS, noise_mb=DEFAULT_NOISE_MB):
+    """Regressions of ``results`` against ``baseline``, as a list of messages.
+
+    A stage regresses when it is more than ``tolerance`` slower (and more than
+    ``noise_seconds`` slower in absolute terms), or when its peak memory is
+    more than ``memory_tolerance`` higher (and more than ``noise_mb`` higher).
+    """
+    if results["scenario"] != baseline["scenario"]:
+        raise BenchmarkError(f"baseline scenario {baseline['scenario']} does not match {results['scenario']}")
+    regressions = []
+    for name in STAGES:
+        base = baseline["stages"].get(name)
+        stage = results["stages"].get(name)
+        if base is None or base.get("status") != "OK":
+            continue
+        if stage is None or stage["status"] != "OK":
+            regressions.append(f"{name}: {stage['error'] if stage else 'not reached'}")
+            continue
+        slower = stage["seconds"] - base["seconds"]
+        if stage["seconds"] > base["seconds"] * (1 + tolerance) and slower > noise_seconds:
+            regressions.append(f"{name}: {stage['seconds']:.3f}s vs baseline {base['seconds']:.3f}s "
+                               f"(+{slower / base['seconds']:.0%})" if base["seconds"] else
+                               f"{name}: {stage['seconds']:.3f}s vs baseline 0s")
+        grown = stage["peak_rss_mb"] - base["peak_rss_mb"]
+        if stage["peak_rss_mb"] > base["peak_rss_mb"] * (1 + memory_tolerance) and grown > noise_mb:
+            regressions.append(f"{name}: peak memory {stage['peak_rss_mb']:.0f} MB vs baseline "
+                               f"{base['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+# =====================================================
+# CLI
+# =====================================================
+
+def _write_json(path, payload):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the FDD pipeline stages on synthetic data")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="smoke")
+    parser.add_argument("--deals", type=int, help="Override the preset")
+    parser.add_argument("--accounts", type=int, help="Override the preset")
+    parser.add_argument("--periods", type=int, help="Override the preset")
+    parser.add_argument("--entities", type=int, help="Override the preset")
+    parser.add_argument("--imbalance-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=SynthSpec.seed)
+    parser.add_argument("--data", help="Existing fdd_tools.synth output directory (skips generation)")
+    parser.add_argument("--work-dir", help="Directory for generated data, spill files and exports (default: a temp dir)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, help="DuckDB threads (default: all cores)")
+    parser.add_argument("--memory-limit", help="DuckDB memory_limit, e.g. 8GB")
+    parser.add_argument("--out", help="Write the results JSON to this path")
+    parser.add_argument("--baseline", help="Baseline JSON to compare with")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Store this run as a baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown per stage (0.25 = 25%%)")
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE,
+                        help="Allowed peak memory growth per stage")
+    args = parser.parse_args(argv)
+
+    scenario = dict(PRESETS[args.preset])
+    for key in scenario:
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+    spec = SynthSpec(imbalance_rate=args.imbalance_rate, seed=args.seed, **scenario)
+
+    try:
+        if args.baseline and not os.path.exists(args.baseline):
+            raise BenchmarkError(f"baseline {args.baseline} does not exist; create it with --save-baseline")
+        results = benchmark(spec, args.data, args.work_dir, args.repeat, args.threads, args.memory_limit)
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as handle:
+                regressions = compare_to_baseline(results, json.load(handle), args.tolerance, args.memory_tolerance)
+    except (BenchmarkError, SynthError) as exc:
+        print(f"ERROR: {exc}")
+        return 2
+
+    s = results["scenario"]
+    print(f"{results['rows']:,} rows ({s['deals']} deals x {s['accounts']} accounts x {s['periods']} periods x "
+          f"{s['entities']} entities), duckdb {results['engine']['version']}, median of {results['repeat']}")
+    for name in STAGES:
+        stage = results["stages"].get(name)
+        if stage is None:
+            print(f"  {name:<16} not reached")
+        elif stage["status"] != "OK":
+            print(f"  {name:<16} FAILED after {stage['seconds']:.2f}s: {stage['error']}")
+        else:
+            print(f"  {name:<16} {stage['seconds']:>9.3f}s  {stage['peak_rss_mb']:>9.1f} MB  {stage['rows']:>12,} rows")
+    print(f"  {'total':<16} {results['total_seconds']:>9.3f}s")
+
+    if args.out:
+        _write_json(args.out, results)
+        print(f"Wrote {args.out}")
+    if args.save_baseline:
+        _write_json(args.save_baseline, results)
+        print(f"Saved baseline {args.save_baseline}")
+
+    if results["failed"]:
+        print("FAILED: the pipeline did not complete at this scale")
+        return 1
+    if regressions:
+        print(f"REGRESSION: {len(regressions)} stage(s) beyond tolerance")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    if args.baseline:
+        print(f"OK: within {args.tolerance:.0%} time and {args.memory_tolerance:.0%} memory of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,504 @@
+"""
+Houlihan Lokey FDD Automation - Streaming Trial Balance Ingestion
+==================================================================
+Validates and converts trial balance exports of any size into compressed
+Parquet parts ready for ``PUT`` to ``@fdd_input_stage``, before any warehouse
+time is spent on ``COPY INTO``.
+
+The file is read as a stream of chunks, so memory stays flat no matter how
+large the export is. Only the running debit/credit totals per
+(deal_id, period_date) are kept, plus the per-account totals when
+``--aggregate`` is used. Each record is checked with the same rules the
+Snowflake side enforces:
+
+- ``deal_id`` matches ``deal_id_validation_regex`` and ``max_deal_id_length``
+- ``period_date`` and ``account_number`` are present (NOT NULL in trial_balance_raw)
+- amounts parse as NUMBER(18,2)
+
+Rejected rows go to ``rejects.csv`` with their line number. If the reject rate
+exceeds ``max_error_rate_pct``, the parts are deleted and the exit code is 1.
+This is the same threshold at which ``load_trial_balance`` would roll back.
+Unbalanced periods (``balance_tolerance_dollars``) are reported as warnings,
+as the load procedure does.
+
+General-ledger-level exports carry many rows per account and period.
+``--aggregate`` sums them to one trial balance row per (deal_id, entity,
+period_date, account_number), which matches the primary key of
+trial_balance_raw.
+
+Usage:
+    python -m fdd_tools.ingest GL_EXPORT.csv --out build/deal_hl_002
+    python -m fdd_tools.ingest GL_EXPORT.csv.gz --out build/deal_hl_002 --aggregate
+    python -m fdd_tools.ingest GL_EXPORT.csv --check     # validate only, no files written
+
+Then stage and load the parts:
+    PUT file://build/deal_hl_002/*.parquet @fdd_input_stage/deal_hl_002/ AUTO_COMPRESS=FALSE;
+    CALL load_trial_balance('deal_hl_002/', 'DEAL_HL_002');
+
+Writing Parquet requires pyarrow (see fdd_tools/environment.yml); ``--check``
+runs without it.
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from fdd_tools.schedule_engine import _clean, _format_cents
+
+# Defaults mirror the seeded values in sql/00_system_config.sql
+DEFAULT_DEAL_ID_REGEX = r"^[A-Z0-9_-]+$"
+DEFAULT_MAX_DEAL_ID_LENGTH = 50
+DEFAULT_MAX_ERROR_RATE = 0.05
+DEFAULT_BALANCE_TOLERANCE = Decimal("0.10")
+
+DEFAULT_CHUNK_ROWS = 50_000
+DEFAULT_ROWS_PER_FILE = 2_000_000
+
+# trial_balance_raw columns carried in the Parquet parts (names match the table
+# so load_trial_balance can use MATCH_BY_COLUMN_NAME)
+OUTPUT_COLUMNS = [
+    "deal_id", "deal_name", "entity", "period_date", "account_number",
+    "account_name", "debit_amount", "credit_amount", "net_amount",
+]
+REQUIRED_COLUMNS = ["deal_id", "period_date", "account_number", "debit_amount", "credit_amount"]
+AMOUNT_COLUMNS = ["debit_amount", "credit_amount", "net_amount"]
+
+# Snowflake DATE_INPUT_FORMAT AUTO accepts these for csv_format loads
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d-%b-%Y")
+
+# NUMBER(18,2): at most 16 digits before the decimal point
+MAX_AMOUNT = Decimal("1e16")
+
+_CENT = Decimal("0.01")
+
+
+class IngestError(Exception):
+    """The input cannot be processed at all (missing file, bad header)."""
+
+
+# =====================================================
+# READING
+# =====================================================
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8-sig", newline="")
+    return open(path, newline="", encoding="utf-8-sig")
+
+
+def iter_records(path):
+    """Yield (line_number, {column: cleaned value}) for each data row of a CSV.
+
+    Applies the csv_format rules: TRIM_SPACE, NULL_IF and no error on column
+    count mismatch (short rows are padded, long rows truncated).
+    """
+    with _open_text(path) as handle:
+        reader = csv.reader(handle)
+        try:
+            header = [h.strip().lower() for h in next(reader)]
+        except StopIteration:
+            raise IngestError(f"{path} is empty")
+        missing = [c for c in REQUIRED_COLUMNS if c not in header]
+        if missing:
+            raise IngestError(f"{path} is missing required columns: {', '.join(missing)}")
+        width = len(header)
+        for record in reader:
+            if not record:
+                continue
+            if len(record) != width:
+                record = (record + [None] * width)[:width]
+            yield reader.line_num, {name: _clean(value) for name, value in zip(header, record)}
+
+
+def chunked(iterable, size):
+    """Group an iterable into lists of at most ``size`` items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# =====================================================
+# VALIDATION
+# =====================================================
+
+def _parse_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_amount(value):
+    try:
+        amount = Decimal(value).quantize(_CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+        return None
+    return amount
+
+
+class RecordValidator:
+    """Type and security checks for one trial balance record."""
+
+    def __init__(self, deal_id_regex=DEFAULT_DEAL_ID_REGEX, max_deal_id_length=DEFAULT_MAX_DEAL_ID_LENGTH):
+        self.deal_id_pattern = re.compile(deal_id_regex)
+        self.max_deal_id_length = max_deal_id_length
+
+    def validate(self, record):
+        """Return (row, None) with typed values, or (None, error message)."""
+        deal_id = record.get("deal_id")
+        if deal_id is None:
+            return None, "deal_id is NULL"
+        if len(deal_id) > self.max_deal_id_length or not self.deal_id_pattern.match(deal_id):
+            return None, f"Invalid deal_id format: {deal_id[:60]}"
+
+        if record.get("account_number") is None:
+            return None, "account_number is NULL"
+
+        raw_date = record.get("period_date")
+        if raw_date is None:
+            return None, "period_date is NULL"
+        period_date = _parse_date(raw_date)
+        if period_date is None:
+            return None, f"Date '{raw_date[:40]}' is not recognized"
+
+        amounts = {}
+        for column in AMOUNT_COLUMNS:
+            raw = record.get(column)
+            if raw is None:
+                amounts[column] = None
+                continue
+            amount = _parse_amount(raw)
+            if amount is None:
+                return None, f"Numeric value '{raw[:40]}' is not recognized in {column}"
+            amounts[column] = amount
+
+        return {
+            "deal_id": deal_id,
+            "deal_name": record.get("deal_name"),
+            "entity": record.get("entity"),
+            "period_date": period_date,
+            "account_number": record.get("account_number"),
+            "account_name": record.get("account_name"),
+            **amounts,
+        }, None
+
+
+# =====================================================
+# RUNNING BALANCES
+# =====================================================
+
+class BalanceTracker:
+    """Running debit/credit totals per (deal_id, period_date), in cents."""
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, row):
+        key = (row["deal_id"], row["period_date"])
+        totals = self.totals.get(key)
+        if totals is None:
+            totals = self.totals[key] = [0, 0, 0]
+        if row["debit_amount"] is not None:
+            totals[0] += int(row["debit_amount"] * 100)
+        if row["credit_amount"] is not None:
+            totals[1] += int(row["credit_amount"] * 100)
+        totals[2] += 1
+
+    def unbalanced(self, tolerance=DEFAULT_BALANCE_TOLERANCE):
+        """Periods where |SUM(debit) - SUM(credit)| exceeds the tolerance."""
+        limit = int(tolerance * 100)
+        result = []
+        for (deal_id, period_date), (debit, credit, _) in sorted(self.totals.items()):
+            if abs(debit - credit) > limit:
+                result.append({
+                    "deal_id": deal_id,
+                    "period_date": period_date.isoformat(),
+                    "debits": _format_cents(debit),
+                    "credits": _format_cents(credit),
+                    "imbalance": _format_cents(abs(debit - credit)),
+                })
+        return result
+
+    def deals(self):
+        return sorted({deal_id for deal_id, _ in self.totals})
+
+
+class AccountAggregator:
+    """Sums GL lines to one row per trial_balance_raw primary key."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, row):
+        key = (row["deal_id"], row["entity"], row["period_date"], row["account_number"])
+        current = self.rows.get(key)
+        if current is None:
+            self.rows[key] = dict(row)
+            return
+        for column in AMOUNT_COLUMNS:
+            if row[column] is not None:
+                current[column] = row[column] if current[column] is None else current[column] + row[column]
+
+    def __iter__(self):
+        for key in sorted(self.rows, key=lambda k: (k[0], k[2], k[1] or "", k[3])):
+            yield self.rows[key]
+
+
+# =====================================================
+# WRITING
+# =====================================================
+
+class ParquetPartWriter:
+    """Writes rows to part-NNNNN.parquet files of at most ``rows_per_file`` rows.
+
+    Each chunk becomes one row group, so only one chunk is held in memory.
+    """
+
+    def __init__(self, out_dir, rows_per_file=DEFAULT_ROWS_PER_FILE, compression="snappy"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise IngestError("Writing Parquet requires pyarrow; install it or run with --check")
+        self._pa = pa
+        self._pq = pq
+        self.schema = pa.schema([
+            ("deal_id", pa.string()),
+            ("deal_name", pa.string()),
+            ("entity", pa.string()),
+            ("period_date", pa.date32()),
+            ("account_number", pa.string()),
+            ("account_name", pa.string()),
+            ("debit_amount", pa.decimal128(18, 2)),
+            ("credit_amount", pa.decimal128(18, 2)),
+            ("net_amount", pa.decimal128(18, 2)),
+        ])
+        self.out_dir = out_dir
+        self.rows_per_file = rows_per_file
+        self.compression = compression
+        self.files = []
+        self._writer = None
+        self._rows_in_file = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _open_next(self):
+        self._close_current()
+        path = os.path.join(self.out_dir, f"part-{len(self.files):05d}.parquet")
+        self._writer = self._pq.ParquetWriter(path, self.schema, compression=self.compression)
+        self._rows_in_file = 0
+        self.files.append({"name": os.path.basename(path), "rows": 0})
+
+    def _close_current(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            entry = self.files[-1]
+            entry["bytes"] = os.path.getsize(os.path.join(self.out_dir, entry["name"]))
+
+    def write(self, rows):
+        start = 0
+        while start < len(rows):
+            if self._writer is None or self._rows_in_file >= self.rows_per_file:
+                self._open_next()
+            take = min(len(rows) - start, self.rows_per_file - self._rows_in_file)
+            batch = rows[start:start + take]
+            table = self._pa.Table.from_arrays(
+                [self._pa.array([r[c] for r in batch], type=self.schema.field(c).type) for c in OUTPUT_COLUMNS],
+                schema=self.schema,
+            )
+            self._writer.write_table(table)
+            self._rows_in_file += take
+            self.files[-1]["rows"] += take
+            start += take
+
+    def close(self):
+        self._close_current()
+
+    def discard(self):
+        self._close_current()
+        for entry in self.files:
+            os.remove(os.path.join(self.out_dir, entry["name"]))
+        self.files = []
+
+
+class RejectWriter:
+    """Streams rejected rows to rejects.csv (opened on first reject)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._handle = None
+        self._writer = None
+
+    def write(self, line_number, error, record):
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._handle = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._handle)
+            self._writer.writerow(["line", "error", "deal_id", "period_date", "account_number", "raw"])
+        self._writer.writerow([
+            line_number, error, record.get("deal_id"), record.get("period_date"),
+            record.get("account_number"), json.dumps(record)[:2000],
+        ])
+        self.count += 1
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+
+# =====================================================
+# PIPELINE
+# =====================================================
+
+def ingest(path, out_dir=None, chunk_rows=DEFAULT_CHUNK_ROWS, rows_per_file=DEFAULT_ROWS_PER_FILE,
+           aggregate=False, validator=None, max_error_rate=DEFAULT_MAX_ERROR_RATE,
+           balance_tolerance=DEFAULT_BALANCE_TOLERANCE, compression="snappy"):
+    """Validate ``path`` and, when ``out_dir`` is given, write Parquet parts.
+
+    Returns the manifest dict (also written to ``out_dir/manifest.json``).
+    """
+    started = time.perf_counter()
+    validator = validator or RecordValidator()
+    balances = BalanceTracker()
+    aggregator = AccountAggregator() if aggregate else None
+    writer = ParquetPartWriter(out_dir, rows_per_file, compression) if out_dir else None
+    rejects = RejectWriter(os.path.join(out_dir or ".", "rejects.csv"))
+    rows_read = 0
+
+    try:
+        for chunk in chunked(iter_records(path), chunk_rows):
+            valid = []
+            for line_number, record in chunk:
+                row, error = validator.validate(record)
+                if error:
+                    rejects.write(line_number, error, record)
+                    continue
+                balances.add(row)
+                if aggregator is not None:
+                    aggregator.add(row)
+                else:
+                    valid.append(row)
+            rows_read += len(chunk)
+            if writer is not None and valid:
+                writer.write(valid)
+
+        if aggregator is not None and writer is not None:
+            for rows in chunked(aggregator, chunk_rows):
+                writer.write(rows)
+    finally:
+        rejects.close()
+        if writer is not None:
+            writer.close()
+
+    error_rate = rejects.count / rows_read if rows_read else 0.0
+    status = "REJECTED" if error_rate > max_error_rate else "READY"
+    if status == "REJECTED" and writer is not None:
+        writer.discard()
+
+    unbalanced = balances.unbalanced(balance_tolerance)
+    manifest = {
+        "source": os.path.abspath(path),
+        "status": status,
+        "rows_read": rows_read,
+        "rows_valid": rows_read - rejects.count,
+        "rows_rejected": rejects.count,
+        "error_rate": round(error_rate, 6),
+        "max_error_rate": max_error_rate,
+        "rows_written": sum(f["rows"] for f in writer.files) if writer else 0,
+        "aggregated": aggregate,
+        "deals": balances.deals(),
+        "periods": len(balances.totals),
+        "unbalanced_periods": unbalanced,
+        "files": writer.files if writer else [],
+        "rejects_file": rejects.path if rejects.count else None,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }
+    if out_dir:
+        with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as handle:
+            json.dump(manifest, handle, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate and convert a trial balance export to Parquet parts")
+    parser.add_argument("input", help="Trial balance / GL export (CSV, optionally .gz)")
+    parser.add_argument("--out", help="Directory for part-NNNNN.parquet, manifest.json and rejects.csv")
+    parser.add_argument("--check", action="store_true", help="Validate only; write nothing but rejects.csv")
+    parser.add_argument("--aggregate", action="store_true",
+                        help="Sum GL lines to one row per deal/entity/period/account")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--rows-per-file", type=int, default=DEFAULT_ROWS_PER_FILE)
+    parser.add_argument("--compression", default="snappy", choices=["snappy", "zstd", "gzip"])
+    parser.add_argument("--deal-id-regex", default=DEFAULT_DEAL_ID_REGEX, help="system_config deal_id_validation_regex")
+    parser.add_argument("--max-deal-id-length", type=int, default=DEFAULT_MAX_DEAL_ID_LENGTH)
+    parser.add_argument("--max-error-rate", type=float, default=DEFAULT_MAX_ERROR_RATE,
+                        help="system_config max_error_rate_pct")
+    parser.add_argument("--balance-tolerance", type=Decimal, default=DEFAULT_BALANCE_TOLERANCE,
+                        help="system_config balance_tolerance_dollars")
+    args = parser.parse_args(argv)
+
+    if not args.check and not args.out:
+        parser.error("--out is required unless --check is given")
+
+    try:
+        manifest = ingest(
+            args.input,
+            out_dir=None if args.check else args.out,
+            chunk_rows=args.chunk_rows,
+            rows_per_file=args.rows_per_file,
+            aggregate=args.aggregate,
+            validator=RecordValidator(args.deal_id_regex, args.max_deal_id_length),
+            max_error_rate=args.max_error_rate,
+            balance_tolerance=args.balance_tolerance,
+            compression=args.compression,
+        )
+    except IngestError as exc:
+        print(f"ERROR: {exc}")
+        return 2
+
+    print(f"Read {manifest['rows_read']:,} rows in {manifest['elapsed_seconds']}s: "
+          f"{manifest['rows_valid']:,} valid, {manifest['rows_rejected']:,} rejected "
+          f"({manifest['error_rate']:.2%})")
+    for period in manifest["unbalanced_periods"][:20]:
+        print(f"  WARNING: {period['deal_id']} {period['period_date']} out of balance by ${period['imbalance']}")
+    if len(manifest["unbalanced_periods"]) > 20:
+        print(f"  ... {len(manifest['unbalanced_periods']) - 20} more unbalanced periods")
+
+    if manifest["status"] == "REJECTED":
+        print(f"REJECTED: error rate exceeds {args.max_error_rate:.2%}; no files to stage. "
+              f"See {manifest['rejects_file']}")
+        return 1
+
+    if args.check:
+        print("READY: file passes validation")
+        return 0
+
+    prefix = os.path.basename(os.path.normpath(args.out))
+    print(f"READY: wrote {manifest['rows_written']:,} rows to {len(manifest['files'])} part(s) in {args.out}")
+    print("Stage and load with:")
+    print(f"  PUT file://{os.path.abspath(args.out)}/*.parquet @fdd_input_stage/{prefix}/ AUTO_COMPRESS=FALSE;")
+    deal_arg = f"'{manifest['deals'][0]}'" if len(manifest["deals"]) == 1 else "NULL"
+    print(f"  CALL load_trial_balance('{prefix}/', {deal_arg});")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Houlihan Lokey FDD Automation - Portfolio Runner
+=================================================
+Runs ``generate_fdd_schedules`` for many deals at once, with a concurrency
+limit, per-deal retries and a run summary in Snowflake.
+
+A Snowpark session runs one stored procedure call at a time, and
+``generate_fdd_schedules`` builds, refreshes and exports a deal in one
+call. For that reason every worker thread opens its own Snowpark session,
+instead of sharing one session and submitting async jobs to it. With N workers,
+wall-clock time is roughly (number of deals / N) times the time of one deal,
+as long as the warehouse can run N queries at once. FDD_POC_WH scales out
+to 3 clusters, and each cluster runs about 8 concurrent queries at the
+default MAX_CONCURRENCY_LEVEL.
+
+Each attempt is written to ``portfolio_run_deals``. The final outcome per
+deal is in ``v_portfolio_run_status``. The run totals, including
+``deal_seconds / elapsed_seconds`` as the effective parallelism, are in
+``portfolio_runs`` (sql/07_portfolio_runs.sql).
+
+A call that raises, or that returns an ``ERROR:`` result, is retried up to
+``--retries`` times with exponential backoff. A broken session is replaced
+before the retry. Errors that a retry cannot fix, such as an invalid
+deal_id or a deal with no trial balance rows, are not retried.
+
+Usage:
+    python -m fdd_tools.portfolio --all
+    python -m fdd_tools.portfolio DEAL_HL_001 DEAL_HL_002 --concurrency 8 --retries 2
+    python -m fdd_tools.portfolio --all --connection fdd_prod --warehouse FDD_POC_WH
+
+The connection comes from ``~/.snowflake/connections.toml``; ``--connection``
+selects a named entry. ``--concurrency`` and ``--retries`` default to
+system_config ``portfolio_max_concurrency`` and ``portfolio_max_retries``.
+
+Requires snowflake-snowpark-python (see fdd_tools/environment.yml).
+"""
+
+import argparse
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from fdd_tools.ingest import DEFAULT_DEAL_ID_REGEX, DEFAULT_MAX_DEAL_ID_LENGTH
+
+DEFAULT_DATABASE = "HL_FDD_POC"
+DEFAULT_SCHEMA = "TRIAL_BALANCE"
+DEFAULT_RETRY_DELAY = 5.0
+
+# generate_fdd_schedules results that a retry cannot fix
+PERMANENT_ERRORS = (
+    "ERROR: Invalid deal_id format",
+    "ERROR: No trial balance data found",
+)
+
+
+class PortfolioError(Exception):
+    """Raised when a portfolio run cannot start."""
+
+
+def create_session(connection_name=None, database=DEFAULT_DATABASE, schema=DEFAULT_SCHEMA, warehouse=None):
+    """Open a Snowpark session on the FDD schema."""
+    try:
+        from snowflake.snowpark import Session
+    except ImportError as exc:
+        raise PortfolioError("The portfolio runner requires snowflake-snowpark-python") from exc
+
+    builder = Session.builder
+    if connection_name:
+        builder = builder.config("connection_name", connection_name)
+    session = builder.create()
+    session.use_database(database)
+    session.use_schema(schema)
+    if warehouse:
+        session.use_warehouse(warehouse)
+    return session
+
+
+def portfolio_deals(session):
+    """All deals in v_portfolio_summary, largest first so long deals do not finish last."""
+    rows = session.sql(
+        "SELECT deal_id, SUM(total_rows) AS total_rows FROM v_portfolio_summary "
+        "GROUP BY deal_id ORDER BY total_rows DESC, deal_id"
+    ).collect()
+    return [row["DEAL_ID"] for row in rows]
+
+
+def config_number(session, key, default):
+    value = session.sql("SELECT get_config_number(?) AS v", params=[key]).collect()[0]["V"]
+    return default if value is None else int(value)
+
+
+class RunRecorder:
+    """Writes portfolio_runs / portfolio_run_deals rows through the control session."""
+
+    def __init__(self, session, run_id):
+        self.session = session
+        self.run_id = run_id
+        self._lock = threading.Lock()
+
+    def start(self, deals, concurrency, retries):
+        with self._lock:
+            self.session.sql(
+                "INSERT INTO portfolio_runs (run_id, concurrency_limit, max_retries, deals_total) "
+                "VALUES (?, ?, ?, ?)",
+                params=[self.run_id, concurrency, retries, len(deals)],
+            ).collect()
+
+    def attempt(self, deal_id, attempt, status, seconds, message, session_id):
+        with self._lock:
+            self.session.sql(
+                "INSERT INTO portfolio_run_deals "
+                "(run_id, deal_id, attempt, start_time, end_time, duration_seconds, status, result_message, session_id) "
+                "SELECT ?, ?, ?, DATEADD(millisecond, -?, CURRENT_TIMESTAMP()), CURRENT_TIMESTAMP(), ?, ?, ?, ?",
+                params=[self.run_id, deal_id, attempt, int(seconds * 1000), round(seconds, 2),
+                        status, message[:5000], session_id],
+            ).collect()
+
+    def finish(self):
+        with self._lock:
+            return self.session.sql("CALL finish_portfolio_run(?)", params=[self.run_id]).collect()[0][0]
+
+
+class SessionPool:
+    """One Snowpark session per worker thread, created on first use."""
+
+    def __init__(self, factory, query_tag):
+        self.factory = factory
+        self.query_tag = query_tag
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    def get(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self.factory()
+            session.query_tag = self.query_tag
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def discard(self):
+        """Drop this thread's session (after a connection-level failure)."""
+        session = getattr(self._local, "session", None)
+        self._local.session = None
+        if session is not None:
+            with self._lock:
+                self._sessions.remove(session)
+            try:
+                session.close()
+            except Exception:
+                pass
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+
+def run_deal(deal_id, pool, recorder, retries, retry_delay):
+    """Run generate_fdd_schedules for one deal with retries; returns (status, attempts, message)."""
+    attempt = 0
+    while True:
+        attempt += 1
+        started = time.monotonic()
+        session_id = None
+        try:
+            session = pool.get()
+            session_id = str(session.session_id)
+            message = session.sql("CALL generate_fdd_schedules(?)", params=[deal_id]).collect()[0][0] or ""
+            status = next((s for s in ("SUCCESS", "WARNING") if message.startswith(s)), "ERROR")
+            retryable = status == "ERROR" and not message.startswith(PERMANENT_ERRORS)
+        except Exception as exc:
+            pool.discard()
+            message = f"ERROR: {type(exc).__name__}: {exc}"
+            status = "ERROR"
+            retryable = True
+        recorder.attempt(deal_id, attempt, status, time.monotonic() - started, message, session_id)
+
+        if status == "SUCCESS" or not retryable or attempt > retries:
+            return status, attempt, message
+        time.sleep(retry_delay * 2 ** (attempt - 1))
+
+
+def run_portfolio(deals, session_factory, control_session, concurrency, retries,
+                  retry_delay=DEFAULT_RETRY_DELAY, progress=print):
+    """Run all deals with at most ``concurrency`` in flight; returns (run_id, summary, results)."""
+    run_id = str(uuid.uuid4())
+    recorder = RunRecorder(control_session, run_id)
+    recorder.start(deals, concurrency, retries)
+    pool = SessionPool(session_factory, f"fdd_portfolio:{run_id}")
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fdd-deal") as executor:
+            futures = {
+                executor.submit(run_deal, deal_id, pool, recorder, retries, retry_delay): deal_id
+                for deal_id in deals
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                deal_id = futures[future]
+                results[deal_id] = future.result()
+                status, attempts, message = results[deal_id]
+                retry_note = f" after {attempts} attempts" if attempts > 1 else ""
+                progress(f"[{done}/{len(deals)}] {deal_id}: {status}{retry_note}")
+    finally:
+        pool.close_all()
+        summary = recorder.finish()
+    return run_id, summary, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run generate_fdd_schedules for many deals concurrently")
+    parser.add_argument("deals", nargs="*", help="Deal IDs to refresh")
+    parser.add_argument("--all", action="store_true", help="Refresh every deal in v_portfolio_summary")
+    parser.add_argument("--concurrency", type=int, help="system_config portfolio_max_concurrency")
+    parser.add_argument("--retries", type=int, help="system_config portfolio_max_retries")
+    parser.add_argument("--retry-delay", type=float, default=DEFAULT_RETRY_DELAY,
+                        help="Seconds before the first retry (doubles on each further retry)")
+    parser.add_argument("--connection", help="Named connection in connections.toml")
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA)
+    parser.add_argument("--warehouse")
+    args = parser.parse_args(argv)
+
+    if args.all == bool(args.deals):
+        parser.error("give deal IDs or --all (not both)")
+    invalid = [d for d in args.deals
+               if not re.match(DEFAULT_DEAL_ID_REGEX, d) or len(d) > DEFAULT_MAX_DEAL_ID_LENGTH]
+    if invalid:
+        parser.error(f"invalid deal_id: {', '.join(invalid)}")
+
+    def session_factory():
+        return create_session(args.connection, args.database, args.schema, args.warehouse)
+
+    try:
+        control = session_factory()
+    except PortfolioError as exc:
+        print(f"ERROR: {exc}")
+        return 2
+
+    try:
+        deals = portfolio_deals(control) if args.all else list(dict.fromkeys(args.deals))
+        if not deals:
+            print("No deals to refresh")
+            return 0
+        concurrency = args.concurrency or config_number(control, "portfolio_max_concurrency", 4)
+        retries = args.retries if args.retries is not None else config_number(control, "portfolio_max_retries", 1)
+        concurrency = max(1, min(concurrency, len(deals)))
+
+        print(f"Refreshing {len(deals)} deal(s) with concurrency {concurrency}, {retries} retries")
+        started = time.monotonic()
+        run_id, summary, results = run_portfolio(
+            deals, session_factory, control, concurrency, retries, args.retry_delay
+        )
+        print(f"{summary} in {time.monotonic() - started:.1f}s (run {run_id})")
+        for deal_id, (status, attempts, message) in sorted(results.items()):
+            if status != "SUCCESS":
+                print(f"  {deal_id}: {message}")
+        print(f"Details: SELECT * FROM v_portfolio_run_status WHERE run_id = '{run_id}';")
+        return 0 if summary.startswith("SUCCESS") else 1
+    finally:
+        control.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+"""
+Houlihan Lokey FDD Automation - Local Schedule Engine
+======================================================
+In-process, columnar reproduction of the Snowflake presentation layer:
+
+- ``refresh_schedule_trial_balance``: joins the trial balance to the active
+  account mappings and applies each mapping's ``display_sign_rule``
+  (``classify_display_sign``) to get ``amount_for_display``
+- ``refresh_database_tab`` / ``build_database_tab_sql``: pivots each deal's
+  most recent periods into the wide Database tab consumed by the Excel SUMIF
+  formulas
+
+Input files use the same layout as ``examples/01_sample_trial_balance_24mo.csv``
+and ``examples/02_sample_account_mappings_24mo.csv`` and are parsed with the
+same rules as the ``csv_format`` file format. Amounts are held as integer
+cents in NumPy arrays, so results match NUMBER(18,2) arithmetic exactly.
+
+Usage:
+    python -m fdd_tools.schedule_engine TB.csv MAPPINGS.csv --deal DEAL_HL_001 --out database_tab.csv
+    python -m fdd_tools.schedule_engine TB.csv MAPPINGS.csv --deal DEAL_HL_001 --compare database_tab_DEAL_HL_001.csv
+
+``--compare`` checks the engine output against a file exported by
+``export_database_tab`` (downloaded from @fdd_output_stage).
+"""
+
+import argparse
+import csv
+import sys
+import time
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+# Mirrors csv_format in sql/01_schema.sql
+NULL_TOKENS = {"NULL", "null", "", "N/A", "n/a"}
+
+# Mirrors the ILIKE patterns in classify_display_sign
+CONTRA_ASSET_PATTERNS = ("accumulated depreciation", "allowance", "reserve")
+
+# system_config max_pivot_periods
+DEFAULT_MAX_PIVOT_PERIODS = 24
+
+MONTH_ABBR = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+              "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+GROUP_COLUMNS = [
+    "deal_id", "deal_name", "entity", "account_number", "account_name", "unique_id",
+    "mapping_level_1", "mapping_level_2", "mapping_level_3", "statement_type",
+    "sort_order_l1", "sort_order_l2",
+]
+
+_CENT = Decimal("0.01")
+
+
+# =====================================================
+# PARSING
+# =====================================================
+
+def _clean(value):
+    """Apply TRIM_SPACE and NULL_IF the way csv_format does."""
+    if value is None:
+        return None
+    value = value.strip()
+    return None if value in NULL_TOKENS else value
+
+
+def _to_cents(value):
+    """Parse a CSV amount into integer cents (NUMBER(18,2) rounding)."""
+    if value is None:
+        return None
+    return int(Decimal(value).quantize(_CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def _format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    whole, frac = divmod(abs(int(cents)), 100)
+    return f"{sign}{whole}.{frac:02d}"
+
+
+def read_csv_columns(path):
+    """Read a CSV file into a dict of column name -> list of cleaned values."""
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        reader = csv.reader(handle)
+        header = [h.strip().lower() for h in next(reader)]
+        columns = {name: [] for name in header}
+        for record in reader:
+            if not record:
+                continue
+            # ERROR_ON_COLUMN_COUNT_MISMATCH = FALSE: pad or truncate silently
+            record = (record + [None] * len(header))[:len(header)]
+            for name, value in zip(header, record):
+                columns[name].append(_clean(value))
+    return columns
+
+
+@dataclass
+class TrialBalance:
+    """Columnar trial_balance_raw. Amounts are int64 cents with a null mask."""
+    deal_id: np.ndarray
+    deal_name: np.ndarray
+    entity: np.ndarray
+    period_date: np.ndarray
+    account_number: np.ndarray
+    account_name: np.ndarray
+    net_cents: np.ndarray
+    net_is_null: np.ndarray
+
+    def __len__(self):
+        return len(self.deal_id)
+
+
+@dataclass
+class AccountMappings:
+    """Columnar account_mappings plus a (deal_id, account_number) index."""
+    columns: dict
+    index: dict
+
+
+def load_trial_balance(path):
+    cols = read_csv_columns(path)
+    net = [_to_cents(v) for v in cols["net_amount"]]
+    return TrialBalance(
+        deal_id=np.array(cols["deal_id"], dtype=object),
+        deal_name=np.array(cols["deal_name"], dtype=object),
+        entity=np.array(cols["entity"], dtype=object),
+        period_date=np.array(cols["period_date"], dtype="datetime64[D]"),
+        account_number=np.array(cols["account_number"], dtype=object),
+        account_name=np.array(cols["account_name"], dtype=object),
+        net_cents=np.array([0 if v is None else v for v in net], dtype=np.int64),
+        net_is_null=np.array([v is None for v in net], dtype=bool),
+    )
+
+
+def load_account_mappings(path):
+    cols = read_csv_columns(path)
+    for name in ("sort_order_l1", "sort_order_l2", "sort_order_l3"):
+        cols[name] = [None if v is None else Decimal(v) for v in cols.get(name, [])]
+    # load_account_mappings sets is_active = TRUE for rows the CSV does not flag
+    if "is_active" in cols:
+        cols["is_active"] = [v is None or v.upper() in ("TRUE", "1", "Y", "YES") for v in cols["is_active"]]
+    else:
+        cols["is_active"] = [True] * len(cols["deal_id"])
+    columns = {name: np.array(values, dtype=object) for name, values in cols.items()}
+    index = {(d, a): i for i, (d, a) in enumerate(zip(cols["deal_id"], cols["account_number"]))}
+    return AccountMappings(columns=columns, index=index)
+
+
+# =====================================================
+# trial_balance_for_schedules
+# =====================================================
+
+def _contains_any(values, patterns):
+    return np.array(
+        [v is not None and any(p in v.lower() for p in patterns) for v in values],
+        dtype=bool,
+    )
+
+
+def schedule_ready(tb, mappings):
+    """Join the trial balance to active mappings and compute amount_for_display.
+
+    Returns a dict of columns restricted to rows with an active mapping. The
+    sign rule is classified from the mapping's account name, as
+    load_account_mappings does.
+    """
+    m_idx = np.array(
+        [mappings.index.get(key, -1) for key in zip(tb.deal_id, tb.account_number)],
+        dtype=np.int64,
+    )
+    active = mappings.columns["is_active"]
+    keep = m_idx >= 0
+    keep[keep] = active[m_idx[keep]].astype(bool)
+    rows = np.flatnonzero(keep)
+    m_rows = m_idx[rows]
+
+    def mapping_col(name):
+        return mappings.columns[name][m_rows]
+
+    statement_type = mapping_col("statement_type")
+    level_1 = mapping_col("mapping_level_1")
+    net = tb.net_cents[rows]
+    account_name = tb.account_name[rows]
+
+    is_stmt = statement_type == "IS"
+    is_bs = statement_type == "BS"
+    revenue = is_stmt & (level_1 == "Revenue")
+    contra_asset = is_bs & (level_1 == "Assets") & _contains_any(mapping_col("account_name"), CONTRA_ASSET_PATTERNS)
+
+    # Every other branch of the CASE (expenses, regular assets, liabilities,
+    # equity and the default) shows the absolute value
+    display = np.abs(net)
+    display = np.where(revenue, -net, display)
+    display = np.where(contra_asset & ~revenue, net, display)
+
+    account_number = tb.account_number[rows]
+    unique_id = np.array(
+        [None if a is None or n is None else f"{a} - {n}" for a, n in zip(account_number, account_name)],
+        dtype=object,
+    )
+
+    return {
+        "deal_id": tb.deal_id[rows],
+        "deal_name": tb.deal_name[rows],
+        "entity": tb.entity[rows],
+        "period_date": tb.period_date[rows],
+        "account_number": account_number,
+        "account_name": account_name,
+        "unique_id": unique_id,
+        "amount_for_display": display,
+        "amount_is_null": tb.net_is_null[rows],
+        "statement_type": statement_type,
+        "mapping_level_1": level_1,
+        "mapping_level_2": mapping_col("mapping_level_2"),
+        "mapping_level_3": mapping_col("mapping_level_3"),
+        "sort_order_l1": mapping_col("sort_order_l1"),
+        "sort_order_l2": mapping_col("sort_order_l2"),
+    }
+
+
+# =====================================================
+# DATABASE TAB (refresh_database_tab + build_database_tab_sql)
+# =====================================================
+
+def period_label(day):
+    """TO_CHAR(period_date, 'Mon-YYYY')."""
+    year, month = int(str(day)[:4]), int(str(day)[5:7])
+    return f"{MONTH_ABBR[month - 1]}-{year}"
+
+
+def _nulls_last(value):
+    return (value is None, value if value is not None else 0)
+
+
+def _column_suffix(rank):
+    """LPAD(period_rank, GREATEST(2, LENGTH(period_rank)), '0')."""
+    return f"{rank:02d}"
+
+
+@dataclass
+class DatabaseTab:
+    """Wide Database tab for one deal: one row per group, one slot per period in its window."""
+    deal_id: str
+    keys: list
+    labels: list
+    present: np.ndarray
+    values: np.ndarray
+    value_is_null: np.ndarray
+
+    @property
+    def period_count(self):
+        return len(self.labels)
+
+    @property
+    def header(self):
+        suffixes = [_column_suffix(n) for n in range(1, self.period_count + 1)]
+        labels = [f"period_{n}_label" for n in suffixes]
+        periods = [f"period_{n}" for n in suffixes]
+        return [c.upper() for c in GROUP_COLUMNS + labels + periods]
+
+    def rows(self):
+        """Yield output rows as lists of strings/None, in the export's ORDER BY."""
+        for g, key in enumerate(self.keys):
+            group = [None if v is None else str(v) for v in key]
+            labels = [self.labels[p] if self.present[g, p] else None for p in range(self.period_count)]
+            values = [
+                None if self.value_is_null[g, p] else _format_cents(self.values[g, p])
+                for p in range(self.period_count)
+            ]
+            yield group + labels + values
+
+    def write_csv(self, path):
+        count = 0
+        with open(path, "w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(self.header)
+            for row in self.rows():
+                writer.writerow(["NULL" if v is None else v for v in row])
+                count += 1
+        return count
+
+
+def pivot_database_tab(frame, deal_periods, deal_id, max_pivot_periods=DEFAULT_MAX_PIVOT_PERIODS):
+    """Build one deal's Database tab from schedule-ready rows.
+
+    ``deal_periods`` are the period dates of the deal in trial_balance_raw.
+    Its most recent ``max_pivot_periods`` distinct periods are ranked
+    oldest-first, with one column pair per rank, as in database_tab_periods.
+    """
+    distinct = np.unique(deal_periods)
+    window = distinct[-max_pivot_periods:] if max_pivot_periods > 0 else distinct[:0]
+    width = len(window)
+
+    # The window is a suffix of the deal's sorted periods, so every period at
+    # or after its first date is in it
+    in_deal = np.flatnonzero(frame["deal_id"] == deal_id)
+    periods = frame["period_date"][in_deal]
+    in_window = periods >= window[0] if width else np.zeros(len(in_deal), dtype=bool)
+    rows = in_deal[in_window]
+    slots = np.searchsorted(window, periods[in_window])
+
+    group_of = {}
+    group_ids = np.empty(len(rows), dtype=np.int64)
+    columns = [frame[name] for name in GROUP_COLUMNS]
+    for i, r in enumerate(rows):
+        key = tuple(col[r] for col in columns)
+        group_ids[i] = group_of.setdefault(key, len(group_of))
+    keys = list(group_of)
+
+    n_groups = len(keys)
+    present = np.zeros((n_groups, width), dtype=bool)
+    values = np.full((n_groups, width), np.iinfo(np.int64).min, dtype=np.int64)
+    present[group_ids, slots] = True
+    has_amount = ~frame["amount_is_null"][rows]
+    np.maximum.at(values, (group_ids[has_amount], slots[has_amount]), frame["amount_for_display"][rows][has_amount])
+    value_is_null = values == np.iinfo(np.int64).min
+
+    # ORDER BY sort_order_l1, sort_order_l2, account_number (NULLS LAST)
+    so1, so2, acct = (GROUP_COLUMNS.index(c) for c in ("sort_order_l1", "sort_order_l2", "account_number"))
+    order = sorted(range(n_groups), key=lambda g: (_nulls_last(keys[g][so1]), _nulls_last(keys[g][so2]), _nulls_last(keys[g][acct])))
+
+    return DatabaseTab(
+        deal_id=deal_id,
+        keys=[keys[g] for g in order],
+        labels=[period_label(d) for d in window],
+        present=present[order],
+        values=values[order],
+        value_is_null=value_is_null[order],
+    )
+
+
+def build_database_tab(tb_path, mappings_path, deal_id=None, max_pivot_periods=DEFAULT_MAX_PIVOT_PERIODS):
+    """Database tab for ``deal_id`` (optional when the file holds a single deal)."""
+    tb = load_trial_balance(tb_path)
+    deals = sorted(set(tb.deal_id) - {None})
+    if deal_id is None:
+        if len(deals) != 1:
+            raise ValueError(f"{tb_path} holds {len(deals)} deals; choose one with --deal")
+        deal_id = deals[0]
+    mappings = load_account_mappings(mappings_path)
+    frame = schedule_ready(tb, mappings)
+    return pivot_database_tab(frame, tb.period_date[tb.deal_id == deal_id], deal_id, max_pivot_periods)
+
+
+# =====================================================
+# VERIFICATION AGAINST THE SNOWFLAKE EXPORT
+# =====================================================
+
+def _normalize(header, row):
+    """Normalize a CSV row so engine and Snowflake output compare by value."""
+    out = {}
+    for name, value in zip(header, row):
+        value = _clean(value)
+        if value is not None and name.startswith("PERIOD_") and not name.endswith("_LABEL"):
+            value = Decimal(value)
+        out[name] = value
+    return out
+
+
+def compare_csv(expected_path, actual_path):
+    """Compare two Database tab CSVs cell by cell. Returns a list of differences."""
+    def load(path):
+        with open(path, newline="", encoding="utf-8-sig") as handle:
+            reader = csv.reader(handle)
+            header = [h.strip().upper() for h in next(reader)]
+            rows = {}
+            for row in reader:
+                record = _normalize(header, row)
+                rows[(record.get("DEAL_ID"), record.get("ENTITY"), record.get("ACCOUNT_NUMBER"),
+                      record.get("UNIQUE_ID"))] = record
+            return header, rows
+
+    expected_header, expected = load(expected_path)
+    actual_header, actual = load(actual_path)
+    differences = []
+    if expected_header != actual_header:
+        differences.append(f"header mismatch: {expected_header} != {actual_header}")
+    for key in sorted(set(expected) | set(actual), key=str):
+        if key not in actual:
+            differences.append(f"missing row {key}")
+        elif key not in expected:
+            differences.append(f"unexpected row {key}")
+        else:
+            for name, value in expected[key].items():
+                if actual[key].get(name) != value:
+                    differences.append(f"{key} {name}: expected {value!r}, got {actual[key].get(name)!r}")
+    return differences
+
+
+# =====================================================
+# CLI
+# =====================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the FDD Database tab locally")
+    parser.add_argument("trial_balance", help="Trial balance CSV (01_sample_trial_balance_24mo.csv layout)")
+    parser.add_argument("mappings", help="Account mapping CSV (02_sample_account_mappings_24mo.csv layout)")
+    parser.add_argument("--deal", help="deal_id to build (required when the file holds several deals)")
+    parser.add_argument("--max-pivot-periods", type=int, default=DEFAULT_MAX_PIVOT_PERIODS)
+    parser.add_argument("--out", help="Write the Database tab CSV to this path")
+    parser.add_argument("--compare", help="Database tab CSV exported from Snowflake to check against")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        tab = build_database_tab(args.trial_balance, args.mappings, args.deal, args.max_pivot_periods)
+    except ValueError as exc:
+        parser.error(str(exc))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    row_count = sum(1 for _ in tab.rows())
+    print(f"Built Database tab for {tab.deal_id}: {row_count} rows x {tab.period_count} periods in {elapsed_ms:.1f} ms")
+
+    out_path = args.out
+    if args.compare and not out_path:
+        out_path = args.compare + ".local.csv"
+    if out_path:
+        tab.write_csv(out_path)
+        print(f"Wrote {out_path}")
+
+    if args.compare:
+        differences = compare_csv(args.compare, out_path)
+        if differences:
+            print(f"MISMATCH: {len(differences)} differences")
+            for line in differences[:50]:
+                print("  " + line)
+            return 1
+        print("MATCH: output is identical to " + args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+"""
+Houlihan Lokey FDD Automation - Synthetic Trial Balance Generator
+==================================================================
+Scales the example deal to N deals x M accounts x P periods x E entities
+for load and performance testing. The output files use the same layouts
+as ``examples/01_sample_trial_balance_24mo.csv`` and
+``examples/02_sample_account_mappings_24mo.csv``, so they can go through
+``fdd_tools.ingest``, ``load_trial_balance`` and the benchmark suite
+unchanged.
+
+Every account of the example chart is a template. When M is larger than the
+chart, the templates are cloned round-robin as ``<number>-<NNN>``. Clones keep
+the template's mapping and name, so display sign rules (revenue, contra-asset)
+apply to them in the same way. Amounts start from the template's average in
+the example file and are scaled per deal, entity and account. Then:
+
+- income statement accounts follow a yearly seasonal curve (amplitude and
+  peak month vary by deal)
+- every account grows or shrinks by a per-deal annual rate and carries
+  noise sized from the template's own month-to-month variation
+- the first equity account is the plug, so each entity and period balances
+  to the cent
+
+Controlled imbalances: ``--imbalance-rate`` of the (entity, period) groups get
+``--imbalance-amount`` added to the debit side of one random account. The
+(deal_id, period_date) pairs that ``load_trial_balance`` should report as
+unbalanced are listed in ``manifest.json``.
+
+The output is deterministic for a given ``--seed``. Deals are generated one at
+a time, so memory stays at one deal's rows (M x P x E).
+
+Usage:
+    python -m fdd_tools.synth --out build/synth --deals 20 --accounts 1000 --periods 24 --entities 2
+    python -m fdd_tools.synth --out build/synth_200 --deals 200 --accounts 5000 --imbalance-rate 0.01
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+from fdd_tools.schedule_engine import _format_cents, _to_cents, read_csv_columns
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+DEFAULT_TB_TEMPLATE = os.path.join(EXAMPLES_DIR, "01_sample_trial_balance_24mo.csv")
+DEFAULT_MAPPINGS_TEMPLATE = os.path.join(EXAMPLES_DIR, "02_sample_account_mappings_24mo.csv")
+
+TB_FILE = "trial_balance.csv"
+MAPPINGS_FILE = "account_mappings.csv"
+
+TB_COLUMNS = [
+    "deal_id", "deal_name", "entity", "period_date", "account_number",
+    "account_name", "debit_amount", "credit_amount", "net_amount",
+]
+MAPPING_COLUMNS = [
+    "deal_id", "account_number", "account_name", "account_category", "statement_type",
+    "mapping_level_1", "mapping_level_2", "mapping_level_3",
+    "sort_order_l1", "sort_order_l2", "sort_order_l3",
+]
+
+# Month-to-month noise is capped so amounts keep the template's sign
+MAX_NOISE_CV = 0.25
+
+
+class SynthError(Exception):
+    """The requested data set cannot be generated (bad template or spec)."""
+
+
+@dataclass
+class SynthSpec:
+    deals: int = 2
+    accounts: int = 100
+    periods: int = 24
+    entities: int = 1
+    end_period: str = "2024-12-31"
+    imbalance_rate: float = 0.0
+    imbalance_amount: str = "1000.00"
+    seed: int = 42
+
+    def validate(self):
+        if min(self.deals, self.accounts, self.periods, self.entities) < 1:
+            raise SynthError("deals, accounts, periods and entities must all be at least 1")
+        if not 0.0 <= self.imbalance_rate <= 1.0:
+            raise SynthError("imbalance_rate must be between 0 and 1")
+
+    @property
+    def rows(self):
+        return self.deals * self.accounts * self.periods * self.entities
+
+
+@dataclass
+class AccountTemplates:
+    """The example chart of accounts with each account's amount profile."""
+    mappings: list       # one dict per account, MAPPING_COLUMNS without deal_id
+    mean_cents: np.ndarray
+    noise_cv: np.ndarray
+    seasonal: np.ndarray  # income statement accounts
+    plug: int             # index of the balancing equity account
+
+    def __len__(self):
+        return len(self.mappings)
+
+
+def load_templates(tb_path=DEFAULT_TB_TEMPLATE, mappings_path=DEFAULT_MAPPINGS_TEMPLATE):
+    """Read the example files into AccountTemplates (first deal of each file)."""
+    mapping_cols = read_csv_columns(mappings_path)
+    tb_cols = read_csv_columns(tb_path)
+
+    amounts = {}
+    for account, net in zip(tb_cols["account_number"], tb_cols["net_amount"]):
+        if account is not None and net is not None:
+            amounts.setdefault(account, []).append(_to_cents(net))
+
+    mappings, means, cvs = [], [], []
+    seen = set()
+    for i, account in enumerate(mapping_cols["account_number"]):
+        if account in seen or account not in amounts:
+            continue
+        seen.add(account)
+        mappings.append({name: mapping_cols.get(name, [None] * (i + 1))[i] for name in MAPPING_COLUMNS[1:]})
+        values = np.array(amounts[account], dtype=np.float64)
+        mean = values.mean()
+        means.append(mean)
+        cvs.append(min(values.std() / abs(mean), MAX_NOISE_CV) if mean else 0.0)
+
+    if not mappings:
+        raise SynthError(f"{mappings_path} has no accounts with amounts in {tb_path}")
+    plugs = [i for i, m in enumerate(mappings) if m["mapping_level_1"] == "Equity"]
+    if not plugs:
+        raise SynthError(f"{mappings_path} has no Equity account to balance the periods with")
+
+    return AccountTemplates(
+        mappings=mappings,
+        mean_cents=np.array(means, dtype=np.float64),
+        noise_cv=np.array(cvs, dtype=np.float64),
+        seasonal=np.array([m["statement_type"] == "IS" for m in mappings], dtype=bool),
+        plug=plugs[0],
+    )
+
+
+def period_dates(end_period, periods):
+    """``periods`` month-end dates ending with the month of ``end_period``."""
+    last_month = np.datetime64(end_period, "M")
+    months = np.arange(last_month - periods + 1, last_month + 1)
+    return (months + 1).astype("datetime64[D]") - 1
+
+
+def chart_of_accounts(templates, accounts):
+    """Template index, account number and account name of each of ``accounts`` accounts."""
+    count = len(templates)
+    clones = (accounts - 1) // count
+    width = max(3, len(str(clones)))
+    source = np.arange(accounts) % count
+    numbers, names = [], []
+    for i, t in enumerate(source):
+        clone = i // count
+        mapping = templates.mappings[t]
+        if clone == 0:
+            numbers.append(mapping["account_number"])
+            names.append(mapping["account_name"])
+        else:
+            numbers.append(f"{mapping['account_number']}-{clone:0{width}d}")
+            names.append(f"{mapping['account_name']} {clone:0{width}d}")
+    return source, numbers, names
+
+
+def deal_amounts(rng, templates, source, dates, entities, imbalance_rate, imbalance_cents):
+    """Net amounts in cents, shape (entities, accounts, periods), and the unbalanced period mask.
+
+    The plug account (first occurrence of the template's equity account)
+    absorbs the rest of each entity-period, so every group balances before
+    the controlled imbalances are added.
+    """
+    accounts, periods = len(source), len(dates)
+    t = np.arange(periods)
+    months = dates.astype("datetime64[M]").astype(np.int64) % 12
+
+    growth = (1 + rng.uniform(-0.05, 0.20)) ** (t / 12.0)
+    amplitude = rng.uniform(0.05, 0.25)
+    peak = rng.integers(0, 12)
+    season = np.where(
+        templates.seasonal[source][:, None],
+        1 + amplitude * np.cos(2 * np.pi * (months - peak) / 12.0)[None, :],
+        1.0,
+    )
+
+    scale = rng.lognormal(0.0, 0.5) * rng.lognormal(0.0, 0.3, size=accounts)
+    base = templates.mean_cents[source] * scale
+    cv = templates.noise_cv[source]
+    entity_scale = rng.uniform(0.5, 1.5, size=entities)
+
+    noise = 1 + rng.standard_normal((entities, accounts, periods)) * cv[None, :, None]
+    factor = np.clip(season[None, :, :] * growth[None, None, :] * noise, 0.05, None)
+    nets = np.rint(base[None, :, None] * entity_scale[:, None, None] * factor).astype(np.int64)
+
+    plug = templates.plug
+    nets[:, plug, :] = 0
+    nets[:, plug, :] = -nets.sum(axis=1)
+
+    unbalanced = rng.random((entities, periods)) < imbalance_rate
+    if unbalanced.any():
+        e_idx, p_idx = np.nonzero(unbalanced)
+        others = np.delete(np.arange(accounts), plug) if accounts > 1 else np.array([plug])
+        a_idx = rng.choice(others, size=len(e_idx))
+        nets[e_idx, a_idx, p_idx] += imbalance_cents
+    return nets, unbalanced.any(axis=0)
+
+
+def write_deal(tb_writer, deal_id, deal_name, entity_names, dates, numbers, names, nets):
+    """Append one deal's rows (period, entity, account order, as in the example file)."""
+    date_text = [str(d) for d in dates]
+    amounts = [[_format_cents(v) for v in row] for row in nets.reshape(-1, nets.shape[2]).tolist()]
+    debits = [[a if a[0] != "-" else "0.00" for a in row] for row in amounts]
+    credits = [["0.00" if a[0] != "-" else a[1:] for a in row] for row in amounts]
+    accounts = len(numbers)
+    rows = 0
+    for p, period in enumerate(date_text):
+        for e, entity in enumerate(entity_names):
+            base = e * accounts
+            tb_writer.writerows(
+                [deal_id, deal_name, entity, period, numbers[a], names[a],
+                 debits[base + a][p], credits[base + a][p], amounts[base + a][p]]
+                for a in range(accounts)
+            )
+            rows += accounts
+    return rows
+
+
+def generate(spec, out_dir, templates=None):
+    """Write trial_balance.csv, account_mappings.csv and manifest.json to ``out_dir``.
+
+    Returns the manifest dict.
+    """
+    spec.validate()
+    templates = templates or load_templates()
+    started = time.perf_counter()
+    rng = np.random.default_rng(spec.seed)
+    imbalance_cents = _to_cents(spec.imbalance_amount)
+
+    dates = period_dates(spec.end_period, spec.periods)
+    source, numbers, names = chart_of_accounts(templates, spec.accounts)
+    os.makedirs(out_dir, exist_ok=True)
+    tb_path = os.path.join(out_dir, TB_FILE)
+    mappings_path = os.path.join(out_dir, MAPPINGS_FILE)
+
+    rows = 0
+    unbalanced_periods = []
+    with open(tb_path, "w", newline="", encoding="utf-8") as tb_handle, \
+            open(mappings_path, "w", newline="", encoding="utf-8") as map_handle:
+        tb_writer = csv.writer(tb_handle)
+        map_writer = csv.writer(map_handle)
+        tb_writer.writerow(TB_COLUMNS)
+        map_writer.writerow(MAPPING_COLUMNS)
+
+        for d in range(1, spec.deals + 1):
+            deal_id = f"DEAL_SYN_{d:04d}"
+            deal_name = f"Synthetic Holdings {d:04d}"
+            entity_names = [f"Synthetic {d:04d} Entity {e:02d}" for e in range(1, spec.entities + 1)]
+
+            nets, unbalanced = deal_amounts(rng, templates, source, dates, spec.entities,
+                                            spec.imbalance_rate, imbalance_cents)
+            rows += write_deal(tb_writer, deal_id, deal_name, entity_names, dates, numbers, names, nets)
+            unbalanced_periods.extend(
+                {"deal_id": deal_id, "period_date": str(dates[p])} for p in np.flatnonzero(unbalanced)
+            )
+
+            for a, t in enumerate(source):
+                mapping = templates.mappings[t]
+                map_writer.writerow(
+                    [deal_id, numbers[a], names[a]] +
+                    ["" if mapping[c] is None else mapping[c] for c in MAPPING_COLUMNS[3:]]
+                )
+
+    manifest = {
+        "spec": asdict(spec),
+        "rows": rows,
+        "mapping_rows": spec.deals * spec.accounts,
+        "files": {
+            "trial_balance": TB_FILE,
+            "account_mappings": MAPPINGS_FILE,
+            "trial_balance_bytes": os.path.getsize(tb_path),
+        },
+        "unbalanced_periods": unbalanced_periods,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    defaults = SynthSpec()
+    parser = argparse.ArgumentParser(description="Generate a synthetic multi-deal trial balance")
+    parser.add_argument("--out", required=True, help="Directory for trial_balance.csv, account_mappings.csv and manifest.json")
+    parser.add_argument("--deals", type=int, default=defaults.deals)
+    parser.add_argument("--accounts", type=int, default=defaults.accounts, help="Accounts per deal")
+    parser.add_argument("--periods", type=int, default=defaults.periods, help="Monthly periods per deal")
+    parser.add_argument("--entities", type=int, default=defaults.entities, help="Entities per deal")
+    parser.add_argument("--end-period", default=defaults.end_period, help="Last period (month-end date)")
+    parser.add_argument("--imbalance-rate", type=float, default=defaults.imbalance_rate,
+                        help="Share of entity-periods made to miss balance")
+    parser.add_argument("--imbalance-amount", default=defaults.imbalance_amount,
+                        help="Amount added to one debit of each unbalanced entity-period")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--tb-template", default=DEFAULT_TB_TEMPLATE)
+    parser.add_argument("--mappings-template", default=DEFAULT_MAPPINGS_TEMPLATE)
+    args = parser.parse_args(argv)
+
+    spec = SynthSpec(
+        deals=args.deals,
+        accounts=args.accounts,
+        periods=args.periods,
+        entities=args.entities,
+        end_period=args.end_period,
+        imbalance_rate=args.imbalance_rate,
+        imbalance_amount=args.imbalance_amount,
+        seed=args.seed,
+    )
+    try:
+        manifest = generate(spec, args.out, load_templates(args.tb_template, args.mappings_template))
+    except SynthError as exc:
+        print(f"ERROR: {exc}")
+        return 2
+
+    print(f"Wrote {manifest['rows']:,} trial balance rows ({spec.deals} deals x {spec.accounts} accounts x "
+          f"{spec.periods} periods x {spec.entities} entities) to {args.out} in {manifest['elapsed_seconds']}s")
+    print(f"{len(manifest['unbalanced_periods'])} unbalanced deal-periods (see manifest.json)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
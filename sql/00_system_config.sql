@@ -26,28 +26,55 @@ FROM VALUES
     ('min_variance_amount', '5000.00', 'Minimum dollar amount to trigger variance analysis', 0),
     ('variance_threshold_pct', '0.20', 'Minimum percentage change to flag as variance (0.20 = 20%)', 0),
     ('max_error_rate_pct', '0.05', 'Maximum acceptable error rate for data loads (0.05 = 5%)', 0),
+    ('dq_outlier_zscore', '4', 'Account Outliers rule: standard deviations from the account mean that flag an amount', 0),
     
     -- AI Configuration
     ('max_ai_insights', '15', 'Maximum number of AI insights to generate per deal', 0),
     ('ai_model_variance', '"claude-4-sonnet"', 'AI model for variance analysis', 0),
     ('ai_model_trends', '"claude-4-sonnet"', 'AI model for trend analysis', 0),
     ('ai_batch_size', '50', 'Number of variance records to process in single AI batch', 0),
+    ('ai_cache_max_age_days', '90', 'Evict cached Cortex completions not used for this many days', 0),
+    ('ai_cache_max_entries', '50000', 'Maximum cached Cortex completions kept (least recently used evicted first)', 0),
+    ('ai_estimated_cost_per_call_usd', '0.03', 'Estimated Cortex cost per completion, used by the threshold impact preview', 0),
+    ('ai_model_low_severity', '"mistral-large2"', 'AI model for low-severity variances (cheaper, faster bulk model)', 0),
+    ('ai_deal_daily_token_budget', '200000', 'Cortex tokens one deal may use per day; low-severity prompts are skipped first', 0),
+    ('ai_daily_token_budget', '2000000', 'Cortex tokens all deals together may use per day', 0),
+    ('ai_estimated_completion_tokens', '150', 'Completion tokens assumed per Cortex call when checking the token budgets', 0),
+    ('ai_cost_per_million_tokens_usd', '{"claude-4-sonnet": 3.30, "claude-3-5-sonnet": 3.30, "mistral-large2": 2.00, "mistral-large": 2.00, "llama3.1-70b": 1.20, "default": 2.00}', 'Estimated Cortex cost per million tokens by model (default applies to unlisted models)', 0),
+    ('variance_index_pct_step', '0.05', 'Variance % grid step of variance_distribution_index (0.05 = 5%)', 0),
+    ('variance_index_amount_step', '1000', 'Prior amount grid step of variance_distribution_index (dollars)', 0),
     
     -- Performance & Scaling
     ('warehouse_size_default', '"SMALL"', 'Default warehouse size for processing', 0),
     ('warehouse_auto_suspend', '60', 'Auto-suspend timeout in seconds', 0),
     ('max_pivot_periods', '24', 'Maximum number of periods in pivoted views', 0),
+    ('schedule_template_name', '"STANDARD"', 'schedule_templates template used by build_schedules', 0),
     ('query_timeout_seconds', '3600', 'Maximum query execution time (1 hour)', 0),
+    ('portfolio_max_concurrency', '4', 'Deals processed in parallel by fdd_tools.portfolio (one session each)', 0),
+    ('portfolio_max_retries', '1', 'Retries per deal after a failed generate_fdd_schedules call in a portfolio run', 0),
     
     -- File Management
     ('input_stage_name', '"fdd_input_stage"', 'Name of input file stage', 0),
     ('output_stage_name', '"fdd_output_stage"', 'Name of output file stage', 0),
     ('default_file_format', '"csv_format"', 'Default file format for imports/exports', 0),
+    ('export_xlsx_workbook', 'true', 'generate_fdd_schedules also writes the multi-sheet fdd_workbook_<deal>.xlsx', 0),
+    ('export_mode', '"SINGLE"', 'SINGLE = one CSV per output; PARTITIONED = concurrent multi-file unloads under exports/<deal>/ with manifest.json', 0),
+    ('export_file_format', '"CSV_GZIP"', 'File format of PARTITIONED exports: CSV_GZIP or PARQUET', 0),
+    ('export_max_file_size_mb', '64', 'Maximum size of one PARTITIONED export file (MB)', 0),
+    ('columnar_file_format', '"parquet_format"', 'File format for Parquet files produced by fdd_tools.ingest', 0),
     
     -- Audit & Retention
     ('audit_retention_days', '90', 'Number of days to retain audit logs', 0),
     ('error_log_retention_days', '180', 'Number of days to retain error logs', 0),
+    ('dq_check_retention_days', '90', 'Number of days to retain data quality check results', 0),
     ('output_retention_days', '30', 'Number of days to retain output files in stage', 0),
+    ('stage_purge_files_per_remove', '200', 'Files matched by each regex-pattern REMOVE in purge_stage_files', 0),
+    ('retention_batch_rows', '100000', 'Rows deleted per transaction by purge_expired_rows', 0),
+    ('retention_max_batches', '100', 'Batches per table per retention run; the next run continues', 0),
+    ('retention_archive_enabled', 'false', 'Copy expired rows to retention_archive before deleting them', 0),
+    ('rollup_lag_minutes', '5', 'Minutes behind current time that operational rollups stop, so in-flight rows are not skipped', 0),
+    ('query_history_latency_minutes', '45', 'Minutes ACCOUNT_USAGE query history may lag; collect_step_performance waits this long', 0),
+    ('step_credits_backfill_hours', '24', 'Hours collect_step_performance keeps re-collecting steps whose attributed credits are still missing', 0),
     
     -- Security
     ('deal_id_validation_regex', '"^[A-Z0-9_-]+$"', 'Regex pattern for validating deal_id format', 0),
@@ -98,6 +125,18 @@ $$
     SELECT config_value::BOOLEAN FROM system_config WHERE config_key = key_name
 $$;
 
+-- Versioned snapshot of the whole configuration as one typed OBJECT (numbers stay
+-- numbers, booleans stay booleans). Procedures resolve it once per run and bind
+-- the values, instead of calling get_config_* inside row-level predicates.
+-- config_version changes whenever any key or value changes; it is stamped on
+-- audit_log rows, ai_insights, export_files and export manifests.
+CREATE OR REPLACE VIEW v_config_snapshot AS
+SELECT 
+    HASH_AGG(config_key, config_value) AS config_version,
+    OBJECT_AGG(config_key, IFF(is_sensitive, NULL, config_value))::OBJECT AS config_values,
+    MAX(last_updated) AS last_updated
+FROM system_config;
+
 -- Procedure to update config value
 CREATE OR REPLACE PROCEDURE update_config(
     key_name VARCHAR,
@@ -108,6 +147,8 @@ RETURNS VARCHAR
 LANGUAGE SQL
 AS
 $$
+DECLARE
+    new_version NUMBER;
 BEGIN
     UPDATE system_config
     SET config_value = :new_value,
@@ -119,13 +160,16 @@ BEGIN
         RETURN 'ERROR: Configuration key "' || :key_name || '" not found';
     END IF;
     
+    SELECT config_version INTO :new_version FROM v_config_snapshot;
+    
     -- Log the change
-    INSERT INTO audit_log (procedure_name, deal_id, status, rows_affected, message)
+    INSERT INTO audit_log (procedure_name, deal_id, status, rows_affected, message, config_version)
     VALUES ('update_config', NULL, 'SUCCESS', 1, 
             'Updated config: ' || :key_name || ' = ' || :new_value::VARCHAR || 
-            CASE WHEN :change_description IS NOT NULL THEN ' (' || :change_description || ')' ELSE '' END);
+            CASE WHEN :change_description IS NOT NULL THEN ' (' || :change_description || ')' ELSE '' END,
+            :new_version);
     
-    RETURN 'SUCCESS: Updated configuration ' || :key_name;
+    RETURN 'SUCCESS: Updated configuration ' || :key_name || ' (config version ' || :new_version || ')';
 END;
 $$;
 
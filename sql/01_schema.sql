@@ -57,6 +57,9 @@ CREATE TABLE IF NOT EXISTS account_mappings (
     sort_order_l3 NUMBER,
     sort_order_l4 NUMBER,
     
+    -- Display sign convention (classify_display_sign), set by load_account_mappings
+    display_sign_rule VARCHAR(20),  -- 'NEGATE', 'AS_IS', 'ABS'
+    
     -- Metadata
     is_active BOOLEAN DEFAULT TRUE,
     created_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
@@ -68,6 +71,9 @@ CREATE TABLE IF NOT EXISTS account_mappings (
 -- Add clustering
 ALTER TABLE account_mappings CLUSTER BY (deal_id, account_number);
 
+-- Add display_sign_rule to existing deployments (backfilled by refresh_schedule_trial_balance)
+ALTER TABLE account_mappings ADD COLUMN IF NOT EXISTS display_sign_rule VARCHAR(20);
+
 -- AI Insights Storage
 CREATE TABLE IF NOT EXISTS ai_insights (
     insight_id VARCHAR(50) DEFAULT UUID_STRING() PRIMARY KEY,
@@ -106,6 +112,66 @@ CREATE TABLE IF NOT EXISTS ai_insights (
     reviewed_timestamp TIMESTAMP_NTZ
 );
 
+-- v_config_snapshot version the insight was generated under
+ALTER TABLE ai_insights ADD COLUMN IF NOT EXISTS config_version NUMBER;
+
+-- Cortex completion cache, keyed by SHA2(model || '|' || prompt)
+-- Lets generate_ai_insights reuse answers for unchanged prompts across runs
+CREATE TABLE IF NOT EXISTS ai_completion_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    model_name VARCHAR(100) NOT NULL,
+    prompt_text VARCHAR(16000),
+    completion_text VARCHAR(16000),
+    
+    -- Usage tracking (drives eviction)
+    created_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    last_used_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    hit_count NUMBER DEFAULT 0
+);
+
+-- Token counts returned by Cortex for the call that produced the completion
+ALTER TABLE ai_completion_cache ADD COLUMN IF NOT EXISTS prompt_tokens NUMBER;
+ALTER TABLE ai_completion_cache ADD COLUMN IF NOT EXISTS completion_tokens NUMBER;
+
+-- Cortex token ledger: one row per COMPLETE call made by generate_ai_insights
+-- (cache hits are free and not recorded). Drives the daily token budgets.
+CREATE TABLE IF NOT EXISTS ai_token_usage (
+    usage_id VARCHAR(50) DEFAULT UUID_STRING() PRIMARY KEY,
+    call_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    call_date DATE DEFAULT CURRENT_DATE(),
+    deal_id VARCHAR(50) NOT NULL,
+    user_name VARCHAR(100) DEFAULT CURRENT_USER(),
+    
+    -- Call
+    model_name VARCHAR(100) NOT NULL,
+    insight_type VARCHAR(50),  -- 'variance', 'trend_analysis'
+    severity VARCHAR(20),
+    cache_key VARCHAR(64),
+    
+    -- Usage
+    prompt_tokens NUMBER,
+    completion_tokens NUMBER,
+    total_tokens NUMBER,
+    estimated_cost_usd NUMBER(10,4)
+);
+
+ALTER TABLE ai_token_usage CLUSTER BY (call_date, deal_id);
+
+-- Cumulative variance counts on a (variance %, prior amount) grid per deal.
+-- variance_count = candidates with variance_ratio > min_variance_pct AND
+-- prior_abs_amount > min_prior_amount, i.e. what generate_ai_insights would
+-- select at those thresholds before max_ai_insights applies.
+CREATE TABLE IF NOT EXISTS variance_distribution_index (
+    deal_id VARCHAR(50) NOT NULL,
+    min_variance_pct NUMBER(6,4) NOT NULL,   -- variance_threshold_pct grid edge (0.05 = 5%)
+    min_prior_amount NUMBER(18,2) NOT NULL,  -- min_variance_amount grid edge
+    cell_count NUMBER DEFAULT 0,             -- candidates between this edge and the next
+    variance_count NUMBER DEFAULT 0,         -- candidates above both edges
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, min_variance_pct, min_prior_amount)
+);
+
 -- ============================================================================
 -- OPERATIONAL TABLES
 -- ============================================================================
@@ -134,13 +200,19 @@ CREATE TABLE IF NOT EXISTS audit_log (
     error_message VARCHAR(5000),
     message VARCHAR(5000),
     
-    -- Query tracking
-    query_id VARCHAR(100) DEFAULT LAST_QUERY_ID(),
+    -- Query tracking (CALL that started a traced run; filled by collect_step_performance)
+    query_id VARCHAR(100),
     
     -- Cost tracking
     credits_used NUMBER(18,6)
 );
 
+-- LAST_QUERY_ID() at insert time was the statement before the audit row, not the run
+ALTER TABLE audit_log ALTER COLUMN query_id DROP DEFAULT;
+
+-- v_config_snapshot version the run resolved its settings from
+ALTER TABLE audit_log ADD COLUMN IF NOT EXISTS config_version NUMBER;
+
 -- Index for common queries
 CREATE INDEX IF NOT EXISTS idx_audit_deal_time ON audit_log(deal_id, log_timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_audit_status ON audit_log(status, log_timestamp DESC);
@@ -170,6 +242,31 @@ CREATE TABLE IF NOT EXISTS load_errors (
 
 CREATE INDEX IF NOT EXISTS idx_errors_unresolved ON load_errors(deal_id, is_resolved, error_timestamp DESC);
 
+-- Trial balance load history (one row per load_trial_balance call)
+CREATE TABLE IF NOT EXISTS trial_balance_load_history (
+    load_id VARCHAR(50) PRIMARY KEY,  -- audit_log.log_id of the load
+    load_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    deal_id VARCHAR(50),
+    file_name VARCHAR(500),
+    load_mode VARCHAR(10),  -- 'FULL', 'DELTA'
+    
+    -- Row outcomes
+    rows_staged NUMBER,
+    rows_inserted NUMBER,
+    rows_updated NUMBER,
+    rows_unchanged NUMBER,
+    
+    -- Validation scope and results
+    periods_validated NUMBER,
+    errors_found NUMBER,
+    unbalanced_periods NUMBER,
+    loaded_by VARCHAR(100) DEFAULT CURRENT_USER()
+);
+
+-- Periods a DELTA load inserted or updated (NULL = FULL load, every period);
+-- validate_data_quality re-checks only these
+ALTER TABLE trial_balance_load_history ADD COLUMN IF NOT EXISTS changed_periods ARRAY;
+
 -- Data Quality Validation Results
 CREATE TABLE IF NOT EXISTS data_quality_checks (
     check_id VARCHAR(50) DEFAULT UUID_STRING() PRIMARY KEY,
@@ -254,67 +351,108 @@ CREATE OR REPLACE FILE FORMAT csv_format
     COMPRESSION = 'AUTO'
     COMMENT = 'Standard CSV format for FDD data files';
 
+-- Parquet format for columnar files produced by fdd_tools.ingest
+CREATE OR REPLACE FILE FORMAT parquet_format
+    TYPE = 'PARQUET'
+    COMPRESSION = 'AUTO'
+    COMMENT = 'Columnar trial balance parts written by the streaming ingestion client';
+
+-- ============================================================================
+-- SIGN CONVENTION LAYER
+-- ============================================================================
+
+-- Display sign rule for one account, evaluated once per mapping row:
+--   NEGATE = revenue, flipped to positive
+--   AS_IS  = contra-asset (accumulated depreciation, allowance, reserve), kept negative
+--   ABS    = everything else (expenses, assets, liabilities, equity), shown positive
+CREATE OR REPLACE FUNCTION classify_display_sign(
+    statement_type VARCHAR,
+    mapping_level_1 VARCHAR,
+    account_name VARCHAR
+)
+RETURNS VARCHAR
+AS
+$$
+    CASE 
+        WHEN statement_type = 'IS' AND mapping_level_1 = 'Revenue' THEN 'NEGATE'
+        WHEN statement_type = 'BS' AND mapping_level_1 = 'Assets'
+             AND (account_name ILIKE '%accumulated depreciation%'
+                  OR account_name ILIKE '%allowance%'
+                  OR account_name ILIKE '%reserve%') THEN 'AS_IS'
+        ELSE 'ABS'
+    END
+$$;
+
+-- Schedule-ready trial balance: trial_balance_raw joined to the active mappings
+-- with display signs applied. Maintained by refresh_schedule_trial_balance,
+-- which load_trial_balance and load_account_mappings call inside their
+-- transactions (DELTA loads rebuild only the changed periods).
+CREATE TABLE IF NOT EXISTS trial_balance_for_schedules (
+    deal_id VARCHAR(50) NOT NULL,
+    deal_name VARCHAR(200),
+    entity VARCHAR(100),
+    period_date DATE NOT NULL,
+    account_number VARCHAR(50) NOT NULL,
+    account_name VARCHAR(500),
+    unique_id VARCHAR(600),
+    debit_amount NUMBER(18,2),
+    credit_amount NUMBER(18,2),
+    net_amount_raw NUMBER(18,2),
+    amount_for_display NUMBER(18,2),
+    display_sign_rule VARCHAR(20),
+    
+    -- Mapping info
+    account_category VARCHAR(50),
+    statement_type VARCHAR(20),
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    mapping_level_3 VARCHAR(200),
+    sort_order_l1 NUMBER,
+    sort_order_l2 NUMBER,
+    sort_order_l3 NUMBER,
+    upload_timestamp TIMESTAMP_NTZ,
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+ALTER TABLE trial_balance_for_schedules CLUSTER BY (deal_id, period_date);
+
+-- Data version per deal, bumped whenever refresh_schedule_trial_balance
+-- rewrites the deal's schedule-ready rows (cache key for schedule_values)
+CREATE TABLE IF NOT EXISTS deal_data_versions (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    data_version NUMBER NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
 -- ============================================================================
 -- VIEWS - Presentation Layer
 -- ============================================================================
 
--- Presentation layer: Convert accounting signs to display signs
+-- Presentation layer: display-signed trial balance (kept for existing queries;
+-- reads the materialized trial_balance_for_schedules table)
 CREATE OR REPLACE VIEW v_trial_balance_for_schedules AS
 SELECT 
-    t.deal_id,
-    t.deal_name,
-    t.entity,
-    t.period_date,
-    t.account_number,
-    t.account_name,
-    t.unique_id,
-    t.debit_amount,
-    t.credit_amount,
-    t.net_amount AS net_amount_raw,
-    
-    -- Calculate display amount based on account type
-    CASE 
-        -- Income Statement Accounts
-        WHEN m.statement_type = 'IS' AND m.mapping_level_1 = 'Revenue' 
-            THEN t.net_amount * -1  -- Flip revenue to positive
-        WHEN m.statement_type = 'IS' AND m.mapping_level_1 IN ('Cost of Goods Sold', 'Operating Expenses') 
-            THEN ABS(t.net_amount)  -- Expenses as positive
-        
-        -- Balance Sheet - Contra-Asset Accounts (shown as negative)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Assets' 
-             AND (t.account_name ILIKE '%accumulated depreciation%' 
-                  OR t.account_name ILIKE '%allowance%'
-                  OR t.account_name ILIKE '%reserve%') 
-            THEN t.net_amount  -- Keep negative (contra-asset)
-        
-        -- Balance Sheet - Regular Asset Accounts (positive)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Assets' 
-            THEN ABS(t.net_amount)
-        
-        -- Balance Sheet - Liabilities and Equity (all positive)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Liabilities' 
-            THEN ABS(t.net_amount)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Equity' 
-            THEN ABS(t.net_amount)
-        
-        -- Default: Absolute value
-        ELSE ABS(t.net_amount)
-    END AS amount_for_display,
-    
-    -- Include mapping info
-    m.account_category,
-    m.statement_type,
-    m.mapping_level_1,
-    m.mapping_level_2,
-    m.mapping_level_3,
-    m.sort_order_l1,
-    m.sort_order_l2,
-    m.sort_order_l3,
-    t.upload_timestamp
-FROM trial_balance_raw t
-LEFT JOIN account_mappings m 
-    ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-WHERE m.is_active = TRUE;
+    deal_id,
+    deal_name,
+    entity,
+    period_date,
+    account_number,
+    account_name,
+    unique_id,
+    debit_amount,
+    credit_amount,
+    net_amount_raw,
+    amount_for_display,
+    account_category,
+    statement_type,
+    mapping_level_1,
+    mapping_level_2,
+    mapping_level_3,
+    sort_order_l1,
+    sort_order_l2,
+    sort_order_l3,
+    upload_timestamp
+FROM trial_balance_for_schedules;
 
 -- Portfolio summary view
 CREATE OR REPLACE VIEW v_portfolio_summary AS
@@ -332,6 +470,43 @@ FROM trial_balance_raw t
 GROUP BY t.deal_id, t.deal_name
 ORDER BY last_updated DESC;
 
+-- Month-over-month variance candidates (same account and entity, prior month).
+-- Shared by generate_ai_insights and refresh_variance_index so the threshold
+-- preview counts exactly what the insight generator would select.
+CREATE OR REPLACE VIEW v_variance_candidates AS
+SELECT 
+    t1.deal_id,
+    t1.entity,
+    t1.period_date,
+    t1.account_number,
+    t1.account_name,
+    t1.net_amount,
+    t2.net_amount AS prior_net_amount,
+    t2.period_date AS prior_period_date,
+    ABS(t2.net_amount) AS prior_abs_amount,
+    ABS((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0)) AS variance_ratio,
+    ROUND((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0) * 100, 2) AS var_pct
+FROM trial_balance_raw t1
+JOIN trial_balance_raw t2
+    ON t1.deal_id = t2.deal_id
+    AND t1.account_number = t2.account_number
+    AND t1.entity = t2.entity
+    AND t2.period_date = DATEADD(month, -1, t1.period_date);
+
+-- Cortex tokens and estimated cost per deal, model and day
+CREATE OR REPLACE VIEW v_ai_cost_by_deal_model AS
+SELECT 
+    call_date,
+    deal_id,
+    model_name,
+    COUNT(*) AS cortex_calls,
+    SUM(prompt_tokens) AS prompt_tokens,
+    SUM(completion_tokens) AS completion_tokens,
+    SUM(total_tokens) AS total_tokens,
+    SUM(estimated_cost_usd) AS estimated_cost_usd
+FROM ai_token_usage
+GROUP BY call_date, deal_id, model_name;
+
 SELECT 'Core schema created successfully' AS status;
 
 
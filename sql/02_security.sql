@@ -48,10 +48,16 @@ GRANT USAGE ON SCHEMA TRIAL_BALANCE TO ROLE FDD_ANALYST_ROLE;
 -- Table access for analysts
 GRANT SELECT, INSERT, UPDATE ON TABLE trial_balance_raw TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT, INSERT, UPDATE ON TABLE account_mappings TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT, DELETE ON TABLE trial_balance_for_schedules TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT, UPDATE ON TABLE deal_data_versions TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE ai_insights TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE ai_completion_cache TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE ai_token_usage TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE variance_distribution_index TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE audit_log TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE data_quality_checks TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT, INSERT ON TABLE load_errors TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT ON TABLE trial_balance_load_history TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE system_config TO ROLE FDD_ANALYST_ROLE;
 
 -- View access
@@ -146,16 +152,37 @@ CREATE OR REPLACE MASKING POLICY mask_financial_amounts AS (val NUMBER) RETURNS
 -- PART 5: INPUT VALIDATION FUNCTIONS
 -- ============================================================================
 
--- Function to validate deal_id format (prevent SQL injection)
+-- Function to validate deal_id format (prevent SQL injection) against a
+-- config snapshot the caller already resolved from v_config_snapshot
+CREATE OR REPLACE FUNCTION validate_deal_id(deal_id_input VARCHAR, config_values OBJECT)
+RETURNS BOOLEAN
+LANGUAGE SQL
+AS
+$$
+    deal_id_input IS NOT NULL 
+    AND LENGTH(deal_id_input) <= config_values:max_deal_id_length::NUMBER
+    AND REGEXP_LIKE(deal_id_input, config_values:deal_id_validation_regex::VARCHAR)
+$$;
+
+-- Function to validate deal_id format (one v_config_snapshot read per call)
 CREATE OR REPLACE FUNCTION validate_deal_id(deal_id_input VARCHAR)
 RETURNS BOOLEAN
 LANGUAGE SQL
 AS
 $$
-    SELECT 
-        deal_id_input IS NOT NULL 
-        AND LENGTH(deal_id_input) <= get_config_number('max_deal_id_length')
-        AND REGEXP_LIKE(deal_id_input, get_config_string('deal_id_validation_regex'))
+    SELECT validate_deal_id(deal_id_input, config_values) FROM v_config_snapshot
+$$;
+
+-- Function to sanitize deal_id against a resolved config snapshot
+CREATE OR REPLACE FUNCTION sanitize_deal_id(deal_id_input VARCHAR, config_values OBJECT)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+    CASE 
+        WHEN validate_deal_id(deal_id_input, config_values) THEN UPPER(TRIM(deal_id_input))
+        ELSE NULL
+    END
 $$;
 
 -- Function to sanitize deal_id
@@ -164,11 +191,7 @@ RETURNS VARCHAR
 LANGUAGE SQL
 AS
 $$
-    SELECT 
-        CASE 
-            WHEN validate_deal_id(deal_id_input) THEN UPPER(TRIM(deal_id_input))
-            ELSE NULL
-        END
+    SELECT sanitize_deal_id(deal_id_input, config_values) FROM v_config_snapshot
 $$;
 
 -- ============================================================================
@@ -10,10 +10,121 @@
 -- PART 1: DATA LOADING PROCEDURES
 -- ============================================================================
 
+-- Procedure: Refresh the materialized schedule-ready trial balance
+-- Rebuilds trial_balance_for_schedules for one deal (or all deals), optionally
+-- limited to an array of period dates. Runs inside the caller's transaction
+-- (no BEGIN/COMMIT here) so the table commits or rolls back with the load that
+-- changed trial_balance_raw or account_mappings; errors propagate to the caller.
+CREATE OR REPLACE PROCEDURE refresh_schedule_trial_balance(
+    deal_id_param VARCHAR DEFAULT NULL,
+    periods_param ARRAY DEFAULT NULL
+)
+RETURNS VARCHAR
+LANGUAGE SQL
+EXECUTE AS CALLER
+AS
+$$
+DECLARE
+    rows_deleted NUMBER DEFAULT 0;
+    rows_inserted NUMBER DEFAULT 0;
+BEGIN
+    -- Mappings inserted outside load_account_mappings have no rule yet
+    UPDATE account_mappings
+    SET display_sign_rule = classify_display_sign(statement_type, mapping_level_1, account_name)
+    WHERE display_sign_rule IS NULL
+    AND (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    DELETE FROM trial_balance_for_schedules
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param)
+    AND (:periods_param IS NULL OR period_date IN (
+        SELECT value::DATE FROM TABLE(FLATTEN(INPUT => :periods_param))
+    ));
+    
+    rows_deleted := SQLROWCOUNT;
+    
+    INSERT INTO trial_balance_for_schedules (
+        deal_id, deal_name, entity, period_date, account_number, account_name, unique_id,
+        debit_amount, credit_amount, net_amount_raw, amount_for_display, display_sign_rule,
+        account_category, statement_type, mapping_level_1, mapping_level_2, mapping_level_3,
+        sort_order_l1, sort_order_l2, sort_order_l3, upload_timestamp
+    )
+    SELECT 
+        t.deal_id,
+        t.deal_name,
+        t.entity,
+        t.period_date,
+        t.account_number,
+        t.account_name,
+        t.unique_id,
+        t.debit_amount,
+        t.credit_amount,
+        t.net_amount,
+        CASE m.display_sign_rule
+            WHEN 'NEGATE' THEN t.net_amount * -1  -- Revenue shown positive
+            WHEN 'AS_IS' THEN t.net_amount        -- Contra-assets stay negative
+            ELSE ABS(t.net_amount)
+        END,
+        m.display_sign_rule,
+        m.account_category,
+        m.statement_type,
+        m.mapping_level_1,
+        m.mapping_level_2,
+        m.mapping_level_3,
+        m.sort_order_l1,
+        m.sort_order_l2,
+        m.sort_order_l3,
+        t.upload_timestamp
+    FROM trial_balance_raw t
+    JOIN account_mappings m 
+        ON t.deal_id = m.deal_id AND t.account_number = m.account_number
+    WHERE m.is_active = TRUE
+    AND (:deal_id_param IS NULL OR t.deal_id = :deal_id_param)
+    AND (:periods_param IS NULL OR t.period_date IN (
+        SELECT value::DATE FROM TABLE(FLATTEN(INPUT => :periods_param))
+    ));
+    
+    rows_inserted := SQLROWCOUNT;
+    
+    -- New data version for every deal touched (invalidates cached schedule_values)
+    MERGE INTO deal_data_versions v
+    USING (
+        SELECT :deal_id_param AS deal_id WHERE :deal_id_param IS NOT NULL
+        UNION
+        SELECT DISTINCT deal_id FROM trial_balance_raw WHERE :deal_id_param IS NULL
+    ) d
+    ON v.deal_id = d.deal_id
+    WHEN MATCHED THEN UPDATE SET data_version = v.data_version + 1, changed_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (deal_id, data_version) VALUES (d.deal_id, 1);
+    
+    RETURN 'SUCCESS: ' || :rows_inserted || ' schedule rows written, ' || :rows_deleted || ' replaced';
+END;
+$$;
+
+-- Drop all possible existing versions to avoid overload errors
+-- Note: Must match exact signature including DEFAULT parameters
+EXECUTE IMMEDIATE $$
+BEGIN
+    DROP PROCEDURE IF EXISTS load_trial_balance();
+    DROP PROCEDURE IF EXISTS load_trial_balance(VARCHAR);
+    DROP PROCEDURE IF EXISTS load_trial_balance(VARCHAR, VARCHAR);
+    DROP PROCEDURE IF EXISTS load_trial_balance(VARCHAR, VARCHAR, VARCHAR);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Ignore errors if procedure doesn't exist
+        RETURN 'Procedures dropped or did not exist';
+END;
+$$;
+
 -- Procedure: Load Trial Balance with comprehensive error handling
+-- load_mode:
+--   'FULL'  - replace all data (or all data for deal_id_filter), then COPY
+--   'DELTA' - stage the file, then MERGE on (deal_id, account_number, period_date, entity);
+--             only new or changed rows are written and only their periods are re-validated.
+--             Rows absent from the file are kept.
 CREATE OR REPLACE PROCEDURE load_trial_balance(
     file_name VARCHAR DEFAULT '01_sample_trial_balance_24mo.csv',
-    deal_id_filter VARCHAR DEFAULT NULL
+    deal_id_filter VARCHAR DEFAULT NULL,
+    load_mode VARCHAR DEFAULT 'FULL'
 )
 RETURNS TABLE(status VARCHAR, rows_loaded NUMBER, errors_found NUMBER, message VARCHAR)
 LANGUAGE SQL
@@ -23,53 +134,130 @@ $$
 DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    load_mode_var VARCHAR;
     rows_loaded NUMBER DEFAULT 0;
     error_count NUMBER DEFAULT 0;
     unbalanced_count NUMBER DEFAULT 0;
     max_imbalance NUMBER DEFAULT 0;
+    rows_inserted NUMBER DEFAULT 0;
+    rows_updated NUMBER DEFAULT 0;
+    rows_unchanged NUMBER DEFAULT 0;
+    duplicate_keys NUMBER DEFAULT 0;
+    affected_periods NUMBER DEFAULT 0;
+    changed_periods ARRAY;
+    config_version_var NUMBER;
+    input_stage VARCHAR;
+    default_format VARCHAR;
+    columnar_format VARCHAR;
+    max_error_rate FLOAT;
+    balance_tolerance FLOAT;
     stage_path VARCHAR;
+    target_table VARCHAR;
+    column_list VARCHAR;
+    copy_options VARCHAR;
     result_cursor RESULTSET;
+    error_msg VARCHAR;
 BEGIN
+    load_mode_var := UPPER(COALESCE(:load_mode, 'FULL'));
+    
+    -- Settings for the whole run, resolved once and bound below
+    SELECT 
+        config_version,
+        config_values:input_stage_name::VARCHAR,
+        config_values:default_file_format::VARCHAR,
+        config_values:columnar_file_format::VARCHAR,
+        config_values:max_error_rate_pct::FLOAT,
+        config_values:balance_tolerance_dollars::FLOAT
+    INTO :config_version_var, :input_stage, :default_format, :columnar_format, :max_error_rate, :balance_tolerance
+    FROM v_config_snapshot;
+    
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message)
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message, config_version)
     VALUES (:log_id_var, 'load_trial_balance', :deal_id_filter, :start_time_var, 'STARTED', 
-            'Loading from file: ' || :file_name);
+            'Loading from file: ' || :file_name || ' (' || :load_mode_var || ')', :config_version_var);
+    
+    IF (:load_mode_var NOT IN ('FULL', 'DELTA')) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'ERROR',
+            error_message = 'Invalid load_mode: ' || :load_mode_var
+        WHERE log_id = :log_id_var;
+        
+        result_cursor := (
+            SELECT 'ERROR' AS status, 0 AS rows_loaded, 0 AS errors_found,
+                   'Invalid load_mode ''' || :load_mode_var || '''. Use FULL or DELTA.' AS message
+        );
+        RETURN TABLE(result_cursor);
+    END IF;
     
     -- Construct stage path
-    stage_path := '@' || get_config_string('input_stage_name') || '/' || :file_name;
+    stage_path := '@' || :input_stage || '/' || :file_name;
     
-    BEGIN TRANSACTION;
+    -- Parquet parts written by fdd_tools.ingest are loaded by column name;
+    -- a trailing '/' loads every part under that stage prefix
+    IF (:file_name ILIKE '%.parquet' OR RIGHT(:file_name, 1) = '/') THEN
+        column_list := '';
+        copy_options := 'FILE_FORMAT = (FORMAT_NAME = ''' || :columnar_format || ''') ' ||
+                        'MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE ' ||
+                        IFF(RIGHT(:file_name, 1) = '/', 'PATTERN = ''.*[.]parquet'' ', '');
+    ELSE
+        column_list := '(deal_id, deal_name, entity, period_date, account_number, account_name, ' ||
+                       'debit_amount, credit_amount, net_amount) ';
+        copy_options := 'FILE_FORMAT = (FORMAT_NAME = ''' || :default_format || ''') ';
+    END IF;
     
-    -- Option 1: Full reload (if no deal_id_filter provided)
-    IF (:deal_id_filter IS NULL) THEN
-        TRUNCATE TABLE trial_balance_raw;
+    -- DELTA loads land in a session staging table first (DDL must precede the transaction)
+    IF (:load_mode_var = 'DELTA') THEN
+        CREATE OR REPLACE TEMPORARY TABLE temp_tb_delta LIKE trial_balance_raw;
+        ALTER TABLE temp_tb_delta ADD COLUMN change_type VARCHAR(10);
+        target_table := 'temp_tb_delta';
     ELSE
-        -- Option 2: Selective reload for specific deal
-        DELETE FROM trial_balance_raw WHERE deal_id = :deal_id_filter;
+        target_table := 'trial_balance_raw';
+    END IF;
+    
+    BEGIN TRANSACTION;
+    
+    IF (:load_mode_var = 'FULL') THEN
+        -- Option 1: Full reload (if no deal_id_filter provided)
+        IF (:deal_id_filter IS NULL) THEN
+            TRUNCATE TABLE trial_balance_raw;
+        ELSE
+            -- Option 2: Selective reload for specific deal
+            DELETE FROM trial_balance_raw WHERE deal_id = :deal_id_filter;
+        END IF;
     END IF;
     
     -- Load data with error continuation
     EXECUTE IMMEDIATE
-        'COPY INTO trial_balance_raw (' ||
-        '    deal_id, deal_name, entity, period_date, account_number, account_name, ' ||
-        '    debit_amount, credit_amount, net_amount' ||
-        ') ' ||
+        'COPY INTO ' || :target_table || ' ' || :column_list ||
         'FROM ' || :stage_path || ' ' ||
-        'FILE_FORMAT = (FORMAT_NAME = ''' || get_config_string('default_file_format') || ''') ' ||
+        :copy_options ||
         'ON_ERROR = ''CONTINUE'' ' ||
         'RETURN_FAILED_ONLY = FALSE';
     
     rows_loaded := SQLROWCOUNT;
     
     -- Capture load errors
-    INSERT INTO load_errors (deal_id, file_name, error_type, error_message)
-    SELECT 
-        :deal_id_filter,
-        :file_name,
-        'LOAD_ERROR',
-        ERROR || ' at line ' || LINE
-    FROM TABLE(VALIDATE(trial_balance_raw, JOB_ID => '_last'))
-    WHERE ERROR IS NOT NULL;
+    IF (:load_mode_var = 'DELTA') THEN
+        INSERT INTO load_errors (deal_id, file_name, error_type, error_message)
+        SELECT 
+            :deal_id_filter,
+            :file_name,
+            'LOAD_ERROR',
+            ERROR || ' at line ' || LINE
+        FROM TABLE(VALIDATE(temp_tb_delta, JOB_ID => '_last'))
+        WHERE ERROR IS NOT NULL;
+    ELSE
+        INSERT INTO load_errors (deal_id, file_name, error_type, error_message)
+        SELECT 
+            :deal_id_filter,
+            :file_name,
+            'LOAD_ERROR',
+            ERROR || ' at line ' || LINE
+        FROM TABLE(VALIDATE(trial_balance_raw, JOB_ID => '_last'))
+        WHERE ERROR IS NOT NULL;
+    END IF;
     
     SELECT COUNT(*) INTO :error_count 
     FROM load_errors 
@@ -77,7 +265,7 @@ BEGIN
     AND error_timestamp > :start_time_var;
     
     -- Check error rate threshold
-    IF (:rows_loaded > 0 AND :error_count::FLOAT / :rows_loaded > get_config_number('max_error_rate_pct')) THEN
+    IF (:rows_loaded > 0 AND :error_count::FLOAT / :rows_loaded > :max_error_rate) THEN
         ROLLBACK;
         
         -- Log failure
@@ -86,7 +274,7 @@ BEGIN
             duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
             status = 'ERROR',
             error_message = 'Error rate (' || ROUND(:error_count::FLOAT / :rows_loaded * 100, 2) || 
-                          '%) exceeds threshold (' || (get_config_number('max_error_rate_pct') * 100) || '%)',
+                          '%) exceeds threshold (' || (:max_error_rate * 100) || '%)',
             rows_affected = :rows_loaded
         WHERE log_id = :log_id_var;
         
@@ -99,48 +287,194 @@ BEGIN
         RETURN TABLE(result_cursor);
     END IF;
     
-    -- Update unique_id for new records
-    UPDATE trial_balance_raw
-    SET unique_id = account_number || ' - ' || account_name
-    WHERE unique_id IS NULL;
+    IF (:load_mode_var = 'DELTA') THEN
+        -- Only touch the requested deal
+        IF (:deal_id_filter IS NOT NULL) THEN
+            DELETE FROM temp_tb_delta WHERE deal_id <> :deal_id_filter;
+            rows_loaded := :rows_loaded - SQLROWCOUNT;
+        END IF;
+        
+        -- MERGE needs one source row per natural key
+        SELECT COUNT(*) INTO :duplicate_keys
+        FROM (
+            SELECT 1
+            FROM temp_tb_delta
+            GROUP BY deal_id, account_number, period_date, entity
+            HAVING COUNT(*) > 1
+        );
+        
+        IF (:duplicate_keys > 0) THEN
+            ROLLBACK;
+            
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+                status = 'ERROR',
+                error_message = :duplicate_keys || ' duplicate (deal_id, account_number, period_date, entity) keys in file',
+                rows_affected = 0
+            WHERE log_id = :log_id_var;
+            
+            result_cursor := (
+                SELECT 'ERROR' AS status, 
+                       :rows_loaded AS rows_loaded, 
+                       :error_count AS errors_found,
+                       :duplicate_keys || ' duplicate natural keys in file. Nothing was merged.' AS message
+            );
+            RETURN TABLE(result_cursor);
+        END IF;
+        
+        -- Classify staged rows against the current trial balance
+        UPDATE temp_tb_delta SET change_type = 'INSERT';
+        
+        UPDATE temp_tb_delta s
+        SET change_type = CASE
+                WHEN EQUAL_NULL(s.deal_name, t.deal_name)
+                 AND EQUAL_NULL(s.account_name, t.account_name)
+                 AND EQUAL_NULL(s.debit_amount, t.debit_amount)
+                 AND EQUAL_NULL(s.credit_amount, t.credit_amount)
+                 AND EQUAL_NULL(s.net_amount, t.net_amount)
+                THEN 'UNCHANGED'
+                ELSE 'UPDATE'
+            END
+        FROM trial_balance_raw t
+        WHERE t.deal_id = s.deal_id
+        AND t.account_number = s.account_number
+        AND t.period_date = s.period_date
+        AND EQUAL_NULL(t.entity, s.entity);
+        
+        SELECT 
+            COUNT_IF(change_type = 'INSERT'),
+            COUNT_IF(change_type = 'UPDATE'),
+            COUNT_IF(change_type = 'UNCHANGED')
+        INTO :rows_inserted, :rows_updated, :rows_unchanged
+        FROM temp_tb_delta;
+        
+        MERGE INTO trial_balance_raw t
+        USING (SELECT * FROM temp_tb_delta WHERE change_type <> 'UNCHANGED') s
+        ON t.deal_id = s.deal_id
+        AND t.account_number = s.account_number
+        AND t.period_date = s.period_date
+        AND EQUAL_NULL(t.entity, s.entity)
+        WHEN MATCHED THEN UPDATE SET
+            deal_name = s.deal_name,
+            account_name = s.account_name,
+            debit_amount = s.debit_amount,
+            credit_amount = s.credit_amount,
+            net_amount = s.net_amount,
+            unique_id = s.account_number || ' - ' || s.account_name,
+            upload_timestamp = CURRENT_TIMESTAMP(),
+            uploaded_by = CURRENT_USER()
+        WHEN NOT MATCHED THEN INSERT (
+            deal_id, deal_name, entity, period_date, account_number, account_name,
+            debit_amount, credit_amount, net_amount, unique_id
+        ) VALUES (
+            s.deal_id, s.deal_name, s.entity, s.period_date, s.account_number, s.account_name,
+            s.debit_amount, s.credit_amount, s.net_amount, s.account_number || ' - ' || s.account_name
+        );
+        
+        -- VALIDATION: Check balances of the changed (deal_id, period_date) groups only
+        SELECT COUNT(*), COUNT_IF(imbalance > :balance_tolerance),
+               MAX(IFF(imbalance > :balance_tolerance, imbalance, NULL))
+        INTO :affected_periods, :unbalanced_count, :max_imbalance
+        FROM (
+            SELECT 
+                tb.deal_id,
+                tb.period_date,
+                ABS(SUM(tb.debit_amount) - SUM(tb.credit_amount)) AS imbalance
+            FROM trial_balance_raw tb
+            INNER JOIN (
+                SELECT DISTINCT deal_id, period_date
+                FROM temp_tb_delta
+                WHERE change_type <> 'UNCHANGED'
+            ) changed
+                ON tb.deal_id = changed.deal_id
+                AND tb.period_date = changed.period_date
+            GROUP BY tb.deal_id, tb.period_date
+        );
+        
+        -- Rebuild the schedule-ready rows of the changed periods only
+        IF (:rows_inserted + :rows_updated > 0) THEN
+            SELECT ARRAY_AGG(DISTINCT period_date) INTO :changed_periods
+            FROM temp_tb_delta
+            WHERE change_type <> 'UNCHANGED';
+            
+            CALL refresh_schedule_trial_balance(:deal_id_filter, :changed_periods);
+        END IF;
+    ELSE
+        rows_inserted := :rows_loaded;
+        
+        -- Update unique_id for new records
+        UPDATE trial_balance_raw
+        SET unique_id = account_number || ' - ' || account_name
+        WHERE unique_id IS NULL;
+        
+        -- VALIDATION: Check trial balance balances
+        SELECT COUNT(*), COUNT_IF(imbalance > :balance_tolerance),
+               MAX(IFF(imbalance > :balance_tolerance, imbalance, NULL))
+        INTO :affected_periods, :unbalanced_count, :max_imbalance
+        FROM (
+            SELECT 
+                period_date,
+                ABS(SUM(debit_amount) - SUM(credit_amount)) AS imbalance
+            FROM trial_balance_raw
+            WHERE deal_id = COALESCE(:deal_id_filter, deal_id)
+            GROUP BY deal_id, period_date
+        );
+        
+        CALL refresh_schedule_trial_balance(:deal_id_filter);
+    END IF;
     
-    -- VALIDATION: Check trial balance balances
-    SELECT COUNT(*), MAX(imbalance)
-    INTO :unbalanced_count, :max_imbalance
-    FROM (
+    -- Log data quality check (using SELECT to support OBJECT_CONSTRUCT)
+    -- Only log if deal_id is provided
+    IF (:deal_id_filter IS NOT NULL) THEN
+        INSERT INTO data_quality_checks (deal_id, check_name, check_type, passed, actual_value, severity, message)
         SELECT 
-            period_date,
-            ABS(SUM(debit_amount) - SUM(credit_amount)) AS imbalance
-        FROM trial_balance_raw
-        WHERE deal_id = COALESCE(:deal_id_filter, deal_id)
-        GROUP BY deal_id, period_date
-        HAVING ABS(SUM(debit_amount) - SUM(credit_amount)) > get_config_number('balance_tolerance_dollars')
-    );
+            :deal_id_filter,
+            'Trial Balance Balancing',
+            'BALANCE',
+            :unbalanced_count = 0,
+            OBJECT_CONSTRUCT('unbalanced_periods', :unbalanced_count, 'max_imbalance', :max_imbalance,
+                             'periods_checked', :affected_periods, 'load_mode', :load_mode_var),
+            CASE WHEN :unbalanced_count = 0 THEN 'INFO' ELSE 'WARNING' END,
+            CASE 
+                WHEN :unbalanced_count = 0 THEN 'All periods balanced (debits = credits)'
+                ELSE :unbalanced_count || ' periods out of balance. Max imbalance: $' || ROUND(:max_imbalance, 2)
+            END;
+    END IF;
     
-    -- Log data quality check
-    INSERT INTO data_quality_checks (deal_id, check_name, check_type, passed, actual_value, severity, message)
-    VALUES (
-        :deal_id_filter,
-        'Trial Balance Balancing',
-        'BALANCE',
-        :unbalanced_count = 0,
-        OBJECT_CONSTRUCT('unbalanced_periods', :unbalanced_count, 'max_imbalance', :max_imbalance),
-        CASE WHEN :unbalanced_count = 0 THEN 'INFO' ELSE 'WARNING' END,
-        CASE 
-            WHEN :unbalanced_count = 0 THEN 'All periods balanced (debits = credits)'
-            ELSE :unbalanced_count || ' periods out of balance. Max imbalance: $' || ROUND(:max_imbalance, 2)
-        END
-    );
+    -- Record what this load changed
+    INSERT INTO trial_balance_load_history (
+        load_id, deal_id, file_name, load_mode, rows_staged,
+        rows_inserted, rows_updated, rows_unchanged, periods_validated,
+        errors_found, unbalanced_periods, changed_periods
+    )
+    SELECT 
+        :log_id_var, :deal_id_filter, :file_name, :load_mode_var, :rows_loaded,
+        :rows_inserted, :rows_updated, :rows_unchanged, :affected_periods,
+        :error_count, :unbalanced_count,
+        IFF(:load_mode_var = 'DELTA', COALESCE(:changed_periods, ARRAY_CONSTRUCT()), NULL);
     
     COMMIT;
     
+    IF (:load_mode_var = 'DELTA') THEN
+        DROP TABLE IF EXISTS temp_tb_delta;
+    END IF;
+    
+    -- Keep the threshold preview index and the Database tab in step with the data
+    IF (:rows_inserted + :rows_updated > 0 OR :load_mode_var = 'FULL') THEN
+        CALL refresh_variance_index(:deal_id_filter);
+        CALL refresh_database_tab(:deal_id_filter);
+    END IF;
+    
     -- Log success
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
         duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
         status = CASE WHEN :unbalanced_count > 0 THEN 'WARNING' ELSE 'SUCCESS' END,
-        rows_affected = :rows_loaded,
-        message = 'Loaded ' || :rows_loaded || ' rows, ' || :error_count || ' errors, ' || 
+        rows_affected = :rows_inserted + :rows_updated,
+        message = 'Loaded ' || :rows_loaded || ' rows (' || :load_mode_var || '): ' ||
+                  :rows_inserted || ' inserted, ' || :rows_updated || ' updated, ' ||
+                  :rows_unchanged || ' unchanged, ' || :error_count || ' errors, ' || 
                   :unbalanced_count || ' unbalanced periods'
     WHERE log_id = :log_id_var;
     
@@ -150,6 +484,11 @@ BEGIN
             :rows_loaded AS rows_loaded,
             :error_count AS errors_found,
             'Loaded ' || :rows_loaded || ' rows. ' ||
+            CASE WHEN :load_mode_var = 'DELTA'
+                 THEN :rows_inserted || ' inserted, ' || :rows_updated || ' updated, ' ||
+                      :rows_unchanged || ' unchanged; ' || :affected_periods || ' periods re-validated. '
+                 ELSE ''
+            END ||
             CASE 
                 WHEN :unbalanced_count > 0 
                 THEN :unbalanced_count || ' periods have imbalances (max: $' || ROUND(:max_imbalance, 2) || ')'
@@ -161,6 +500,8 @@ BEGIN
     
 EXCEPTION
     WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
         ROLLBACK;
         
         -- Log error
@@ -168,7 +509,7 @@ EXCEPTION
         SET end_time = CURRENT_TIMESTAMP(),
             duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
             status = 'ERROR',
-            error_message = 'FATAL: ' || SQLERRM,
+            error_message = 'FATAL: ' || :error_msg,
             rows_affected = :rows_loaded
         WHERE log_id = :log_id_var;
         
@@ -176,7 +517,7 @@ EXCEPTION
             SELECT 'ERROR' AS status, 
                    0 AS rows_loaded, 
                    0 AS errors_found,
-                   'FATAL ERROR: ' || SQLERRM AS message
+                   'FATAL ERROR: ' || :error_msg AS message
         );
         RETURN TABLE(result_cursor);
 END;
@@ -245,6 +586,13 @@ BEGIN
         WHERE deal_id = :deal_id_filter AND is_active IS NULL;
     END IF;
     
+    -- Classify display signs once per account, then rebuild the schedule-ready rows
+    UPDATE account_mappings
+    SET display_sign_rule = classify_display_sign(statement_type, mapping_level_1, account_name)
+    WHERE deal_id = COALESCE(:deal_id_filter, deal_id);
+    
+    CALL refresh_schedule_trial_balance(:deal_id_filter);
+    
     -- VALIDATION: Check for unmapped accounts in trial balance
     SELECT COUNT(DISTINCT t.account_number)
     INTO :unmapped_count
@@ -287,6 +635,9 @@ BEGIN
     
     COMMIT;
     
+    -- Mapping levels and sort orders are part of the Database tab
+    CALL refresh_database_tab(:deal_id_filter);
+    
     -- Log completion
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
@@ -336,17 +687,156 @@ $$;
 -- PART 2: DATA VALIDATION PROCEDURES
 -- ============================================================================
 
+-- validate_data_quality evaluates the rules registered in dq_rules. Each rule
+-- reads one metric, and the evaluator computes every metric in a single scan of
+-- the deal's trial balance, kept per period in dq_period_metrics. A new rule over
+-- an existing metric adds no scan at all. Only periods loaded since the deal's
+-- last check are re-scanned (DELTA loads record them in
+-- trial_balance_load_history.changed_periods); FULL loads, account mapping loads
+-- and full_check => TRUE re-scan the whole deal.
+
+-- Rule registry: a rule passes when its metric lies within [min_pass, max_pass]
+CREATE TABLE IF NOT EXISTS dq_rules (
+    rule_name VARCHAR(200) PRIMARY KEY,  -- data_quality_checks.check_name
+    check_type VARCHAR(50),              -- 'COMPLETENESS', 'CONSISTENCY', 'ACCURACY'
+    metric_name VARCHAR(100) NOT NULL,   -- tb_rows, unmapped_accounts, missing_periods, revenue_sign_rows,
+                                         -- duplicate_rows, outlier_rows, missing_entity_periods
+    min_pass NUMBER,                     -- NULL = no lower bound
+    max_pass NUMBER,                     -- NULL = no upper bound
+    fail_severity VARCHAR(20) NOT NULL,  -- 'WARNING', 'ERROR', 'CRITICAL'
+    escalate_at NUMBER,                  -- metric value from which escalated_severity applies
+    escalated_severity VARCHAR(20),
+    pass_message VARCHAR(500),           -- {n} is replaced by the metric value
+    fail_message VARCHAR(500),
+    rule_order NUMBER,
+    is_enabled BOOLEAN DEFAULT TRUE
+);
+
+-- Built-in rules (re-deploying updates their definitions but keeps is_enabled)
+MERGE INTO dq_rules r
+USING (
+    SELECT column1 AS rule_name, column2 AS check_type, column3 AS metric_name,
+           column4 AS min_pass, column5 AS max_pass, column6 AS fail_severity,
+           column7 AS escalate_at, column8 AS escalated_severity,
+           column9 AS pass_message, column10 AS fail_message, column11 AS rule_order
+    FROM VALUES
+        ('Trial Balance Existence', 'COMPLETENESS', 'tb_rows', 1, NULL, 'CRITICAL', NULL, NULL,
+         'Found {n} records', 'No trial balance data found', 1),
+        ('Account Mapping Completeness', 'COMPLETENESS', 'unmapped_accounts', NULL, 0, 'WARNING', 5, 'ERROR',
+         'All accounts mapped', '{n} accounts missing mappings', 2),
+        ('Period Continuity', 'COMPLETENESS', 'missing_periods', NULL, 0, 'WARNING', NULL, NULL,
+         'No date gaps detected', '{n} month gaps in period sequence', 3),
+        ('Revenue Sign Check', 'ACCURACY', 'revenue_sign_rows', NULL, 0, 'WARNING', NULL, NULL,
+         'Revenue signs look correct', '{n} revenue rows with unexpected debit (positive) values', 4),
+        ('Duplicate Records', 'CONSISTENCY', 'duplicate_rows', NULL, 0, 'ERROR', NULL, NULL,
+         'No duplicates found', '{n} duplicate records detected', 5),
+        ('Account Outliers', 'ACCURACY', 'outlier_rows', NULL, 0, 'WARNING', NULL, NULL,
+         'No account-level outliers', '{n} account-period amounts beyond dq_outlier_zscore standard deviations of the account''s mean', 6),
+        ('Entity Completeness', 'COMPLETENESS', 'missing_entity_periods', NULL, 0, 'WARNING', NULL, NULL,
+         'Every entity reports in every period', '{n} entity-periods without trial balance rows', 7)
+) s
+ON r.rule_name = s.rule_name
+WHEN MATCHED THEN UPDATE SET
+    check_type = s.check_type,
+    metric_name = s.metric_name,
+    min_pass = s.min_pass,
+    max_pass = s.max_pass,
+    fail_severity = s.fail_severity,
+    escalate_at = s.escalate_at,
+    escalated_severity = s.escalated_severity,
+    pass_message = s.pass_message,
+    fail_message = s.fail_message,
+    rule_order = s.rule_order
+WHEN NOT MATCHED THEN INSERT (
+    rule_name, check_type, metric_name, min_pass, max_pass, fail_severity,
+    escalate_at, escalated_severity, pass_message, fail_message, rule_order
+) VALUES (
+    s.rule_name, s.check_type, s.metric_name, s.min_pass, s.max_pass, s.fail_severity,
+    s.escalate_at, s.escalated_severity, s.pass_message, s.fail_message, s.rule_order
+);
+
+-- Rule metrics per deal and period (deal metrics are folded from these rows)
+CREATE TABLE IF NOT EXISTS dq_period_metrics (
+    deal_id VARCHAR(50) NOT NULL,
+    period_date DATE NOT NULL,
+    tb_rows NUMBER,
+    unmapped_accounts ARRAY,   -- distinct account numbers without a mapping
+    revenue_sign_rows NUMBER,  -- Revenue rows with a debit (positive) net amount
+    duplicate_rows NUMBER,     -- rows beyond the first per (account_number, entity)
+    outlier_rows NUMBER,       -- amounts beyond dq_outlier_zscore stddevs of the account baseline
+    entities ARRAY,            -- distinct entities with rows in the period
+    evaluated_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, period_date)
+);
+
+-- Mean and standard deviation of each account's net amount, taken on full scans;
+-- incremental checks score new periods against them
+CREATE TABLE IF NOT EXISTS dq_account_baselines (
+    deal_id VARCHAR(50) NOT NULL,
+    account_number VARCHAR(50) NOT NULL,
+    entity VARCHAR(100) NOT NULL,  -- '' when the trial balance has no entity
+    mean_amount FLOAT,
+    stddev_amount FLOAT,
+    periods NUMBER,
+    computed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, account_number, entity)
+);
+
+-- Loads up to checked_through are reflected in a deal's dq_period_metrics
+CREATE TABLE IF NOT EXISTS dq_check_state (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    checked_through TIMESTAMP_NTZ,
+    last_full_check TIMESTAMP_NTZ
+);
+
+GRANT SELECT ON TABLE dq_rules TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE dq_rules TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON TABLE dq_period_metrics TO ROLE FDD_ANALYST_ROLE;
+
+-- Drop the pre-registry signature; with a DEFAULT parameter it would be an ambiguous overload
+EXECUTE IMMEDIATE $$
+BEGIN
+    DROP PROCEDURE IF EXISTS validate_data_quality(VARCHAR);
+    DROP PROCEDURE IF EXISTS validate_data_quality(VARCHAR, BOOLEAN);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Ignore errors if procedure doesn't exist
+        RETURN 'Procedures dropped or did not exist';
+END;
+$$;
+
 -- Comprehensive data quality validation
-CREATE OR REPLACE PROCEDURE validate_data_quality(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE validate_data_quality(deal_id_param VARCHAR, full_check BOOLEAN DEFAULT FALSE)
 RETURNS TABLE(check_name VARCHAR, passed BOOLEAN, severity VARCHAR, message VARCHAR)
 LANGUAGE SQL
 AS
 $$
 DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    config_version_var NUMBER;
+    run_config OBJECT;
+    outlier_zscore FLOAT;
+    checked_through TIMESTAMP_NTZ;
+    new_checked_through TIMESTAMP_NTZ;
+    full_loads NUMBER DEFAULT 0;
+    mapping_loads NUMBER DEFAULT 0;
+    full_scan BOOLEAN;
+    periods_scanned NUMBER DEFAULT 0;
+    rules_evaluated NUMBER DEFAULT 0;
+    rules_failed NUMBER DEFAULT 0;
     result_cursor RESULTSET;
+    error_msg VARCHAR;
 BEGIN
+    -- Settings for the whole run, resolved once and bound below
+    SELECT config_version, config_values, COALESCE(config_values:dq_outlier_zscore::FLOAT, 4)
+    INTO :config_version_var, :run_config, :outlier_zscore
+    FROM v_config_snapshot;
+    
     -- Validate deal_id
-    IF (NOT validate_deal_id(:deal_id_param)) THEN
+    IF (NOT validate_deal_id(:deal_id_param, :run_config)) THEN
         result_cursor := (
             SELECT 'Input Validation' AS check_name, FALSE AS passed, 
                    'ERROR' AS severity, 'Invalid deal_id format' AS message
@@ -354,108 +844,211 @@ BEGIN
         RETURN TABLE(result_cursor);
     END IF;
     
-    -- Run all data quality checks and return results
-    result_cursor := (
-        WITH checks AS (
-            -- Check 1: Trial balance exists
-            SELECT 
-                'Trial Balance Existence' AS check_name,
-                COUNT(*) > 0 AS passed,
-                CASE WHEN COUNT(*) > 0 THEN 'INFO' ELSE 'CRITICAL' END AS severity,
-                CASE WHEN COUNT(*) > 0 
-                     THEN 'Found ' || COUNT(*) || ' records' 
-                     ELSE 'No trial balance data found' END AS message
-            FROM trial_balance_raw
-            WHERE deal_id = :deal_id_param
-            
-            UNION ALL
-            
-            -- Check 2: Account mappings complete
-            SELECT 
-                'Account Mapping Completeness',
-                COUNT(*) = 0,
-                CASE WHEN COUNT(*) = 0 THEN 'INFO' WHEN COUNT(*) < 5 THEN 'WARNING' ELSE 'ERROR' END,
-                CASE WHEN COUNT(*) = 0 
-                     THEN 'All accounts mapped' 
-                     ELSE COUNT(*)::VARCHAR || ' accounts missing mappings' END
-            FROM trial_balance_raw t
-            LEFT JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-            WHERE t.deal_id = :deal_id_param AND m.account_number IS NULL
-            
-            UNION ALL
-            
-            -- Check 3: Period continuity
-            SELECT 
-                'Period Continuity',
-                gaps = 0,
-                CASE WHEN gaps = 0 THEN 'INFO' ELSE 'WARNING' END,
-                CASE WHEN gaps = 0 
-                     THEN 'No date gaps detected' 
-                     ELSE gaps::VARCHAR || ' month gaps in period sequence' END
-            FROM (
-                SELECT COUNT(*) AS gaps
-                FROM (
-                    SELECT 
-                        period_date,
-                        LAG(period_date) OVER (ORDER BY period_date) AS prev_date,
-                        DATEDIFF(month, LAG(period_date) OVER (ORDER BY period_date), period_date) AS month_diff
-                    FROM (SELECT DISTINCT period_date FROM trial_balance_raw WHERE deal_id = :deal_id_param)
-                )
-                WHERE month_diff > 1
-            )
-            
-            UNION ALL
-            
-            -- Check 4: Negative revenue detection (potential data issue)
-            SELECT 
-                'Revenue Sign Check',
-                COUNT(*) = 0,
-                CASE WHEN COUNT(*) = 0 THEN 'INFO' ELSE 'WARNING' END,
-                CASE WHEN COUNT(*) = 0 
-                     THEN 'Revenue signs look correct' 
-                     ELSE COUNT(*)::VARCHAR || ' revenue accounts with unexpected negative values' END
-            FROM trial_balance_raw t
-            JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-            WHERE t.deal_id = :deal_id_param 
-            AND m.mapping_level_1 = 'Revenue' 
-            AND t.net_amount > 0  -- In accounting, revenue is typically credit (negative)
-            
-            UNION ALL
-            
-            -- Check 5: Duplicate records
-            SELECT 
-                'Duplicate Records',
-                COUNT(*) = 0,
-                CASE WHEN COUNT(*) = 0 THEN 'INFO' ELSE 'ERROR' END,
-                CASE WHEN COUNT(*) = 0 
-                     THEN 'No duplicates found' 
-                     ELSE COUNT(*)::VARCHAR || ' duplicate records detected' END
-            FROM (
-                SELECT deal_id, account_number, period_date, entity, COUNT(*) AS cnt
-                FROM trial_balance_raw
-                WHERE deal_id = :deal_id_param
-                GROUP BY deal_id, account_number, period_date, entity
-                HAVING COUNT(*) > 1
-            )
-        )
-        SELECT * FROM checks
-    );
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+    VALUES (:log_id_var, 'validate_data_quality', :deal_id_param, :start_time_var, 'STARTED', :config_version_var);
+    
+    -- Loads since the last check decide the scan: their changed periods, or the whole deal
+    SELECT MAX(checked_through) INTO :checked_through
+    FROM dq_check_state
+    WHERE deal_id = :deal_id_param;
+    
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_loads AS
+    SELECT load_timestamp, changed_periods
+    FROM trial_balance_load_history
+    WHERE (deal_id = :deal_id_param OR deal_id IS NULL)
+      AND load_timestamp > COALESCE(:checked_through, '1900-01-01'::TIMESTAMP_NTZ);
+    
+    SELECT COUNT_IF(changed_periods IS NULL), MAX(load_timestamp)
+    INTO :full_loads, :new_checked_through
+    FROM temp_dq_loads;
     
-    -- Also insert into data_quality_checks table
-    INSERT INTO data_quality_checks (deal_id, check_name, check_type, passed, severity, message)
+    -- Mapping changes affect every period of the deal
+    SELECT COUNT(*) INTO :mapping_loads
+    FROM audit_log
+    WHERE procedure_name = 'load_account_mappings'
+      AND status = 'SUCCESS'
+      AND (deal_id = :deal_id_param OR deal_id IS NULL)
+      AND end_time > :checked_through;
+    
+    full_scan := (:full_check OR :checked_through IS NULL OR :full_loads > 0 OR :mapping_loads > 0);
+    new_checked_through := GREATEST(COALESCE(:new_checked_through, :checked_through, :start_time_var),
+                                    COALESCE(:checked_through, :start_time_var));
+    
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_periods AS
+    SELECT DISTINCT p.value::DATE AS period_date
+    FROM temp_dq_loads l,
+         LATERAL FLATTEN(input => l.changed_periods) p;
+    
+    -- The single pass over trial_balance_raw: one row per trial balance row with
+    -- the flags every metric needs
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_rows AS
+    SELECT 
+        t.period_date,
+        t.account_number,
+        COALESCE(t.entity, '') AS entity,
+        t.net_amount,
+        m.account_number IS NULL AS is_unmapped,
+        COALESCE(m.is_revenue AND t.net_amount > 0, FALSE) AS is_revenue_debit  -- revenue is typically credit (negative)
+    FROM trial_balance_raw t
+    LEFT JOIN (
+        SELECT account_number, BOOLOR_AGG(mapping_level_1 = 'Revenue') AS is_revenue
+        FROM account_mappings
+        WHERE deal_id = :deal_id_param
+        GROUP BY account_number
+    ) m ON m.account_number = t.account_number
+    WHERE t.deal_id = :deal_id_param
+      AND (:full_scan OR t.period_date IN (SELECT period_date FROM temp_dq_periods));
+    
+    SELECT COUNT(DISTINCT period_date) INTO :periods_scanned FROM temp_dq_rows;
+    
+    BEGIN TRANSACTION;
+    
+    IF (:full_scan) THEN
+        DELETE FROM dq_account_baselines WHERE deal_id = :deal_id_param;
+        
+        INSERT INTO dq_account_baselines (deal_id, account_number, entity, mean_amount, stddev_amount, periods)
+        SELECT :deal_id_param, account_number, entity, AVG(net_amount), STDDEV(net_amount), COUNT(*)
+        FROM temp_dq_rows
+        GROUP BY account_number, entity;
+    END IF;
+    
+    DELETE FROM dq_period_metrics
+    WHERE deal_id = :deal_id_param
+      AND (:full_scan OR period_date IN (SELECT period_date FROM temp_dq_periods));
+    
+    INSERT INTO dq_period_metrics (
+        deal_id, period_date, tb_rows, unmapped_accounts, revenue_sign_rows,
+        duplicate_rows, outlier_rows, entities
+    )
+    SELECT 
+        :deal_id_param,
+        r.period_date,
+        COUNT(*),
+        ARRAY_AGG(DISTINCT IFF(r.is_unmapped, r.account_number, NULL)),
+        COUNT_IF(r.is_revenue_debit),
+        COUNT(*) - COUNT(DISTINCT r.account_number, r.entity),
+        COUNT_IF(b.stddev_amount > 0 AND ABS(r.net_amount - b.mean_amount) > :outlier_zscore * b.stddev_amount),
+        ARRAY_AGG(DISTINCT r.entity)
+    FROM temp_dq_rows r
+    LEFT JOIN dq_account_baselines b
+        ON b.deal_id = :deal_id_param
+        AND b.account_number = r.account_number
+        AND b.entity = r.entity
+    GROUP BY r.period_date;
+    
+    MERGE INTO dq_check_state s
+    USING (SELECT :deal_id_param AS deal_id) d
+    ON s.deal_id = d.deal_id
+    WHEN MATCHED THEN UPDATE SET
+        checked_through = :new_checked_through,
+        last_full_check = IFF(:full_scan, CURRENT_TIMESTAMP(), s.last_full_check)
+    WHEN NOT MATCHED THEN INSERT (deal_id, checked_through, last_full_check)
+        VALUES (d.deal_id, :new_checked_through, CURRENT_TIMESTAMP());
+    
+    COMMIT;
+    
+    -- Deal metrics folded from the period rows, then every enabled rule against them
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_results AS
+    WITH deal_metrics AS (
+        SELECT OBJECT_CONSTRUCT(
+            'tb_rows', COALESCE(SUM(tb_rows), 0),
+            'unmapped_accounts', COALESCE(ARRAY_SIZE(ARRAY_UNION_AGG(unmapped_accounts)), 0),
+            'missing_periods', COALESCE(DATEDIFF(month, MIN(period_date), MAX(period_date)) + 1 - COUNT(*), 0),
+            'revenue_sign_rows', COALESCE(SUM(revenue_sign_rows), 0),
+            'duplicate_rows', COALESCE(SUM(duplicate_rows), 0),
+            'outlier_rows', COALESCE(SUM(outlier_rows), 0),
+            'missing_entity_periods', COALESCE(ARRAY_SIZE(ARRAY_UNION_AGG(entities)) * COUNT(*) - SUM(ARRAY_SIZE(entities)), 0)
+        ) AS metrics
+        FROM dq_period_metrics
+        WHERE deal_id = :deal_id_param
+    ),
+    rule_values AS (
+        SELECT r.*, d.metrics[r.metric_name]::NUMBER AS metric_value
+        FROM dq_rules r
+        CROSS JOIN deal_metrics d
+        WHERE r.is_enabled
+    ),
+    evaluated AS (
+        SELECT 
+            *,
+            COALESCE(metric_value >= COALESCE(min_pass, metric_value)
+                     AND metric_value <= COALESCE(max_pass, metric_value), FALSE) AS rule_passed
+        FROM rule_values
+    )
+    SELECT 
+        rule_name AS check_name,
+        check_type,
+        rule_order,
+        metric_name,
+        metric_value,
+        OBJECT_CONSTRUCT('min', min_pass, 'max', max_pass) AS expected_value,
+        rule_passed AS passed,
+        CASE 
+            WHEN rule_passed THEN 'INFO'
+            WHEN escalate_at IS NOT NULL AND metric_value >= escalate_at THEN escalated_severity
+            ELSE fail_severity
+        END AS severity,
+        CASE 
+            WHEN metric_value IS NULL THEN 'Unknown metric ' || metric_name
+            ELSE REPLACE(IFF(rule_passed, pass_message, fail_message), '{n}', metric_value::VARCHAR)
+        END AS message
+    FROM evaluated;
+    
+    -- One batched insert for the whole run
+    INSERT INTO data_quality_checks (deal_id, check_name, check_type, passed, expected_value, actual_value, severity, message, details)
     SELECT 
         :deal_id_param,
         check_name,
-        'VALIDATION',
+        check_type,
         passed,
+        expected_value,
+        OBJECT_CONSTRUCT('metric', metric_name, 'value', metric_value),
         severity,
-        message
-    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+        message,
+        IFF(:full_scan, 'Full check', 'Incremental check') || ': ' || :periods_scanned || ' periods scanned'
+    FROM temp_dq_results;
     
+    SELECT COUNT(*), COUNT_IF(NOT passed) INTO :rules_evaluated, :rules_failed FROM temp_dq_results;
+    
+    UPDATE audit_log 
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = 'SUCCESS',
+        rows_affected = :rules_evaluated,
+        message = :rules_evaluated || ' rules evaluated, ' || :rules_failed || ' failed (' ||
+                  IFF(:full_scan, 'full', 'incremental') || ' check, ' || :periods_scanned || ' periods scanned)'
+    WHERE log_id = :log_id_var;
+    
+    result_cursor := (
+        SELECT check_name, passed, severity, message
+        FROM temp_dq_results
+        ORDER BY rule_order, check_name
+    );
     RETURN TABLE(result_cursor);
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+        
+        result_cursor := (
+            SELECT 'Data Quality Evaluation' AS check_name, FALSE AS passed,
+                   'ERROR' AS severity, :error_msg AS message
+        );
+        RETURN TABLE(result_cursor);
 END;
 $$;
 
+-- Backfill display_sign_rule and the schedule-ready table on upgrade
+CALL refresh_schedule_trial_balance();
+
 SELECT 'Core data procedures created successfully' AS status;
 
 
@@ -7,38 +7,253 @@
 -- ============================================================================
 
 -- ============================================================================
--- PART 1: PIVOTED DATABASE VIEW (Wide format for Excel)
+-- PART 1: DATABASE TAB (Wide format for Excel)
 -- ============================================================================
+-- The Database tab is materialized per deal in long form (one row per account
+-- and period rank) and pivoted on export. Every deal gets its own period window
+-- (its most recent max_pivot_periods periods, ranked oldest = 1), so the number
+-- of period columns follows the deal and max_pivot_periods, not a fixed 24.
 
-CREATE OR REPLACE VIEW v_database_tab_pivoted AS
-WITH last_n_periods AS (
-    -- Get the most recent N distinct periods (configured)
-    SELECT DISTINCT period_date
-    FROM trial_balance_raw
-    ORDER BY period_date DESC
-    LIMIT (SELECT get_config_number('max_pivot_periods'))
-),
-ranked_periods AS (
-    -- Rank from oldest (1) to newest (N)
+-- Period window per deal
+CREATE TABLE IF NOT EXISTS database_tab_periods (
+    deal_id VARCHAR(50) NOT NULL,
+    period_rank NUMBER NOT NULL,  -- 1 = oldest period in the window
+    period_date DATE NOT NULL,
+    period_label VARCHAR(20),     -- TO_CHAR(period_date, 'Mon-YYYY')
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, period_rank)
+);
+
+-- Database tab rows in long form (pivoted by build_database_tab_sql)
+CREATE TABLE IF NOT EXISTS database_tab_cache (
+    deal_id VARCHAR(50) NOT NULL,
+    deal_name VARCHAR(200),
+    entity VARCHAR(100),
+    account_number VARCHAR(50),
+    account_name VARCHAR(500),
+    unique_id VARCHAR(600),
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    mapping_level_3 VARCHAR(200),
+    statement_type VARCHAR(20),
+    sort_order_l1 NUMBER,
+    sort_order_l2 NUMBER,
+    period_rank NUMBER NOT NULL,
+    amount_for_display NUMBER(18,2),
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (deal_id);
+
+-- Drop the signatures without trace_id_param (generate_fdd_schedules passes
+-- its trace id so the steps skip their own audit_log rows); with a DEFAULT
+-- parameter they would be ambiguous overloads
+EXECUTE IMMEDIATE $$
+BEGIN
+    DROP PROCEDURE IF EXISTS refresh_database_tab(VARCHAR);
+    DROP PROCEDURE IF EXISTS build_schedules(VARCHAR, VARCHAR);
+    DROP PROCEDURE IF EXISTS refresh_schedule_values(VARCHAR, BOOLEAN);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Ignore errors if procedure doesn't exist
+        RETURN 'Procedures dropped or did not exist';
+END;
+$$;
+
+-- Rebuild the materialized Database tab for one deal (NULL = all deals)
+CREATE OR REPLACE PROCEDURE refresh_database_tab(deal_id_param VARCHAR DEFAULT NULL, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    max_periods NUMBER DEFAULT COALESCE(get_config_number('max_pivot_periods'), 24);
+    deal_count NUMBER DEFAULT 0;
+    rows_created NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    IF (:deal_id_param IS NOT NULL AND NOT validate_deal_id(:deal_id_param)) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+        VALUES (:log_id_var, 'refresh_database_tab', :deal_id_param, :start_time_var, 'STARTED');
+    END IF;
+    
+    BEGIN TRANSACTION;
+    
+    DELETE FROM database_tab_periods WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    DELETE FROM database_tab_cache WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    -- Most recent N distinct periods of each deal, ranked oldest (1) to newest (N)
+    INSERT INTO database_tab_periods (deal_id, period_rank, period_date, period_label)
     SELECT 
+        deal_id,
+        ROW_NUMBER() OVER (PARTITION BY deal_id ORDER BY period_date),
         period_date,
-        TO_CHAR(period_date, 'Mon-YYYY') AS period_label,
-        ROW_NUMBER() OVER (ORDER BY period_date) AS period_rank
-    FROM last_n_periods
-)
+        TO_CHAR(period_date, 'Mon-YYYY')
+    FROM (
+        SELECT DISTINCT deal_id, period_date
+        FROM trial_balance_raw
+        WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param)
+        QUALIFY DENSE_RANK() OVER (PARTITION BY deal_id ORDER BY period_date DESC) <= :max_periods
+    );
+    
+    INSERT INTO database_tab_cache (
+        deal_id, deal_name, entity, account_number, account_name, unique_id,
+        mapping_level_1, mapping_level_2, mapping_level_3, statement_type,
+        sort_order_l1, sort_order_l2, period_rank, amount_for_display
+    )
+    SELECT 
+        t.deal_id, t.deal_name, t.entity, t.account_number, t.account_name, t.unique_id,
+        t.mapping_level_1, t.mapping_level_2, t.mapping_level_3, t.statement_type,
+        t.sort_order_l1, t.sort_order_l2, p.period_rank,
+        MAX(t.amount_for_display)
+    FROM trial_balance_for_schedules t
+    JOIN database_tab_periods p
+        ON p.deal_id = t.deal_id
+        AND p.period_date = t.period_date
+    WHERE (:deal_id_param IS NULL OR t.deal_id = :deal_id_param)
+    GROUP BY 1,2,3,4,5,6,7,8,9,10,11,12,13;
+    
+    rows_created := SQLROWCOUNT;
+    
+    SELECT COUNT(DISTINCT deal_id) INTO :deal_count
+    FROM database_tab_periods
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    COMMIT;
+    
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :rows_created,
+            message = 'Database tab materialized for ' || :deal_count || ' deal(s)'
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Database tab materialized for ' || :deal_count || ' deal(s), ' || :rows_created || ' account-period rows';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- SELECT statement that pivots one deal's Database tab, with one label and one
+-- amount column per period in its window (period_01 .. period_NN)
+CREATE OR REPLACE PROCEDURE build_database_tab_sql(deal_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    safe_deal_id VARCHAR;
+    label_columns VARCHAR;
+    amount_columns VARCHAR;
+BEGIN
+    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN NULL;
+    END IF;
+    
+    SELECT 
+        LISTAGG(
+            'MAX(CASE WHEN c.period_rank = ' || period_rank || ' THEN ''' || period_label || ''' END) AS period_' ||
+            LPAD(period_rank::VARCHAR, GREATEST(2, LENGTH(period_rank::VARCHAR)), '0') || '_label',
+            ', '
+        ) WITHIN GROUP (ORDER BY period_rank),
+        LISTAGG(
+            'MAX(CASE WHEN c.period_rank = ' || period_rank || ' THEN c.amount_for_display END) AS period_' ||
+            LPAD(period_rank::VARCHAR, GREATEST(2, LENGTH(period_rank::VARCHAR)), '0'),
+            ', '
+        ) WITHIN GROUP (ORDER BY period_rank)
+    INTO :label_columns, :amount_columns
+    FROM database_tab_periods
+    WHERE deal_id = :safe_deal_id;
+    
+    IF (:label_columns IS NULL) THEN
+        RETURN NULL;
+    END IF;
+    
+    RETURN 'SELECT c.deal_id, c.deal_name, c.entity, c.account_number, c.account_name, c.unique_id, ' ||
+           'c.mapping_level_1, c.mapping_level_2, c.mapping_level_3, c.statement_type, ' ||
+           'c.sort_order_l1, c.sort_order_l2, ' ||
+           :label_columns || ', ' || :amount_columns ||
+           ' FROM database_tab_cache c WHERE c.deal_id = ''' || :safe_deal_id || '''' ||
+           ' GROUP BY 1,2,3,4,5,6,7,8,9,10,11,12 ORDER BY 11, 12, 4';
+END;
+$$;
+
+-- Interactive access: CALL get_database_tab('DEAL_HL_001');
+CREATE OR REPLACE PROCEDURE get_database_tab(deal_id_param VARCHAR)
+RETURNS TABLE()
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    safe_deal_id VARCHAR;
+    select_sql VARCHAR;
+    result_cursor RESULTSET;
+BEGIN
+    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    IF (safe_deal_id IS NULL) THEN
+        result_cursor := (SELECT 'ERROR: Invalid deal_id format' AS message);
+        RETURN TABLE(result_cursor);
+    END IF;
+    
+    CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    
+    -- Materialize on first use
+    IF (:select_sql IS NULL) THEN
+        CALL refresh_database_tab(:safe_deal_id);
+        CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    END IF;
+    
+    IF (:select_sql IS NULL) THEN
+        result_cursor := (SELECT 'No trial balance data found for deal' AS message);
+    ELSE
+        result_cursor := (EXECUTE IMMEDIATE :select_sql);
+    END IF;
+    
+    RETURN TABLE(result_cursor);
+END;
+$$;
+
+-- Compatibility view over the materialized Database tab: the first 24 periods
+-- of each deal's window. Exports use build_database_tab_sql, which is not
+-- limited to 24 columns.
+CREATE OR REPLACE VIEW v_database_tab_pivoted AS
 SELECT 
-    t.deal_id,
-    t.deal_name,
-    t.entity,
-    t.account_number,
-    t.account_name,
-    t.unique_id,
-    t.mapping_level_1,
-    t.mapping_level_2,
-    t.mapping_level_3,
-    t.statement_type,
-    t.sort_order_l1,
-    t.sort_order_l2,
+    c.deal_id,
+    c.deal_name,
+    c.entity,
+    c.account_number,
+    c.account_name,
+    c.unique_id,
+    c.mapping_level_1,
+    c.mapping_level_2,
+    c.mapping_level_3,
+    c.statement_type,
+    c.sort_order_l1,
+    c.sort_order_l2,
     -- Period headers and data (using amount_for_display with proper signs)
     MAX(CASE WHEN p.period_rank = 1 THEN p.period_label END) AS period_01_label,
     MAX(CASE WHEN p.period_rank = 2 THEN p.period_label END) AS period_02_label,
@@ -64,41 +279,185 @@ SELECT
     MAX(CASE WHEN p.period_rank = 22 THEN p.period_label END) AS period_22_label,
     MAX(CASE WHEN p.period_rank = 23 THEN p.period_label END) AS period_23_label,
     MAX(CASE WHEN p.period_rank = 24 THEN p.period_label END) AS period_24_label,
-    MAX(CASE WHEN p.period_rank = 1 THEN t.amount_for_display END) AS period_01,
-    MAX(CASE WHEN p.period_rank = 2 THEN t.amount_for_display END) AS period_02,
-    MAX(CASE WHEN p.period_rank = 3 THEN t.amount_for_display END) AS period_03,
-    MAX(CASE WHEN p.period_rank = 4 THEN t.amount_for_display END) AS period_04,
-    MAX(CASE WHEN p.period_rank = 5 THEN t.amount_for_display END) AS period_05,
-    MAX(CASE WHEN p.period_rank = 6 THEN t.amount_for_display END) AS period_06,
-    MAX(CASE WHEN p.period_rank = 7 THEN t.amount_for_display END) AS period_07,
-    MAX(CASE WHEN p.period_rank = 8 THEN t.amount_for_display END) AS period_08,
-    MAX(CASE WHEN p.period_rank = 9 THEN t.amount_for_display END) AS period_09,
-    MAX(CASE WHEN p.period_rank = 10 THEN t.amount_for_display END) AS period_10,
-    MAX(CASE WHEN p.period_rank = 11 THEN t.amount_for_display END) AS period_11,
-    MAX(CASE WHEN p.period_rank = 12 THEN t.amount_for_display END) AS period_12,
-    MAX(CASE WHEN p.period_rank = 13 THEN t.amount_for_display END) AS period_13,
-    MAX(CASE WHEN p.period_rank = 14 THEN t.amount_for_display END) AS period_14,
-    MAX(CASE WHEN p.period_rank = 15 THEN t.amount_for_display END) AS period_15,
-    MAX(CASE WHEN p.period_rank = 16 THEN t.amount_for_display END) AS period_16,
-    MAX(CASE WHEN p.period_rank = 17 THEN t.amount_for_display END) AS period_17,
-    MAX(CASE WHEN p.period_rank = 18 THEN t.amount_for_display END) AS period_18,
-    MAX(CASE WHEN p.period_rank = 19 THEN t.amount_for_display END) AS period_19,
-    MAX(CASE WHEN p.period_rank = 20 THEN t.amount_for_display END) AS period_20,
-    MAX(CASE WHEN p.period_rank = 21 THEN t.amount_for_display END) AS period_21,
-    MAX(CASE WHEN p.period_rank = 22 THEN t.amount_for_display END) AS period_22,
-    MAX(CASE WHEN p.period_rank = 23 THEN t.amount_for_display END) AS period_23,
-    MAX(CASE WHEN p.period_rank = 24 THEN t.amount_for_display END) AS period_24
-FROM v_trial_balance_for_schedules t
-CROSS JOIN ranked_periods p
-WHERE t.period_date = p.period_date
+    MAX(CASE WHEN p.period_rank = 1 THEN c.amount_for_display END) AS period_01,
+    MAX(CASE WHEN p.period_rank = 2 THEN c.amount_for_display END) AS period_02,
+    MAX(CASE WHEN p.period_rank = 3 THEN c.amount_for_display END) AS period_03,
+    MAX(CASE WHEN p.period_rank = 4 THEN c.amount_for_display END) AS period_04,
+    MAX(CASE WHEN p.period_rank = 5 THEN c.amount_for_display END) AS period_05,
+    MAX(CASE WHEN p.period_rank = 6 THEN c.amount_for_display END) AS period_06,
+    MAX(CASE WHEN p.period_rank = 7 THEN c.amount_for_display END) AS period_07,
+    MAX(CASE WHEN p.period_rank = 8 THEN c.amount_for_display END) AS period_08,
+    MAX(CASE WHEN p.period_rank = 9 THEN c.amount_for_display END) AS period_09,
+    MAX(CASE WHEN p.period_rank = 10 THEN c.amount_for_display END) AS period_10,
+    MAX(CASE WHEN p.period_rank = 11 THEN c.amount_for_display END) AS period_11,
+    MAX(CASE WHEN p.period_rank = 12 THEN c.amount_for_display END) AS period_12,
+    MAX(CASE WHEN p.period_rank = 13 THEN c.amount_for_display END) AS period_13,
+    MAX(CASE WHEN p.period_rank = 14 THEN c.amount_for_display END) AS period_14,
+    MAX(CASE WHEN p.period_rank = 15 THEN c.amount_for_display END) AS period_15,
+    MAX(CASE WHEN p.period_rank = 16 THEN c.amount_for_display END) AS period_16,
+    MAX(CASE WHEN p.period_rank = 17 THEN c.amount_for_display END) AS period_17,
+    MAX(CASE WHEN p.period_rank = 18 THEN c.amount_for_display END) AS period_18,
+    MAX(CASE WHEN p.period_rank = 19 THEN c.amount_for_display END) AS period_19,
+    MAX(CASE WHEN p.period_rank = 20 THEN c.amount_for_display END) AS period_20,
+    MAX(CASE WHEN p.period_rank = 21 THEN c.amount_for_display END) AS period_21,
+    MAX(CASE WHEN p.period_rank = 22 THEN c.amount_for_display END) AS period_22,
+    MAX(CASE WHEN p.period_rank = 23 THEN c.amount_for_display END) AS period_23,
+    MAX(CASE WHEN p.period_rank = 24 THEN c.amount_for_display END) AS period_24
+FROM database_tab_cache c
+JOIN database_tab_periods p
+    ON p.deal_id = c.deal_id
+    AND p.period_rank = c.period_rank
+WHERE c.period_rank <= 24
 GROUP BY 1,2,3,4,5,6,7,8,9,10,11,12
 ORDER BY 11, 12, 4;
 
+GRANT SELECT ON TABLE database_tab_periods TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE database_tab_cache TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_database_tab_pivoted TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_database_tab_pivoted TO ROLE FDD_READONLY_ROLE;
+
+-- Materialize data already loaded
+CALL refresh_database_tab();
+
 -- ============================================================================
--- PART 2: INCOME STATEMENT GENERATION
+-- PART 2: SCHEDULE TEMPLATES
 -- ============================================================================
+-- Each template line is a header, blank, section/subsection header, subtotal,
+-- calculated or total row, or an 'accounts' line that expands into one data
+-- row per active mapped account. An account goes to the 'accounts' line of
+-- its mapping_level_1 whose mapping_level_2 matches its own. If none matches,
+-- it goes to the line with no mapping_level_2, or to the line flagged
+-- includes_unassigned.
+--   subtotal             = sum of the accounts under mapping_level_1, or, with mapping_level_2
+--                          set, of the accounts placed on that mapping_level_2's 'accounts'
+--                          lines (including unassigned accounts placed there)
+--   calculated / total   = signed sum of the mapping_level_1 groups in calc_terms
 
-CREATE OR REPLACE PROCEDURE generate_income_statement(deal_id_param VARCHAR)
+CREATE TABLE IF NOT EXISTS schedule_templates (
+    template_name VARCHAR(50) NOT NULL,
+    statement_type VARCHAR(20) NOT NULL,   -- 'IS', 'BS'
+    line_order NUMBER NOT NULL,
+    row_label VARCHAR(500),
+    row_type VARCHAR(20) NOT NULL,         -- 'header', 'blank', 'section_header', 'subsection_header',
+                                           -- 'accounts', 'subtotal', 'calculated', 'total'
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    includes_unassigned BOOLEAN DEFAULT FALSE,
+    calc_terms VARIANT,                    -- [{"mapping_level_1": "Revenue", "sign": 1}, ...]
+    formula_template VARCHAR(5000),
+    row_format_json VARCHAR(5000),
+    
+    PRIMARY KEY (template_name, statement_type, line_order)
+);
+
+-- Generated schedule rows per deal (replaces the per-session temp_is_schedule / temp_bs_schedule)
+CREATE TABLE IF NOT EXISTS schedule_rows (
+    deal_id VARCHAR(50) NOT NULL,
+    statement_type VARCHAR(20) NOT NULL,
+    row_num NUMBER NOT NULL,
+    template_name VARCHAR(50),
+    line_order NUMBER,
+    row_label VARCHAR(500),
+    row_type VARCHAR(20),
+    account_number VARCHAR(50),
+    account_filter VARCHAR(600),
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    formula_template VARCHAR(5000),
+    row_format_json VARCHAR(5000),
+    generated_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, statement_type, row_num)
+);
+
+ALTER TABLE schedule_rows CLUSTER BY (deal_id, statement_type);
+
+-- STANDARD template (reseeded on every deployment; other templates are kept)
+DELETE FROM schedule_templates WHERE template_name = 'STANDARD';
+
+INSERT INTO schedule_templates (
+    template_name, statement_type, line_order, row_label, row_type,
+    mapping_level_1, mapping_level_2, includes_unassigned, calc_terms, formula_template, row_format_json
+)
+SELECT 'STANDARD', column1, column2, column3, column4, column5, column6, TO_BOOLEAN(column7),
+       PARSE_JSON(column8), column9, column10
+FROM VALUES
+    -- Income Statement
+    ('IS', 10, 'Income Statement ($000s)', 'header', NULL, NULL, 0, NULL, 'PERIOD_LABEL',
+     '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
+    ('IS', 20, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 30, 'Revenue', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('IS', 40, NULL, 'accounts', 'Revenue', NULL, 0, NULL, NULL, NULL),
+    ('IS', 50, 'Total Revenue', 'subtotal', 'Revenue', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('IS', 60, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 70, 'Cost of Goods Sold', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('IS', 80, NULL, 'accounts', 'Cost of Goods Sold', NULL, 0, NULL, NULL, NULL),
+    ('IS', 90, 'Total Cost of Goods Sold', 'subtotal', 'Cost of Goods Sold', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('IS', 100, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 110, 'Gross Margin', 'calculated', NULL, NULL, 0,
+     '[{"mapping_level_1": "Revenue", "sign": 1}, {"mapping_level_1": "Cost of Goods Sold", "sign": -1}]', NULL,
+     '{"bold": true, "border_bottom": true, "number_format": "#,##0"}'),
+    ('IS', 120, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 130, 'Operating Expenses', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('IS', 140, NULL, 'accounts', 'Operating Expenses', NULL, 0, NULL, NULL, NULL),
+    ('IS', 150, 'Total Operating Expenses', 'subtotal', 'Operating Expenses', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('IS', 160, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 170, 'Operating Income', 'total', NULL, NULL, 0,
+     '[{"mapping_level_1": "Revenue", "sign": 1}, {"mapping_level_1": "Cost of Goods Sold", "sign": -1}, {"mapping_level_1": "Operating Expenses", "sign": -1}]', NULL,
+     '{"bold": true, "border_bottom_double": true, "number_format": "#,##0"}'),
+    
+    -- Balance Sheet
+    ('BS', 10, 'Balance Sheet ($000s)', 'header', NULL, NULL, 0, NULL, 'PERIOD_LABEL',
+     '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
+    ('BS', 20, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 30, 'ASSETS', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('BS', 40, 'Current Assets', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 50, NULL, 'accounts', 'Assets', 'Current Assets', 1, NULL, NULL, NULL),
+    ('BS', 60, '  Total Current Assets', 'subtotal', 'Assets', 'Current Assets', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 70, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 80, 'Non-Current Assets', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 90, NULL, 'accounts', 'Assets', 'Non-Current Assets', 0, NULL, NULL, NULL),
+    ('BS', 100, '  Total Non-Current Assets', 'subtotal', 'Assets', 'Non-Current Assets', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 110, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 120, 'TOTAL ASSETS', 'subtotal', 'Assets', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_bottom_double": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('BS', 130, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 140, 'LIABILITIES', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('BS', 150, 'Current Liabilities', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 160, NULL, 'accounts', 'Liabilities', 'Current Liabilities', 1, NULL, NULL, NULL),
+    ('BS', 170, '  Total Current Liabilities', 'subtotal', 'Liabilities', 'Current Liabilities', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 180, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 190, 'Non-Current Liabilities', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 200, NULL, 'accounts', 'Liabilities', 'Non-Current Liabilities', 0, NULL, NULL, NULL),
+    ('BS', 210, '  Total Non-Current Liabilities', 'subtotal', 'Liabilities', 'Non-Current Liabilities', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 220, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 230, 'TOTAL LIABILITIES', 'subtotal', 'Liabilities', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('BS', 240, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 250, 'EQUITY', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('BS', 260, NULL, 'accounts', 'Equity', NULL, 0, NULL, NULL, NULL),
+    ('BS', 270, 'TOTAL EQUITY', 'subtotal', 'Equity', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('BS', 280, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 290, 'TOTAL LIABILITIES AND EQUITY', 'total', NULL, NULL, 0,
+     '[{"mapping_level_1": "Liabilities", "sign": 1}, {"mapping_level_1": "Equity", "sign": 1}]', NULL,
+     '{"bold": true, "border_bottom_double": true, "number_format": "#,##0"}');
+
+-- ============================================================================
+-- PART 3: SCHEDULE BUILDER
+-- ============================================================================
+
+-- Build the Income Statement and/or Balance Sheet rows for a deal from the
+-- schedule_template_name template in one set-based INSERT
+-- statement_type_param: 'IS', 'BS' or NULL for both
+CREATE OR REPLACE PROCEDURE build_schedules(deal_id_param VARCHAR, statement_type_param VARCHAR DEFAULT NULL, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -106,168 +465,222 @@ $$
 DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    template_var VARCHAR DEFAULT COALESCE(get_config_string('schedule_template_name'), 'STANDARD');
+    statement_var VARCHAR;
     rows_created NUMBER DEFAULT 0;
     session_id VARCHAR DEFAULT CURRENT_SESSION()::VARCHAR;
+    error_msg VARCHAR;
 BEGIN
     -- Validate input
     IF (NOT validate_deal_id(:deal_id_param)) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
+    statement_var := UPPER(:statement_type_param);
+    IF (:statement_var IS NOT NULL AND :statement_var NOT IN ('IS', 'BS')) THEN
+        RETURN 'ERROR: Invalid statement_type ''' || :statement_var || '''. Use IS, BS or NULL.';
+    END IF;
+    
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, session_id)
-    VALUES (:log_id_var, 'generate_income_statement', :deal_id_param, :start_time_var, 'STARTED', :session_id);
-    
-    -- Create session-specific temp table (isolated per user/session)
-    CREATE OR REPLACE TEMPORARY TABLE temp_is_schedule (
-        row_num NUMBER AUTOINCREMENT,
-        row_label VARCHAR(500),
-        row_type VARCHAR(20),
-        account_filter VARCHAR(600),
-        formula_template VARCHAR(5000),
-        row_format_json VARCHAR(5000)
-    );
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, session_id)
+        VALUES (:log_id_var, 'build_schedules', :deal_id_param, :start_time_var, 'STARTED', :session_id);
+    END IF;
     
-    -- Header
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, formula_template, row_format_json)
-    VALUES 
-        ('Income Statement ($000s)', 'header', NULL, 'PERIOD_LABEL', 
-         '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
-        ('', 'blank', NULL, NULL, '{}'),
-        ('Revenue', 'section_header', NULL, NULL, '{"bold": true, "outline_level": 1}');
+    BEGIN TRANSACTION;
     
-    -- Revenue accounts (flexible mapping depth)
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'IS' 
-    AND mapping_level_1 = 'Revenue'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Total Revenue', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Cost of Goods Sold', 'section_header', NULL, '{"bold": true, "outline_level": 1}');
-    
-    -- COGS accounts
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'IS' 
-    AND mapping_level_1 = 'Cost of Goods Sold'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Total Cost of Goods Sold', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Gross Margin', 'calculated', NULL, 
-         '{"bold": true, "border_bottom": true, "number_format": "#,##0"}'),
-        ('', 'blank', NULL, '{}'),
-        ('Operating Expenses', 'section_header', NULL, '{"bold": true, "outline_level": 1}');
-    
-    -- OpEx accounts
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
+    DELETE FROM schedule_rows
+    WHERE deal_id = :deal_id_param
+    AND (:statement_var IS NULL OR statement_type = :statement_var);
+    
+    INSERT INTO schedule_rows (
+        deal_id, statement_type, row_num, template_name, line_order, row_label, row_type,
+        account_number, account_filter, mapping_level_1, mapping_level_2, formula_template, row_format_json
+    )
+    WITH template AS (
+        SELECT *
+        FROM schedule_templates
+        WHERE template_name = :template_var
+        AND (:statement_var IS NULL OR statement_type = :statement_var)
+    ),
+    -- Each active account lands on exactly one 'accounts' line
+    placed_accounts AS (
+        SELECT 
+            t.statement_type,
+            t.line_order,
+            m.account_number,
+            m.account_name,
+            m.mapping_level_1,
+            m.mapping_level_2,
+            m.mapping_level_3,
+            m.sort_order_l1,
+            m.sort_order_l2,
+            m.sort_order_l3
+        FROM template t
+        JOIN account_mappings m
+            ON m.statement_type = t.statement_type
+            AND m.mapping_level_1 = t.mapping_level_1
+            AND (t.mapping_level_2 IS NULL OR t.mapping_level_2 = m.mapping_level_2 OR t.includes_unassigned)
+        WHERE t.row_type = 'accounts'
+        AND m.deal_id = :deal_id_param
+        AND m.is_active = TRUE
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY t.statement_type, m.account_number
+            ORDER BY IFF(EQUAL_NULL(t.mapping_level_2, m.mapping_level_2), 0, 1),
+                     IFF(t.mapping_level_2 IS NULL, 0, 1),
+                     t.line_order
+        ) = 1
+    ),
+    schedule_lines AS (
+        SELECT 
+            statement_type, line_order,
+            0 AS sort_l1, 0 AS sort_l2, 0 AS sort_l3,
+            row_label, row_type,
+            NULL AS account_number, NULL AS account_filter,
+            mapping_level_1, mapping_level_2, formula_template, row_format_json
+        FROM template
+        WHERE row_type <> 'accounts'
+        
+        UNION ALL
+        
+        -- Data rows (flexible mapping depth)
+        SELECT 
+            statement_type, line_order,
+            sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999),
+            CASE 
+                WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
+                WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
+                ELSE account_name
+            END,
+            'data',
+            account_number,
+            account_number || ' - ' || account_name,
+            mapping_level_1, mapping_level_2, NULL,
+            OBJECT_CONSTRUCT(
+                'number_format', '#,##0',
+                'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
+                                     WHEN mapping_level_2 IS NOT NULL THEN 2
+                                     ELSE 1 END,
+                'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
+                              WHEN mapping_level_2 IS NOT NULL THEN 1
+                              ELSE 0 END
+            )::VARCHAR
+        FROM placed_accounts
+    )
     SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'IS' 
-    AND mapping_level_1 = 'Operating Expenses'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Total Operating Expenses', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Operating Income', 'total', NULL, 
-         '{"bold": true, "border_bottom_double": true, "number_format": "#,##0"}');
-    
-    SELECT COUNT(*) INTO :rows_created FROM temp_is_schedule;
+        :deal_id_param,
+        statement_type,
+        ROW_NUMBER() OVER (PARTITION BY statement_type ORDER BY line_order, sort_l1, sort_l2, sort_l3, account_number),
+        :template_var,
+        line_order, row_label, row_type, account_number, account_filter,
+        mapping_level_1, mapping_level_2, formula_template, row_format_json
+    FROM schedule_lines;
     
-    -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :rows_created
-    WHERE log_id = :log_id_var;
+    rows_created := SQLROWCOUNT;
     
-    RETURN 'SUCCESS: Generated Income Statement with ' || :rows_created || ' rows';
+    COMMIT;
     
-EXCEPTION
-    WHEN OTHER THEN
+    -- Log success
+    IF (:trace_id_param IS NULL) THEN
         UPDATE audit_log 
         SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = SQLERRM
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = IFF(:rows_created = 0, 'WARNING', 'SUCCESS'),
+            rows_affected = :rows_created,
+            message = 'Template ' || :template_var || ', ' || COALESCE(:statement_var, 'IS and BS')
         WHERE log_id = :log_id_var;
+    END IF;
+    
+    IF (:rows_created = 0) THEN
+        RETURN 'WARNING: Schedule template ''' || :template_var || ''' has no lines for ' || COALESCE(:statement_var, 'IS or BS');
+    END IF;
+    
+    RETURN 'SUCCESS: Generated ' || COALESCE(:statement_var, 'IS and BS') || ' schedules with ' || :rows_created || ' rows';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
         
-        RETURN 'ERROR: ' || SQLERRM;
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Single-statement entry points (kept for existing callers and runbooks)
+CREATE OR REPLACE PROCEDURE generate_income_statement(deal_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    result VARCHAR;
+BEGIN
+    CALL build_schedules(:deal_id_param, 'IS') INTO :result;
+    RETURN :result;
 END;
 $$;
 
+CREATE OR REPLACE PROCEDURE generate_balance_sheet(deal_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    result VARCHAR;
+BEGIN
+    CALL build_schedules(:deal_id_param, 'BS') INTO :result;
+    RETURN :result;
+END;
+$$;
+
+GRANT SELECT ON TABLE schedule_templates TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE schedule_rows TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE schedule_rows TO ROLE FDD_READONLY_ROLE;
+
 -- ============================================================================
--- PART 3: BALANCE SHEET GENERATION
+-- PART 4: SCHEDULE VALUES
 -- ============================================================================
+-- Period amounts for every account and mapping level, computed with one
+-- ROLLUP over mapping_level_1..3 and cached per deal and data version
+-- (deal_data_versions). v_schedule_values lays them onto schedule_rows:
+-- data rows read the account, mapping_level_1 subtotals the level rollup,
+-- mapping_level_2 subtotals the data rows placed under them, calculated and
+-- total rows the signed sum of their calc_terms.
 
-CREATE OR REPLACE PROCEDURE generate_balance_sheet(deal_id_param VARCHAR)
+CREATE TABLE IF NOT EXISTS schedule_values (
+    deal_id VARCHAR(50) NOT NULL,
+    data_version NUMBER NOT NULL,
+    statement_type VARCHAR(20) NOT NULL,
+    rollup_level VARCHAR(20) NOT NULL,     -- 'ACCOUNT', 'LEVEL_3', 'LEVEL_2', 'LEVEL_1', 'STATEMENT'
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    mapping_level_3 VARCHAR(200),
+    account_number VARCHAR(50),
+    period_date DATE NOT NULL,
+    amount NUMBER(18,2)
+);
+
+ALTER TABLE schedule_values CLUSTER BY (deal_id, statement_type);
+
+-- Data version each deal's schedule_values were computed from
+CREATE TABLE IF NOT EXISTS schedule_values_cache (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    data_version NUMBER NOT NULL,
+    value_count NUMBER,
+    computed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- Compute a deal's schedule values unless the cached ones match its data version
+CREATE OR REPLACE PROCEDURE refresh_schedule_values(deal_id_param VARCHAR, force_refresh BOOLEAN DEFAULT FALSE, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -275,98 +688,179 @@ $$
 DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    current_version NUMBER DEFAULT 0;
+    cached_version NUMBER;
     rows_created NUMBER DEFAULT 0;
-    session_id VARCHAR DEFAULT CURRENT_SESSION()::VARCHAR;
+    error_msg VARCHAR;
 BEGIN
-    -- Validate input
     IF (NOT validate_deal_id(:deal_id_param)) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
-    -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, session_id)
-    VALUES (:log_id_var, 'generate_balance_sheet', :deal_id_param, :start_time_var, 'STARTED', :session_id);
-    
-    -- Create session-specific temp table
-    CREATE OR REPLACE TEMPORARY TABLE temp_bs_schedule (
-        row_num NUMBER AUTOINCREMENT,
-        row_label VARCHAR(500),
-        row_type VARCHAR(20),
-        account_filter VARCHAR(600),
-        row_format_json VARCHAR(5000)
-    );
+    SELECT COALESCE(MAX(data_version), 0) INTO :current_version
+    FROM deal_data_versions
+    WHERE deal_id = :deal_id_param;
+    
+    SELECT MAX(data_version) INTO :cached_version
+    FROM schedule_values_cache
+    WHERE deal_id = :deal_id_param;
+    
+    IF (NOT :force_refresh AND :cached_version = :current_version) THEN
+        RETURN 'SUCCESS: Schedule values for ' || :deal_id_param || ' are current (data version ' || :current_version || ')';
+    END IF;
     
-    -- Header
-    INSERT INTO temp_bs_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Balance Sheet ($000s)', 'header', NULL, 
-         '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
-        ('', 'blank', NULL, '{}'),
-        ('ASSETS', 'section_header', NULL, '{"bold": true, "outline_level": 1}'),
-        ('Current Assets', 'subsection_header', NULL, '{"bold": true, "outline_level": 2, "indent": 1}');
-    
-    -- Current Assets
-    INSERT INTO temp_bs_schedule (row_label, row_type, account_filter, row_format_json)
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+        VALUES (:log_id_var, 'refresh_schedule_values', :deal_id_param, :start_time_var, 'STARTED');
+    END IF;
+    
+    BEGIN TRANSACTION;
+    
+    DELETE FROM schedule_values WHERE deal_id = :deal_id_param;
+    DELETE FROM schedule_values_cache WHERE deal_id = :deal_id_param;
+    
+    INSERT INTO schedule_values (
+        deal_id, data_version, statement_type, rollup_level,
+        mapping_level_1, mapping_level_2, mapping_level_3, account_number, period_date, amount
+    )
     SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'BS' 
-    AND mapping_level_1 = 'Assets' 
-    AND COALESCE(mapping_level_2, 'Current Assets') = 'Current Assets'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_bs_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('  Total Current Assets', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Non-Current Assets', 'subsection_header', NULL, 
-         '{"bold": true, "outline_level": 2, "indent": 1}');
-    
-    -- Add remaining BS sections (Non-Current Assets, Liabilities, Equity)
-    -- ... (similar pattern as above)
-    
-    SELECT COUNT(*) INTO :rows_created FROM temp_bs_schedule;
+        deal_id,
+        :current_version,
+        statement_type,
+        CASE GROUPING_ID(mapping_level_1, mapping_level_2, mapping_level_3, account_number)
+            WHEN 0 THEN 'ACCOUNT'
+            WHEN 1 THEN 'LEVEL_3'
+            WHEN 3 THEN 'LEVEL_2'
+            WHEN 7 THEN 'LEVEL_1'
+            ELSE 'STATEMENT'
+        END,
+        mapping_level_1,
+        mapping_level_2,
+        mapping_level_3,
+        account_number,
+        period_date,
+        SUM(amount_for_display)
+    FROM trial_balance_for_schedules
+    WHERE deal_id = :deal_id_param
+    AND statement_type IN ('IS', 'BS')
+    GROUP BY deal_id, statement_type, period_date,
+             ROLLUP (mapping_level_1, mapping_level_2, mapping_level_3, account_number);
     
-    -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :rows_created
-    WHERE log_id = :log_id_var;
+    rows_created := SQLROWCOUNT;
     
-    RETURN 'SUCCESS: Generated Balance Sheet with ' || :rows_created || ' rows';
+    INSERT INTO schedule_values_cache (deal_id, data_version, value_count)
+    VALUES (:deal_id_param, :current_version, :rows_created);
     
-EXCEPTION
-    WHEN OTHER THEN
+    COMMIT;
+    
+    IF (:trace_id_param IS NULL) THEN
         UPDATE audit_log 
         SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = SQLERRM
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :rows_created,
+            message = 'Schedule values computed for data version ' || :current_version
         WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Computed ' || :rows_created || ' schedule values for ' || :deal_id_param ||
+           ' (data version ' || :current_version || ')';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
         
-        RETURN 'ERROR: ' || SQLERRM;
+        RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
+-- Schedule rows with their computed period amounts (headers and blanks carry no values)
+CREATE OR REPLACE VIEW v_schedule_values AS
+WITH row_terms AS (
+    -- Data rows: the account itself
+    SELECT deal_id, statement_type, row_num, row_label, row_type,
+           'ACCOUNT' AS rollup_level, mapping_level_1, NULL AS mapping_level_2, account_number, 1 AS sign
+    FROM schedule_rows
+    WHERE row_type = 'data'
+    
+    UNION ALL
+    
+    -- mapping_level_1 subtotals: the level rollup
+    SELECT deal_id, statement_type, row_num, row_label, row_type,
+           'LEVEL_1', mapping_level_1, NULL, NULL, 1
+    FROM schedule_rows
+    WHERE row_type = 'subtotal'
+    AND mapping_level_2 IS NULL
+    
+    UNION ALL
+    
+    -- mapping_level_2 subtotals: every data row placed on an 'accounts' line of
+    -- that mapping_level_2, so accounts placed there by includes_unassigned
+    -- (NULL or unmatched mapping_level_2) are counted where they are shown
+    SELECT s.deal_id, s.statement_type, s.row_num, s.row_label, s.row_type,
+           'ACCOUNT', d.mapping_level_1, NULL, d.account_number, 1
+    FROM schedule_rows s
+    JOIN schedule_rows d
+        ON d.deal_id = s.deal_id
+        AND d.statement_type = s.statement_type
+        AND d.row_type = 'data'
+    JOIN schedule_templates t
+        ON t.template_name = d.template_name
+        AND t.statement_type = d.statement_type
+        AND t.line_order = d.line_order
+    WHERE s.row_type = 'subtotal'
+    AND s.mapping_level_2 IS NOT NULL
+    AND t.mapping_level_1 = s.mapping_level_1
+    AND t.mapping_level_2 = s.mapping_level_2
+    
+    UNION ALL
+    
+    -- Calculated and total rows: signed mapping_level_1 rollups from the template
+    SELECT r.deal_id, r.statement_type, r.row_num, r.row_label, r.row_type,
+           'LEVEL_1', term.value:mapping_level_1::VARCHAR, NULL, NULL, term.value:sign::NUMBER
+    FROM schedule_rows r
+    JOIN schedule_templates t
+        ON t.template_name = r.template_name
+        AND t.statement_type = r.statement_type
+        AND t.line_order = r.line_order,
+    LATERAL FLATTEN(INPUT => t.calc_terms) term
+    WHERE r.row_type IN ('calculated', 'total')
+)
+SELECT 
+    rt.deal_id,
+    rt.statement_type,
+    rt.row_num,
+    rt.row_label,
+    rt.row_type,
+    v.period_date,
+    TO_CHAR(v.period_date, 'Mon-YYYY') AS period_label,
+    SUM(v.amount * rt.sign) AS amount,
+    v.data_version
+FROM row_terms rt
+JOIN schedule_values v
+    ON v.deal_id = rt.deal_id
+    AND v.statement_type = rt.statement_type
+    AND v.rollup_level = rt.rollup_level
+    AND v.mapping_level_1 = rt.mapping_level_1
+    AND (rt.mapping_level_2 IS NULL OR v.mapping_level_2 = rt.mapping_level_2)
+    AND (rt.account_number IS NULL OR v.account_number = rt.account_number)
+GROUP BY rt.deal_id, rt.statement_type, rt.row_num, rt.row_label, rt.row_type, v.period_date, v.data_version;
+
+GRANT SELECT ON TABLE schedule_values TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE schedule_values_cache TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_schedule_values TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_schedule_values TO ROLE FDD_READONLY_ROLE;
+
 SELECT 'Schedule generation procedures created successfully' AS status;
 
 
@@ -10,7 +10,63 @@
 -- PART 1: AI INSIGHTS GENERATION
 -- ============================================================================
 
-CREATE OR REPLACE PROCEDURE generate_ai_insights(deal_id_param VARCHAR)
+-- Drop the pre-cache and pre-trace signatures; with DEFAULT parameters they
+-- would be ambiguous overloads
+EXECUTE IMMEDIATE $$
+BEGIN
+    DROP PROCEDURE IF EXISTS generate_ai_insights(VARCHAR);
+    DROP PROCEDURE IF EXISTS generate_ai_insights(VARCHAR, BOOLEAN);
+    DROP PROCEDURE IF EXISTS export_database_tab(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_income_statement_structure(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_balance_sheet_structure(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_schedule_values(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_ai_insights(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_fdd_workbook(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_partitioned(VARCHAR, VARCHAR, VARCHAR);
+    DROP PROCEDURE IF EXISTS export_fdd_outputs_parallel(VARCHAR);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Ignore errors if procedure doesn't exist
+        RETURN 'Procedures dropped or did not exist';
+END;
+$$;
+
+-- Estimated USD cost of a Cortex call from its token counts and a rate card
+-- (ai_cost_per_million_tokens_usd already resolved by the caller, falling back
+-- to its "default" rate)
+CREATE OR REPLACE FUNCTION estimate_cortex_cost_usd(model_name VARCHAR, prompt_tokens NUMBER, completion_tokens NUMBER, token_prices OBJECT)
+RETURNS NUMBER(10,4)
+LANGUAGE SQL
+AS
+$$
+    (COALESCE(prompt_tokens, 0) + COALESCE(completion_tokens, 0)) / 1000000
+    * COALESCE(token_prices[model_name]::FLOAT, token_prices:default::FLOAT)
+$$;
+
+-- Same estimate priced with the current ai_cost_per_million_tokens_usd
+CREATE OR REPLACE FUNCTION estimate_cortex_cost_usd(model_name VARCHAR, prompt_tokens NUMBER, completion_tokens NUMBER)
+RETURNS NUMBER(10,4)
+LANGUAGE SQL
+AS
+$$
+    SELECT estimate_cortex_cost_usd(model_name, prompt_tokens, completion_tokens,
+                                    config_values:ai_cost_per_million_tokens_usd::OBJECT)
+    FROM v_config_snapshot
+$$;
+
+-- Cortex completions are cached in ai_completion_cache by SHA2(model || '|' || prompt).
+-- Unchanged prompts reuse the stored answer; pass force_refresh => TRUE to re-ask Cortex.
+-- Cache writes happen outside the insight transaction so completed calls are kept
+-- even if the run fails later.
+--
+-- Models come from config: ai_model_variance (high/medium variances),
+-- ai_model_low_severity (low variances) and ai_model_trends (margin trend).
+-- Every Cortex call is recorded in ai_token_usage with its token counts. Calls
+-- are made within the day's token budgets (ai_deal_daily_token_budget per deal,
+-- ai_daily_token_budget across deals): cache misses are ranked high, medium,
+-- low severity and the lowest-severity prompts are skipped once the estimated
+-- tokens exceed what is left.
+CREATE OR REPLACE PROCEDURE generate_ai_insights(deal_id_param VARCHAR, force_refresh BOOLEAN DEFAULT FALSE, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -19,143 +75,469 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     insight_count NUMBER DEFAULT 0;
-    ai_model VARCHAR DEFAULT get_config_string('ai_model_variance');
-    max_insights NUMBER DEFAULT get_config_number('max_ai_insights');
+    config_version_var NUMBER;
+    run_config OBJECT;
+    variance_model VARCHAR;
+    bulk_model VARCHAR;
+    trends_model VARCHAR;
+    max_insights NUMBER;
+    completion_tokens_estimate NUMBER;
+    min_variance_amount FLOAT;
+    variance_threshold FLOAT;
+    deal_token_budget NUMBER;
+    daily_token_budget NUMBER;
+    token_prices OBJECT;
+    tokens_remaining NUMBER;
+    tokens_used NUMBER DEFAULT 0;
+    cache_hits NUMBER DEFAULT 0;
+    cache_misses NUMBER DEFAULT 0;
+    calls_skipped NUMBER DEFAULT 0;
+    invalid_models NUMBER DEFAULT 0;
+    call_model VARCHAR;
+    call_sql VARCHAR;
+    margin_data VARCHAR;
+    margin_prompt VARCHAR;
+    margin_key VARCHAR;
+    margin_analysis VARCHAR;
+    cache_summary VARCHAR;
+    error_msg VARCHAR;
+    invalid_model EXCEPTION (-20017, 'Invalid Cortex model name in system_config');
+    call_models CURSOR FOR SELECT DISTINCT model_name FROM temp_ai_calls WHERE call_allowed;
 BEGIN
+    -- Settings for the whole run, resolved once and bound below
+    SELECT 
+        config_version,
+        config_values,
+        COALESCE(TRIM(config_values:ai_model_variance::VARCHAR, '"'), 'mistral-large'),
+        COALESCE(TRIM(config_values:ai_model_low_severity::VARCHAR, '"'), TRIM(config_values:ai_model_variance::VARCHAR, '"'), 'mistral-large'),
+        COALESCE(TRIM(config_values:ai_model_trends::VARCHAR, '"'), 'mistral-large'),
+        config_values:max_ai_insights::NUMBER,
+        COALESCE(config_values:ai_estimated_completion_tokens::NUMBER, 150),
+        config_values:min_variance_amount::FLOAT,
+        config_values:variance_threshold_pct::FLOAT,
+        config_values:ai_deal_daily_token_budget::NUMBER,
+        config_values:ai_daily_token_budget::NUMBER,
+        config_values:ai_cost_per_million_tokens_usd::OBJECT
+    INTO :config_version_var, :run_config, :variance_model, :bulk_model, :trends_model,
+         :max_insights, :completion_tokens_estimate, :min_variance_amount, :variance_threshold,
+         :deal_token_budget, :daily_token_budget, :token_prices
+    FROM v_config_snapshot;
+    
     -- Validate input
-    IF (NOT validate_deal_id(:deal_id_param)) THEN
+    IF (NOT validate_deal_id(:deal_id_param, :run_config)) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'generate_ai_insights', :deal_id_param, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'generate_ai_insights', :deal_id_param, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
+    
+    -- Step 1: Variance Analysis (period-over-period > threshold%)
+    -- Build and fingerprint the prompts first so Cortex is only called for cache misses
+    CREATE OR REPLACE TEMPORARY TABLE temp_variance_prompts AS
+    SELECT 
+        prompts.*,
+        CASE WHEN prompts.severity = 'low' THEN :bulk_model ELSE :variance_model END AS model_name,
+        SHA2(model_name || '|' || prompts.prompt_text, 256) AS cache_key
+    FROM (
+        SELECT 
+            variance_data.*,
+            CASE 
+                WHEN ABS(variance_data.var_pct) > 50 THEN 'high'
+                WHEN ABS(variance_data.var_pct) > 30 THEN 'medium'
+                ELSE 'low'
+            END AS severity,
+            'Analyze this financial variance for a due diligence review: Account "' || variance_data.account_name || 
+            '" changed from $' || TO_CHAR(ABS(variance_data.prior_net_amount), '999,999,999') || 
+            ' to $' || TO_CHAR(ABS(variance_data.net_amount), '999,999,999') || 
+            ' (' || ROUND(variance_data.var_pct, 1) || '% change) between ' || 
+            TO_CHAR(variance_data.prior_period_date, 'Mon YYYY') || ' and ' || TO_CHAR(variance_data.period_date, 'Mon YYYY') || 
+            '. Provide a 2-sentence explanation of potential business reasons for this variance that a due diligence analyst should investigate.' AS prompt_text
+        FROM (
+            SELECT 
+                deal_id, period_date, account_number, account_name, net_amount,
+                prior_net_amount, var_pct, prior_period_date
+            FROM v_variance_candidates
+            WHERE deal_id = :deal_id_param
+              AND prior_abs_amount > :min_variance_amount
+              AND variance_ratio > :variance_threshold
+        ) AS variance_data
+        ORDER BY ABS(variance_data.var_pct) DESC
+        LIMIT :max_insights
+    ) AS prompts;
+    
+    -- Step 2: Margin Trend Analysis prompt
+    -- Build margin trend data string
+    SELECT LISTAGG(
+        TO_CHAR(period_date, 'Mon-YY') || ': ' || TO_CHAR(ROUND(gross_margin_pct, 1), '990.0') || '%', 
+        ', '
+    ) WITHIN GROUP (ORDER BY period_date)
+    INTO :margin_data
+    FROM (
+        SELECT 
+            t.period_date,
+            (SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN t.net_amount ELSE 0 END) +
+             SUM(CASE WHEN m.mapping_level_1 = 'Cost of Goods Sold' THEN t.net_amount ELSE 0 END)) /
+            NULLIF(SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN ABS(t.net_amount) ELSE 0 END), 0) * 100 AS gross_margin_pct
+        FROM trial_balance_raw t
+        JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
+        WHERE t.deal_id = :deal_id_param
+        GROUP BY t.period_date
+        ORDER BY t.period_date
+    );
+    
+    IF (:margin_data IS NOT NULL) THEN
+        margin_prompt := 'Analyze the following gross margin trend over 24 months for a company undergoing due diligence: ' ||
+                         :margin_data ||
+                         '. Identify any concerning trends, seasonality patterns, or margin compression/expansion. Provide 3 specific questions for management in 150 words.';
+        margin_key := SHA2(:trends_model || '|' || :margin_prompt, 256);
+    END IF;
+    
+    -- Every completion the run needs, with its severity and estimated tokens
+    -- (about 4 characters per prompt token)
+    CREATE OR REPLACE TEMPORARY TABLE temp_ai_calls AS
+    SELECT 
+        cache_key, model_name, prompt_text, insight_type, severity, priority,
+        CEIL(LENGTH(prompt_text) / 4) + :completion_tokens_estimate AS estimated_tokens,
+        FALSE AS cached,
+        FALSE AS call_allowed
+    FROM (
+        SELECT cache_key, model_name, prompt_text, 'variance' AS insight_type, severity, MAX(ABS(var_pct)) AS priority
+        FROM temp_variance_prompts
+        GROUP BY cache_key, model_name, prompt_text, severity
+        UNION ALL
+        SELECT :margin_key, :trends_model, :margin_prompt, 'trend_analysis', 'medium', 0
+        WHERE :margin_prompt IS NOT NULL
+    );
+    
+    -- Cortex model names are spliced into the COMPLETE calls below
+    SELECT COUNT_IF(NOT REGEXP_LIKE(model_name, '[a-z0-9][a-z0-9._-]*')) INTO :invalid_models FROM temp_ai_calls;
+    IF (:invalid_models > 0) THEN
+        RAISE invalid_model;
+    END IF;
+    
+    IF (:force_refresh) THEN
+        DELETE FROM ai_completion_cache
+        WHERE cache_key IN (SELECT cache_key FROM temp_ai_calls);
+    END IF;
+    
+    UPDATE temp_ai_calls t
+    SET cached = TRUE
+    FROM ai_completion_cache c
+    WHERE c.cache_key = t.cache_key;
+    
+    SELECT COUNT_IF(cached), COUNT_IF(NOT cached)
+    INTO :cache_hits, :cache_misses
+    FROM temp_ai_calls;
+    
+    -- Mark hits as used (drives LRU eviction)
+    UPDATE ai_completion_cache
+    SET last_used_timestamp = CURRENT_TIMESTAMP(),
+        hit_count = hit_count + 1
+    WHERE cache_key IN (SELECT cache_key FROM temp_ai_calls WHERE cached);
+    
+    -- Tokens left today: the smaller of the deal's and the account-wide budget
+    SELECT GREATEST(LEAST(
+               COALESCE(:deal_token_budget - COALESCE(SUM(IFF(deal_id = :deal_id_param, total_tokens, 0)), 0), 1e15),
+               COALESCE(:daily_token_budget - COALESCE(SUM(total_tokens), 0), 1e15)
+           ), 0)
+    INTO :tokens_remaining
+    FROM ai_token_usage
+    WHERE call_date = CURRENT_DATE();
+    
+    -- Cache misses in severity order; the low-severity tail is cut at the budget
+    UPDATE temp_ai_calls t
+    SET call_allowed = TRUE
+    FROM (
+        SELECT 
+            cache_key,
+            SUM(estimated_tokens) OVER (
+                ORDER BY CASE severity WHEN 'high' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END, priority DESC, cache_key
+                ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ) AS running_tokens
+        FROM temp_ai_calls
+        WHERE NOT cached
+    ) r
+    WHERE r.cache_key = t.cache_key
+    AND r.running_tokens <= :tokens_remaining;
+    
+    SELECT COUNT_IF(NOT cached AND NOT call_allowed) INTO :calls_skipped FROM temp_ai_calls;
+    
+    -- Use Cortex AI for allowed misses, one statement per model (the model must be a
+    -- literal string per Snowflake Cortex requirements). The options argument makes
+    -- COMPLETE return the usage (token counts) with the answer.
+    FOR model_row IN call_models DO
+        call_model := model_row.model_name;
+        call_sql := 'INSERT INTO ai_completion_cache (cache_key, model_name, prompt_text, completion_text, prompt_tokens, completion_tokens) ' ||
+                    'SELECT cache_key, model_name, prompt_text, r:choices[0]:messages::VARCHAR, ' ||
+                    'r:usage:prompt_tokens::NUMBER, r:usage:completion_tokens::NUMBER ' ||
+                    'FROM (SELECT cache_key, model_name, prompt_text, TRY_PARSE_JSON(TO_VARCHAR(SNOWFLAKE.CORTEX.COMPLETE(''' ||
+                    :call_model || ''', ARRAY_CONSTRUCT(OBJECT_CONSTRUCT(''role'', ''user'', ''content'', prompt_text)), ' ||
+                    'OBJECT_CONSTRUCT()))) AS r ' ||
+                    'FROM temp_ai_calls WHERE call_allowed AND model_name = ''' || :call_model || ''')';
+        EXECUTE IMMEDIATE :call_sql;
+    END FOR;
+    
+    -- Token ledger: one row per Cortex call
+    INSERT INTO ai_token_usage (
+        deal_id, model_name, insight_type, severity, cache_key,
+        prompt_tokens, completion_tokens, total_tokens, estimated_cost_usd
+    )
+    SELECT 
+        :deal_id_param, t.model_name, t.insight_type, t.severity, t.cache_key,
+        c.prompt_tokens, c.completion_tokens,
+        COALESCE(c.prompt_tokens, 0) + COALESCE(c.completion_tokens, 0),
+        estimate_cortex_cost_usd(t.model_name, c.prompt_tokens, c.completion_tokens, :token_prices)
+    FROM temp_ai_calls t
+    JOIN ai_completion_cache c ON c.cache_key = t.cache_key
+    WHERE t.call_allowed;
+    
+    SELECT COALESCE(SUM(COALESCE(c.prompt_tokens, 0) + COALESCE(c.completion_tokens, 0)), 0) INTO :tokens_used
+    FROM temp_ai_calls t
+    JOIN ai_completion_cache c ON c.cache_key = t.cache_key
+    WHERE t.call_allowed;
+    
+    IF (:margin_key IS NOT NULL) THEN
+        SELECT MAX(completion_text) INTO :margin_analysis
+        FROM ai_completion_cache
+        WHERE cache_key = :margin_key;
+    END IF;
+    
+    cache_summary := 'cache: ' || :cache_hits || ' hits, ' || :cache_misses || ' misses; ' ||
+                     :tokens_used || ' tokens used' ||
+                     IFF(:calls_skipped > 0, ', ' || :calls_skipped || ' prompts skipped by token budget', '');
     
     BEGIN TRANSACTION;
     
-    -- Clear previous insights for this deal
+    -- Replace previous insights for this deal
     DELETE FROM ai_insights WHERE deal_id = :deal_id_param;
     
-    -- Step 1: Variance Analysis (period-over-period > threshold%)
     INSERT INTO ai_insights (
         deal_id, insight_type, severity, account_number, account_name, period_date,
         metric_value, comparison_value, variance_pct, insight_text, suggested_question, 
-        model_used, prompt_tokens, completion_tokens
+        model_used, prompt_tokens, completion_tokens, estimated_cost_usd, config_version
     )
     SELECT 
-        variance_data.deal_id,
+        p.deal_id,
         'variance',
-        CASE 
-            WHEN ABS(variance_data.var_pct) > 50 THEN 'high'
-            WHEN ABS(variance_data.var_pct) > 30 THEN 'medium'
-            ELSE 'low'
-        END,
-        variance_data.account_number,
-        variance_data.account_name,
-        variance_data.period_date,
-        variance_data.net_amount,
-        variance_data.prior_net_amount,
-        variance_data.var_pct,
-        -- Use Cortex AI to generate insights (model must be literal string per Snowflake Cortex requirements)
-        SNOWFLAKE.CORTEX.COMPLETE(
-            'mistral-large',
-            'Analyze this financial variance for a due diligence review: Account "' || variance_data.account_name || 
-            '" changed from $' || TO_CHAR(ABS(variance_data.prior_net_amount), '999,999,999') || 
-            ' to $' || TO_CHAR(ABS(variance_data.net_amount), '999,999,999') || 
-            ' (' || ROUND(variance_data.var_pct, 1) || '% change) between ' || 
-            TO_CHAR(variance_data.prior_period_date, 'Mon YYYY') || ' and ' || TO_CHAR(variance_data.period_date, 'Mon YYYY') || 
-            '. Provide a 2-sentence explanation of potential business reasons for this variance that a due diligence analyst should investigate.'
-        ),
-        'Why did ' || variance_data.account_name || ' change by ' || ROUND(ABS(variance_data.var_pct), 1) || '% from ' ||
-        TO_CHAR(variance_data.prior_period_date, 'Mon YYYY') || ' to ' || TO_CHAR(variance_data.period_date, 'Mon YYYY') || '?',
-        'mistral-large',
-        NULL,  -- Token counts would need to be calculated separately
-        NULL
-    FROM (
-        SELECT 
-            t1.deal_id, t1.period_date, t1.account_number, t1.account_name, t1.net_amount,
-            t2.net_amount AS prior_net_amount,
-            ROUND((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0) * 100, 2) AS var_pct,
-            t2.period_date AS prior_period_date
-        FROM trial_balance_raw t1
-        JOIN trial_balance_raw t2
-            ON t1.deal_id = t2.deal_id
-            AND t1.account_number = t2.account_number
-            AND t1.entity = t2.entity
-            AND t2.period_date = DATEADD(month, -1, t1.period_date)
-        WHERE t1.deal_id = :deal_id_param
-          AND ABS(t2.net_amount) > get_config_number('min_variance_amount')
-          AND ABS((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0)) > get_config_number('variance_threshold_pct')
-    ) AS variance_data
-    ORDER BY ABS(variance_data.var_pct) DESC
-    LIMIT :max_insights;
+        p.severity,
+        p.account_number,
+        p.account_name,
+        p.period_date,
+        p.net_amount,
+        p.prior_net_amount,
+        p.var_pct,
+        c.completion_text,
+        'Why did ' || p.account_name || ' change by ' || ROUND(ABS(p.var_pct), 1) || '% from ' ||
+        TO_CHAR(p.prior_period_date, 'Mon YYYY') || ' to ' || TO_CHAR(p.period_date, 'Mon YYYY') || '?',
+        p.model_name,
+        c.prompt_tokens,
+        c.completion_tokens,
+        estimate_cortex_cost_usd(p.model_name, c.prompt_tokens, c.completion_tokens, :token_prices),
+        :config_version_var
+    FROM temp_variance_prompts p
+    JOIN ai_completion_cache c ON c.cache_key = p.cache_key
+    ORDER BY ABS(p.var_pct) DESC;
     
     SELECT COUNT(*) INTO :insight_count FROM ai_insights WHERE deal_id = :deal_id_param AND insight_type = 'variance';
     
-    -- Step 2: Margin Trend Analysis using Cortex
-    DECLARE
-        margin_analysis VARCHAR;
-        margin_data VARCHAR;
-    BEGIN
-        -- Build margin trend data string
-        SELECT LISTAGG(
-            TO_CHAR(period_date, 'Mon-YY') || ': ' || TO_CHAR(ROUND(gross_margin_pct, 1), '990.0') || '%', 
-            ', '
-        ) WITHIN GROUP (ORDER BY period_date)
-        INTO :margin_data
-        FROM (
-            SELECT 
-                t.period_date,
-                (SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN t.net_amount ELSE 0 END) +
-                 SUM(CASE WHEN m.mapping_level_1 = 'Cost of Goods Sold' THEN t.net_amount ELSE 0 END)) /
-                NULLIF(SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN ABS(t.net_amount) ELSE 0 END), 0) * 100 AS gross_margin_pct
-            FROM trial_balance_raw t
-            JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-            WHERE t.deal_id = :deal_id_param
-            GROUP BY t.period_date
-            ORDER BY t.period_date
-        );
+    IF (:margin_analysis IS NOT NULL) THEN
+        INSERT INTO ai_insights (deal_id, insight_type, severity, insight_text, model_used,
+                                 prompt_tokens, completion_tokens, estimated_cost_usd, config_version)
+        SELECT :deal_id_param, 'trend_analysis', 'medium', completion_text, model_name,
+               prompt_tokens, completion_tokens, estimate_cortex_cost_usd(model_name, prompt_tokens, completion_tokens, :token_prices),
+               :config_version_var
+        FROM ai_completion_cache
+        WHERE cache_key = :margin_key;
         
-        -- Generate AI analysis if we have data
-        IF (:margin_data IS NOT NULL) THEN
-            SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                'mistral-large',
-                'Analyze the following gross margin trend over 24 months for a company undergoing due diligence: ' ||
-                :margin_data ||
-                '. Identify any concerning trends, seasonality patterns, or margin compression/expansion. Provide 3 specific questions for management in 150 words.'
-            ) INTO :margin_analysis;
-            
-            INSERT INTO ai_insights (deal_id, insight_type, severity, insight_text, model_used)
-            VALUES (:deal_id_param, 'trend_analysis', 'medium', :margin_analysis, 'mistral-large');
-            
-            insight_count := :insight_count + 1;
-        END IF;
-    END;
+        insight_count := :insight_count + 1;
+    END IF;
     
     COMMIT;
     
+    -- Enforce cache age/size limits
+    CALL evict_ai_completion_cache();
+    
     -- Log success
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = IFF(:calls_skipped > 0, 'WARNING', 'SUCCESS'),
+            rows_affected = :insight_count,
+            message = 'Generated ' || :insight_count || ' AI insights (' || :cache_summary || ')'
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN IFF(:calls_skipped > 0, 'WARNING', 'SUCCESS') || ': Generated ' || :insight_count ||
+           ' AI insights for ' || :deal_id_param || ' (' || :cache_summary || ')';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Evict cached completions by age (ai_cache_max_age_days since last use),
+-- then by size (least recently used beyond ai_cache_max_entries)
+CREATE OR REPLACE PROCEDURE evict_ai_completion_cache()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    max_age_days NUMBER DEFAULT get_config_number('ai_cache_max_age_days');
+    max_entries NUMBER DEFAULT get_config_number('ai_cache_max_entries');
+    evicted_age NUMBER DEFAULT 0;
+    evicted_size NUMBER DEFAULT 0;
+BEGIN
+    DELETE FROM ai_completion_cache
+    WHERE last_used_timestamp < DATEADD(day, -1 * COALESCE(:max_age_days, 90), CURRENT_TIMESTAMP());
+    evicted_age := SQLROWCOUNT;
+    
+    DELETE FROM ai_completion_cache
+    WHERE cache_key IN (
+        SELECT cache_key
+        FROM ai_completion_cache
+        QUALIFY ROW_NUMBER() OVER (ORDER BY last_used_timestamp DESC, created_timestamp DESC) > COALESCE(:max_entries, 50000)
+    );
+    evicted_size := SQLROWCOUNT;
+    
+    RETURN 'SUCCESS: Evicted ' || :evicted_age || ' expired and ' || :evicted_size || ' least recently used completions';
+END;
+$$;
+
+-- Rebuild the variance distribution index for one deal (NULL = all deals).
+-- Grid: variance % edges every variance_index_pct_step up to 100%, prior amount
+-- edges every variance_index_amount_step up to $100,000 (the dashboard slider
+-- ranges). Candidates above the last edge are counted in the last cell.
+CREATE OR REPLACE PROCEDURE refresh_variance_index(deal_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    pct_step NUMBER(6,4) DEFAULT COALESCE(get_config_number('variance_index_pct_step'), 0.05);
+    amount_step NUMBER(18,2) DEFAULT COALESCE(get_config_number('variance_index_amount_step'), 1000);
+    pct_edges NUMBER;
+    amount_edges NUMBER;
+    deal_count NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    IF (:deal_id_param IS NOT NULL AND NOT validate_deal_id(:deal_id_param)) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+    VALUES (:log_id_var, 'refresh_variance_index', :deal_id_param, :start_time_var, 'STARTED');
+    
+    pct_edges := CEIL(1 / :pct_step) + 1;
+    amount_edges := CEIL(100000 / :amount_step) + 1;
+    
+    BEGIN TRANSACTION;
+    
+    DELETE FROM variance_distribution_index
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    INSERT INTO variance_distribution_index (
+        deal_id, min_variance_pct, min_prior_amount, cell_count, variance_count
+    )
+    WITH cells AS (
+        -- Highest grid edge each candidate is strictly above (matches the > tests in generate_ai_insights)
+        SELECT 
+            deal_id,
+            LEAST(CEIL(variance_ratio / :pct_step) - 1, :pct_edges - 1) AS pct_idx,
+            LEAST(CEIL(prior_abs_amount / :amount_step) - 1, :amount_edges - 1) AS amount_idx,
+            COUNT(*) AS candidates
+        FROM v_variance_candidates
+        WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param)
+        AND variance_ratio > 0
+        AND prior_abs_amount > 0
+        GROUP BY 1, 2, 3
+    ),
+    pct_grid AS (
+        SELECT ROW_NUMBER() OVER (ORDER BY SEQ4()) - 1 AS pct_idx
+        FROM TABLE(GENERATOR(ROWCOUNT => 1000))
+        QUALIFY pct_idx < :pct_edges
+    ),
+    amount_grid AS (
+        SELECT ROW_NUMBER() OVER (ORDER BY SEQ4()) - 1 AS amount_idx
+        FROM TABLE(GENERATOR(ROWCOUNT => 10000))
+        QUALIFY amount_idx < :amount_edges
+    ),
+    dense AS (
+        SELECT d.deal_id, p.pct_idx, a.amount_idx, COALESCE(c.candidates, 0) AS candidates
+        FROM (SELECT DISTINCT deal_id FROM cells) d
+        CROSS JOIN pct_grid p
+        CROSS JOIN amount_grid a
+        LEFT JOIN cells c
+            ON c.deal_id = d.deal_id AND c.pct_idx = p.pct_idx AND c.amount_idx = a.amount_idx
+    ),
+    above_amount AS (
+        SELECT 
+            dense.*,
+            SUM(candidates) OVER (
+                PARTITION BY deal_id, pct_idx ORDER BY amount_idx DESC
+                ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ) AS candidates_above_amount
+        FROM dense
+    )
+    SELECT 
+        deal_id,
+        pct_idx * :pct_step,
+        amount_idx * :amount_step,
+        candidates,
+        SUM(candidates_above_amount) OVER (
+            PARTITION BY deal_id, amount_idx ORDER BY pct_idx DESC
+            ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+        )
+    FROM above_amount;
+    
+    SELECT COUNT(DISTINCT deal_id) INTO :deal_count
+    FROM variance_distribution_index
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    COMMIT;
+    
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
         duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
         status = 'SUCCESS',
-        rows_affected = :insight_count,
-        message = 'Generated ' || :insight_count || ' AI insights'
+        rows_affected = :deal_count * :pct_edges * :amount_edges,
+        message = 'Variance index rebuilt for ' || :deal_count || ' deal(s)'
     WHERE log_id = :log_id_var;
     
-    RETURN 'SUCCESS: Generated ' || :insight_count || ' AI insights for ' || :deal_id_param;
+    RETURN 'SUCCESS: Variance index rebuilt for ' || :deal_count || ' deal(s)';
     
 EXCEPTION
     WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
         ROLLBACK;
         
         UPDATE audit_log 
         SET end_time = CURRENT_TIMESTAMP(),
             status = 'ERROR',
-            error_message = SQLERRM
+            error_message = :error_msg
         WHERE log_id = :log_id_var;
         
-        RETURN 'ERROR: ' || SQLERRM;
+        RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
@@ -164,7 +546,7 @@ $$;
 -- ============================================================================
 
 -- Export database tab to CSV
-CREATE OR REPLACE PROCEDURE export_database_tab(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_database_tab(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -173,59 +555,95 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
+    select_sql VARCHAR;
+    copy_sql VARCHAR;
+    error_msg VARCHAR;
 BEGIN
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
     -- Validate and sanitize deal_id
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format. Must be alphanumeric with underscores/hyphens only.';
     END IF;
     
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_database_tab', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_database_tab', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
     -- Build output path
-    output_path := '@' || get_config_string('output_stage_name') || '/database_tab_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/database_tab_' || :safe_deal_id || '.csv';
     
-    -- Export using parameterized query to prevent SQL injection
-    COPY INTO IDENTIFIER(:output_path)
-    FROM (
-        SELECT * FROM v_database_tab_pivoted WHERE deal_id = :safe_deal_id
-    )
-    FILE_FORMAT = (FORMAT_NAME = 'csv_format' COMPRESSION = NONE)
-    HEADER = TRUE
-    OVERWRITE = TRUE
-    SINGLE = TRUE;
+    -- Pivot from the materialized Database tab (built on first use)
+    CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    IF (:select_sql IS NULL) THEN
+        CALL refresh_database_tab(:safe_deal_id, :trace_id_param);
+        CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    END IF;
+    
+    IF (:select_sql IS NULL) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = 'No trial balance data found for deal'
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: No trial balance data found for deal ' || :safe_deal_id;
+    END IF;
+    
+    -- Export using EXECUTE IMMEDIATE (COPY INTO doesn't support variable paths)
+    copy_sql := 'COPY INTO ' || :output_path || 
+                    ' FROM (' || :select_sql || ') ' ||
+                    ' FILE_FORMAT = (FORMAT_NAME = ''csv_format'' COMPRESSION = NONE) ' ||
+                    ' HEADER = TRUE OVERWRITE = TRUE SINGLE = TRUE';
+    
+    EXECUTE IMMEDIATE :copy_sql;
     
     file_count := SQLROWCOUNT;
     
     -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :file_count,
-        message = 'Exported to ' || :output_path
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count,
+            message = 'Exported to ' || :output_path
+        WHERE log_id = :log_id_var;
+    END IF;
     
     RETURN 'SUCCESS: Exported Database tab to ' || :output_path || ' (' || :file_count || ' rows)';
     
 EXCEPTION
     WHEN OTHER THEN
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = SQLERRM
-        WHERE log_id = :log_id_var;
+        error_msg := SQLERRM;
         
-        RETURN 'ERROR: ' || SQLERRM;
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
 -- Export income statement structure
-CREATE OR REPLACE PROCEDURE export_income_statement_structure(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_income_statement_structure(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -234,25 +652,36 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
 BEGIN
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
     -- Validate and sanitize deal_id
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_income_statement_structure', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_income_statement_structure', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
-    output_path := '@' || get_config_string('output_stage_name') || '/income_statement_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/income_statement_' || :safe_deal_id || '.csv';
     
     COPY INTO IDENTIFIER(:output_path)
     FROM (
         SELECT row_num, row_label, row_type, account_filter, row_format_json
-        FROM temp_is_schedule
+        FROM schedule_rows
+        WHERE deal_id = :safe_deal_id AND statement_type = 'IS'
         ORDER BY row_num
     )
     FILE_FORMAT = (FORMAT_NAME = 'csv_format' COMPRESSION = NONE)
@@ -263,29 +692,33 @@ BEGIN
     file_count := SQLROWCOUNT;
     
     -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :file_count
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
+        WHERE log_id = :log_id_var;
+    END IF;
     
     RETURN 'SUCCESS: Exported Income Statement to ' || :output_path;
     
 EXCEPTION
     WHEN OTHER THEN
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = SQLERRM
-        WHERE log_id = :log_id_var;
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = SQLERRM
+            WHERE log_id = :log_id_var;
+        END IF;
         
         RETURN 'ERROR: ' || SQLERRM;
 END;
 $$;
 
 -- Export balance sheet structure
-CREATE OR REPLACE PROCEDURE export_balance_sheet_structure(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_balance_sheet_structure(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -294,23 +727,34 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
 BEGIN
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_balance_sheet_structure', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_balance_sheet_structure', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
-    output_path := '@' || get_config_string('output_stage_name') || '/balance_sheet_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/balance_sheet_' || :safe_deal_id || '.csv';
     
     COPY INTO IDENTIFIER(:output_path)
     FROM (
         SELECT row_num, row_label, row_type, account_filter, row_format_json
-        FROM temp_bs_schedule
+        FROM schedule_rows
+        WHERE deal_id = :safe_deal_id AND statement_type = 'BS'
         ORDER BY row_num
     )
     FILE_FORMAT = (FORMAT_NAME = 'csv_format' COMPRESSION = NONE)
@@ -320,29 +764,123 @@ BEGIN
     
     file_count := SQLROWCOUNT;
     
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :file_count
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
+        WHERE log_id = :log_id_var;
+    END IF;
     
     RETURN 'SUCCESS: Exported Balance Sheet to ' || :output_path;
     
 EXCEPTION
     WHEN OTHER THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = SQLERRM
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || SQLERRM;
+END;
+$$;
+
+-- Export computed schedule values (long form: one row per schedule row and period)
+CREATE OR REPLACE PROCEDURE export_schedule_values(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
+    safe_deal_id VARCHAR;
+    file_count NUMBER;
+    refresh_result VARCHAR;
+    error_msg VARCHAR;
+BEGIN
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_schedule_values', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
+    
+    -- No-op when the cached values match the deal's data version
+    CALL refresh_schedule_values(:safe_deal_id, FALSE, :trace_id_param) INTO :refresh_result;
+    IF (NOT STARTSWITH(:refresh_result, 'SUCCESS')) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :refresh_result
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN :refresh_result;
+    END IF;
+    
+    output_path := '@' || :output_stage || '/schedule_values_' || :safe_deal_id || '.csv';
+    
+    COPY INTO IDENTIFIER(:output_path)
+    FROM (
+        SELECT statement_type, row_num, row_label, row_type, period_date, period_label, amount
+        FROM v_schedule_values
+        WHERE deal_id = :safe_deal_id
+        ORDER BY statement_type, row_num, period_date
+    )
+    FILE_FORMAT = (FORMAT_NAME = 'csv_format' COMPRESSION = NONE)
+    HEADER = TRUE
+    OVERWRITE = TRUE
+    SINGLE = TRUE;
+    
+    file_count := SQLROWCOUNT;
+    
+    IF (:trace_id_param IS NULL) THEN
         UPDATE audit_log 
         SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = SQLERRM
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
         WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Exported schedule values to ' || :output_path;
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
         
-        RETURN 'ERROR: ' || SQLERRM;
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
 -- Export AI insights
-CREATE OR REPLACE PROCEDURE export_ai_insights(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_ai_insights(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -351,18 +889,28 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
 BEGIN
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_ai_insights', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_ai_insights', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
-    output_path := '@' || get_config_string('output_stage_name') || '/ai_insights_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/ai_insights_' || :safe_deal_id || '.csv';
     
     COPY INTO IDENTIFIER(:output_path)
     FROM (
@@ -390,29 +938,761 @@ BEGIN
     
     file_count := SQLROWCOUNT;
     
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Exported AI insights to ' || :output_path || ' (' || :file_count || ' insights)';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = SQLERRM
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || SQLERRM;
+END;
+$$;
+
+-- Export the full FDD workbook (Database, Income Statement, Balance Sheet, AI Insights)
+-- as one .xlsx file. Query results are streamed in batches (to_local_iterator) into
+-- an xlsxwriter workbook in constant_memory mode, which flushes each row to disk once
+-- the next row starts, so memory stays flat however large the deal is. Schedule rows
+-- carry their row_format_json formatting and outline levels; schedule amounts come
+-- from v_schedule_values over the deal's Database tab period window.
+CREATE OR REPLACE PROCEDURE export_fdd_workbook(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.11'
+PACKAGES = ('snowflake-snowpark-python', 'xlsxwriter')
+HANDLER = 'export_fdd_workbook'
+EXECUTE AS CALLER
+AS
+$$
+import datetime
+import json
+import os
+import tempfile
+import uuid
+from decimal import Decimal
+
+import xlsxwriter
+
+EXCEL_MAX_ROWS = 1048576
+
+HEADER_FORMAT = {"bold": True, "bg_color": "#4472C4", "font_color": "white", "border": 1}
+
+
+def _write_value(sheet, row, col, value, cell_format=None):
+    if value is None:
+        return
+    if isinstance(value, (Decimal, int, float)) and not isinstance(value, bool):
+        sheet.write_number(row, col, float(value), cell_format)
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        sheet.write_string(row, col, value.isoformat(), cell_format)
+    else:
+        sheet.write_string(row, col, str(value), cell_format)
+
+
+class RowFormats:
+    """One xlsxwriter Format per distinct row_format_json, plus its outline level."""
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._cache = {}
+
+    def get(self, format_json):
+        if format_json not in self._cache:
+            spec = json.loads(format_json) if format_json else {}
+            props = {}
+            if spec.get("bold"):
+                props["bold"] = True
+            if spec.get("font_size"):
+                props["font_size"] = spec["font_size"]
+            if spec.get("bg_color"):
+                props["bg_color"] = spec["bg_color"]
+            if spec.get("font_color"):
+                props["font_color"] = spec["font_color"]
+            if spec.get("number_format"):
+                props["num_format"] = spec["number_format"]
+            if spec.get("indent"):
+                props["indent"] = spec["indent"]
+            if spec.get("border_top"):
+                props["top"] = 1
+            if spec.get("border_bottom"):
+                props["bottom"] = 1
+            if spec.get("border_bottom_double"):
+                props["bottom"] = 6
+            # Level-1 rows (sections, subtotals) stay visible; deeper rows group under them
+            level = max(int(spec.get("outline_level") or 1) - 1, 0)
+            self._cache[format_json] = (self.workbook.add_format(props) if props else None, level)
+        return self._cache[format_json]
+
+
+def _write_table(sheet, dataframe, header_format):
+    """Header plus every row of a Snowpark DataFrame, streamed batch by batch."""
+    columns = [name.strip('"').lower() for name in dataframe.columns]
+    sheet.write_row(0, 0, columns, header_format)
+    sheet.freeze_panes(1, 0)
+    row = 0
+    for record in dataframe.to_local_iterator():
+        row += 1
+        if row >= EXCEL_MAX_ROWS:
+            raise ValueError(f"sheet {sheet.get_name()} exceeds {EXCEL_MAX_ROWS} rows")
+        for col, value in enumerate(record):
+            _write_value(sheet, row, col, value)
+    return row
+
+
+def _write_schedule(session, sheet, formats, deal_id, statement_type, periods):
+    """Schedule rows in row_num order with their period amounts.
+
+    The template row whose formula_template is PERIOD_LABEL carries the period
+    labels. Rows arrive as (row, period) pairs and are folded on row_num, so only
+    the current row is ever held in memory.
+    """
+    period_columns = {period_key: col for col, (period_key, _) in enumerate(periods, start=1)}
+    records = session.sql(
+        """
+        SELECT r.row_num, r.row_label, r.formula_template, r.row_format_json,
+               TO_CHAR(v.period_date, 'YYYY-MM-DD') AS period_key, v.amount
+        FROM schedule_rows r
+        LEFT JOIN v_schedule_values v
+            ON v.deal_id = r.deal_id
+            AND v.statement_type = r.statement_type
+            AND v.row_num = r.row_num
+        WHERE r.deal_id = ? AND r.statement_type = ?
+        ORDER BY r.row_num, v.period_date
+        """,
+        params=[deal_id, statement_type],
+    )
+    sheet.set_column(0, 0, 45)
+    sheet.set_column(1, len(periods), 14)
+
+    row = -1
+    current_row_num = None
+    cell_format = None
+    for record in records.to_local_iterator():
+        if record["ROW_NUM"] != current_row_num:
+            row += 1
+            current_row_num = record["ROW_NUM"]
+            cell_format, level = formats.get(record["ROW_FORMAT_JSON"])
+            if level:
+                sheet.set_row(row, None, None, {"level": level})
+            sheet.write_string(row, 0, record["ROW_LABEL"] or "", cell_format)
+            if record["FORMULA_TEMPLATE"] == "PERIOD_LABEL":
+                for col, (_, label) in enumerate(periods, start=1):
+                    sheet.write_string(row, col, label, cell_format)
+        col = period_columns.get(record["PERIOD_KEY"])
+        if col is not None and record["AMOUNT"] is not None:
+            sheet.write_number(row, col, float(record["AMOUNT"]), cell_format)
+    return row + 1
+
+
+def export_fdd_workbook(session, deal_id_param, trace_id_param=None):
+    log_id = str(uuid.uuid4())
+    # Settings for this export, resolved once from the config snapshot
+    config_version, stage, safe_deal_id = session.sql(
+        "SELECT config_version, config_values:output_stage_name::VARCHAR, sanitize_deal_id(?, config_values) "
+        "FROM v_config_snapshot",
+        params=[deal_id_param],
+    ).collect()[0]
+    if safe_deal_id is None:
+        return "ERROR: Invalid deal_id format"
+
+    # In a traced run the run's span records this export instead of audit_log
+    audited = trace_id_param is None
+    if audited:
+        session.sql(
+            "INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version) "
+            "VALUES (?, 'export_fdd_workbook', ?, CURRENT_TIMESTAMP(), 'STARTED', ?)",
+            params=[log_id, safe_deal_id, config_version],
+        ).collect()
+
+    try:
+        # Same inputs as the CSV exports: the Database tab (built on first use) and schedule values
+        database_sql = session.call("build_database_tab_sql", safe_deal_id)
+        if database_sql is None:
+            session.call("refresh_database_tab", safe_deal_id, trace_id_param)
+            database_sql = session.call("build_database_tab_sql", safe_deal_id)
+        if database_sql is None:
+            raise ValueError("No trial balance data found for deal")
+        refresh_result = session.call("refresh_schedule_values", safe_deal_id, False, trace_id_param)
+        if not str(refresh_result).startswith("SUCCESS"):
+            raise RuntimeError(refresh_result)
+
+        periods = [
+            (r["PERIOD_KEY"], r["PERIOD_LABEL"])
+            for r in session.sql(
+                "SELECT TO_CHAR(period_date, 'YYYY-MM-DD') AS period_key, period_label "
+                "FROM database_tab_periods WHERE deal_id = ? ORDER BY period_rank",
+                params=[safe_deal_id],
+            ).collect()
+        ]
+
+        file_name = f"fdd_workbook_{safe_deal_id}.xlsx"
+        local_path = os.path.join(tempfile.mkdtemp(), file_name)
+        workbook = xlsxwriter.Workbook(local_path, {"constant_memory": True})
+        workbook.set_properties({"comments": f"config_version {config_version}"})
+        header_format = workbook.add_format(HEADER_FORMAT)
+        formats = RowFormats(workbook)
+        rows_written = 0
+
+        rows_written += _write_table(workbook.add_worksheet("Database"), session.sql(database_sql), header_format)
+
+        rows_written += _write_schedule(session, workbook.add_worksheet("Income Statement"),
+                                        formats, safe_deal_id, "IS", periods)
+        rows_written += _write_schedule(session, workbook.add_worksheet("Balance Sheet"),
+                                        formats, safe_deal_id, "BS", periods)
+
+        insights = session.sql(
+            """
+            SELECT insight_type, severity, COALESCE(account_name, 'General') AS account_name,
+                   TO_CHAR(period_date, 'Mon YYYY') AS period, metric_value, comparison_value,
+                   variance_pct, insight_text, suggested_question, model_used
+            FROM ai_insights
+            WHERE deal_id = ?
+            ORDER BY CASE severity WHEN 'high' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END,
+                     ABS(variance_pct) DESC
+            """,
+            params=[safe_deal_id],
+        )
+        rows_written += _write_table(workbook.add_worksheet("AI Insights"), insights, header_format)
+
+        workbook.close()
+        size_bytes = os.path.getsize(local_path)
+
+        session.file.put(local_path, f"@{stage}", auto_compress=False, overwrite=True)
+        os.remove(local_path)
+
+        if audited:
+            session.sql(
+                "UPDATE audit_log SET end_time = CURRENT_TIMESTAMP(), "
+                "duration_seconds = DATEDIFF(second, start_time, CURRENT_TIMESTAMP()), "
+                "status = 'SUCCESS', rows_affected = ?, message = ? WHERE log_id = ?",
+                params=[rows_written, f"{file_name}: {size_bytes} bytes", log_id],
+            ).collect()
+        return f"SUCCESS: Exported workbook to @{stage}/{file_name} ({rows_written} rows, {size_bytes} bytes)"
+
+    except Exception as exc:
+        error_msg = str(exc)[:5000]
+        if audited:
+            session.sql(
+                "UPDATE audit_log SET end_time = CURRENT_TIMESTAMP(), status = 'ERROR', error_message = ? "
+                "WHERE log_id = ?",
+                params=[error_msg, log_id],
+            ).collect()
+        return "ERROR: " + error_msg
+$$;
+
+-- ============================================================================
+-- PART 3: PARTITIONED EXPORT MODE
+-- ============================================================================
+-- export_mode = 'PARTITIONED' replaces the SINGLE = TRUE CSV unloads with
+-- multi-file unloads under @<output_stage>/exports/<deal>/<export>/, run as
+-- concurrent child jobs. Files are gzip CSV or Parquet (export_file_format),
+-- the Database tab is partitioned by entity, and manifest.json lists every
+-- file with its row count, size and MD5 checksum.
+
+-- One row per unloaded file (the manifest is built from these rows)
+CREATE TABLE IF NOT EXISTS export_files (
+    export_run_id VARCHAR(50) NOT NULL,
+    deal_id VARCHAR(50) NOT NULL,
+    export_name VARCHAR(50) NOT NULL,  -- 'database_tab', 'income_statement', 'balance_sheet', 'schedule_values', 'ai_insights'
+    file_name VARCHAR(1000) NOT NULL,  -- path relative to the output stage
+    row_count NUMBER,
+    size_bytes NUMBER,
+    md5 VARCHAR(64),  -- as reported by LIST
+    exported_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- v_config_snapshot version the file was exported under
+ALTER TABLE export_files ADD COLUMN IF NOT EXISTS config_version NUMBER;
+
+-- Unload one export for a deal as multiple files and record them in export_files
+CREATE OR REPLACE PROCEDURE export_partitioned(deal_id_param VARCHAR, export_name VARCHAR, export_run_id VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+EXECUTE AS CALLER
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    safe_deal_id VARCHAR;
+    stage_path VARCHAR;
+    select_sql VARCHAR;
+    partition_sql VARCHAR DEFAULT '';
+    format_sql VARCHAR;
+    copy_sql VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
+    export_format VARCHAR;
+    max_file_bytes NUMBER;
+    file_count NUMBER DEFAULT 0;
+    row_count NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    -- Settings for this export, resolved once
+    SELECT 
+        config_version,
+        config_values,
+        config_values:output_stage_name::VARCHAR,
+        config_values:export_file_format::VARCHAR,
+        COALESCE(config_values:export_max_file_size_mb::NUMBER, 64) * 1024 * 1024
+    INTO :config_version_var, :run_config, :output_stage, :export_format, :max_file_bytes
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message, config_version)
+        VALUES (:log_id_var, 'export_partitioned', :safe_deal_id, :start_time_var, 'STARTED',
+                :export_name || ' (export run ' || :export_run_id || ')', :config_version_var);
+    END IF;
+    
+    stage_path := :output_stage || '/exports/' || :safe_deal_id || '/' || :export_name || '/';
+    
+    CASE (:export_name)
+        WHEN 'database_tab' THEN
+            CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+            IF (:select_sql IS NULL) THEN
+                CALL refresh_database_tab(:safe_deal_id, :trace_id_param);
+                CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+            END IF;
+            partition_sql := ' PARTITION BY (''entity='' || COALESCE(entity, ''UNASSIGNED''))';
+        WHEN 'income_statement' THEN
+            select_sql := 'SELECT row_num, row_label, row_type, account_filter, row_format_json FROM schedule_rows ' ||
+                          'WHERE deal_id = ''' || :safe_deal_id || ''' AND statement_type = ''IS'' ORDER BY row_num';
+        WHEN 'balance_sheet' THEN
+            select_sql := 'SELECT row_num, row_label, row_type, account_filter, row_format_json FROM schedule_rows ' ||
+                          'WHERE deal_id = ''' || :safe_deal_id || ''' AND statement_type = ''BS'' ORDER BY row_num';
+        WHEN 'schedule_values' THEN
+            select_sql := 'SELECT statement_type, row_num, row_label, row_type, period_date, period_label, amount ' ||
+                          'FROM v_schedule_values WHERE deal_id = ''' || :safe_deal_id || ''' ' ||
+                          'ORDER BY statement_type, row_num, period_date';
+        WHEN 'ai_insights' THEN
+            select_sql := 'SELECT insight_type, severity, COALESCE(account_name, ''General'') AS account_name, ' ||
+                          'TO_CHAR(period_date, ''Mon YYYY'') AS period, metric_value, comparison_value, variance_pct, ' ||
+                          'insight_text, suggested_question, model_used FROM ai_insights ' ||
+                          'WHERE deal_id = ''' || :safe_deal_id || ''' ' ||
+                          'ORDER BY CASE severity WHEN ''high'' THEN 1 WHEN ''medium'' THEN 2 ELSE 3 END, ABS(variance_pct) DESC';
+        ELSE
+            select_sql := NULL;
+    END CASE;
+    
+    IF (:select_sql IS NULL) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = 'Nothing to export for ' || :export_name
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: Nothing to export for deal ' || :safe_deal_id;
+    END IF;
+    
+    format_sql := CASE :export_format
+        WHEN 'PARQUET' THEN ' FILE_FORMAT = (FORMAT_NAME = ''parquet_format'')'
+        ELSE ' FILE_FORMAT = (FORMAT_NAME = ''csv_format'' COMPRESSION = GZIP)'
+    END;
+    
+    -- PARTITION BY does not support OVERWRITE, so clear the previous run's files first
+    copy_sql := 'REMOVE @' || :stage_path;
+    EXECUTE IMMEDIATE :copy_sql;
+    
+    copy_sql := 'COPY INTO @' || :stage_path || ' FROM (' || :select_sql || ')' ||
+                :partition_sql || :format_sql ||
+                ' HEADER = TRUE MAX_FILE_SIZE = ' || :max_file_bytes || ' DETAILED_OUTPUT = TRUE';
+    EXECUTE IMMEDIATE :copy_sql;
+    
+    -- DETAILED_OUTPUT returns one row per file written
+    INSERT INTO export_files (export_run_id, deal_id, export_name, file_name, row_count, size_bytes, config_version)
+    SELECT :export_run_id, :safe_deal_id, :export_name,
+           'exports/' || :safe_deal_id || '/' || :export_name || '/' || "FILE_NAME",
+           "ROW_COUNT", "FILE_SIZE", :config_version_var
+    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()))
+    WHERE "FILE_NAME" IS NOT NULL;
+    
+    SELECT COUNT(*), COALESCE(SUM(row_count), 0) INTO :file_count, :row_count
+    FROM export_files
+    WHERE export_run_id = :export_run_id AND export_name = :export_name;
+    
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :row_count
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Exported ' || :export_name || ' to @' || :stage_path || ' (' || :file_count || ' files, ' || :row_count || ' rows)';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Run all exports for a deal as concurrent child jobs, then write manifest.json
+CREATE OR REPLACE PROCEDURE export_fdd_outputs_parallel(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+EXECUTE AS CALLER
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    export_run_id VARCHAR DEFAULT UUID_STRING();
+    safe_deal_id VARCHAR;
+    export_root VARCHAR;
+    database_job RESULTSET;
+    income_statement_job RESULTSET;
+    balance_sheet_job RESULTSET;
+    schedule_values_job RESULTSET;
+    ai_insights_job RESULTSET;
+    failures VARCHAR DEFAULT '';
+    manifest_sql VARCHAR;
+    period_count NUMBER;
+    schedule_row_count NUMBER;
+    prepare_result VARCHAR;
+    file_count NUMBER;
+    row_count NUMBER;
+    total_bytes NUMBER;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
+    export_format VARCHAR;
+    error_msg VARCHAR;
+BEGIN
+    -- Settings for this export run, resolved once
+    SELECT 
+        config_version,
+        config_values,
+        config_values:output_stage_name::VARCHAR,
+        config_values:export_file_format::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage, :export_format
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message, config_version)
+        VALUES (:log_id_var, 'export_fdd_outputs_parallel', :safe_deal_id, :start_time_var, 'STARTED',
+                'export run ' || :export_run_id, :config_version_var);
+    END IF;
+    
+    export_root := :output_stage || '/exports/' || :safe_deal_id || '/';
+    
+    -- Build the Database tab up front so the child jobs only read
+    SELECT COUNT(*) INTO :period_count FROM database_tab_periods WHERE deal_id = :safe_deal_id;
+    IF (:period_count = 0) THEN
+        CALL refresh_database_tab(:safe_deal_id, :trace_id_param);
+    END IF;
+    
+    -- Same for the schedules: rows on first use, values unless current for the
+    -- deal's data version (as export_schedule_values and export_fdd_workbook do)
+    SELECT COUNT(*) INTO :schedule_row_count FROM schedule_rows WHERE deal_id = :safe_deal_id;
+    IF (:schedule_row_count = 0) THEN
+        CALL build_schedules(:safe_deal_id, NULL, :trace_id_param) INTO :prepare_result;
+    END IF;
+    IF (NOT STARTSWITH(COALESCE(:prepare_result, ''), 'ERROR')) THEN
+        CALL refresh_schedule_values(:safe_deal_id, FALSE, :trace_id_param) INTO :prepare_result;
+    END IF;
+    
+    IF (STARTSWITH(:prepare_result, 'ERROR')) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :prepare_result
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN :prepare_result;
+    END IF;
+    
+    database_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'database_tab', :export_run_id, :trace_id_param));
+    income_statement_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'income_statement', :export_run_id, :trace_id_param));
+    balance_sheet_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'balance_sheet', :export_run_id, :trace_id_param));
+    schedule_values_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'schedule_values', :export_run_id, :trace_id_param));
+    ai_insights_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'ai_insights', :export_run_id, :trace_id_param));
+    AWAIT ALL;
+    
+    -- A RESULTSET can be looped over but not queried: read each child's
+    -- result and tag failures with the export that failed
+    FOR r IN database_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; database_tab: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN income_statement_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; income_statement: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN balance_sheet_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; balance_sheet: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN schedule_values_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; schedule_values: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN ai_insights_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; ai_insights: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    
+    IF (:failures <> '') THEN
+        failures := SUBSTR(:failures, 3);
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :failures
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :failures;
+    END IF;
+    
+    -- Checksums for the manifest
+    manifest_sql := 'LIST @' || :export_root;
+    EXECUTE IMMEDIATE :manifest_sql;
+    UPDATE export_files f
+    SET md5 = l."md5"
+    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID())) l
+    WHERE f.export_run_id = :export_run_id
+      AND ENDSWITH(l."name", '/' || f.file_name);
+    
+    manifest_sql :=
+        'COPY INTO @' || :export_root || 'manifest.json FROM (' ||
+        'SELECT OBJECT_CONSTRUCT(' ||
+        '''deal_id'', deal_id, ''export_run_id'', export_run_id, ' ||
+        '''config_version'', ' || :config_version_var || ', ''file_format'', ''' || :export_format || ''', ' ||
+        '''generated_at'', MAX(exported_at), ''file_count'', COUNT(*), ''row_count'', SUM(row_count), ' ||
+        '''size_bytes'', SUM(size_bytes), ' ||
+        '''files'', ARRAY_AGG(OBJECT_CONSTRUCT(''export'', export_name, ''file'', file_name, ' ||
+        '''rows'', row_count, ''bytes'', size_bytes, ''md5'', md5)) WITHIN GROUP (ORDER BY export_name, file_name)) ' ||
+        'FROM export_files WHERE export_run_id = ''' || :export_run_id || ''' GROUP BY deal_id, export_run_id) ' ||
+        'FILE_FORMAT = (TYPE = JSON COMPRESSION = NONE) OVERWRITE = TRUE SINGLE = TRUE';
+    EXECUTE IMMEDIATE :manifest_sql;
+    
+    SELECT COUNT(*), COALESCE(SUM(row_count), 0), COALESCE(SUM(size_bytes), 0)
+    INTO :file_count, :row_count, :total_bytes
+    FROM export_files
+    WHERE export_run_id = :export_run_id;
+    
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :row_count,
+            message = 'export run ' || :export_run_id || ': ' || :file_count || ' files, ' || :total_bytes || ' bytes'
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Exported ' || :file_count || ' files (' || :row_count || ' rows, ' || :total_bytes ||
+           ' bytes) to @' || :export_root || ' with manifest.json';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+GRANT SELECT, INSERT, UPDATE ON TABLE export_files TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE export_files TO ROLE FDD_READONLY_ROLE;
+
+-- ============================================================================
+-- PART 4: STAGE HOUSEKEEPING
+-- ============================================================================
+
+-- Whether a stage file is one of a deal's outputs, by the names the exports
+-- write: exports/<deal>/... and <export>_<deal>.<ext> at the stage root.
+-- Exact comparisons, so deal HL_001 never matches DEAL_HL_001's files.
+CREATE OR REPLACE FUNCTION stage_file_deal_match(relative_path VARCHAR, deal_id VARCHAR)
+RETURNS BOOLEAN
+LANGUAGE SQL
+AS
+$$
+    STARTSWITH(relative_path, 'exports/' || deal_id || '/')
+    OR (NOT CONTAINS(relative_path, '/')
+        AND SPLIT_PART(relative_path, '.', 1) IN (
+            'database_tab_' || deal_id,
+            'income_statement_' || deal_id,
+            'balance_sheet_' || deal_id,
+            'schedule_values_' || deal_id,
+            'ai_insights_' || deal_id,
+            'fdd_workbook_' || deal_id))
+$$;
+
+-- Remove files older than retention_days (default output_retention_days) from
+-- an FDD stage, optionally only one deal's files. Expired files are read from
+-- the stage directory table and removed with one regex-pattern REMOVE per
+-- stage_purge_files_per_remove files instead of one REMOVE per file.
+-- dry_run => TRUE only reports what would be removed.
+CREATE OR REPLACE PROCEDURE purge_stage_files(
+    stage_name_param VARCHAR,
+    retention_days NUMBER DEFAULT NULL,
+    deal_id_param VARCHAR DEFAULT NULL,
+    dry_run BOOLEAN DEFAULT FALSE
+)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    stage_name VARCHAR DEFAULT LOWER(stage_name_param);
+    keep_days NUMBER;
+    files_per_remove NUMBER DEFAULT COALESCE(get_config_number('stage_purge_files_per_remove'), 200);
+    refresh_sql VARCHAR;
+    expired_sql VARCHAR;
+    remove_sql VARCHAR;
+    expired_files NUMBER DEFAULT 0;
+    expired_mb NUMBER(18,2) DEFAULT 0;
+    remove_calls NUMBER DEFAULT 0;
+    purge_summary VARCHAR;
+    remove_patterns RESULTSET;
+    error_msg VARCHAR;
+BEGIN
+    -- Stage names are spliced into the statements below
+    IF (:stage_name NOT IN ('fdd_input_stage', 'fdd_output_stage')) THEN
+        RETURN 'ERROR: Unknown stage ' || :stage_name_param;
+    END IF;
+    
+    IF (:deal_id_param IS NOT NULL AND NOT validate_deal_id(:deal_id_param)) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    keep_days := FLOOR(COALESCE(:retention_days, get_config_number('output_retention_days'), 30));
+    IF (:keep_days < 1) THEN
+        RETURN 'ERROR: retention_days must be at least 1';
+    END IF;
+    
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+    VALUES (:log_id_var, 'purge_stage_files', :deal_id_param, :start_time_var, 'STARTED');
+    
+    -- Directory tables of internal stages are refreshed on demand
+    refresh_sql := 'ALTER STAGE ' || :stage_name || ' REFRESH';
+    EXECUTE IMMEDIATE :refresh_sql;
+    
+    expired_sql := 'CREATE OR REPLACE TEMPORARY TABLE temp_expired_stage_files AS ' ||
+                   'SELECT relative_path, size, last_modified FROM DIRECTORY(@' || :stage_name || ') ' ||
+                   'WHERE last_modified < DATEADD(day, -' || :keep_days || ', CURRENT_TIMESTAMP())';
+    EXECUTE IMMEDIATE :expired_sql;
+    
+    IF (:deal_id_param IS NOT NULL) THEN
+        DELETE FROM temp_expired_stage_files
+        WHERE NOT stage_file_deal_match(relative_path, :deal_id_param);
+    END IF;
+    
+    SELECT COUNT(*), COALESCE(SUM(size), 0) / POWER(1024, 2)
+    INTO :expired_files, :expired_mb
+    FROM temp_expired_stage_files;
+    
+    IF (NOT :dry_run AND :expired_files > 0) THEN
+        -- Paths are regex-escaped (backslash first, then the other metacharacters)
+        -- and OR-ed together, files_per_remove paths per pattern. REMOVE matches
+        -- the full path, which starts with the stage name segment.
+        remove_patterns := (
+            SELECT '[^/]+/(' || LISTAGG(escaped_path, '|') || ')' AS remove_pattern
+            FROM (
+                SELECT 
+                    REGEXP_REPLACE(REPLACE(relative_path, '\\', '\\\\'), '([]().*+?{}|$^[])', '\\\\\\1') AS escaped_path,
+                    FLOOR((ROW_NUMBER() OVER (ORDER BY relative_path) - 1) / :files_per_remove) AS batch_number
+                FROM temp_expired_stage_files
+            )
+            GROUP BY batch_number
+        );
+        
+        FOR pattern_row IN remove_patterns DO
+            remove_sql := 'REMOVE @' || :stage_name || ' PATTERN = ''' ||
+                          REPLACE(REPLACE(pattern_row.remove_pattern, '\\', '\\\\'), '''', '\\''') || '''';
+            EXECUTE IMMEDIATE :remove_sql;
+            remove_calls := :remove_calls + 1;
+        END FOR;
+        
+        EXECUTE IMMEDIATE :refresh_sql;
+    END IF;
+    
+    purge_summary := :expired_files || ' files (' || :expired_mb || ' MB) older than ' || :keep_days ||
+                     ' days in @' || :stage_name || IFF(:deal_id_param IS NULL, '', ' for ' || :deal_id_param);
+    
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
         duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
         status = 'SUCCESS',
-        rows_affected = :file_count
+        rows_affected = IFF(:dry_run, 0, :expired_files),
+        message = IFF(:dry_run, 'Dry run: would remove ', 'Removed ') || :purge_summary ||
+                  IFF(:dry_run, '', ' with ' || :remove_calls || ' REMOVE calls')
     WHERE log_id = :log_id_var;
     
-    RETURN 'SUCCESS: Exported AI insights to ' || :output_path || ' (' || :file_count || ' insights)';
+    RETURN IFF(:dry_run, 'DRY RUN: Would remove ', 'SUCCESS: Removed ') || :purge_summary ||
+           IFF(:dry_run, '', ' with ' || :remove_calls || ' REMOVE calls');
     
 EXCEPTION
     WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
         UPDATE audit_log 
         SET end_time = CURRENT_TIMESTAMP(),
             status = 'ERROR',
-            error_message = SQLERRM
+            error_message = :error_msg
         WHERE log_id = :log_id_var;
         
-        RETURN 'ERROR: ' || SQLERRM;
+        RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
 -- ============================================================================
--- PART 3: MASTER ORCHESTRATION PROCEDURES
+-- PART 5: MASTER ORCHESTRATION PROCEDURES
 -- ============================================================================
 
 -- Master procedure for generating all FDD schedules for a deal
@@ -422,51 +1702,140 @@ LANGUAGE SQL
 AS
 $$
 DECLARE
-    log_id_var VARCHAR DEFAULT UUID_STRING();
+    log_id_var VARCHAR DEFAULT UUID_STRING();  -- also the trace_id of the run's spans
+    root_span_id VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     result VARCHAR;
     tb_row_count NUMBER;
     insight_count NUMBER;
     safe_deal_id VARCHAR;
+    outputs_var VARCHAR;
+    run_status VARCHAR DEFAULT 'SUCCESS';
+    failed_steps NUMBER;
+    warning_steps NUMBER;
+    step_errors VARCHAR;
+    step_warnings VARCHAR;
+    spans ARRAY DEFAULT ARRAY_CONSTRUCT();  -- buffered step spans, written once by record_spans
+    step_name VARCHAR;
+    step_start TIMESTAMP;
+    step_result VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    export_mode VARCHAR;
+    export_workbook BOOLEAN;
+    output_stage VARCHAR;
+    error_msg VARCHAR;
 BEGIN
+    -- Settings for the whole run, resolved once; every audit row of the run is
+    -- stamped with this config_version
+    SELECT 
+        config_version,
+        config_values,
+        config_values:export_mode::VARCHAR,
+        COALESCE(config_values:export_xlsx_workbook::BOOLEAN, FALSE),
+        config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :export_mode, :export_workbook, :output_stage
+    FROM v_config_snapshot;
+    
     -- Validate and sanitize input
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format. Must be alphanumeric with underscores/hyphens only.';
     END IF;
     
-    -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, 'STARTED');
-    
     -- Validate deal exists
     SELECT COUNT(*) INTO :tb_row_count 
     FROM trial_balance_raw 
     WHERE deal_id = :safe_deal_id;
     
     IF (:tb_row_count = 0) THEN
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = 'No trial balance data found for deal'
-        WHERE log_id = :log_id_var;
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, end_time, status, error_message, config_version)
+        VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, CURRENT_TIMESTAMP(),
+                'ERROR', 'No trial balance data found for deal', :config_version_var);
         
         RETURN 'ERROR: No trial balance data found for deal ' || :safe_deal_id || 
                '. Please load data first using load_trial_balance().';
     END IF;
     
-    -- Step 1: Generate schedules (session-isolated temp tables)
-    CALL generate_income_statement(:safe_deal_id);
-    CALL generate_balance_sheet(:safe_deal_id);
+    -- Each step is timed into a span: step_name is set first so the error
+    -- handler can close the span of the step that failed, and cleared once
+    -- the span is buffered. Steps are called with the run's trace id, so they
+    -- skip their own audit_log rows and the step span (with the step's return
+    -- value) is their only record.
+    
+    -- Step 1: Generate schedules (Income Statement and Balance Sheet in one pass)
+    step_name := 'build_schedules';
+    step_start := CURRENT_TIMESTAMP();
+    CALL build_schedules(:safe_deal_id, NULL, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
+    
+    step_name := 'refresh_database_tab';
+    step_start := CURRENT_TIMESTAMP();
+    CALL refresh_database_tab(:safe_deal_id, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
+    
+    step_name := 'refresh_schedule_values';
+    step_start := CURRENT_TIMESTAMP();
+    CALL refresh_schedule_values(:safe_deal_id, FALSE, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
     
     -- Step 2: Generate AI insights
-    CALL generate_ai_insights(:safe_deal_id);
+    step_name := 'generate_ai_insights';
+    step_start := CURRENT_TIMESTAMP();
+    CALL generate_ai_insights(:safe_deal_id, FALSE, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
     
     -- Step 3: Export everything with deal-specific filenames
-    CALL export_database_tab(:safe_deal_id);
-    CALL export_income_statement_structure(:safe_deal_id);
-    CALL export_balance_sheet_structure(:safe_deal_id);
-    CALL export_ai_insights(:safe_deal_id);
+    IF (:export_mode = 'PARTITIONED') THEN
+        step_name := 'export_fdd_outputs_parallel';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_fdd_outputs_parallel(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        outputs_var := '/exports/' || :safe_deal_id || '/';
+    ELSE
+        step_name := 'export_database_tab';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_database_tab(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_income_statement_structure';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_income_statement_structure(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_balance_sheet_structure';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_balance_sheet_structure(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_schedule_values';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_schedule_values(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_ai_insights';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_ai_insights(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        outputs_var := '/*_' || :safe_deal_id || '.csv';
+    END IF;
+    IF (:export_workbook) THEN
+        step_name := 'export_fdd_workbook';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_fdd_workbook(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+    END IF;
     
     -- Get counts for confirmation
     SELECT COUNT(*) INTO :insight_count FROM ai_insights WHERE deal_id = :safe_deal_id;
@@ -474,29 +1843,60 @@ BEGIN
     result := :tb_row_count::VARCHAR || ' TB rows processed, ' ||
               :insight_count::VARCHAR || ' AI insights generated for ' || :safe_deal_id;
     
-    -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :tb_row_count,
-        message = result
-    WHERE log_id = :log_id_var;
+    -- Steps report failures in their return value (now only in their span),
+    -- so the run's status is the worst step status
+    SELECT 
+        COUNT_IF(s.value:status::VARCHAR = 'ERROR'),
+        COUNT_IF(s.value:status::VARCHAR = 'WARNING'),
+        LISTAGG(IFF(s.value:status::VARCHAR = 'ERROR', s.value:span_name::VARCHAR || ': ' || s.value:message::VARCHAR, NULL), '; '),
+        LISTAGG(IFF(s.value:status::VARCHAR = 'WARNING', s.value:span_name::VARCHAR || ': ' || s.value:message::VARCHAR, NULL), '; ')
+    INTO :failed_steps, :warning_steps, :step_errors, :step_warnings
+    FROM TABLE(FLATTEN(input => :spans)) s;
+    
+    IF (:failed_steps > 0) THEN
+        run_status := 'ERROR';
+        result := :failed_steps || ' step(s) failed: ' || :step_errors || '. ' || :result;
+    ELSEIF (:warning_steps > 0) THEN
+        run_status := 'WARNING';
+        result := :warning_steps || ' step(s) with warnings: ' || :step_warnings || '. ' || :result;
+    END IF;
+    
+    -- Root span, then one INSERT for all spans and one audit_log row for the run.
+    -- The root span is not buffered, so a failure here is recorded once by the handler.
+    CALL record_spans(:log_id_var, :safe_deal_id, ARRAY_APPEND(:spans, OBJECT_INSERT(
+        span_record(NULL, 'generate_fdd_schedules', :start_time_var, :run_status || ': ' || :result), 'span_id', :root_span_id)));
     
-    RETURN 'SUCCESS: ' || result || '. Outputs available at @' || get_config_string('output_stage_name') || '/*_' || :safe_deal_id || '.csv';
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, end_time, duration_seconds, status, rows_affected, message, error_message, config_version)
+    VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, CURRENT_TIMESTAMP(),
+            DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()), :run_status, :tb_row_count, LEFT(:result, 5000),
+            LEFT(:step_errors, 5000), :config_version_var);
+    
+    RETURN :run_status || ': ' || :result || '. Outputs available at @' || :output_stage || :outputs_var ||
+           ' (config version ' || :config_version_var || ')';
     
 EXCEPTION
     WHEN OTHER THEN
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = SQLERRM
-        WHERE log_id = :log_id_var;
+        error_msg := SQLERRM;
         
-        RETURN 'ERROR: ' || SQLERRM;
+        -- Flush what was buffered: the failed step and the root span close with the error
+        IF (:step_name IS NOT NULL) THEN
+            spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, 'ERROR: ' || :error_msg));
+        END IF;
+        spans := ARRAY_APPEND(:spans, OBJECT_INSERT(
+            span_record(NULL, 'generate_fdd_schedules', :start_time_var, 'ERROR: ' || :error_msg), 'span_id', :root_span_id));
+        CALL record_spans(:log_id_var, :safe_deal_id, :spans);
+        
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, end_time, status, error_message, config_version)
+        VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, CURRENT_TIMESTAMP(),
+                'ERROR', :error_msg, :config_version_var);
+        
+        RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
+-- Build the variance index for data already loaded
+CALL refresh_variance_index();
+
 SELECT 'AI insights and export procedures created successfully' AS status;
 
 
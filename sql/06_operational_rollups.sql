@@ -0,0 +1,390 @@
+-- ============================================================================
+-- Houlihan Lokey FDD Automation - Operational Rollups
+-- ============================================================================
+-- Description: Hourly rollups of audit_log and data_quality_checks, maintained
+--              incrementally from a high-water mark, for the admin dashboard,
+--              and a metadata-based system health probe
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: ROLLUP TABLES
+-- ============================================================================
+
+-- Procedure executions per hour (by start_time), procedure and deal
+CREATE TABLE IF NOT EXISTS audit_hourly_rollup (
+    hour_bucket TIMESTAMP_NTZ NOT NULL,
+    procedure_name VARCHAR(200) NOT NULL,
+    deal_id VARCHAR(50),
+
+    -- Counts
+    executions NUMBER DEFAULT 0,
+    successes NUMBER DEFAULT 0,
+    errors NUMBER DEFAULT 0,
+    warnings NUMBER DEFAULT 0,
+    running NUMBER DEFAULT 0,  -- still 'STARTED' when the bucket was last rebuilt
+
+    -- Timing
+    timed_executions NUMBER DEFAULT 0,
+    total_duration_seconds NUMBER(18,2) DEFAULT 0,
+    max_duration_seconds NUMBER(10,2),
+    duration_digest VARIANT,  -- APPROX_PERCENTILE_ACCUMULATE state, combine across buckets
+
+    -- Results
+    rows_affected NUMBER DEFAULT 0,
+    last_error_time TIMESTAMP_NTZ,
+
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (hour_bucket);
+
+-- Data quality check outcomes per hour (by check_timestamp), deal and check type
+CREATE TABLE IF NOT EXISTS dq_hourly_rollup (
+    hour_bucket TIMESTAMP_NTZ NOT NULL,
+    deal_id VARCHAR(50) NOT NULL,
+    check_type VARCHAR(50),
+    severity VARCHAR(20),
+
+    total_checks NUMBER DEFAULT 0,
+    passed_checks NUMBER DEFAULT 0,
+    failed_checks NUMBER DEFAULT 0,
+
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (hour_bucket);
+
+-- High-water marks for incremental maintenance
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    rollup_name VARCHAR(100) PRIMARY KEY,
+    high_water_mark TIMESTAMP_NTZ NOT NULL,
+    last_refresh_time TIMESTAMP_NTZ,
+    buckets_refreshed NUMBER
+);
+
+-- ============================================================================
+-- PART 2: INCREMENTAL REFRESH
+-- ============================================================================
+
+-- Rebuilds only the hour buckets touched by rows that completed since the last
+-- high-water mark. An audit_log row is picked up once its status leaves
+-- 'STARTED'; the bucket it belongs to (its start hour) is then recomputed from
+-- the raw rows of that hour, so late completions and updates are never
+-- double-counted. Rows newer than rollup_lag_minutes are left for the next run
+-- so that transactions still in flight are not skipped.
+CREATE OR REPLACE PROCEDURE refresh_operational_rollups()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    lag_minutes NUMBER DEFAULT get_config_number('rollup_lag_minutes');
+    refresh_to TIMESTAMP_NTZ;
+    audit_from TIMESTAMP_NTZ;
+    dq_from TIMESTAMP_NTZ;
+    audit_buckets NUMBER DEFAULT 0;
+    dq_buckets NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    -- Log start
+    INSERT INTO audit_log (log_id, procedure_name, start_time, status)
+    VALUES (:log_id_var, 'refresh_operational_rollups', :start_time_var, 'STARTED');
+
+    refresh_to := DATEADD(minute, -1 * COALESCE(:lag_minutes, 5), CURRENT_TIMESTAMP())::TIMESTAMP_NTZ;
+
+    SELECT COALESCE(MAX(CASE WHEN rollup_name = 'audit_hourly_rollup' THEN high_water_mark END), '1970-01-01'::TIMESTAMP_NTZ),
+           COALESCE(MAX(CASE WHEN rollup_name = 'dq_hourly_rollup' THEN high_water_mark END), '1970-01-01'::TIMESTAMP_NTZ)
+    INTO :audit_from, :dq_from
+    FROM rollup_watermarks;
+
+    -- Hour buckets affected since the last refresh
+    -- (start_time bound prunes partitions; no procedure runs longer than a day)
+    CREATE OR REPLACE TEMPORARY TABLE temp_audit_buckets AS
+    SELECT DISTINCT DATE_TRUNC('hour', start_time) AS hour_bucket
+    FROM audit_log
+    WHERE status <> 'STARTED'
+    AND start_time IS NOT NULL
+    AND start_time > DATEADD(day, -1, :audit_from)
+    AND COALESCE(end_time, log_timestamp) > :audit_from
+    AND COALESCE(end_time, log_timestamp) <= :refresh_to;
+
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_buckets AS
+    SELECT DISTINCT DATE_TRUNC('hour', check_timestamp) AS hour_bucket
+    FROM data_quality_checks
+    WHERE check_timestamp > :dq_from
+    AND check_timestamp <= :refresh_to;
+
+    SELECT COUNT(*) INTO :audit_buckets FROM temp_audit_buckets;
+    SELECT COUNT(*) INTO :dq_buckets FROM temp_dq_buckets;
+
+    BEGIN TRANSACTION;
+
+    -- Recompute affected audit buckets
+    DELETE FROM audit_hourly_rollup
+    WHERE hour_bucket IN (SELECT hour_bucket FROM temp_audit_buckets);
+
+    INSERT INTO audit_hourly_rollup (
+        hour_bucket, procedure_name, deal_id,
+        executions, successes, errors, warnings, running,
+        timed_executions, total_duration_seconds, max_duration_seconds, duration_digest,
+        rows_affected, last_error_time
+    )
+    SELECT
+        DATE_TRUNC('hour', a.start_time) AS hour_bucket,
+        a.procedure_name,
+        a.deal_id,
+        COUNT(*),
+        COUNT_IF(a.status = 'SUCCESS'),
+        COUNT_IF(a.status = 'ERROR'),
+        COUNT_IF(a.status = 'WARNING'),
+        COUNT_IF(a.status = 'STARTED'),
+        COUNT(a.duration_seconds),
+        COALESCE(SUM(a.duration_seconds), 0),
+        MAX(a.duration_seconds),
+        APPROX_PERCENTILE_ACCUMULATE(a.duration_seconds),
+        SUM(COALESCE(a.rows_affected, 0)),
+        MAX(CASE WHEN a.status = 'ERROR' THEN a.start_time END)
+    FROM audit_log a
+    WHERE a.start_time >= (SELECT MIN(hour_bucket) FROM temp_audit_buckets)
+    AND DATE_TRUNC('hour', a.start_time) IN (SELECT hour_bucket FROM temp_audit_buckets)
+    GROUP BY 1, 2, 3;
+
+    -- Recompute affected data quality buckets
+    DELETE FROM dq_hourly_rollup
+    WHERE hour_bucket IN (SELECT hour_bucket FROM temp_dq_buckets);
+
+    INSERT INTO dq_hourly_rollup (
+        hour_bucket, deal_id, check_type, severity,
+        total_checks, passed_checks, failed_checks
+    )
+    SELECT
+        DATE_TRUNC('hour', d.check_timestamp) AS hour_bucket,
+        d.deal_id,
+        d.check_type,
+        d.severity,
+        COUNT(*),
+        COUNT_IF(d.passed = TRUE),
+        COUNT_IF(d.passed = FALSE)
+    FROM data_quality_checks d
+    WHERE d.check_timestamp >= (SELECT MIN(hour_bucket) FROM temp_dq_buckets)
+    AND DATE_TRUNC('hour', d.check_timestamp) IN (SELECT hour_bucket FROM temp_dq_buckets)
+    GROUP BY 1, 2, 3, 4;
+
+    -- Advance high-water marks
+    MERGE INTO rollup_watermarks w
+    USING (
+        SELECT 'audit_hourly_rollup' AS rollup_name, :audit_buckets AS buckets
+        UNION ALL
+        SELECT 'dq_hourly_rollup', :dq_buckets
+    ) s
+    ON w.rollup_name = s.rollup_name
+    WHEN MATCHED THEN UPDATE SET
+        high_water_mark = :refresh_to,
+        last_refresh_time = CURRENT_TIMESTAMP(),
+        buckets_refreshed = s.buckets
+    WHEN NOT MATCHED THEN INSERT (rollup_name, high_water_mark, last_refresh_time, buckets_refreshed)
+        VALUES (s.rollup_name, :refresh_to, CURRENT_TIMESTAMP(), s.buckets);
+
+    COMMIT;
+
+    -- Log success
+    UPDATE audit_log
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = 'SUCCESS',
+        rows_affected = :audit_buckets + :dq_buckets,
+        message = 'Refreshed ' || :audit_buckets || ' audit and ' || :dq_buckets || ' data quality hour buckets'
+    WHERE log_id = :log_id_var;
+
+    RETURN 'SUCCESS: Refreshed ' || :audit_buckets || ' audit and ' || :dq_buckets ||
+           ' data quality hour buckets up to ' || :refresh_to;
+
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+
+        ROLLBACK;
+
+        UPDATE audit_log
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Rebuild all rollups from scratch (e.g. after purging audit_log)
+CREATE OR REPLACE PROCEDURE rebuild_operational_rollups()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+BEGIN
+    TRUNCATE TABLE audit_hourly_rollup;
+    TRUNCATE TABLE dq_hourly_rollup;
+    DELETE FROM rollup_watermarks
+    WHERE rollup_name IN ('audit_hourly_rollup', 'dq_hourly_rollup');
+
+    CALL refresh_operational_rollups();
+
+    RETURN 'SUCCESS: Operational rollups rebuilt';
+END;
+$$;
+
+-- ============================================================================
+-- PART 3: HEALTH PROBE
+-- ============================================================================
+
+-- System health checks for the admin dashboard and external monitoring:
+--   CALL system_health_check();
+-- Object and row counts come from INFORMATION_SCHEMA metadata, mappings are
+-- checked with a LIMIT 1 probe and errors from audit_hourly_rollup, so no check
+-- scans trial_balance_raw or evaluates v_database_tab_pivoted. The independent
+-- probes run as concurrent child jobs.
+CREATE OR REPLACE PROCEDURE system_health_check()
+RETURNS TABLE(check_name VARCHAR, category VARCHAR, observed NUMBER, passed BOOLEAN, severity VARCHAR, message VARCHAR)
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    objects_job RESULTSET;
+    row_counts_job RESULTSET;
+    mappings_job RESULTSET;
+    errors_job RESULTSET;
+    checks ARRAY DEFAULT ARRAY_CONSTRUCT();
+    result_cursor RESULTSET;
+BEGIN
+    -- Tables, views and procedures in this schema
+    objects_job := ASYNC (
+        SELECT check_order, check_name, 'Database Objects' AS category, observed,
+               observed >= minimum AS passed, 'ERROR' AS severity,
+               observed || ' found, at least ' || minimum || ' expected' AS message
+        FROM (
+            SELECT 1 AS check_order, 'Tables' AS check_name, COUNT(*) AS observed, 14 AS minimum
+            FROM information_schema.tables
+            WHERE table_schema = CURRENT_SCHEMA() AND table_type = 'BASE TABLE'
+            UNION ALL
+            SELECT 2, 'Views', COUNT(*), 5
+            FROM information_schema.views
+            WHERE table_schema = CURRENT_SCHEMA()
+            UNION ALL
+            SELECT 3, 'Procedures', COUNT(*), 16
+            FROM information_schema.procedures
+            WHERE procedure_schema = CURRENT_SCHEMA()
+        )
+    );
+    
+    -- Row counts from table metadata; the two views read the materialized tables
+    row_counts_job := ASYNC (
+        SELECT t.check_order, t.check_name, t.category, COALESCE(i.row_count, 0) AS observed,
+               COALESCE(i.row_count, 0) > 0 AS passed, 'ERROR' AS severity,
+               COALESCE(i.row_count, 0) || ' rows in ' || LOWER(t.table_name) AS message
+        FROM (
+            SELECT column1 AS check_order, column2 AS check_name, column3 AS category, column4 AS table_name
+            FROM VALUES
+                (4, 'Trial Balance Rows', 'Data Integrity', 'TRIAL_BALANCE_RAW'),
+                (5, 'Account Mappings', 'Data Integrity', 'ACCOUNT_MAPPINGS'),
+                (7, 'v_trial_balance_for_schedules', 'View Health', 'TRIAL_BALANCE_FOR_SCHEDULES'),
+                (8, 'v_database_tab_pivoted', 'View Health', 'DATABASE_TAB_CACHE')
+        ) t
+        LEFT JOIN information_schema.tables i
+            ON i.table_schema = CURRENT_SCHEMA()
+            AND i.table_name = t.table_name
+    );
+    
+    -- Stops at the first inactive mapping
+    mappings_job := ASYNC (
+        SELECT 6 AS check_order, 'Inactive Mappings' AS check_name, 'Data Integrity' AS category,
+               COUNT(*) AS observed, COUNT(*) = 0 AS passed, 'WARNING' AS severity,
+               IFF(COUNT(*) = 0, 'All account mappings are active', 'At least one account mapping is inactive') AS message
+        FROM (
+            SELECT 1 FROM account_mappings
+            WHERE NOT COALESCE(is_active, FALSE)
+            LIMIT 1
+        )
+    );
+    
+    errors_job := ASYNC (
+        SELECT 9 AS check_order, 'Recent Errors' AS check_name, 'Recent Execution' AS category,
+               COALESCE(SUM(errors), 0) AS observed, COALESCE(SUM(errors), 0) = 0 AS passed, 'WARNING' AS severity,
+               COALESCE(SUM(errors), 0) || ' procedure errors in the last 24 hours (audit_hourly_rollup)' AS message
+        FROM audit_hourly_rollup
+        WHERE hour_bucket >= DATE_TRUNC('hour', DATEADD(hour, -24, CURRENT_TIMESTAMP()))
+    );
+    
+    AWAIT ALL;
+    
+    -- A RESULTSET can be looped over but not queried, so the checks are
+    -- gathered into one ARRAY and returned in check order
+    FOR r IN objects_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    FOR r IN row_counts_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    FOR r IN mappings_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    FOR r IN errors_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    
+    result_cursor := (
+        SELECT
+            c.value:check_name::VARCHAR AS check_name,
+            c.value:category::VARCHAR AS category,
+            c.value:observed::NUMBER AS observed,
+            c.value:passed::BOOLEAN AS passed,
+            c.value:severity::VARCHAR AS severity,
+            c.value:message::VARCHAR AS message
+        FROM TABLE(FLATTEN(input => :checks)) c
+        ORDER BY c.value:check_order::NUMBER
+    );
+    RETURN TABLE(result_cursor);
+END;
+$$;
+
+-- ============================================================================
+-- PART 4: SCHEDULED REFRESH
+-- ============================================================================
+
+-- Serverless task; resumed here so rollups start filling immediately
+CREATE OR REPLACE TASK refresh_operational_rollups_task
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = 'XSMALL'
+    SCHEDULE = '15 MINUTE'
+    COMMENT = 'Incremental refresh of audit_hourly_rollup and dq_hourly_rollup'
+AS
+    CALL refresh_operational_rollups();
+
+ALTER TASK refresh_operational_rollups_task RESUME;
+
+-- ============================================================================
+-- PART 5: GRANTS
+-- ============================================================================
+
+GRANT SELECT ON TABLE audit_hourly_rollup TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE dq_hourly_rollup TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE rollup_watermarks TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE audit_hourly_rollup TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON TABLE dq_hourly_rollup TO ROLE FDD_READONLY_ROLE;
+GRANT USAGE ON PROCEDURE refresh_operational_rollups() TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE system_health_check() TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE system_health_check() TO ROLE FDD_ANALYST_ROLE;
+
+-- Initial backfill
+CALL refresh_operational_rollups();
+
+SELECT 'Operational rollups created and backfilled' AS status;
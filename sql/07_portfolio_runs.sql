@@ -0,0 +1,143 @@
+-- ============================================================================
+-- Houlihan Lokey FDD Automation - Portfolio Runs
+-- ============================================================================
+-- Description: Run and per-deal status tracking for portfolio-wide
+--              generate_fdd_schedules refreshes (driven by fdd_tools.portfolio)
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: RUN TRACKING TABLES
+-- ============================================================================
+
+-- One row per portfolio refresh
+CREATE TABLE IF NOT EXISTS portfolio_runs (
+    run_id VARCHAR(50) DEFAULT UUID_STRING() PRIMARY KEY,
+    requested_by VARCHAR(100) DEFAULT CURRENT_USER(),
+
+    -- Settings
+    concurrency_limit NUMBER,
+    max_retries NUMBER,
+
+    -- Timing
+    start_time TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    end_time TIMESTAMP_NTZ,
+    elapsed_seconds NUMBER(10,2),
+
+    -- Results
+    status VARCHAR(20) DEFAULT 'RUNNING',  -- 'RUNNING', 'SUCCESS', 'PARTIAL', 'ERROR'
+    deals_total NUMBER,
+    deals_succeeded NUMBER,
+    deals_failed NUMBER,
+    total_attempts NUMBER,
+    deal_seconds NUMBER(18,2),  -- sum of per-deal durations; deal_seconds / elapsed_seconds = effective parallelism
+    message VARCHAR(5000)
+);
+
+-- One row per generate_fdd_schedules attempt
+CREATE TABLE IF NOT EXISTS portfolio_run_deals (
+    run_id VARCHAR(50) NOT NULL,
+    deal_id VARCHAR(50) NOT NULL,
+    attempt NUMBER NOT NULL,
+
+    start_time TIMESTAMP_NTZ,
+    end_time TIMESTAMP_NTZ,
+    duration_seconds NUMBER(10,2),
+
+    status VARCHAR(20),  -- 'SUCCESS', 'WARNING', 'ERROR'
+    result_message VARCHAR(5000),
+    session_id VARCHAR(100),
+
+    PRIMARY KEY (run_id, deal_id, attempt)
+);
+
+-- ============================================================================
+-- PART 2: STATUS VIEWS
+-- ============================================================================
+
+-- Final outcome per deal (last attempt) for each run
+CREATE OR REPLACE VIEW v_portfolio_run_status AS
+SELECT
+    d.run_id,
+    r.start_time AS run_start_time,
+    d.deal_id,
+    d.status,
+    d.attempt AS attempts,
+    d.start_time,
+    d.end_time,
+    d.duration_seconds,
+    d.result_message
+FROM portfolio_run_deals d
+JOIN portfolio_runs r ON r.run_id = d.run_id
+QUALIFY ROW_NUMBER() OVER (PARTITION BY d.run_id, d.deal_id ORDER BY d.attempt DESC) = 1;
+
+-- ============================================================================
+-- PART 3: RUN COMPLETION
+-- ============================================================================
+
+-- Summarize a run from its attempt rows (called by the runner when all deals finish)
+CREATE OR REPLACE PROCEDURE finish_portfolio_run(run_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    deals_total NUMBER DEFAULT 0;
+    deals_succeeded NUMBER DEFAULT 0;
+    deals_failed NUMBER DEFAULT 0;
+    run_status VARCHAR;
+BEGIN
+    SELECT COUNT(*), COUNT_IF(status = 'SUCCESS'), COUNT_IF(status <> 'SUCCESS')
+    INTO :deals_total, :deals_succeeded, :deals_failed
+    FROM v_portfolio_run_status
+    WHERE run_id = :run_id_param;
+
+    run_status := CASE
+        WHEN :deals_failed = 0 THEN 'SUCCESS'
+        WHEN :deals_succeeded = 0 THEN 'ERROR'
+        ELSE 'PARTIAL'
+    END;
+
+    UPDATE portfolio_runs r
+    SET end_time = CURRENT_TIMESTAMP(),
+        elapsed_seconds = DATEDIFF(millisecond, r.start_time, CURRENT_TIMESTAMP()) / 1000,
+        status = :run_status,
+        deals_succeeded = :deals_succeeded,
+        deals_failed = :deals_failed,
+        total_attempts = a.attempts,
+        deal_seconds = a.deal_seconds,
+        message = :deals_succeeded || ' of ' || r.deals_total || ' deals succeeded'
+    FROM (
+        SELECT COUNT(*) AS attempts, COALESCE(SUM(duration_seconds), 0) AS deal_seconds
+        FROM portfolio_run_deals
+        WHERE run_id = :run_id_param
+    ) a
+    WHERE r.run_id = :run_id_param;
+
+    INSERT INTO audit_log (procedure_name, start_time, end_time, status, rows_affected, message)
+    SELECT 'portfolio_run', start_time, end_time,
+           CASE status WHEN 'PARTIAL' THEN 'WARNING' ELSE status END,
+           deals_succeeded, message || ' (run ' || run_id || ')'
+    FROM portfolio_runs
+    WHERE run_id = :run_id_param;
+
+    RETURN :run_status || ': ' || :deals_succeeded || ' of ' || :deals_total || ' deals succeeded';
+END;
+$$;
+
+-- ============================================================================
+-- PART 4: GRANTS
+-- ============================================================================
+
+GRANT SELECT, INSERT, UPDATE ON TABLE portfolio_runs TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT ON TABLE portfolio_run_deals TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_portfolio_run_status TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE portfolio_runs TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON VIEW v_portfolio_run_status TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT, INSERT, UPDATE ON TABLE portfolio_runs TO ROLE FDD_SERVICE_ROLE;
+GRANT SELECT, INSERT ON TABLE portfolio_run_deals TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE finish_portfolio_run(VARCHAR) TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE finish_portfolio_run(VARCHAR) TO ROLE FDD_ANALYST_ROLE;
+
+SELECT 'Portfolio run tracking created successfully' AS status;
@@ -0,0 +1,406 @@
+-- ============================================================================
+-- Houlihan Lokey FDD Automation - Execution Tracing
+-- ============================================================================
+-- Description: Trace/span records for generate_fdd_schedules runs. Step spans
+--              are buffered in the run and written with one INSERT; per-step
+--              query statistics are collected from ACCOUNT_USAGE
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: SPAN TABLE
+-- ============================================================================
+
+-- One row per step of a run, plus a root span for the run itself
+CREATE TABLE IF NOT EXISTS execution_spans (
+    trace_id VARCHAR(50) NOT NULL,  -- the run's audit_log log_id
+    span_id VARCHAR(50) NOT NULL,
+    parent_span_id VARCHAR(50),  -- NULL for the root span
+    deal_id VARCHAR(50),
+    span_name VARCHAR(200) NOT NULL,  -- procedure called by the step
+
+    -- Timing
+    start_time TIMESTAMP_NTZ NOT NULL,
+    end_time TIMESTAMP_NTZ,
+    duration_ms NUMBER,
+
+    -- Results
+    status VARCHAR(20),  -- 'SUCCESS', 'WARNING', 'ERROR'
+    message VARCHAR(5000),  -- the step's return value
+
+    user_name VARCHAR(100) DEFAULT CURRENT_USER(),
+    session_id VARCHAR(100) DEFAULT CURRENT_SESSION()::VARCHAR,
+    recorded_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),  -- when record_spans wrote the run
+
+    PRIMARY KEY (trace_id, span_id)
+)
+CLUSTER BY (TO_DATE(start_time));
+
+ALTER TABLE execution_spans ADD COLUMN IF NOT EXISTS recorded_at TIMESTAMP_NTZ;
+
+-- ============================================================================
+-- PART 2: SPAN BUFFERING
+-- ============================================================================
+
+-- A finished span as an OBJECT, appended to the caller's spans ARRAY. The
+-- status is read from the step's return value ('ERROR: ...', 'WARNING: ...').
+CREATE OR REPLACE FUNCTION span_record(
+    parent_span_id VARCHAR,
+    span_name VARCHAR,
+    start_time TIMESTAMP_NTZ,
+    step_result VARCHAR
+)
+RETURNS OBJECT
+LANGUAGE SQL
+AS
+$$
+    OBJECT_CONSTRUCT(
+        'parent_span_id', parent_span_id,
+        'span_name', span_name,
+        'start_time', start_time,
+        'end_time', CURRENT_TIMESTAMP()::TIMESTAMP_NTZ,
+        'status', CASE
+            WHEN STARTSWITH(step_result, 'ERROR') THEN 'ERROR'
+            WHEN STARTSWITH(step_result, 'WARNING') THEN 'WARNING'
+            ELSE 'SUCCESS'
+        END,
+        'message', LEFT(step_result, 5000)
+    )
+$$;
+
+-- Write a run's buffered spans in one INSERT (on completion and on error)
+CREATE OR REPLACE PROCEDURE record_spans(trace_id_param VARCHAR, deal_id_param VARCHAR, spans ARRAY)
+RETURNS NUMBER
+LANGUAGE SQL
+AS
+$$
+BEGIN
+    INSERT INTO execution_spans (
+        trace_id, span_id, parent_span_id, deal_id, span_name,
+        start_time, end_time, duration_ms, status, message, recorded_at
+    )
+    SELECT
+        :trace_id_param,
+        COALESCE(s.value:span_id::VARCHAR, UUID_STRING()),
+        s.value:parent_span_id::VARCHAR,
+        :deal_id_param,
+        s.value:span_name::VARCHAR,
+        s.value:start_time::TIMESTAMP_NTZ,
+        s.value:end_time::TIMESTAMP_NTZ,
+        DATEDIFF(millisecond, s.value:start_time::TIMESTAMP_NTZ, s.value:end_time::TIMESTAMP_NTZ),
+        s.value:status::VARCHAR,
+        s.value:message::VARCHAR,
+        CURRENT_TIMESTAMP()
+    FROM TABLE(FLATTEN(input => :spans)) s;
+    
+    RETURN SQLROWCOUNT;
+END;
+$$;
+
+-- ============================================================================
+-- PART 3: TRACE VIEWS
+-- ============================================================================
+
+-- One row per run (root span), newest first in the dashboard
+CREATE OR REPLACE VIEW v_execution_traces AS
+SELECT
+    r.trace_id,
+    r.deal_id,
+    r.start_time,
+    r.end_time,
+    r.duration_ms,
+    r.status,
+    r.user_name,
+    COUNT(c.span_id) AS steps,
+    COUNT_IF(c.status = 'ERROR') AS failed_steps,
+    MAX_BY(c.span_name, c.duration_ms) AS slowest_step
+FROM execution_spans r
+LEFT JOIN execution_spans c
+    ON c.trace_id = r.trace_id
+    AND c.parent_span_id = r.span_id
+WHERE r.parent_span_id IS NULL
+GROUP BY r.trace_id, r.deal_id, r.start_time, r.end_time, r.duration_ms, r.status, r.user_name;
+
+-- Spans with their offset from the start of the run (waterfall layout)
+CREATE OR REPLACE VIEW v_execution_waterfall AS
+SELECT
+    trace_id,
+    span_id,
+    parent_span_id,
+    deal_id,
+    span_name,
+    IFF(parent_span_id IS NULL, 0, 1) AS depth,
+    DATEDIFF(millisecond, MIN(start_time) OVER (PARTITION BY trace_id), start_time) AS offset_ms,
+    duration_ms,
+    start_time,
+    end_time,
+    status,
+    message
+FROM execution_spans;
+
+-- ============================================================================
+-- PART 4: STEP QUERY PERFORMANCE
+-- ============================================================================
+
+-- Query statistics per step span, summed over the queries the step ran
+CREATE TABLE IF NOT EXISTS step_performance (
+    trace_id VARCHAR(50) NOT NULL,
+    span_id VARCHAR(50) NOT NULL,
+    deal_id VARCHAR(50),
+    span_name VARCHAR(200),
+    step_start_time TIMESTAMP_NTZ,
+
+    -- Queries issued inside the step (CALL statements excluded, their children are counted)
+    query_count NUMBER,
+    slowest_query_id VARCHAR(100),
+
+    -- Pruning
+    bytes_scanned NUMBER,
+    partitions_scanned NUMBER,
+    partitions_total NUMBER,
+
+    -- Spilling
+    bytes_spilled_local NUMBER,
+    bytes_spilled_remote NUMBER,
+
+    -- Time (milliseconds)
+    queued_ms NUMBER,  -- provisioning + repair + overload
+    compilation_ms NUMBER,
+    execution_ms NUMBER,
+
+    credits_used NUMBER(18,6),  -- compute credits attributed to the step's queries
+    collected_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+
+    PRIMARY KEY (trace_id, span_id)
+)
+CLUSTER BY (TO_DATE(step_start_time));
+
+-- Joins finished step spans to SNOWFLAKE.ACCOUNT_USAGE query history. A step's
+-- queries are the ones its session started between the span's start and end,
+-- since owner's rights procedures cannot set QUERY_TAG for their child
+-- queries. Account usage views lag by up to query_history_latency_minutes,
+-- so only spans recorded before that are collected, from a high-water mark on
+-- recorded_at in rollup_watermarks (spans are written when the run ends, so a
+-- long run's spans are recorded after their end_time). QUERY_ATTRIBUTION_HISTORY
+-- lags by hours more: steps that started in the last step_credits_backfill_hours
+-- and still have no credits are collected again until their credits appear. Also fills
+-- audit_log.credits_used and query_id for the run.
+CREATE OR REPLACE PROCEDURE collect_step_performance()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    latency_minutes NUMBER DEFAULT get_config_number('query_history_latency_minutes');
+    backfill_hours NUMBER DEFAULT get_config_number('step_credits_backfill_hours');
+    collect_to TIMESTAMP_NTZ;
+    collect_from TIMESTAMP_NTZ;
+    query_from TIMESTAMP_NTZ;
+    steps_collected NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    INSERT INTO audit_log (log_id, procedure_name, start_time, status)
+    VALUES (:log_id_var, 'collect_step_performance', :start_time_var, 'STARTED');
+    
+    collect_to := DATEADD(minute, -1 * COALESCE(:latency_minutes, 45), CURRENT_TIMESTAMP())::TIMESTAMP_NTZ;
+    
+    SELECT COALESCE(MAX(high_water_mark), DATEADD(day, -7, :collect_to))
+    INTO :collect_from
+    FROM rollup_watermarks
+    WHERE rollup_name = 'step_performance';
+    
+    -- Runs recorded since the last collection, plus runs still missing credits
+    CREATE OR REPLACE TEMPORARY TABLE temp_perf_spans AS
+    SELECT trace_id, span_id, parent_span_id, deal_id, span_name, session_id, start_time, end_time
+    FROM execution_spans
+    WHERE (COALESCE(recorded_at, end_time) > :collect_from
+           AND COALESCE(recorded_at, end_time) <= :collect_to)
+    OR trace_id IN (
+        SELECT trace_id
+        FROM step_performance
+        WHERE credits_used IS NULL
+        AND step_start_time >= DATEADD(hour, -1 * COALESCE(:backfill_hours, 24), CURRENT_TIMESTAMP())
+    );
+    
+    SELECT COALESCE(MIN(start_time), :collect_from) INTO :query_from FROM temp_perf_spans;
+    
+    BEGIN TRANSACTION;
+    
+    MERGE INTO step_performance p
+    USING (
+        SELECT
+            s.trace_id,
+            s.span_id,
+            s.deal_id,
+            s.span_name,
+            s.start_time AS step_start_time,
+            COUNT(q.query_id) AS query_count,
+            MAX_BY(q.query_id, q.execution_time) AS slowest_query_id,
+            SUM(q.bytes_scanned) AS bytes_scanned,
+            SUM(q.partitions_scanned) AS partitions_scanned,
+            SUM(q.partitions_total) AS partitions_total,
+            SUM(q.bytes_spilled_to_local_storage) AS bytes_spilled_local,
+            SUM(q.bytes_spilled_to_remote_storage) AS bytes_spilled_remote,
+            SUM(q.queued_provisioning_time + q.queued_repair_time + q.queued_overload_time) AS queued_ms,
+            SUM(q.compilation_time) AS compilation_ms,
+            SUM(q.execution_time) AS execution_ms,
+            SUM(a.credits_attributed_compute) AS credits_used
+        FROM temp_perf_spans s
+        JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY q
+            ON q.session_id::VARCHAR = s.session_id
+            AND q.start_time::TIMESTAMP_NTZ >= s.start_time
+            AND q.start_time::TIMESTAMP_NTZ < s.end_time
+        LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_ATTRIBUTION_HISTORY a
+            ON a.query_id = q.query_id
+        WHERE s.parent_span_id IS NOT NULL
+        AND q.start_time >= :query_from
+        AND q.query_type <> 'CALL'
+        GROUP BY 1, 2, 3, 4, 5
+    ) src
+    ON p.trace_id = src.trace_id AND p.span_id = src.span_id
+    WHEN MATCHED THEN UPDATE SET
+        query_count = src.query_count,
+        slowest_query_id = src.slowest_query_id,
+        bytes_scanned = src.bytes_scanned,
+        partitions_scanned = src.partitions_scanned,
+        partitions_total = src.partitions_total,
+        bytes_spilled_local = src.bytes_spilled_local,
+        bytes_spilled_remote = src.bytes_spilled_remote,
+        queued_ms = src.queued_ms,
+        compilation_ms = src.compilation_ms,
+        execution_ms = src.execution_ms,
+        credits_used = src.credits_used,
+        collected_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (
+        trace_id, span_id, deal_id, span_name, step_start_time, query_count, slowest_query_id,
+        bytes_scanned, partitions_scanned, partitions_total, bytes_spilled_local, bytes_spilled_remote,
+        queued_ms, compilation_ms, execution_ms, credits_used
+    ) VALUES (
+        src.trace_id, src.span_id, src.deal_id, src.span_name, src.step_start_time, src.query_count, src.slowest_query_id,
+        src.bytes_scanned, src.partitions_scanned, src.partitions_total, src.bytes_spilled_local, src.bytes_spilled_remote,
+        src.queued_ms, src.compilation_ms, src.execution_ms, src.credits_used
+    );
+    
+    steps_collected := SQLROWCOUNT;
+    
+    -- Run totals on the run's audit_log row: credits, and the CALL that started the run
+    UPDATE audit_log l
+    SET credits_used = r.credits_used,
+        query_id = COALESCE(r.call_query_id, l.query_id)
+    FROM (
+        SELECT
+            s.trace_id,
+            MAX(c.credits_used) AS credits_used,
+            MAX_BY(q.query_id, q.start_time) AS call_query_id
+        FROM temp_perf_spans s
+        LEFT JOIN (
+            SELECT trace_id, SUM(credits_used) AS credits_used
+            FROM step_performance
+            GROUP BY trace_id
+        ) c
+            ON c.trace_id = s.trace_id
+        LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY q
+            ON q.session_id::VARCHAR = s.session_id
+            AND q.query_type = 'CALL'
+            AND q.start_time >= DATEADD(day, -1, :query_from)
+            AND q.start_time::TIMESTAMP_NTZ <= s.start_time
+            AND q.end_time::TIMESTAMP_NTZ >= s.end_time
+            AND q.query_text ILIKE '%generate_fdd_schedules%'
+        WHERE s.parent_span_id IS NULL
+        GROUP BY s.trace_id
+    ) r
+    WHERE l.log_id = r.trace_id;
+    
+    MERGE INTO rollup_watermarks w
+    USING (SELECT 'step_performance' AS rollup_name) s
+    ON w.rollup_name = s.rollup_name
+    WHEN MATCHED THEN UPDATE SET
+        high_water_mark = :collect_to,
+        last_refresh_time = CURRENT_TIMESTAMP(),
+        buckets_refreshed = :steps_collected
+    WHEN NOT MATCHED THEN INSERT (rollup_name, high_water_mark, last_refresh_time, buckets_refreshed)
+        VALUES (s.rollup_name, :collect_to, CURRENT_TIMESTAMP(), :steps_collected);
+    
+    COMMIT;
+    
+    UPDATE audit_log
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = 'SUCCESS',
+        rows_affected = :steps_collected,
+        message = 'Collected query statistics for ' || :steps_collected || ' steps'
+    WHERE log_id = :log_id_var;
+    
+    RETURN 'SUCCESS: Collected query statistics for ' || :steps_collected || ' steps up to ' || :collect_to;
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        UPDATE audit_log
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Per-step averages: pruning ratio, spill and queuing show where a slow step loses time
+CREATE OR REPLACE VIEW v_step_performance AS
+SELECT
+    p.trace_id,
+    p.deal_id,
+    p.span_name,
+    p.step_start_time,
+    s.duration_ms AS step_ms,
+    p.query_count,
+    p.execution_ms,
+    p.compilation_ms,
+    p.queued_ms,
+    p.bytes_scanned,
+    p.partitions_scanned,
+    p.partitions_total,
+    ROUND(p.partitions_scanned / NULLIF(p.partitions_total, 0), 4) AS scan_ratio,  -- 1.0 = no pruning
+    p.bytes_spilled_local,
+    p.bytes_spilled_remote,
+    p.credits_used,
+    p.slowest_query_id
+FROM step_performance p
+LEFT JOIN execution_spans s
+    ON s.trace_id = p.trace_id
+    AND s.span_id = p.span_id;
+
+-- Hourly, after account usage has caught up
+CREATE OR REPLACE TASK collect_step_performance_task
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = 'XSMALL'
+    SCHEDULE = '60 MINUTE'
+    COMMENT = 'Collect ACCOUNT_USAGE query statistics for generate_fdd_schedules step spans'
+AS
+    CALL collect_step_performance();
+
+ALTER TASK collect_step_performance_task RESUME;
+
+-- ============================================================================
+-- PART 5: GRANTS
+-- ============================================================================
+
+GRANT SELECT, INSERT ON TABLE execution_spans TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_execution_traces TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_execution_waterfall TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_execution_traces TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON VIEW v_execution_waterfall TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT, INSERT ON TABLE execution_spans TO ROLE FDD_SERVICE_ROLE;
+GRANT SELECT ON TABLE step_performance TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_step_performance TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_step_performance TO ROLE FDD_READONLY_ROLE;
+GRANT USAGE ON PROCEDURE collect_step_performance() TO ROLE FDD_SERVICE_ROLE;
+
+SELECT 'Execution tracing created successfully' AS status;
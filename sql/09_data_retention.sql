@@ -0,0 +1,311 @@
+-- ============================================================================
+-- Houlihan Lokey FDD Automation - Data Retention
+-- ============================================================================
+-- Description: Scheduled enforcement of audit_retention_days,
+--              error_log_retention_days, dq_check_retention_days and
+--              output_retention_days, in bounded batches with optional
+--              archiving and a record of every run
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: RETENTION TABLES
+-- ============================================================================
+
+-- One row per table (or stage) per retention run
+CREATE TABLE IF NOT EXISTS retention_runs (
+    run_id VARCHAR(50) NOT NULL,
+    table_name VARCHAR(100) NOT NULL,  -- 'audit_log', 'load_errors', 'data_quality_checks', '@fdd_output_stage'
+
+    -- Settings
+    retention_days NUMBER,
+    cutoff_time TIMESTAMP_NTZ,  -- rows older than this were removed
+    archived BOOLEAN,
+
+    -- Timing
+    start_time TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    end_time TIMESTAMP_NTZ,
+
+    -- Results
+    batches NUMBER DEFAULT 0,
+    rows_archived NUMBER DEFAULT 0,
+    rows_deleted NUMBER DEFAULT 0,
+    status VARCHAR(20),  -- 'SUCCESS', 'PARTIAL' (batch limit reached), 'ERROR'
+    message VARCHAR(5000),
+
+    PRIMARY KEY (run_id, table_name)
+);
+
+-- Expired rows kept when retention_archive_enabled is true: one compact
+-- VARIANT row per source row, so a single table serves all sources
+CREATE TABLE IF NOT EXISTS retention_archive (
+    source_table VARCHAR(100) NOT NULL,
+    record_timestamp TIMESTAMP_NTZ,
+    deal_id VARCHAR(50),
+    record OBJECT,
+    run_id VARCHAR(50),
+    archived_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (source_table, TO_DATE(record_timestamp));
+
+-- ============================================================================
+-- PART 2: BATCHED PURGE
+-- ============================================================================
+
+-- Delete (and optionally archive) rows older than the table's retention
+-- setting, oldest first, retention_batch_rows rows per transaction and at
+-- most retention_max_batches batches per call; a run that stops at the limit
+-- is recorded as PARTIAL and the next run continues.
+-- audit_log and data_quality_checks are never purged past what the hourly
+-- rollups and the step performance collector may still re-read (their
+-- watermarks, less a day).
+CREATE OR REPLACE PROCEDURE purge_expired_rows(
+    table_name_param VARCHAR,
+    run_id_param VARCHAR DEFAULT NULL,
+    archive BOOLEAN DEFAULT NULL
+)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    run_id VARCHAR DEFAULT COALESCE(run_id_param, UUID_STRING());
+    table_name VARCHAR DEFAULT LOWER(table_name_param);
+    time_column VARCHAR;
+    retention_key VARCHAR;
+    retention_days NUMBER;
+    cutoff_time TIMESTAMP_NTZ;
+    archive_rows BOOLEAN DEFAULT COALESCE(archive, get_config_boolean('retention_archive_enabled'), FALSE);
+    batch_rows NUMBER DEFAULT COALESCE(get_config_number('retention_batch_rows'), 100000);
+    max_batches NUMBER DEFAULT COALESCE(get_config_number('retention_max_batches'), 100);
+    batch_end TIMESTAMP_NTZ;
+    batch_sql VARCHAR;
+    archive_sql VARCHAR;
+    delete_sql VARCHAR;
+    batches NUMBER DEFAULT 0;
+    rows_archived NUMBER DEFAULT 0;
+    rows_deleted NUMBER DEFAULT 0;
+    run_status VARCHAR DEFAULT 'SUCCESS';
+    run_message VARCHAR;
+    error_msg VARCHAR;
+BEGIN
+    -- Table and column names are spliced into the statements below
+    CASE (:table_name)
+        WHEN 'audit_log' THEN
+            time_column := 'log_timestamp';
+            retention_key := 'audit_retention_days';
+        WHEN 'load_errors' THEN
+            time_column := 'error_timestamp';
+            retention_key := 'error_log_retention_days';
+        WHEN 'data_quality_checks' THEN
+            time_column := 'check_timestamp';
+            retention_key := 'dq_check_retention_days';
+        ELSE
+            RETURN 'ERROR: No retention rule for table ' || :table_name_param;
+    END CASE;
+
+    retention_days := get_config_number(:retention_key);
+    IF (:retention_days IS NULL OR :retention_days < 1) THEN
+        RETURN 'ERROR: ' || :retention_key || ' must be at least 1';
+    END IF;
+
+    cutoff_time := DATEADD(day, -1 * :retention_days, CURRENT_TIMESTAMP())::TIMESTAMP_NTZ;
+
+    -- Keep rows the incremental rollups/collector can still look back to
+    IF (:table_name IN ('audit_log', 'data_quality_checks')) THEN
+        SELECT LEAST(:cutoff_time, COALESCE(MIN(DATEADD(day, -1, high_water_mark)), :cutoff_time))
+        INTO :cutoff_time
+        FROM rollup_watermarks
+        WHERE rollup_name IN (
+            IFF(:table_name = 'audit_log', 'audit_hourly_rollup', 'dq_hourly_rollup'),
+            IFF(:table_name = 'audit_log', 'step_performance', NULL)
+        );
+    END IF;
+
+    INSERT INTO retention_runs (run_id, table_name, retention_days, cutoff_time, archived, status)
+    VALUES (:run_id, :table_name, :retention_days, :cutoff_time, :archive_rows, 'RUNNING');
+
+    batch_sql := 'CREATE OR REPLACE TEMPORARY TABLE temp_retention_batch AS ' ||
+                 'SELECT MAX(' || :time_column || ') AS batch_end FROM (' ||
+                 'SELECT ' || :time_column || ' FROM ' || :table_name ||
+                 ' WHERE ' || :time_column || ' < ? ORDER BY ' || :time_column || ' LIMIT ' || :batch_rows || ')';
+    archive_sql := 'INSERT INTO retention_archive (source_table, record_timestamp, deal_id, record, run_id) ' ||
+                   'SELECT ''' || :table_name || ''', ' || :time_column || ', deal_id, OBJECT_CONSTRUCT(*), ? ' ||
+                   'FROM ' || :table_name || ' WHERE ' || :time_column || ' <= ?';
+    delete_sql := 'DELETE FROM ' || :table_name || ' WHERE ' || :time_column || ' <= ?';
+
+    LOOP
+        -- Upper bound of the oldest batch_rows expired rows
+        EXECUTE IMMEDIATE :batch_sql USING (cutoff_time);
+        SELECT batch_end INTO :batch_end FROM temp_retention_batch;
+
+        IF (:batch_end IS NULL) THEN
+            BREAK;
+        END IF;
+
+        IF (:batches >= :max_batches) THEN
+            run_status := 'PARTIAL';
+            BREAK;
+        END IF;
+
+        BEGIN TRANSACTION;
+
+        IF (:archive_rows) THEN
+            EXECUTE IMMEDIATE :archive_sql USING (run_id, batch_end);
+            rows_archived := :rows_archived + SQLROWCOUNT;
+        END IF;
+
+        EXECUTE IMMEDIATE :delete_sql USING (batch_end);
+        rows_deleted := :rows_deleted + SQLROWCOUNT;
+
+        COMMIT;
+
+        batches := :batches + 1;
+    END LOOP;
+
+    run_message := 'Deleted ' || :rows_deleted || ' rows older than ' || :cutoff_time || ' in ' || :batches || ' batches' ||
+                   IFF(:archive_rows, ' (' || :rows_archived || ' archived)', '') ||
+                   IFF(:run_status = 'PARTIAL', '; batch limit reached, the next run continues', '');
+
+    UPDATE retention_runs
+    SET end_time = CURRENT_TIMESTAMP(),
+        batches = :batches,
+        rows_archived = :rows_archived,
+        rows_deleted = :rows_deleted,
+        status = :run_status,
+        message = :run_message
+    WHERE run_id = :run_id AND table_name = :table_name;
+
+    RETURN :run_status || ': ' || :table_name || ': ' || :run_message;
+
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+
+        ROLLBACK;
+
+        UPDATE retention_runs
+        SET end_time = CURRENT_TIMESTAMP(),
+            batches = :batches,
+            rows_archived = :rows_archived,
+            rows_deleted = :rows_deleted,
+            status = 'ERROR',
+            message = :error_msg
+        WHERE run_id = :run_id AND table_name = :table_name;
+
+        RETURN 'ERROR: ' || :table_name || ': ' || :error_msg;
+END;
+$$;
+
+-- Apply every retention rule: the three operational tables, then expired
+-- files on the output stage (purge_stage_files)
+CREATE OR REPLACE PROCEDURE enforce_retention()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    run_id VARCHAR DEFAULT UUID_STRING();
+    step_result VARCHAR;
+    results VARCHAR DEFAULT '';
+    failures NUMBER DEFAULT 0;
+    rows_deleted NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    INSERT INTO audit_log (log_id, procedure_name, start_time, status)
+    VALUES (:log_id_var, 'enforce_retention', :start_time_var, 'STARTED');
+
+    CALL purge_expired_rows('audit_log', :run_id) INTO :step_result;
+    results := :results || :step_result || '; ';
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    CALL purge_expired_rows('load_errors', :run_id) INTO :step_result;
+    results := :results || :step_result || '; ';
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    CALL purge_expired_rows('data_quality_checks', :run_id) INTO :step_result;
+    results := :results || :step_result || '; ';
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    CALL purge_stage_files('fdd_output_stage') INTO :step_result;
+    INSERT INTO retention_runs (run_id, table_name, retention_days, end_time, status, message)
+    SELECT :run_id, '@fdd_output_stage', get_config_number('output_retention_days'), CURRENT_TIMESTAMP(),
+           IFF(STARTSWITH(:step_result, 'ERROR'), 'ERROR', 'SUCCESS'), :step_result;
+    results := :results || :step_result;
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    SELECT COALESCE(SUM(rows_deleted), 0) INTO :rows_deleted
+    FROM retention_runs
+    WHERE run_id = :run_id;
+
+    UPDATE audit_log
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = IFF(:failures > 0, 'WARNING', 'SUCCESS'),
+        rows_affected = :rows_deleted,
+        message = LEFT(:results || ' (run ' || :run_id || ')', 5000)
+    WHERE log_id = :log_id_var;
+
+    RETURN IFF(:failures > 0, 'WARNING', 'SUCCESS') || ': Deleted ' || :rows_deleted ||
+           ' expired rows (retention run ' || :run_id || ')';
+
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+
+        UPDATE audit_log
+        SET end_time = CURRENT_TIMESTAMP(),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Latest retention run per table
+CREATE OR REPLACE VIEW v_retention_status AS
+SELECT
+    table_name,
+    run_id,
+    start_time,
+    end_time,
+    retention_days,
+    cutoff_time,
+    archived,
+    batches,
+    rows_archived,
+    rows_deleted,
+    status,
+    message
+FROM retention_runs
+QUALIFY ROW_NUMBER() OVER (PARTITION BY table_name ORDER BY start_time DESC) = 1;
+
+-- ============================================================================
+-- PART 3: SCHEDULED RETENTION
+-- ============================================================================
+
+-- Serverless task, daily outside business hours
+CREATE OR REPLACE TASK enforce_retention_task
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = 'XSMALL'
+    SCHEDULE = 'USING CRON 0 3 * * * UTC'
+    COMMENT = 'Delete rows and output files older than the retention settings in system_config'
+AS
+    CALL enforce_retention();
+
+ALTER TASK enforce_retention_task RESUME;
+
+-- ============================================================================
+-- PART 4: GRANTS
+-- ============================================================================
+
+GRANT SELECT ON TABLE retention_runs TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE retention_archive TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_retention_status TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_retention_status TO ROLE FDD_READONLY_ROLE;
+GRANT USAGE ON PROCEDURE enforce_retention() TO ROLE FDD_SERVICE_ROLE;
+
+SELECT 'Data retention created successfully' AS status;
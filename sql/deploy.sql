@@ -119,8 +119,20 @@ SELECT 'Step 1: Environment created - ' || $DATABASE_NAME || '.' || $SCHEMA_NAME
 -- Execute AI and export procedures
 !source 05_ai_and_export.sql
 
+-- Execute operational rollups
+!source 06_operational_rollups.sql
+
+-- Execute portfolio run tracking
+!source 07_portfolio_runs.sql
+
+-- Execute execution tracing
+!source 08_execution_tracing.sql
+
+-- Execute data retention
+!source 09_data_retention.sql
+
 -- Execute testing framework (optional)
--- !source 06_testing.sql
+-- !source 08_testing.sql
 
 SELECT 'Step 2: All SQL modules executed successfully' AS status;
 
@@ -135,28 +135,55 @@ FROM VALUES
     ('min_variance_amount', '5000.00', 'Minimum dollar amount to trigger variance analysis', 0),
     ('variance_threshold_pct', '0.20', 'Minimum percentage change to flag as variance (0.20 = 20%)', 0),
     ('max_error_rate_pct', '0.05', 'Maximum acceptable error rate for data loads (0.05 = 5%)', 0),
+    ('dq_outlier_zscore', '4', 'Account Outliers rule: standard deviations from the account mean that flag an amount', 0),
     
     -- AI Configuration
     ('max_ai_insights', '15', 'Maximum number of AI insights to generate per deal', 0),
     ('ai_model_variance', '"claude-4-sonnet"', 'AI model for variance analysis', 0),
     ('ai_model_trends', '"claude-4-sonnet"', 'AI model for trend analysis', 0),
     ('ai_batch_size', '50', 'Number of variance records to process in single AI batch', 0),
+    ('ai_cache_max_age_days', '90', 'Evict cached Cortex completions not used for this many days', 0),
+    ('ai_cache_max_entries', '50000', 'Maximum cached Cortex completions kept (least recently used evicted first)', 0),
+    ('ai_estimated_cost_per_call_usd', '0.03', 'Estimated Cortex cost per completion, used by the threshold impact preview', 0),
+    ('ai_model_low_severity', '"mistral-large2"', 'AI model for low-severity variances (cheaper, faster bulk model)', 0),
+    ('ai_deal_daily_token_budget', '200000', 'Cortex tokens one deal may use per day; low-severity prompts are skipped first', 0),
+    ('ai_daily_token_budget', '2000000', 'Cortex tokens all deals together may use per day', 0),
+    ('ai_estimated_completion_tokens', '150', 'Completion tokens assumed per Cortex call when checking the token budgets', 0),
+    ('ai_cost_per_million_tokens_usd', '{"claude-4-sonnet": 3.30, "claude-3-5-sonnet": 3.30, "mistral-large2": 2.00, "mistral-large": 2.00, "llama3.1-70b": 1.20, "default": 2.00}', 'Estimated Cortex cost per million tokens by model (default applies to unlisted models)', 0),
+    ('variance_index_pct_step', '0.05', 'Variance % grid step of variance_distribution_index (0.05 = 5%)', 0),
+    ('variance_index_amount_step', '1000', 'Prior amount grid step of variance_distribution_index (dollars)', 0),
     
     -- Performance & Scaling
     ('warehouse_size_default', '"SMALL"', 'Default warehouse size for processing', 0),
     ('warehouse_auto_suspend', '60', 'Auto-suspend timeout in seconds', 0),
     ('max_pivot_periods', '24', 'Maximum number of periods in pivoted views', 0),
+    ('schedule_template_name', '"STANDARD"', 'schedule_templates template used by build_schedules', 0),
     ('query_timeout_seconds', '3600', 'Maximum query execution time (1 hour)', 0),
+    ('portfolio_max_concurrency', '4', 'Deals processed in parallel by fdd_tools.portfolio (one session each)', 0),
+    ('portfolio_max_retries', '1', 'Retries per deal after a failed generate_fdd_schedules call in a portfolio run', 0),
     
     -- File Management
     ('input_stage_name', '"fdd_input_stage"', 'Name of input file stage', 0),
     ('output_stage_name', '"fdd_output_stage"', 'Name of output file stage', 0),
     ('default_file_format', '"csv_format"', 'Default file format for imports/exports', 0),
+    ('export_xlsx_workbook', 'true', 'generate_fdd_schedules also writes the multi-sheet fdd_workbook_<deal>.xlsx', 0),
+    ('export_mode', '"SINGLE"', 'SINGLE = one CSV per output; PARTITIONED = concurrent multi-file unloads under exports/<deal>/ with manifest.json', 0),
+    ('export_file_format', '"CSV_GZIP"', 'File format of PARTITIONED exports: CSV_GZIP or PARQUET', 0),
+    ('export_max_file_size_mb', '64', 'Maximum size of one PARTITIONED export file (MB)', 0),
+    ('columnar_file_format', '"parquet_format"', 'File format for Parquet files produced by fdd_tools.ingest', 0),
     
     -- Audit & Retention
     ('audit_retention_days', '90', 'Number of days to retain audit logs', 0),
     ('error_log_retention_days', '180', 'Number of days to retain error logs', 0),
+    ('dq_check_retention_days', '90', 'Number of days to retain data quality check results', 0),
     ('output_retention_days', '30', 'Number of days to retain output files in stage', 0),
+    ('stage_purge_files_per_remove', '200', 'Files matched by each regex-pattern REMOVE in purge_stage_files', 0),
+    ('retention_batch_rows', '100000', 'Rows deleted per transaction by purge_expired_rows', 0),
+    ('retention_max_batches', '100', 'Batches per table per retention run; the next run continues', 0),
+    ('retention_archive_enabled', 'false', 'Copy expired rows to retention_archive before deleting them', 0),
+    ('rollup_lag_minutes', '5', 'Minutes behind current time that operational rollups stop, so in-flight rows are not skipped', 0),
+    ('query_history_latency_minutes', '45', 'Minutes ACCOUNT_USAGE query history may lag; collect_step_performance waits this long', 0),
+    ('step_credits_backfill_hours', '24', 'Hours collect_step_performance keeps re-collecting steps whose attributed credits are still missing', 0),
     
     -- Security
     ('deal_id_validation_regex', '"^[A-Z0-9_-]+$"', 'Regex pattern for validating deal_id format', 0),
@@ -207,6 +234,18 @@ $$
     SELECT config_value::BOOLEAN FROM system_config WHERE config_key = key_name
 $$;
 
+-- Versioned snapshot of the whole configuration as one typed OBJECT (numbers stay
+-- numbers, booleans stay booleans). Procedures resolve it once per run and bind
+-- the values, instead of calling get_config_* inside row-level predicates.
+-- config_version changes whenever any key or value changes; it is stamped on
+-- audit_log rows, ai_insights, export_files and export manifests.
+CREATE OR REPLACE VIEW v_config_snapshot AS
+SELECT 
+    HASH_AGG(config_key, config_value) AS config_version,
+    OBJECT_AGG(config_key, IFF(is_sensitive, NULL, config_value))::OBJECT AS config_values,
+    MAX(last_updated) AS last_updated
+FROM system_config;
+
 -- Procedure to update config value
 CREATE OR REPLACE PROCEDURE update_config(
     key_name VARCHAR,
@@ -217,6 +256,8 @@ RETURNS VARCHAR
 LANGUAGE SQL
 AS
 $$
+DECLARE
+    new_version NUMBER;
 BEGIN
     UPDATE system_config
     SET config_value = :new_value,
@@ -228,13 +269,16 @@ BEGIN
         RETURN 'ERROR: Configuration key "' || :key_name || '" not found';
     END IF;
     
+    SELECT config_version INTO :new_version FROM v_config_snapshot;
+    
     -- Log the change
-    INSERT INTO audit_log (procedure_name, deal_id, status, rows_affected, message)
+    INSERT INTO audit_log (procedure_name, deal_id, status, rows_affected, message, config_version)
     VALUES ('update_config', NULL, 'SUCCESS', 1, 
             'Updated config: ' || :key_name || ' = ' || :new_value::VARCHAR || 
-            CASE WHEN :change_description IS NOT NULL THEN ' (' || :change_description || ')' ELSE '' END);
+            CASE WHEN :change_description IS NOT NULL THEN ' (' || :change_description || ')' ELSE '' END,
+            :new_version);
     
-    RETURN 'SUCCESS: Updated configuration ' || :key_name;
+    RETURN 'SUCCESS: Updated configuration ' || :key_name || ' (config version ' || :new_version || ')';
 END;
 $$;
 
@@ -322,6 +366,9 @@ CREATE TABLE IF NOT EXISTS account_mappings (
     sort_order_l3 NUMBER,
     sort_order_l4 NUMBER,
     
+    -- Display sign convention (classify_display_sign), set by load_account_mappings
+    display_sign_rule VARCHAR(20),  -- 'NEGATE', 'AS_IS', 'ABS'
+    
     -- Metadata
     is_active BOOLEAN DEFAULT TRUE,
     created_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
@@ -333,6 +380,9 @@ CREATE TABLE IF NOT EXISTS account_mappings (
 -- Add clustering
 ALTER TABLE account_mappings CLUSTER BY (deal_id, account_number);
 
+-- Add display_sign_rule to existing deployments (backfilled by refresh_schedule_trial_balance)
+ALTER TABLE account_mappings ADD COLUMN IF NOT EXISTS display_sign_rule VARCHAR(20);
+
 -- Note: is_active column already exists in table definition (line 323)
 
 -- AI Insights Storage
@@ -373,6 +423,66 @@ CREATE TABLE IF NOT EXISTS ai_insights (
     reviewed_timestamp TIMESTAMP_NTZ
 );
 
+-- v_config_snapshot version the insight was generated under
+ALTER TABLE ai_insights ADD COLUMN IF NOT EXISTS config_version NUMBER;
+
+-- Cortex completion cache, keyed by SHA2(model || '|' || prompt)
+-- Lets generate_ai_insights reuse answers for unchanged prompts across runs
+CREATE TABLE IF NOT EXISTS ai_completion_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    model_name VARCHAR(100) NOT NULL,
+    prompt_text VARCHAR(16000),
+    completion_text VARCHAR(16000),
+    
+    -- Usage tracking (drives eviction)
+    created_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    last_used_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    hit_count NUMBER DEFAULT 0
+);
+
+-- Token counts returned by Cortex for the call that produced the completion
+ALTER TABLE ai_completion_cache ADD COLUMN IF NOT EXISTS prompt_tokens NUMBER;
+ALTER TABLE ai_completion_cache ADD COLUMN IF NOT EXISTS completion_tokens NUMBER;
+
+-- Cortex token ledger: one row per COMPLETE call made by generate_ai_insights
+-- (cache hits are free and not recorded). Drives the daily token budgets.
+CREATE TABLE IF NOT EXISTS ai_token_usage (
+    usage_id VARCHAR(50) DEFAULT UUID_STRING() PRIMARY KEY,
+    call_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    call_date DATE DEFAULT CURRENT_DATE(),
+    deal_id VARCHAR(50) NOT NULL,
+    user_name VARCHAR(100) DEFAULT CURRENT_USER(),
+    
+    -- Call
+    model_name VARCHAR(100) NOT NULL,
+    insight_type VARCHAR(50),  -- 'variance', 'trend_analysis'
+    severity VARCHAR(20),
+    cache_key VARCHAR(64),
+    
+    -- Usage
+    prompt_tokens NUMBER,
+    completion_tokens NUMBER,
+    total_tokens NUMBER,
+    estimated_cost_usd NUMBER(10,4)
+);
+
+ALTER TABLE ai_token_usage CLUSTER BY (call_date, deal_id);
+
+-- Cumulative variance counts on a (variance %, prior amount) grid per deal.
+-- variance_count = candidates with variance_ratio > min_variance_pct AND
+-- prior_abs_amount > min_prior_amount, i.e. what generate_ai_insights would
+-- select at those thresholds before max_ai_insights applies.
+CREATE TABLE IF NOT EXISTS variance_distribution_index (
+    deal_id VARCHAR(50) NOT NULL,
+    min_variance_pct NUMBER(6,4) NOT NULL,   -- variance_threshold_pct grid edge (0.05 = 5%)
+    min_prior_amount NUMBER(18,2) NOT NULL,  -- min_variance_amount grid edge
+    cell_count NUMBER DEFAULT 0,             -- candidates between this edge and the next
+    variance_count NUMBER DEFAULT 0,         -- candidates above both edges
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, min_variance_pct, min_prior_amount)
+);
+
 -- ============================================================================
 -- OPERATIONAL TABLES
 -- ============================================================================
@@ -401,13 +511,19 @@ CREATE TABLE IF NOT EXISTS audit_log (
     error_message VARCHAR(5000),
     message VARCHAR(5000),
     
-    -- Query tracking
-    query_id VARCHAR(100) DEFAULT LAST_QUERY_ID(),
+    -- Query tracking (CALL that started a traced run; filled by collect_step_performance)
+    query_id VARCHAR(100),
     
     -- Cost tracking
     credits_used NUMBER(18,6)
 );
 
+-- LAST_QUERY_ID() at insert time was the statement before the audit row, not the run
+ALTER TABLE audit_log ALTER COLUMN query_id DROP DEFAULT;
+
+-- v_config_snapshot version the run resolved its settings from
+ALTER TABLE audit_log ADD COLUMN IF NOT EXISTS config_version NUMBER;
+
 -- Note: Indexes on standard tables are not supported in Snowflake
 -- Snowflake uses automatic micro-partitioning and clustering keys instead
 -- Use ALTER TABLE ... CLUSTER BY for performance optimization if needed
@@ -435,6 +551,31 @@ CREATE TABLE IF NOT EXISTS load_errors (
     resolution_notes VARCHAR(5000)
 );
 
+-- Trial balance load history (one row per load_trial_balance call)
+CREATE TABLE IF NOT EXISTS trial_balance_load_history (
+    load_id VARCHAR(50) PRIMARY KEY,  -- audit_log.log_id of the load
+    load_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    deal_id VARCHAR(50),
+    file_name VARCHAR(500),
+    load_mode VARCHAR(10),  -- 'FULL', 'DELTA'
+    
+    -- Row outcomes
+    rows_staged NUMBER,
+    rows_inserted NUMBER,
+    rows_updated NUMBER,
+    rows_unchanged NUMBER,
+    
+    -- Validation scope and results
+    periods_validated NUMBER,
+    errors_found NUMBER,
+    unbalanced_periods NUMBER,
+    loaded_by VARCHAR(100) DEFAULT CURRENT_USER()
+);
+
+-- Periods a DELTA load inserted or updated (NULL = FULL load, every period);
+-- validate_data_quality re-checks only these
+ALTER TABLE trial_balance_load_history ADD COLUMN IF NOT EXISTS changed_periods ARRAY;
+
 -- Data Quality Validation Results
 CREATE TABLE IF NOT EXISTS data_quality_checks (
     check_id VARCHAR(50) DEFAULT UUID_STRING() PRIMARY KEY,
@@ -517,67 +658,108 @@ CREATE OR REPLACE FILE FORMAT csv_format
     COMPRESSION = 'AUTO'
     COMMENT = 'Standard CSV format for FDD data files';
 
+-- Parquet format for columnar files produced by fdd_tools.ingest
+CREATE OR REPLACE FILE FORMAT parquet_format
+    TYPE = 'PARQUET'
+    COMPRESSION = 'AUTO'
+    COMMENT = 'Columnar trial balance parts written by the streaming ingestion client';
+
+-- ============================================================================
+-- SIGN CONVENTION LAYER
+-- ============================================================================
+
+-- Display sign rule for one account, evaluated once per mapping row:
+--   NEGATE = revenue, flipped to positive
+--   AS_IS  = contra-asset (accumulated depreciation, allowance, reserve), kept negative
+--   ABS    = everything else (expenses, assets, liabilities, equity), shown positive
+CREATE OR REPLACE FUNCTION classify_display_sign(
+    statement_type VARCHAR,
+    mapping_level_1 VARCHAR,
+    account_name VARCHAR
+)
+RETURNS VARCHAR
+AS
+$$
+    CASE 
+        WHEN statement_type = 'IS' AND mapping_level_1 = 'Revenue' THEN 'NEGATE'
+        WHEN statement_type = 'BS' AND mapping_level_1 = 'Assets'
+             AND (account_name ILIKE '%accumulated depreciation%'
+                  OR account_name ILIKE '%allowance%'
+                  OR account_name ILIKE '%reserve%') THEN 'AS_IS'
+        ELSE 'ABS'
+    END
+$$;
+
+-- Schedule-ready trial balance: trial_balance_raw joined to the active mappings
+-- with display signs applied. Maintained by refresh_schedule_trial_balance,
+-- which load_trial_balance and load_account_mappings call inside their
+-- transactions (DELTA loads rebuild only the changed periods).
+CREATE TABLE IF NOT EXISTS trial_balance_for_schedules (
+    deal_id VARCHAR(50) NOT NULL,
+    deal_name VARCHAR(200),
+    entity VARCHAR(100),
+    period_date DATE NOT NULL,
+    account_number VARCHAR(50) NOT NULL,
+    account_name VARCHAR(500),
+    unique_id VARCHAR(600),
+    debit_amount NUMBER(18,2),
+    credit_amount NUMBER(18,2),
+    net_amount_raw NUMBER(18,2),
+    amount_for_display NUMBER(18,2),
+    display_sign_rule VARCHAR(20),
+    
+    -- Mapping info
+    account_category VARCHAR(50),
+    statement_type VARCHAR(20),
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    mapping_level_3 VARCHAR(200),
+    sort_order_l1 NUMBER,
+    sort_order_l2 NUMBER,
+    sort_order_l3 NUMBER,
+    upload_timestamp TIMESTAMP_NTZ,
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+ALTER TABLE trial_balance_for_schedules CLUSTER BY (deal_id, period_date);
+
+-- Data version per deal, bumped whenever refresh_schedule_trial_balance
+-- rewrites the deal's schedule-ready rows (cache key for schedule_values)
+CREATE TABLE IF NOT EXISTS deal_data_versions (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    data_version NUMBER NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
 -- ============================================================================
 -- VIEWS - Presentation Layer
 -- ============================================================================
 
--- Presentation layer: Convert accounting signs to display signs
+-- Presentation layer: display-signed trial balance (kept for existing queries;
+-- reads the materialized trial_balance_for_schedules table)
 CREATE OR REPLACE VIEW v_trial_balance_for_schedules AS
 SELECT 
-    t.deal_id,
-    t.deal_name,
-    t.entity,
-    t.period_date,
-    t.account_number,
-    t.account_name,
-    t.unique_id,
-    t.debit_amount,
-    t.credit_amount,
-    t.net_amount AS net_amount_raw,
-    
-    -- Calculate display amount based on account type
-    CASE 
-        -- Income Statement Accounts
-        WHEN m.statement_type = 'IS' AND m.mapping_level_1 = 'Revenue' 
-            THEN t.net_amount * -1  -- Flip revenue to positive
-        WHEN m.statement_type = 'IS' AND m.mapping_level_1 IN ('Cost of Goods Sold', 'Operating Expenses') 
-            THEN ABS(t.net_amount)  -- Expenses as positive
-        
-        -- Balance Sheet - Contra-Asset Accounts (shown as negative)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Assets' 
-             AND (t.account_name ILIKE '%accumulated depreciation%' 
-                  OR t.account_name ILIKE '%allowance%'
-                  OR t.account_name ILIKE '%reserve%') 
-            THEN t.net_amount  -- Keep negative (contra-asset)
-        
-        -- Balance Sheet - Regular Asset Accounts (positive)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Assets' 
-            THEN ABS(t.net_amount)
-        
-        -- Balance Sheet - Liabilities and Equity (all positive)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Liabilities' 
-            THEN ABS(t.net_amount)
-        WHEN m.statement_type = 'BS' AND m.mapping_level_1 = 'Equity' 
-            THEN ABS(t.net_amount)
-        
-        -- Default: Absolute value
-        ELSE ABS(t.net_amount)
-    END AS amount_for_display,
-    
-    -- Include mapping info
-    m.account_category,
-    m.statement_type,
-    m.mapping_level_1,
-    m.mapping_level_2,
-    m.mapping_level_3,
-    m.sort_order_l1,
-    m.sort_order_l2,
-    m.sort_order_l3,
-    t.upload_timestamp
-FROM trial_balance_raw t
-LEFT JOIN account_mappings m 
-    ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-WHERE m.is_active = TRUE;
+    deal_id,
+    deal_name,
+    entity,
+    period_date,
+    account_number,
+    account_name,
+    unique_id,
+    debit_amount,
+    credit_amount,
+    net_amount_raw,
+    amount_for_display,
+    account_category,
+    statement_type,
+    mapping_level_1,
+    mapping_level_2,
+    mapping_level_3,
+    sort_order_l1,
+    sort_order_l2,
+    sort_order_l3,
+    upload_timestamp
+FROM trial_balance_for_schedules;
 
 -- Portfolio summary view
 CREATE OR REPLACE VIEW v_portfolio_summary AS
@@ -595,6 +777,43 @@ FROM trial_balance_raw t
 GROUP BY t.deal_id, t.deal_name
 ORDER BY last_updated DESC;
 
+-- Month-over-month variance candidates (same account and entity, prior month).
+-- Shared by generate_ai_insights and refresh_variance_index so the threshold
+-- preview counts exactly what the insight generator would select.
+CREATE OR REPLACE VIEW v_variance_candidates AS
+SELECT 
+    t1.deal_id,
+    t1.entity,
+    t1.period_date,
+    t1.account_number,
+    t1.account_name,
+    t1.net_amount,
+    t2.net_amount AS prior_net_amount,
+    t2.period_date AS prior_period_date,
+    ABS(t2.net_amount) AS prior_abs_amount,
+    ABS((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0)) AS variance_ratio,
+    ROUND((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0) * 100, 2) AS var_pct
+FROM trial_balance_raw t1
+JOIN trial_balance_raw t2
+    ON t1.deal_id = t2.deal_id
+    AND t1.account_number = t2.account_number
+    AND t1.entity = t2.entity
+    AND t2.period_date = DATEADD(month, -1, t1.period_date);
+
+-- Cortex tokens and estimated cost per deal, model and day
+CREATE OR REPLACE VIEW v_ai_cost_by_deal_model AS
+SELECT 
+    call_date,
+    deal_id,
+    model_name,
+    COUNT(*) AS cortex_calls,
+    SUM(prompt_tokens) AS prompt_tokens,
+    SUM(completion_tokens) AS completion_tokens,
+    SUM(total_tokens) AS total_tokens,
+    SUM(estimated_cost_usd) AS estimated_cost_usd
+FROM ai_token_usage
+GROUP BY call_date, deal_id, model_name;
+
 SELECT 'Core schema created successfully' AS status;
 
 
@@ -652,10 +871,16 @@ GRANT USAGE ON SCHEMA TRIAL_BALANCE TO ROLE FDD_ANALYST_ROLE;
 -- Table access for analysts
 GRANT SELECT, INSERT, UPDATE ON TABLE trial_balance_raw TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT, INSERT, UPDATE ON TABLE account_mappings TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT, DELETE ON TABLE trial_balance_for_schedules TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT, UPDATE ON TABLE deal_data_versions TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE ai_insights TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE ai_completion_cache TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE ai_token_usage TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE variance_distribution_index TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE audit_log TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE data_quality_checks TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT, INSERT ON TABLE load_errors TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT ON TABLE trial_balance_load_history TO ROLE FDD_ANALYST_ROLE;
 GRANT SELECT ON TABLE system_config TO ROLE FDD_ANALYST_ROLE;
 
 -- View access
@@ -750,16 +975,37 @@ CREATE OR REPLACE MASKING POLICY mask_financial_amounts AS (val NUMBER) RETURNS
 -- PART 5: INPUT VALIDATION FUNCTIONS
 -- ============================================================================
 
--- Function to validate deal_id format (prevent SQL injection)
+-- Function to validate deal_id format (prevent SQL injection) against a
+-- config snapshot the caller already resolved from v_config_snapshot
+CREATE OR REPLACE FUNCTION validate_deal_id(deal_id_input VARCHAR, config_values OBJECT)
+RETURNS BOOLEAN
+LANGUAGE SQL
+AS
+$$
+    deal_id_input IS NOT NULL 
+    AND LENGTH(deal_id_input) <= config_values:max_deal_id_length::NUMBER
+    AND REGEXP_LIKE(deal_id_input, config_values:deal_id_validation_regex::VARCHAR)
+$$;
+
+-- Function to validate deal_id format (one v_config_snapshot read per call)
 CREATE OR REPLACE FUNCTION validate_deal_id(deal_id_input VARCHAR)
 RETURNS BOOLEAN
 LANGUAGE SQL
 AS
 $$
-    SELECT 
-        deal_id_input IS NOT NULL 
-        AND LENGTH(deal_id_input) <= get_config_number('max_deal_id_length')
-        AND REGEXP_LIKE(deal_id_input, get_config_string('deal_id_validation_regex'))
+    SELECT validate_deal_id(deal_id_input, config_values) FROM v_config_snapshot
+$$;
+
+-- Function to sanitize deal_id against a resolved config snapshot
+CREATE OR REPLACE FUNCTION sanitize_deal_id(deal_id_input VARCHAR, config_values OBJECT)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+    CASE 
+        WHEN validate_deal_id(deal_id_input, config_values) THEN UPPER(TRIM(deal_id_input))
+        ELSE NULL
+    END
 $$;
 
 -- Function to sanitize deal_id
@@ -768,11 +1014,7 @@ RETURNS VARCHAR
 LANGUAGE SQL
 AS
 $$
-    SELECT 
-        CASE 
-            WHEN validate_deal_id(deal_id_input) THEN UPPER(TRIM(deal_id_input))
-            ELSE NULL
-        END
+    SELECT sanitize_deal_id(deal_id_input, config_values) FROM v_config_snapshot
 $$;
 
 -- ============================================================================
@@ -928,7 +1170,96 @@ SELECT 'Security configuration completed' AS status;
 -- PART 1: DATA LOADING PROCEDURES
 -- ============================================================================
 
--- Procedure: Load Trial Balance with comprehensive error handling
+-- Procedure: Refresh the materialized schedule-ready trial balance
+-- Rebuilds trial_balance_for_schedules for one deal (or all deals), optionally
+-- limited to an array of period dates. Runs inside the caller's transaction
+-- (no BEGIN/COMMIT here) so the table commits or rolls back with the load that
+-- changed trial_balance_raw or account_mappings; errors propagate to the caller.
+CREATE OR REPLACE PROCEDURE refresh_schedule_trial_balance(
+    deal_id_param VARCHAR DEFAULT NULL,
+    periods_param ARRAY DEFAULT NULL
+)
+RETURNS VARCHAR
+LANGUAGE SQL
+EXECUTE AS CALLER
+AS
+$$
+DECLARE
+    rows_deleted NUMBER DEFAULT 0;
+    rows_inserted NUMBER DEFAULT 0;
+BEGIN
+    -- Mappings inserted outside load_account_mappings have no rule yet
+    UPDATE account_mappings
+    SET display_sign_rule = classify_display_sign(statement_type, mapping_level_1, account_name)
+    WHERE display_sign_rule IS NULL
+    AND (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    DELETE FROM trial_balance_for_schedules
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param)
+    AND (:periods_param IS NULL OR period_date IN (
+        SELECT value::DATE FROM TABLE(FLATTEN(INPUT => :periods_param))
+    ));
+    
+    rows_deleted := SQLROWCOUNT;
+    
+    INSERT INTO trial_balance_for_schedules (
+        deal_id, deal_name, entity, period_date, account_number, account_name, unique_id,
+        debit_amount, credit_amount, net_amount_raw, amount_for_display, display_sign_rule,
+        account_category, statement_type, mapping_level_1, mapping_level_2, mapping_level_3,
+        sort_order_l1, sort_order_l2, sort_order_l3, upload_timestamp
+    )
+    SELECT 
+        t.deal_id,
+        t.deal_name,
+        t.entity,
+        t.period_date,
+        t.account_number,
+        t.account_name,
+        t.unique_id,
+        t.debit_amount,
+        t.credit_amount,
+        t.net_amount,
+        CASE m.display_sign_rule
+            WHEN 'NEGATE' THEN t.net_amount * -1  -- Revenue shown positive
+            WHEN 'AS_IS' THEN t.net_amount        -- Contra-assets stay negative
+            ELSE ABS(t.net_amount)
+        END,
+        m.display_sign_rule,
+        m.account_category,
+        m.statement_type,
+        m.mapping_level_1,
+        m.mapping_level_2,
+        m.mapping_level_3,
+        m.sort_order_l1,
+        m.sort_order_l2,
+        m.sort_order_l3,
+        t.upload_timestamp
+    FROM trial_balance_raw t
+    JOIN account_mappings m 
+        ON t.deal_id = m.deal_id AND t.account_number = m.account_number
+    WHERE m.is_active = TRUE
+    AND (:deal_id_param IS NULL OR t.deal_id = :deal_id_param)
+    AND (:periods_param IS NULL OR t.period_date IN (
+        SELECT value::DATE FROM TABLE(FLATTEN(INPUT => :periods_param))
+    ));
+    
+    rows_inserted := SQLROWCOUNT;
+    
+    -- New data version for every deal touched (invalidates cached schedule_values)
+    MERGE INTO deal_data_versions v
+    USING (
+        SELECT :deal_id_param AS deal_id WHERE :deal_id_param IS NOT NULL
+        UNION
+        SELECT DISTINCT deal_id FROM trial_balance_raw WHERE :deal_id_param IS NULL
+    ) d
+    ON v.deal_id = d.deal_id
+    WHEN MATCHED THEN UPDATE SET data_version = v.data_version + 1, changed_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (deal_id, data_version) VALUES (d.deal_id, 1);
+    
+    RETURN 'SUCCESS: ' || :rows_inserted || ' schedule rows written, ' || :rows_deleted || ' replaced';
+END;
+$$;
+
 -- Drop all possible existing versions to avoid overload errors
 -- Note: Must match exact signature including DEFAULT parameters
 EXECUTE IMMEDIATE $$
@@ -936,6 +1267,7 @@ BEGIN
     DROP PROCEDURE IF EXISTS load_trial_balance();
     DROP PROCEDURE IF EXISTS load_trial_balance(VARCHAR);
     DROP PROCEDURE IF EXISTS load_trial_balance(VARCHAR, VARCHAR);
+    DROP PROCEDURE IF EXISTS load_trial_balance(VARCHAR, VARCHAR, VARCHAR);
 EXCEPTION
     WHEN OTHER THEN
         -- Ignore errors if procedure doesn't exist
@@ -943,9 +1275,16 @@ EXCEPTION
 END;
 $$;
 
+-- Procedure: Load Trial Balance with comprehensive error handling
+-- load_mode:
+--   'FULL'  - replace all data (or all data for deal_id_filter), then COPY
+--   'DELTA' - stage the file, then MERGE on (deal_id, account_number, period_date, entity);
+--             only new or changed rows are written and only their periods are re-validated.
+--             Rows absent from the file are kept.
 CREATE OR REPLACE PROCEDURE load_trial_balance(
     file_name VARCHAR DEFAULT '01_sample_trial_balance_24mo.csv',
-    deal_id_filter VARCHAR DEFAULT NULL
+    deal_id_filter VARCHAR DEFAULT NULL,
+    load_mode VARCHAR DEFAULT 'FULL'
 )
 RETURNS TABLE(status VARCHAR, rows_loaded NUMBER, errors_found NUMBER, message VARCHAR)
 LANGUAGE SQL
@@ -955,54 +1294,130 @@ $$
 DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    load_mode_var VARCHAR;
     rows_loaded NUMBER DEFAULT 0;
     error_count NUMBER DEFAULT 0;
     unbalanced_count NUMBER DEFAULT 0;
     max_imbalance NUMBER DEFAULT 0;
+    rows_inserted NUMBER DEFAULT 0;
+    rows_updated NUMBER DEFAULT 0;
+    rows_unchanged NUMBER DEFAULT 0;
+    duplicate_keys NUMBER DEFAULT 0;
+    affected_periods NUMBER DEFAULT 0;
+    changed_periods ARRAY;
+    config_version_var NUMBER;
+    input_stage VARCHAR;
+    default_format VARCHAR;
+    columnar_format VARCHAR;
+    max_error_rate FLOAT;
+    balance_tolerance FLOAT;
     stage_path VARCHAR;
+    target_table VARCHAR;
+    column_list VARCHAR;
+    copy_options VARCHAR;
     result_cursor RESULTSET;
     error_msg VARCHAR;
 BEGIN
+    load_mode_var := UPPER(COALESCE(:load_mode, 'FULL'));
+    
+    -- Settings for the whole run, resolved once and bound below
+    SELECT 
+        config_version,
+        config_values:input_stage_name::VARCHAR,
+        config_values:default_file_format::VARCHAR,
+        config_values:columnar_file_format::VARCHAR,
+        config_values:max_error_rate_pct::FLOAT,
+        config_values:balance_tolerance_dollars::FLOAT
+    INTO :config_version_var, :input_stage, :default_format, :columnar_format, :max_error_rate, :balance_tolerance
+    FROM v_config_snapshot;
+    
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message)
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message, config_version)
     VALUES (:log_id_var, 'load_trial_balance', :deal_id_filter, :start_time_var, 'STARTED', 
-            'Loading from file: ' || :file_name);
+            'Loading from file: ' || :file_name || ' (' || :load_mode_var || ')', :config_version_var);
+    
+    IF (:load_mode_var NOT IN ('FULL', 'DELTA')) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'ERROR',
+            error_message = 'Invalid load_mode: ' || :load_mode_var
+        WHERE log_id = :log_id_var;
+        
+        result_cursor := (
+            SELECT 'ERROR' AS status, 0 AS rows_loaded, 0 AS errors_found,
+                   'Invalid load_mode ''' || :load_mode_var || '''. Use FULL or DELTA.' AS message
+        );
+        RETURN TABLE(result_cursor);
+    END IF;
     
     -- Construct stage path
-    stage_path := '@' || get_config_string('input_stage_name') || '/' || :file_name;
+    stage_path := '@' || :input_stage || '/' || :file_name;
+    
+    -- Parquet parts written by fdd_tools.ingest are loaded by column name;
+    -- a trailing '/' loads every part under that stage prefix
+    IF (:file_name ILIKE '%.parquet' OR RIGHT(:file_name, 1) = '/') THEN
+        column_list := '';
+        copy_options := 'FILE_FORMAT = (FORMAT_NAME = ''' || :columnar_format || ''') ' ||
+                        'MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE ' ||
+                        IFF(RIGHT(:file_name, 1) = '/', 'PATTERN = ''.*[.]parquet'' ', '');
+    ELSE
+        column_list := '(deal_id, deal_name, entity, period_date, account_number, account_name, ' ||
+                       'debit_amount, credit_amount, net_amount) ';
+        copy_options := 'FILE_FORMAT = (FORMAT_NAME = ''' || :default_format || ''') ';
+    END IF;
+    
+    -- DELTA loads land in a session staging table first (DDL must precede the transaction)
+    IF (:load_mode_var = 'DELTA') THEN
+        CREATE OR REPLACE TEMPORARY TABLE temp_tb_delta LIKE trial_balance_raw;
+        ALTER TABLE temp_tb_delta ADD COLUMN change_type VARCHAR(10);
+        target_table := 'temp_tb_delta';
+    ELSE
+        target_table := 'trial_balance_raw';
+    END IF;
     
     BEGIN TRANSACTION;
     
-    -- Option 1: Full reload (if no deal_id_filter provided)
-    IF (:deal_id_filter IS NULL) THEN
-        TRUNCATE TABLE trial_balance_raw;
-    ELSE
-        -- Option 2: Selective reload for specific deal
-        DELETE FROM trial_balance_raw WHERE deal_id = :deal_id_filter;
+    IF (:load_mode_var = 'FULL') THEN
+        -- Option 1: Full reload (if no deal_id_filter provided)
+        IF (:deal_id_filter IS NULL) THEN
+            TRUNCATE TABLE trial_balance_raw;
+        ELSE
+            -- Option 2: Selective reload for specific deal
+            DELETE FROM trial_balance_raw WHERE deal_id = :deal_id_filter;
+        END IF;
     END IF;
     
     -- Load data with error continuation
     EXECUTE IMMEDIATE
-        'COPY INTO trial_balance_raw (' ||
-        '    deal_id, deal_name, entity, period_date, account_number, account_name, ' ||
-        '    debit_amount, credit_amount, net_amount' ||
-        ') ' ||
+        'COPY INTO ' || :target_table || ' ' || :column_list ||
         'FROM ' || :stage_path || ' ' ||
-        'FILE_FORMAT = (FORMAT_NAME = ''' || get_config_string('default_file_format') || ''') ' ||
+        :copy_options ||
         'ON_ERROR = ''CONTINUE'' ' ||
         'RETURN_FAILED_ONLY = FALSE';
     
     rows_loaded := SQLROWCOUNT;
     
     -- Capture load errors
-    INSERT INTO load_errors (deal_id, file_name, error_type, error_message)
-    SELECT 
-        :deal_id_filter,
-        :file_name,
-        'LOAD_ERROR',
-        ERROR || ' at line ' || LINE
-    FROM TABLE(VALIDATE(trial_balance_raw, JOB_ID => '_last'))
-    WHERE ERROR IS NOT NULL;
+    IF (:load_mode_var = 'DELTA') THEN
+        INSERT INTO load_errors (deal_id, file_name, error_type, error_message)
+        SELECT 
+            :deal_id_filter,
+            :file_name,
+            'LOAD_ERROR',
+            ERROR || ' at line ' || LINE
+        FROM TABLE(VALIDATE(temp_tb_delta, JOB_ID => '_last'))
+        WHERE ERROR IS NOT NULL;
+    ELSE
+        INSERT INTO load_errors (deal_id, file_name, error_type, error_message)
+        SELECT 
+            :deal_id_filter,
+            :file_name,
+            'LOAD_ERROR',
+            ERROR || ' at line ' || LINE
+        FROM TABLE(VALIDATE(trial_balance_raw, JOB_ID => '_last'))
+        WHERE ERROR IS NOT NULL;
+    END IF;
     
     SELECT COUNT(*) INTO :error_count 
     FROM load_errors 
@@ -1010,7 +1425,7 @@ BEGIN
     AND error_timestamp > :start_time_var;
     
     -- Check error rate threshold
-    IF (:rows_loaded > 0 AND :error_count::FLOAT / :rows_loaded > get_config_number('max_error_rate_pct')) THEN
+    IF (:rows_loaded > 0 AND :error_count::FLOAT / :rows_loaded > :max_error_rate) THEN
         ROLLBACK;
         
         -- Log failure
@@ -1019,7 +1434,7 @@ BEGIN
             duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
             status = 'ERROR',
             error_message = 'Error rate (' || ROUND(:error_count::FLOAT / :rows_loaded * 100, 2) || 
-                          '%) exceeds threshold (' || (get_config_number('max_error_rate_pct') * 100) || '%)',
+                          '%) exceeds threshold (' || (:max_error_rate * 100) || '%)',
             rows_affected = :rows_loaded
         WHERE log_id = :log_id_var;
         
@@ -1032,23 +1447,142 @@ BEGIN
         RETURN TABLE(result_cursor);
     END IF;
     
-    -- Update unique_id for new records
-    UPDATE trial_balance_raw
-    SET unique_id = account_number || ' - ' || account_name
-    WHERE unique_id IS NULL;
-    
-    -- VALIDATION: Check trial balance balances
-    SELECT COUNT(*), MAX(imbalance)
-    INTO :unbalanced_count, :max_imbalance
-    FROM (
+    IF (:load_mode_var = 'DELTA') THEN
+        -- Only touch the requested deal
+        IF (:deal_id_filter IS NOT NULL) THEN
+            DELETE FROM temp_tb_delta WHERE deal_id <> :deal_id_filter;
+            rows_loaded := :rows_loaded - SQLROWCOUNT;
+        END IF;
+        
+        -- MERGE needs one source row per natural key
+        SELECT COUNT(*) INTO :duplicate_keys
+        FROM (
+            SELECT 1
+            FROM temp_tb_delta
+            GROUP BY deal_id, account_number, period_date, entity
+            HAVING COUNT(*) > 1
+        );
+        
+        IF (:duplicate_keys > 0) THEN
+            ROLLBACK;
+            
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+                status = 'ERROR',
+                error_message = :duplicate_keys || ' duplicate (deal_id, account_number, period_date, entity) keys in file',
+                rows_affected = 0
+            WHERE log_id = :log_id_var;
+            
+            result_cursor := (
+                SELECT 'ERROR' AS status, 
+                       :rows_loaded AS rows_loaded, 
+                       :error_count AS errors_found,
+                       :duplicate_keys || ' duplicate natural keys in file. Nothing was merged.' AS message
+            );
+            RETURN TABLE(result_cursor);
+        END IF;
+        
+        -- Classify staged rows against the current trial balance
+        UPDATE temp_tb_delta SET change_type = 'INSERT';
+        
+        UPDATE temp_tb_delta s
+        SET change_type = CASE
+                WHEN EQUAL_NULL(s.deal_name, t.deal_name)
+                 AND EQUAL_NULL(s.account_name, t.account_name)
+                 AND EQUAL_NULL(s.debit_amount, t.debit_amount)
+                 AND EQUAL_NULL(s.credit_amount, t.credit_amount)
+                 AND EQUAL_NULL(s.net_amount, t.net_amount)
+                THEN 'UNCHANGED'
+                ELSE 'UPDATE'
+            END
+        FROM trial_balance_raw t
+        WHERE t.deal_id = s.deal_id
+        AND t.account_number = s.account_number
+        AND t.period_date = s.period_date
+        AND EQUAL_NULL(t.entity, s.entity);
+        
         SELECT 
-            period_date,
-            ABS(SUM(debit_amount) - SUM(credit_amount)) AS imbalance
-        FROM trial_balance_raw
-        WHERE deal_id = COALESCE(:deal_id_filter, deal_id)
-        GROUP BY deal_id, period_date
-        HAVING ABS(SUM(debit_amount) - SUM(credit_amount)) > get_config_number('balance_tolerance_dollars')
-    );
+            COUNT_IF(change_type = 'INSERT'),
+            COUNT_IF(change_type = 'UPDATE'),
+            COUNT_IF(change_type = 'UNCHANGED')
+        INTO :rows_inserted, :rows_updated, :rows_unchanged
+        FROM temp_tb_delta;
+        
+        MERGE INTO trial_balance_raw t
+        USING (SELECT * FROM temp_tb_delta WHERE change_type <> 'UNCHANGED') s
+        ON t.deal_id = s.deal_id
+        AND t.account_number = s.account_number
+        AND t.period_date = s.period_date
+        AND EQUAL_NULL(t.entity, s.entity)
+        WHEN MATCHED THEN UPDATE SET
+            deal_name = s.deal_name,
+            account_name = s.account_name,
+            debit_amount = s.debit_amount,
+            credit_amount = s.credit_amount,
+            net_amount = s.net_amount,
+            unique_id = s.account_number || ' - ' || s.account_name,
+            upload_timestamp = CURRENT_TIMESTAMP(),
+            uploaded_by = CURRENT_USER()
+        WHEN NOT MATCHED THEN INSERT (
+            deal_id, deal_name, entity, period_date, account_number, account_name,
+            debit_amount, credit_amount, net_amount, unique_id
+        ) VALUES (
+            s.deal_id, s.deal_name, s.entity, s.period_date, s.account_number, s.account_name,
+            s.debit_amount, s.credit_amount, s.net_amount, s.account_number || ' - ' || s.account_name
+        );
+        
+        -- VALIDATION: Check balances of the changed (deal_id, period_date) groups only
+        SELECT COUNT(*), COUNT_IF(imbalance > :balance_tolerance),
+               MAX(IFF(imbalance > :balance_tolerance, imbalance, NULL))
+        INTO :affected_periods, :unbalanced_count, :max_imbalance
+        FROM (
+            SELECT 
+                tb.deal_id,
+                tb.period_date,
+                ABS(SUM(tb.debit_amount) - SUM(tb.credit_amount)) AS imbalance
+            FROM trial_balance_raw tb
+            INNER JOIN (
+                SELECT DISTINCT deal_id, period_date
+                FROM temp_tb_delta
+                WHERE change_type <> 'UNCHANGED'
+            ) changed
+                ON tb.deal_id = changed.deal_id
+                AND tb.period_date = changed.period_date
+            GROUP BY tb.deal_id, tb.period_date
+        );
+        
+        -- Rebuild the schedule-ready rows of the changed periods only
+        IF (:rows_inserted + :rows_updated > 0) THEN
+            SELECT ARRAY_AGG(DISTINCT period_date) INTO :changed_periods
+            FROM temp_tb_delta
+            WHERE change_type <> 'UNCHANGED';
+            
+            CALL refresh_schedule_trial_balance(:deal_id_filter, :changed_periods);
+        END IF;
+    ELSE
+        rows_inserted := :rows_loaded;
+        
+        -- Update unique_id for new records
+        UPDATE trial_balance_raw
+        SET unique_id = account_number || ' - ' || account_name
+        WHERE unique_id IS NULL;
+        
+        -- VALIDATION: Check trial balance balances
+        SELECT COUNT(*), COUNT_IF(imbalance > :balance_tolerance),
+               MAX(IFF(imbalance > :balance_tolerance, imbalance, NULL))
+        INTO :affected_periods, :unbalanced_count, :max_imbalance
+        FROM (
+            SELECT 
+                period_date,
+                ABS(SUM(debit_amount) - SUM(credit_amount)) AS imbalance
+            FROM trial_balance_raw
+            WHERE deal_id = COALESCE(:deal_id_filter, deal_id)
+            GROUP BY deal_id, period_date
+        );
+        
+        CALL refresh_schedule_trial_balance(:deal_id_filter);
+    END IF;
     
     -- Log data quality check (using SELECT to support OBJECT_CONSTRUCT)
     -- Only log if deal_id is provided
@@ -1059,7 +1593,8 @@ BEGIN
             'Trial Balance Balancing',
             'BALANCE',
             :unbalanced_count = 0,
-            OBJECT_CONSTRUCT('unbalanced_periods', :unbalanced_count, 'max_imbalance', :max_imbalance),
+            OBJECT_CONSTRUCT('unbalanced_periods', :unbalanced_count, 'max_imbalance', :max_imbalance,
+                             'periods_checked', :affected_periods, 'load_mode', :load_mode_var),
             CASE WHEN :unbalanced_count = 0 THEN 'INFO' ELSE 'WARNING' END,
             CASE 
                 WHEN :unbalanced_count = 0 THEN 'All periods balanced (debits = credits)'
@@ -1067,15 +1602,39 @@ BEGIN
             END;
     END IF;
     
+    -- Record what this load changed
+    INSERT INTO trial_balance_load_history (
+        load_id, deal_id, file_name, load_mode, rows_staged,
+        rows_inserted, rows_updated, rows_unchanged, periods_validated,
+        errors_found, unbalanced_periods, changed_periods
+    )
+    SELECT 
+        :log_id_var, :deal_id_filter, :file_name, :load_mode_var, :rows_loaded,
+        :rows_inserted, :rows_updated, :rows_unchanged, :affected_periods,
+        :error_count, :unbalanced_count,
+        IFF(:load_mode_var = 'DELTA', COALESCE(:changed_periods, ARRAY_CONSTRUCT()), NULL);
+    
     COMMIT;
     
+    IF (:load_mode_var = 'DELTA') THEN
+        DROP TABLE IF EXISTS temp_tb_delta;
+    END IF;
+    
+    -- Keep the threshold preview index and the Database tab in step with the data
+    IF (:rows_inserted + :rows_updated > 0 OR :load_mode_var = 'FULL') THEN
+        CALL refresh_variance_index(:deal_id_filter);
+        CALL refresh_database_tab(:deal_id_filter);
+    END IF;
+    
     -- Log success
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
         duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
         status = CASE WHEN :unbalanced_count > 0 THEN 'WARNING' ELSE 'SUCCESS' END,
-        rows_affected = :rows_loaded,
-        message = 'Loaded ' || :rows_loaded || ' rows, ' || :error_count || ' errors, ' || 
+        rows_affected = :rows_inserted + :rows_updated,
+        message = 'Loaded ' || :rows_loaded || ' rows (' || :load_mode_var || '): ' ||
+                  :rows_inserted || ' inserted, ' || :rows_updated || ' updated, ' ||
+                  :rows_unchanged || ' unchanged, ' || :error_count || ' errors, ' || 
                   :unbalanced_count || ' unbalanced periods'
     WHERE log_id = :log_id_var;
     
@@ -1085,6 +1644,11 @@ BEGIN
             :rows_loaded AS rows_loaded,
             :error_count AS errors_found,
             'Loaded ' || :rows_loaded || ' rows. ' ||
+            CASE WHEN :load_mode_var = 'DELTA'
+                 THEN :rows_inserted || ' inserted, ' || :rows_updated || ' updated, ' ||
+                      :rows_unchanged || ' unchanged; ' || :affected_periods || ' periods re-validated. '
+                 ELSE ''
+            END ||
             CASE 
                 WHEN :unbalanced_count > 0 
                 THEN :unbalanced_count || ' periods have imbalances (max: $' || ROUND(:max_imbalance, 2) || ')'
@@ -1196,6 +1760,13 @@ BEGIN
         WHERE deal_id = :deal_id_filter AND is_active IS NULL;
     END IF;
     
+    -- Classify display signs once per account, then rebuild the schedule-ready rows
+    UPDATE account_mappings
+    SET display_sign_rule = classify_display_sign(statement_type, mapping_level_1, account_name)
+    WHERE deal_id = COALESCE(:deal_id_filter, deal_id);
+    
+    CALL refresh_schedule_trial_balance(:deal_id_filter);
+    
     -- VALIDATION: Check for unmapped accounts in trial balance
     SELECT COUNT(DISTINCT t.account_number)
     INTO :unmapped_count
@@ -1240,6 +1811,9 @@ BEGIN
     
     COMMIT;
     
+    -- Mapping levels and sort orders are part of the Database tab
+    CALL refresh_database_tab(:deal_id_filter);
+    
     -- Log completion
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
@@ -1291,17 +1865,156 @@ $$;
 -- PART 2: DATA VALIDATION PROCEDURES
 -- ============================================================================
 
+-- validate_data_quality evaluates the rules registered in dq_rules. Each rule
+-- reads one metric, and the evaluator computes every metric in a single scan of
+-- the deal's trial balance, kept per period in dq_period_metrics. A new rule over
+-- an existing metric adds no scan at all. Only periods loaded since the deal's
+-- last check are re-scanned (DELTA loads record them in
+-- trial_balance_load_history.changed_periods); FULL loads, account mapping loads
+-- and full_check => TRUE re-scan the whole deal.
+
+-- Rule registry: a rule passes when its metric lies within [min_pass, max_pass]
+CREATE TABLE IF NOT EXISTS dq_rules (
+    rule_name VARCHAR(200) PRIMARY KEY,  -- data_quality_checks.check_name
+    check_type VARCHAR(50),              -- 'COMPLETENESS', 'CONSISTENCY', 'ACCURACY'
+    metric_name VARCHAR(100) NOT NULL,   -- tb_rows, unmapped_accounts, missing_periods, revenue_sign_rows,
+                                         -- duplicate_rows, outlier_rows, missing_entity_periods
+    min_pass NUMBER,                     -- NULL = no lower bound
+    max_pass NUMBER,                     -- NULL = no upper bound
+    fail_severity VARCHAR(20) NOT NULL,  -- 'WARNING', 'ERROR', 'CRITICAL'
+    escalate_at NUMBER,                  -- metric value from which escalated_severity applies
+    escalated_severity VARCHAR(20),
+    pass_message VARCHAR(500),           -- {n} is replaced by the metric value
+    fail_message VARCHAR(500),
+    rule_order NUMBER,
+    is_enabled BOOLEAN DEFAULT TRUE
+);
+
+-- Built-in rules (re-deploying updates their definitions but keeps is_enabled)
+MERGE INTO dq_rules r
+USING (
+    SELECT column1 AS rule_name, column2 AS check_type, column3 AS metric_name,
+           column4 AS min_pass, column5 AS max_pass, column6 AS fail_severity,
+           column7 AS escalate_at, column8 AS escalated_severity,
+           column9 AS pass_message, column10 AS fail_message, column11 AS rule_order
+    FROM VALUES
+        ('Trial Balance Existence', 'COMPLETENESS', 'tb_rows', 1, NULL, 'CRITICAL', NULL, NULL,
+         'Found {n} records', 'No trial balance data found', 1),
+        ('Account Mapping Completeness', 'COMPLETENESS', 'unmapped_accounts', NULL, 0, 'WARNING', 5, 'ERROR',
+         'All accounts mapped', '{n} accounts missing mappings', 2),
+        ('Period Continuity', 'COMPLETENESS', 'missing_periods', NULL, 0, 'WARNING', NULL, NULL,
+         'No date gaps detected', '{n} month gaps in period sequence', 3),
+        ('Revenue Sign Check', 'ACCURACY', 'revenue_sign_rows', NULL, 0, 'WARNING', NULL, NULL,
+         'Revenue signs look correct', '{n} revenue rows with unexpected debit (positive) values', 4),
+        ('Duplicate Records', 'CONSISTENCY', 'duplicate_rows', NULL, 0, 'ERROR', NULL, NULL,
+         'No duplicates found', '{n} duplicate records detected', 5),
+        ('Account Outliers', 'ACCURACY', 'outlier_rows', NULL, 0, 'WARNING', NULL, NULL,
+         'No account-level outliers', '{n} account-period amounts beyond dq_outlier_zscore standard deviations of the account''s mean', 6),
+        ('Entity Completeness', 'COMPLETENESS', 'missing_entity_periods', NULL, 0, 'WARNING', NULL, NULL,
+         'Every entity reports in every period', '{n} entity-periods without trial balance rows', 7)
+) s
+ON r.rule_name = s.rule_name
+WHEN MATCHED THEN UPDATE SET
+    check_type = s.check_type,
+    metric_name = s.metric_name,
+    min_pass = s.min_pass,
+    max_pass = s.max_pass,
+    fail_severity = s.fail_severity,
+    escalate_at = s.escalate_at,
+    escalated_severity = s.escalated_severity,
+    pass_message = s.pass_message,
+    fail_message = s.fail_message,
+    rule_order = s.rule_order
+WHEN NOT MATCHED THEN INSERT (
+    rule_name, check_type, metric_name, min_pass, max_pass, fail_severity,
+    escalate_at, escalated_severity, pass_message, fail_message, rule_order
+) VALUES (
+    s.rule_name, s.check_type, s.metric_name, s.min_pass, s.max_pass, s.fail_severity,
+    s.escalate_at, s.escalated_severity, s.pass_message, s.fail_message, s.rule_order
+);
+
+-- Rule metrics per deal and period (deal metrics are folded from these rows)
+CREATE TABLE IF NOT EXISTS dq_period_metrics (
+    deal_id VARCHAR(50) NOT NULL,
+    period_date DATE NOT NULL,
+    tb_rows NUMBER,
+    unmapped_accounts ARRAY,   -- distinct account numbers without a mapping
+    revenue_sign_rows NUMBER,  -- Revenue rows with a debit (positive) net amount
+    duplicate_rows NUMBER,     -- rows beyond the first per (account_number, entity)
+    outlier_rows NUMBER,       -- amounts beyond dq_outlier_zscore stddevs of the account baseline
+    entities ARRAY,            -- distinct entities with rows in the period
+    evaluated_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, period_date)
+);
+
+-- Mean and standard deviation of each account's net amount, taken on full scans;
+-- incremental checks score new periods against them
+CREATE TABLE IF NOT EXISTS dq_account_baselines (
+    deal_id VARCHAR(50) NOT NULL,
+    account_number VARCHAR(50) NOT NULL,
+    entity VARCHAR(100) NOT NULL,  -- '' when the trial balance has no entity
+    mean_amount FLOAT,
+    stddev_amount FLOAT,
+    periods NUMBER,
+    computed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, account_number, entity)
+);
+
+-- Loads up to checked_through are reflected in a deal's dq_period_metrics
+CREATE TABLE IF NOT EXISTS dq_check_state (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    checked_through TIMESTAMP_NTZ,
+    last_full_check TIMESTAMP_NTZ
+);
+
+GRANT SELECT ON TABLE dq_rules TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE dq_rules TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON TABLE dq_period_metrics TO ROLE FDD_ANALYST_ROLE;
+
+-- Drop the pre-registry signature; with a DEFAULT parameter it would be an ambiguous overload
+EXECUTE IMMEDIATE $$
+BEGIN
+    DROP PROCEDURE IF EXISTS validate_data_quality(VARCHAR);
+    DROP PROCEDURE IF EXISTS validate_data_quality(VARCHAR, BOOLEAN);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Ignore errors if procedure doesn't exist
+        RETURN 'Procedures dropped or did not exist';
+END;
+$$;
+
 -- Comprehensive data quality validation
-CREATE OR REPLACE PROCEDURE validate_data_quality(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE validate_data_quality(deal_id_param VARCHAR, full_check BOOLEAN DEFAULT FALSE)
 RETURNS TABLE(check_name VARCHAR, passed BOOLEAN, severity VARCHAR, message VARCHAR)
 LANGUAGE SQL
 AS
 $$
 DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    config_version_var NUMBER;
+    run_config OBJECT;
+    outlier_zscore FLOAT;
+    checked_through TIMESTAMP_NTZ;
+    new_checked_through TIMESTAMP_NTZ;
+    full_loads NUMBER DEFAULT 0;
+    mapping_loads NUMBER DEFAULT 0;
+    full_scan BOOLEAN;
+    periods_scanned NUMBER DEFAULT 0;
+    rules_evaluated NUMBER DEFAULT 0;
+    rules_failed NUMBER DEFAULT 0;
     result_cursor RESULTSET;
+    error_msg VARCHAR;
 BEGIN
+    -- Settings for the whole run, resolved once and bound below
+    SELECT config_version, config_values, COALESCE(config_values:dq_outlier_zscore::FLOAT, 4)
+    INTO :config_version_var, :run_config, :outlier_zscore
+    FROM v_config_snapshot;
+    
     -- Validate deal_id
-    IF (NOT validate_deal_id(:deal_id_param)) THEN
+    IF (NOT validate_deal_id(:deal_id_param, :run_config)) THEN
         result_cursor := (
             SELECT 'Input Validation' AS check_name, FALSE AS passed, 
                    'ERROR' AS severity, 'Invalid deal_id format' AS message
@@ -1309,108 +2022,211 @@ BEGIN
         RETURN TABLE(result_cursor);
     END IF;
     
-    -- Run all data quality checks and return results
-    result_cursor := (
-        WITH checks AS (
-            -- Check 1: Trial balance exists
-            SELECT 
-                'Trial Balance Existence' AS check_name,
-                COUNT(*) > 0 AS passed,
-                CASE WHEN COUNT(*) > 0 THEN 'INFO' ELSE 'CRITICAL' END AS severity,
-                CASE WHEN COUNT(*) > 0 
-                     THEN 'Found ' || COUNT(*) || ' records' 
-                     ELSE 'No trial balance data found' END AS message
-            FROM trial_balance_raw
-            WHERE deal_id = :deal_id_param
-            
-            UNION ALL
-            
-            -- Check 2: Account mappings complete
-            SELECT 
-                'Account Mapping Completeness',
-                COUNT(*) = 0,
-                CASE WHEN COUNT(*) = 0 THEN 'INFO' WHEN COUNT(*) < 5 THEN 'WARNING' ELSE 'ERROR' END,
-                CASE WHEN COUNT(*) = 0 
-                     THEN 'All accounts mapped' 
-                     ELSE COUNT(*)::VARCHAR || ' accounts missing mappings' END
-            FROM trial_balance_raw t
-            LEFT JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-            WHERE t.deal_id = :deal_id_param AND m.account_number IS NULL
-            
-            UNION ALL
-            
-            -- Check 3: Period continuity
-            SELECT 
-                'Period Continuity',
-                gaps = 0,
-                CASE WHEN gaps = 0 THEN 'INFO' ELSE 'WARNING' END,
-                CASE WHEN gaps = 0 
-                     THEN 'No date gaps detected' 
-                     ELSE gaps::VARCHAR || ' month gaps in period sequence' END
-            FROM (
-                SELECT COUNT(*) AS gaps
-                FROM (
-                    SELECT 
-                        period_date,
-                        LAG(period_date) OVER (ORDER BY period_date) AS prev_date,
-                        DATEDIFF(month, LAG(period_date) OVER (ORDER BY period_date), period_date) AS month_diff
-                    FROM (SELECT DISTINCT period_date FROM trial_balance_raw WHERE deal_id = :deal_id_param)
-                )
-                WHERE month_diff > 1
-            )
-            
-            UNION ALL
-            
-            -- Check 4: Negative revenue detection (potential data issue)
-            SELECT 
-                'Revenue Sign Check',
-                COUNT(*) = 0,
-                CASE WHEN COUNT(*) = 0 THEN 'INFO' ELSE 'WARNING' END,
-                CASE WHEN COUNT(*) = 0 
-                     THEN 'Revenue signs look correct' 
-                     ELSE COUNT(*)::VARCHAR || ' revenue accounts with unexpected negative values' END
-            FROM trial_balance_raw t
-            JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-            WHERE t.deal_id = :deal_id_param 
-            AND m.mapping_level_1 = 'Revenue' 
-            AND t.net_amount > 0  -- In accounting, revenue is typically credit (negative)
-            
-            UNION ALL
-            
-            -- Check 5: Duplicate records
-            SELECT 
-                'Duplicate Records',
-                COUNT(*) = 0,
-                CASE WHEN COUNT(*) = 0 THEN 'INFO' ELSE 'ERROR' END,
-                CASE WHEN COUNT(*) = 0 
-                     THEN 'No duplicates found' 
-                     ELSE COUNT(*)::VARCHAR || ' duplicate records detected' END
-            FROM (
-                SELECT deal_id, account_number, period_date, entity, COUNT(*) AS cnt
-                FROM trial_balance_raw
-                WHERE deal_id = :deal_id_param
-                GROUP BY deal_id, account_number, period_date, entity
-                HAVING COUNT(*) > 1
-            )
-        )
-        SELECT * FROM checks
-    );
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+    VALUES (:log_id_var, 'validate_data_quality', :deal_id_param, :start_time_var, 'STARTED', :config_version_var);
+    
+    -- Loads since the last check decide the scan: their changed periods, or the whole deal
+    SELECT MAX(checked_through) INTO :checked_through
+    FROM dq_check_state
+    WHERE deal_id = :deal_id_param;
+    
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_loads AS
+    SELECT load_timestamp, changed_periods
+    FROM trial_balance_load_history
+    WHERE (deal_id = :deal_id_param OR deal_id IS NULL)
+      AND load_timestamp > COALESCE(:checked_through, '1900-01-01'::TIMESTAMP_NTZ);
+    
+    SELECT COUNT_IF(changed_periods IS NULL), MAX(load_timestamp)
+    INTO :full_loads, :new_checked_through
+    FROM temp_dq_loads;
+    
+    -- Mapping changes affect every period of the deal
+    SELECT COUNT(*) INTO :mapping_loads
+    FROM audit_log
+    WHERE procedure_name = 'load_account_mappings'
+      AND status = 'SUCCESS'
+      AND (deal_id = :deal_id_param OR deal_id IS NULL)
+      AND end_time > :checked_through;
+    
+    full_scan := (:full_check OR :checked_through IS NULL OR :full_loads > 0 OR :mapping_loads > 0);
+    new_checked_through := GREATEST(COALESCE(:new_checked_through, :checked_through, :start_time_var),
+                                    COALESCE(:checked_through, :start_time_var));
+    
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_periods AS
+    SELECT DISTINCT p.value::DATE AS period_date
+    FROM temp_dq_loads l,
+         LATERAL FLATTEN(input => l.changed_periods) p;
+    
+    -- The single pass over trial_balance_raw: one row per trial balance row with
+    -- the flags every metric needs
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_rows AS
+    SELECT 
+        t.period_date,
+        t.account_number,
+        COALESCE(t.entity, '') AS entity,
+        t.net_amount,
+        m.account_number IS NULL AS is_unmapped,
+        COALESCE(m.is_revenue AND t.net_amount > 0, FALSE) AS is_revenue_debit  -- revenue is typically credit (negative)
+    FROM trial_balance_raw t
+    LEFT JOIN (
+        SELECT account_number, BOOLOR_AGG(mapping_level_1 = 'Revenue') AS is_revenue
+        FROM account_mappings
+        WHERE deal_id = :deal_id_param
+        GROUP BY account_number
+    ) m ON m.account_number = t.account_number
+    WHERE t.deal_id = :deal_id_param
+      AND (:full_scan OR t.period_date IN (SELECT period_date FROM temp_dq_periods));
     
-    -- Also insert into data_quality_checks table
-    INSERT INTO data_quality_checks (deal_id, check_name, check_type, passed, severity, message)
+    SELECT COUNT(DISTINCT period_date) INTO :periods_scanned FROM temp_dq_rows;
+    
+    BEGIN TRANSACTION;
+    
+    IF (:full_scan) THEN
+        DELETE FROM dq_account_baselines WHERE deal_id = :deal_id_param;
+        
+        INSERT INTO dq_account_baselines (deal_id, account_number, entity, mean_amount, stddev_amount, periods)
+        SELECT :deal_id_param, account_number, entity, AVG(net_amount), STDDEV(net_amount), COUNT(*)
+        FROM temp_dq_rows
+        GROUP BY account_number, entity;
+    END IF;
+    
+    DELETE FROM dq_period_metrics
+    WHERE deal_id = :deal_id_param
+      AND (:full_scan OR period_date IN (SELECT period_date FROM temp_dq_periods));
+    
+    INSERT INTO dq_period_metrics (
+        deal_id, period_date, tb_rows, unmapped_accounts, revenue_sign_rows,
+        duplicate_rows, outlier_rows, entities
+    )
+    SELECT 
+        :deal_id_param,
+        r.period_date,
+        COUNT(*),
+        ARRAY_AGG(DISTINCT IFF(r.is_unmapped, r.account_number, NULL)),
+        COUNT_IF(r.is_revenue_debit),
+        COUNT(*) - COUNT(DISTINCT r.account_number, r.entity),
+        COUNT_IF(b.stddev_amount > 0 AND ABS(r.net_amount - b.mean_amount) > :outlier_zscore * b.stddev_amount),
+        ARRAY_AGG(DISTINCT r.entity)
+    FROM temp_dq_rows r
+    LEFT JOIN dq_account_baselines b
+        ON b.deal_id = :deal_id_param
+        AND b.account_number = r.account_number
+        AND b.entity = r.entity
+    GROUP BY r.period_date;
+    
+    MERGE INTO dq_check_state s
+    USING (SELECT :deal_id_param AS deal_id) d
+    ON s.deal_id = d.deal_id
+    WHEN MATCHED THEN UPDATE SET
+        checked_through = :new_checked_through,
+        last_full_check = IFF(:full_scan, CURRENT_TIMESTAMP(), s.last_full_check)
+    WHEN NOT MATCHED THEN INSERT (deal_id, checked_through, last_full_check)
+        VALUES (d.deal_id, :new_checked_through, CURRENT_TIMESTAMP());
+    
+    COMMIT;
+    
+    -- Deal metrics folded from the period rows, then every enabled rule against them
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_results AS
+    WITH deal_metrics AS (
+        SELECT OBJECT_CONSTRUCT(
+            'tb_rows', COALESCE(SUM(tb_rows), 0),
+            'unmapped_accounts', COALESCE(ARRAY_SIZE(ARRAY_UNION_AGG(unmapped_accounts)), 0),
+            'missing_periods', COALESCE(DATEDIFF(month, MIN(period_date), MAX(period_date)) + 1 - COUNT(*), 0),
+            'revenue_sign_rows', COALESCE(SUM(revenue_sign_rows), 0),
+            'duplicate_rows', COALESCE(SUM(duplicate_rows), 0),
+            'outlier_rows', COALESCE(SUM(outlier_rows), 0),
+            'missing_entity_periods', COALESCE(ARRAY_SIZE(ARRAY_UNION_AGG(entities)) * COUNT(*) - SUM(ARRAY_SIZE(entities)), 0)
+        ) AS metrics
+        FROM dq_period_metrics
+        WHERE deal_id = :deal_id_param
+    ),
+    rule_values AS (
+        SELECT r.*, d.metrics[r.metric_name]::NUMBER AS metric_value
+        FROM dq_rules r
+        CROSS JOIN deal_metrics d
+        WHERE r.is_enabled
+    ),
+    evaluated AS (
+        SELECT 
+            *,
+            COALESCE(metric_value >= COALESCE(min_pass, metric_value)
+                     AND metric_value <= COALESCE(max_pass, metric_value), FALSE) AS rule_passed
+        FROM rule_values
+    )
+    SELECT 
+        rule_name AS check_name,
+        check_type,
+        rule_order,
+        metric_name,
+        metric_value,
+        OBJECT_CONSTRUCT('min', min_pass, 'max', max_pass) AS expected_value,
+        rule_passed AS passed,
+        CASE 
+            WHEN rule_passed THEN 'INFO'
+            WHEN escalate_at IS NOT NULL AND metric_value >= escalate_at THEN escalated_severity
+            ELSE fail_severity
+        END AS severity,
+        CASE 
+            WHEN metric_value IS NULL THEN 'Unknown metric ' || metric_name
+            ELSE REPLACE(IFF(rule_passed, pass_message, fail_message), '{n}', metric_value::VARCHAR)
+        END AS message
+    FROM evaluated;
+    
+    -- One batched insert for the whole run
+    INSERT INTO data_quality_checks (deal_id, check_name, check_type, passed, expected_value, actual_value, severity, message, details)
     SELECT 
         :deal_id_param,
         check_name,
-        'VALIDATION',
+        check_type,
         passed,
+        expected_value,
+        OBJECT_CONSTRUCT('metric', metric_name, 'value', metric_value),
         severity,
-        message
-    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+        message,
+        IFF(:full_scan, 'Full check', 'Incremental check') || ': ' || :periods_scanned || ' periods scanned'
+    FROM temp_dq_results;
+    
+    SELECT COUNT(*), COUNT_IF(NOT passed) INTO :rules_evaluated, :rules_failed FROM temp_dq_results;
+    
+    UPDATE audit_log 
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = 'SUCCESS',
+        rows_affected = :rules_evaluated,
+        message = :rules_evaluated || ' rules evaluated, ' || :rules_failed || ' failed (' ||
+                  IFF(:full_scan, 'full', 'incremental') || ' check, ' || :periods_scanned || ' periods scanned)'
+    WHERE log_id = :log_id_var;
     
+    result_cursor := (
+        SELECT check_name, passed, severity, message
+        FROM temp_dq_results
+        ORDER BY rule_order, check_name
+    );
     RETURN TABLE(result_cursor);
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+        
+        result_cursor := (
+            SELECT 'Data Quality Evaluation' AS check_name, FALSE AS passed,
+                   'ERROR' AS severity, :error_msg AS message
+        );
+        RETURN TABLE(result_cursor);
 END;
 $$;
 
+-- Backfill display_sign_rule and the schedule-ready table on upgrade
+CALL refresh_schedule_trial_balance();
+
 SELECT 'Core data procedures created successfully' AS status;
 
 
@@ -1427,39 +2243,253 @@ SELECT 'Core data procedures created successfully' AS status;
 -- ============================================================================
 
 -- ============================================================================
--- PART 1: PIVOTED DATABASE VIEW (Wide format for Excel)
+-- PART 1: DATABASE TAB (Wide format for Excel)
 -- ============================================================================
+-- The Database tab is materialized per deal in long form (one row per account
+-- and period rank) and pivoted on export. Every deal gets its own period window
+-- (its most recent max_pivot_periods periods, ranked oldest = 1), so the number
+-- of period columns follows the deal and max_pivot_periods, not a fixed 24.
 
-CREATE OR REPLACE VIEW v_database_tab_pivoted AS
-WITH last_n_periods AS (
-    -- Get the most recent 24 distinct periods (max configured in system_config)
-    -- Note: LIMIT does not support subqueries in Snowflake, must be a constant
-    SELECT DISTINCT period_date
-    FROM trial_balance_raw
-    ORDER BY period_date DESC
-    LIMIT 24
-),
-ranked_periods AS (
-    -- Rank from oldest (1) to newest (N)
+-- Period window per deal
+CREATE TABLE IF NOT EXISTS database_tab_periods (
+    deal_id VARCHAR(50) NOT NULL,
+    period_rank NUMBER NOT NULL,  -- 1 = oldest period in the window
+    period_date DATE NOT NULL,
+    period_label VARCHAR(20),     -- TO_CHAR(period_date, 'Mon-YYYY')
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, period_rank)
+);
+
+-- Database tab rows in long form (pivoted by build_database_tab_sql)
+CREATE TABLE IF NOT EXISTS database_tab_cache (
+    deal_id VARCHAR(50) NOT NULL,
+    deal_name VARCHAR(200),
+    entity VARCHAR(100),
+    account_number VARCHAR(50),
+    account_name VARCHAR(500),
+    unique_id VARCHAR(600),
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    mapping_level_3 VARCHAR(200),
+    statement_type VARCHAR(20),
+    sort_order_l1 NUMBER,
+    sort_order_l2 NUMBER,
+    period_rank NUMBER NOT NULL,
+    amount_for_display NUMBER(18,2),
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (deal_id);
+
+-- Drop the signatures without trace_id_param (generate_fdd_schedules passes
+-- its trace id so the steps skip their own audit_log rows); with a DEFAULT
+-- parameter they would be ambiguous overloads
+EXECUTE IMMEDIATE $$
+BEGIN
+    DROP PROCEDURE IF EXISTS refresh_database_tab(VARCHAR);
+    DROP PROCEDURE IF EXISTS build_schedules(VARCHAR, VARCHAR);
+    DROP PROCEDURE IF EXISTS refresh_schedule_values(VARCHAR, BOOLEAN);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Ignore errors if procedure doesn't exist
+        RETURN 'Procedures dropped or did not exist';
+END;
+$$;
+
+-- Rebuild the materialized Database tab for one deal (NULL = all deals)
+CREATE OR REPLACE PROCEDURE refresh_database_tab(deal_id_param VARCHAR DEFAULT NULL, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    max_periods NUMBER DEFAULT COALESCE(get_config_number('max_pivot_periods'), 24);
+    deal_count NUMBER DEFAULT 0;
+    rows_created NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    IF (:deal_id_param IS NOT NULL AND NOT validate_deal_id(:deal_id_param)) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+        VALUES (:log_id_var, 'refresh_database_tab', :deal_id_param, :start_time_var, 'STARTED');
+    END IF;
+    
+    BEGIN TRANSACTION;
+    
+    DELETE FROM database_tab_periods WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    DELETE FROM database_tab_cache WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    -- Most recent N distinct periods of each deal, ranked oldest (1) to newest (N)
+    INSERT INTO database_tab_periods (deal_id, period_rank, period_date, period_label)
     SELECT 
+        deal_id,
+        ROW_NUMBER() OVER (PARTITION BY deal_id ORDER BY period_date),
         period_date,
-        TO_CHAR(period_date, 'Mon-YYYY') AS period_label,
-        ROW_NUMBER() OVER (ORDER BY period_date) AS period_rank
-    FROM last_n_periods
-)
+        TO_CHAR(period_date, 'Mon-YYYY')
+    FROM (
+        SELECT DISTINCT deal_id, period_date
+        FROM trial_balance_raw
+        WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param)
+        QUALIFY DENSE_RANK() OVER (PARTITION BY deal_id ORDER BY period_date DESC) <= :max_periods
+    );
+    
+    INSERT INTO database_tab_cache (
+        deal_id, deal_name, entity, account_number, account_name, unique_id,
+        mapping_level_1, mapping_level_2, mapping_level_3, statement_type,
+        sort_order_l1, sort_order_l2, period_rank, amount_for_display
+    )
+    SELECT 
+        t.deal_id, t.deal_name, t.entity, t.account_number, t.account_name, t.unique_id,
+        t.mapping_level_1, t.mapping_level_2, t.mapping_level_3, t.statement_type,
+        t.sort_order_l1, t.sort_order_l2, p.period_rank,
+        MAX(t.amount_for_display)
+    FROM trial_balance_for_schedules t
+    JOIN database_tab_periods p
+        ON p.deal_id = t.deal_id
+        AND p.period_date = t.period_date
+    WHERE (:deal_id_param IS NULL OR t.deal_id = :deal_id_param)
+    GROUP BY 1,2,3,4,5,6,7,8,9,10,11,12,13;
+    
+    rows_created := SQLROWCOUNT;
+    
+    SELECT COUNT(DISTINCT deal_id) INTO :deal_count
+    FROM database_tab_periods
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    COMMIT;
+    
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :rows_created,
+            message = 'Database tab materialized for ' || :deal_count || ' deal(s)'
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Database tab materialized for ' || :deal_count || ' deal(s), ' || :rows_created || ' account-period rows';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- SELECT statement that pivots one deal's Database tab, with one label and one
+-- amount column per period in its window (period_01 .. period_NN)
+CREATE OR REPLACE PROCEDURE build_database_tab_sql(deal_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    safe_deal_id VARCHAR;
+    label_columns VARCHAR;
+    amount_columns VARCHAR;
+BEGIN
+    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN NULL;
+    END IF;
+    
+    SELECT 
+        LISTAGG(
+            'MAX(CASE WHEN c.period_rank = ' || period_rank || ' THEN ''' || period_label || ''' END) AS period_' ||
+            LPAD(period_rank::VARCHAR, GREATEST(2, LENGTH(period_rank::VARCHAR)), '0') || '_label',
+            ', '
+        ) WITHIN GROUP (ORDER BY period_rank),
+        LISTAGG(
+            'MAX(CASE WHEN c.period_rank = ' || period_rank || ' THEN c.amount_for_display END) AS period_' ||
+            LPAD(period_rank::VARCHAR, GREATEST(2, LENGTH(period_rank::VARCHAR)), '0'),
+            ', '
+        ) WITHIN GROUP (ORDER BY period_rank)
+    INTO :label_columns, :amount_columns
+    FROM database_tab_periods
+    WHERE deal_id = :safe_deal_id;
+    
+    IF (:label_columns IS NULL) THEN
+        RETURN NULL;
+    END IF;
+    
+    RETURN 'SELECT c.deal_id, c.deal_name, c.entity, c.account_number, c.account_name, c.unique_id, ' ||
+           'c.mapping_level_1, c.mapping_level_2, c.mapping_level_3, c.statement_type, ' ||
+           'c.sort_order_l1, c.sort_order_l2, ' ||
+           :label_columns || ', ' || :amount_columns ||
+           ' FROM database_tab_cache c WHERE c.deal_id = ''' || :safe_deal_id || '''' ||
+           ' GROUP BY 1,2,3,4,5,6,7,8,9,10,11,12 ORDER BY 11, 12, 4';
+END;
+$$;
+
+-- Interactive access: CALL get_database_tab('DEAL_HL_001');
+CREATE OR REPLACE PROCEDURE get_database_tab(deal_id_param VARCHAR)
+RETURNS TABLE()
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    safe_deal_id VARCHAR;
+    select_sql VARCHAR;
+    result_cursor RESULTSET;
+BEGIN
+    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    IF (safe_deal_id IS NULL) THEN
+        result_cursor := (SELECT 'ERROR: Invalid deal_id format' AS message);
+        RETURN TABLE(result_cursor);
+    END IF;
+    
+    CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    
+    -- Materialize on first use
+    IF (:select_sql IS NULL) THEN
+        CALL refresh_database_tab(:safe_deal_id);
+        CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    END IF;
+    
+    IF (:select_sql IS NULL) THEN
+        result_cursor := (SELECT 'No trial balance data found for deal' AS message);
+    ELSE
+        result_cursor := (EXECUTE IMMEDIATE :select_sql);
+    END IF;
+    
+    RETURN TABLE(result_cursor);
+END;
+$$;
+
+-- Compatibility view over the materialized Database tab: the first 24 periods
+-- of each deal's window. Exports use build_database_tab_sql, which is not
+-- limited to 24 columns.
+CREATE OR REPLACE VIEW v_database_tab_pivoted AS
 SELECT 
-    t.deal_id,
-    t.deal_name,
-    t.entity,
-    t.account_number,
-    t.account_name,
-    t.unique_id,
-    t.mapping_level_1,
-    t.mapping_level_2,
-    t.mapping_level_3,
-    t.statement_type,
-    t.sort_order_l1,
-    t.sort_order_l2,
+    c.deal_id,
+    c.deal_name,
+    c.entity,
+    c.account_number,
+    c.account_name,
+    c.unique_id,
+    c.mapping_level_1,
+    c.mapping_level_2,
+    c.mapping_level_3,
+    c.statement_type,
+    c.sort_order_l1,
+    c.sort_order_l2,
     -- Period headers and data (using amount_for_display with proper signs)
     MAX(CASE WHEN p.period_rank = 1 THEN p.period_label END) AS period_01_label,
     MAX(CASE WHEN p.period_rank = 2 THEN p.period_label END) AS period_02_label,
@@ -1485,41 +2515,185 @@ SELECT
     MAX(CASE WHEN p.period_rank = 22 THEN p.period_label END) AS period_22_label,
     MAX(CASE WHEN p.period_rank = 23 THEN p.period_label END) AS period_23_label,
     MAX(CASE WHEN p.period_rank = 24 THEN p.period_label END) AS period_24_label,
-    MAX(CASE WHEN p.period_rank = 1 THEN t.amount_for_display END) AS period_01,
-    MAX(CASE WHEN p.period_rank = 2 THEN t.amount_for_display END) AS period_02,
-    MAX(CASE WHEN p.period_rank = 3 THEN t.amount_for_display END) AS period_03,
-    MAX(CASE WHEN p.period_rank = 4 THEN t.amount_for_display END) AS period_04,
-    MAX(CASE WHEN p.period_rank = 5 THEN t.amount_for_display END) AS period_05,
-    MAX(CASE WHEN p.period_rank = 6 THEN t.amount_for_display END) AS period_06,
-    MAX(CASE WHEN p.period_rank = 7 THEN t.amount_for_display END) AS period_07,
-    MAX(CASE WHEN p.period_rank = 8 THEN t.amount_for_display END) AS period_08,
-    MAX(CASE WHEN p.period_rank = 9 THEN t.amount_for_display END) AS period_09,
-    MAX(CASE WHEN p.period_rank = 10 THEN t.amount_for_display END) AS period_10,
-    MAX(CASE WHEN p.period_rank = 11 THEN t.amount_for_display END) AS period_11,
-    MAX(CASE WHEN p.period_rank = 12 THEN t.amount_for_display END) AS period_12,
-    MAX(CASE WHEN p.period_rank = 13 THEN t.amount_for_display END) AS period_13,
-    MAX(CASE WHEN p.period_rank = 14 THEN t.amount_for_display END) AS period_14,
-    MAX(CASE WHEN p.period_rank = 15 THEN t.amount_for_display END) AS period_15,
-    MAX(CASE WHEN p.period_rank = 16 THEN t.amount_for_display END) AS period_16,
-    MAX(CASE WHEN p.period_rank = 17 THEN t.amount_for_display END) AS period_17,
-    MAX(CASE WHEN p.period_rank = 18 THEN t.amount_for_display END) AS period_18,
-    MAX(CASE WHEN p.period_rank = 19 THEN t.amount_for_display END) AS period_19,
-    MAX(CASE WHEN p.period_rank = 20 THEN t.amount_for_display END) AS period_20,
-    MAX(CASE WHEN p.period_rank = 21 THEN t.amount_for_display END) AS period_21,
-    MAX(CASE WHEN p.period_rank = 22 THEN t.amount_for_display END) AS period_22,
-    MAX(CASE WHEN p.period_rank = 23 THEN t.amount_for_display END) AS period_23,
-    MAX(CASE WHEN p.period_rank = 24 THEN t.amount_for_display END) AS period_24
-FROM v_trial_balance_for_schedules t
-CROSS JOIN ranked_periods p
-WHERE t.period_date = p.period_date
+    MAX(CASE WHEN p.period_rank = 1 THEN c.amount_for_display END) AS period_01,
+    MAX(CASE WHEN p.period_rank = 2 THEN c.amount_for_display END) AS period_02,
+    MAX(CASE WHEN p.period_rank = 3 THEN c.amount_for_display END) AS period_03,
+    MAX(CASE WHEN p.period_rank = 4 THEN c.amount_for_display END) AS period_04,
+    MAX(CASE WHEN p.period_rank = 5 THEN c.amount_for_display END) AS period_05,
+    MAX(CASE WHEN p.period_rank = 6 THEN c.amount_for_display END) AS period_06,
+    MAX(CASE WHEN p.period_rank = 7 THEN c.amount_for_display END) AS period_07,
+    MAX(CASE WHEN p.period_rank = 8 THEN c.amount_for_display END) AS period_08,
+    MAX(CASE WHEN p.period_rank = 9 THEN c.amount_for_display END) AS period_09,
+    MAX(CASE WHEN p.period_rank = 10 THEN c.amount_for_display END) AS period_10,
+    MAX(CASE WHEN p.period_rank = 11 THEN c.amount_for_display END) AS period_11,
+    MAX(CASE WHEN p.period_rank = 12 THEN c.amount_for_display END) AS period_12,
+    MAX(CASE WHEN p.period_rank = 13 THEN c.amount_for_display END) AS period_13,
+    MAX(CASE WHEN p.period_rank = 14 THEN c.amount_for_display END) AS period_14,
+    MAX(CASE WHEN p.period_rank = 15 THEN c.amount_for_display END) AS period_15,
+    MAX(CASE WHEN p.period_rank = 16 THEN c.amount_for_display END) AS period_16,
+    MAX(CASE WHEN p.period_rank = 17 THEN c.amount_for_display END) AS period_17,
+    MAX(CASE WHEN p.period_rank = 18 THEN c.amount_for_display END) AS period_18,
+    MAX(CASE WHEN p.period_rank = 19 THEN c.amount_for_display END) AS period_19,
+    MAX(CASE WHEN p.period_rank = 20 THEN c.amount_for_display END) AS period_20,
+    MAX(CASE WHEN p.period_rank = 21 THEN c.amount_for_display END) AS period_21,
+    MAX(CASE WHEN p.period_rank = 22 THEN c.amount_for_display END) AS period_22,
+    MAX(CASE WHEN p.period_rank = 23 THEN c.amount_for_display END) AS period_23,
+    MAX(CASE WHEN p.period_rank = 24 THEN c.amount_for_display END) AS period_24
+FROM database_tab_cache c
+JOIN database_tab_periods p
+    ON p.deal_id = c.deal_id
+    AND p.period_rank = c.period_rank
+WHERE c.period_rank <= 24
 GROUP BY 1,2,3,4,5,6,7,8,9,10,11,12
 ORDER BY 11, 12, 4;
 
+GRANT SELECT ON TABLE database_tab_periods TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE database_tab_cache TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_database_tab_pivoted TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_database_tab_pivoted TO ROLE FDD_READONLY_ROLE;
+
+-- Materialize data already loaded
+CALL refresh_database_tab();
+
 -- ============================================================================
--- PART 2: INCOME STATEMENT GENERATION
+-- PART 2: SCHEDULE TEMPLATES
 -- ============================================================================
+-- Each template line is a header, blank, section/subsection header, subtotal,
+-- calculated or total row, or an 'accounts' line that expands into one data
+-- row per active mapped account. An account goes to the 'accounts' line of
+-- its mapping_level_1 whose mapping_level_2 matches its own. If none matches,
+-- it goes to the line with no mapping_level_2, or to the line flagged
+-- includes_unassigned.
+--   subtotal             = sum of the accounts under mapping_level_1, or, with mapping_level_2
+--                          set, of the accounts placed on that mapping_level_2's 'accounts'
+--                          lines (including unassigned accounts placed there)
+--   calculated / total   = signed sum of the mapping_level_1 groups in calc_terms
+
+CREATE TABLE IF NOT EXISTS schedule_templates (
+    template_name VARCHAR(50) NOT NULL,
+    statement_type VARCHAR(20) NOT NULL,   -- 'IS', 'BS'
+    line_order NUMBER NOT NULL,
+    row_label VARCHAR(500),
+    row_type VARCHAR(20) NOT NULL,         -- 'header', 'blank', 'section_header', 'subsection_header',
+                                           -- 'accounts', 'subtotal', 'calculated', 'total'
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    includes_unassigned BOOLEAN DEFAULT FALSE,
+    calc_terms VARIANT,                    -- [{"mapping_level_1": "Revenue", "sign": 1}, ...]
+    formula_template VARCHAR(5000),
+    row_format_json VARCHAR(5000),
+    
+    PRIMARY KEY (template_name, statement_type, line_order)
+);
 
-CREATE OR REPLACE PROCEDURE generate_income_statement(deal_id_param VARCHAR)
+-- Generated schedule rows per deal (replaces the per-session temp_is_schedule / temp_bs_schedule)
+CREATE TABLE IF NOT EXISTS schedule_rows (
+    deal_id VARCHAR(50) NOT NULL,
+    statement_type VARCHAR(20) NOT NULL,
+    row_num NUMBER NOT NULL,
+    template_name VARCHAR(50),
+    line_order NUMBER,
+    row_label VARCHAR(500),
+    row_type VARCHAR(20),
+    account_number VARCHAR(50),
+    account_filter VARCHAR(600),
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    formula_template VARCHAR(5000),
+    row_format_json VARCHAR(5000),
+    generated_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    
+    PRIMARY KEY (deal_id, statement_type, row_num)
+);
+
+ALTER TABLE schedule_rows CLUSTER BY (deal_id, statement_type);
+
+-- STANDARD template (reseeded on every deployment; other templates are kept)
+DELETE FROM schedule_templates WHERE template_name = 'STANDARD';
+
+INSERT INTO schedule_templates (
+    template_name, statement_type, line_order, row_label, row_type,
+    mapping_level_1, mapping_level_2, includes_unassigned, calc_terms, formula_template, row_format_json
+)
+SELECT 'STANDARD', column1, column2, column3, column4, column5, column6, TO_BOOLEAN(column7),
+       PARSE_JSON(column8), column9, column10
+FROM VALUES
+    -- Income Statement
+    ('IS', 10, 'Income Statement ($000s)', 'header', NULL, NULL, 0, NULL, 'PERIOD_LABEL',
+     '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
+    ('IS', 20, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 30, 'Revenue', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('IS', 40, NULL, 'accounts', 'Revenue', NULL, 0, NULL, NULL, NULL),
+    ('IS', 50, 'Total Revenue', 'subtotal', 'Revenue', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('IS', 60, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 70, 'Cost of Goods Sold', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('IS', 80, NULL, 'accounts', 'Cost of Goods Sold', NULL, 0, NULL, NULL, NULL),
+    ('IS', 90, 'Total Cost of Goods Sold', 'subtotal', 'Cost of Goods Sold', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('IS', 100, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 110, 'Gross Margin', 'calculated', NULL, NULL, 0,
+     '[{"mapping_level_1": "Revenue", "sign": 1}, {"mapping_level_1": "Cost of Goods Sold", "sign": -1}]', NULL,
+     '{"bold": true, "border_bottom": true, "number_format": "#,##0"}'),
+    ('IS', 120, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 130, 'Operating Expenses', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('IS', 140, NULL, 'accounts', 'Operating Expenses', NULL, 0, NULL, NULL, NULL),
+    ('IS', 150, 'Total Operating Expenses', 'subtotal', 'Operating Expenses', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('IS', 160, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('IS', 170, 'Operating Income', 'total', NULL, NULL, 0,
+     '[{"mapping_level_1": "Revenue", "sign": 1}, {"mapping_level_1": "Cost of Goods Sold", "sign": -1}, {"mapping_level_1": "Operating Expenses", "sign": -1}]', NULL,
+     '{"bold": true, "border_bottom_double": true, "number_format": "#,##0"}'),
+    
+    -- Balance Sheet
+    ('BS', 10, 'Balance Sheet ($000s)', 'header', NULL, NULL, 0, NULL, 'PERIOD_LABEL',
+     '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
+    ('BS', 20, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 30, 'ASSETS', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('BS', 40, 'Current Assets', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 50, NULL, 'accounts', 'Assets', 'Current Assets', 1, NULL, NULL, NULL),
+    ('BS', 60, '  Total Current Assets', 'subtotal', 'Assets', 'Current Assets', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 70, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 80, 'Non-Current Assets', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 90, NULL, 'accounts', 'Assets', 'Non-Current Assets', 0, NULL, NULL, NULL),
+    ('BS', 100, '  Total Non-Current Assets', 'subtotal', 'Assets', 'Non-Current Assets', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 110, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 120, 'TOTAL ASSETS', 'subtotal', 'Assets', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_bottom_double": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('BS', 130, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 140, 'LIABILITIES', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('BS', 150, 'Current Liabilities', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 160, NULL, 'accounts', 'Liabilities', 'Current Liabilities', 1, NULL, NULL, NULL),
+    ('BS', 170, '  Total Current Liabilities', 'subtotal', 'Liabilities', 'Current Liabilities', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 180, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 190, 'Non-Current Liabilities', 'subsection_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 2, "indent": 1}'),
+    ('BS', 200, NULL, 'accounts', 'Liabilities', 'Non-Current Liabilities', 0, NULL, NULL, NULL),
+    ('BS', 210, '  Total Non-Current Liabilities', 'subtotal', 'Liabilities', 'Non-Current Liabilities', 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
+    ('BS', 220, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 230, 'TOTAL LIABILITIES', 'subtotal', 'Liabilities', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('BS', 240, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 250, 'EQUITY', 'section_header', NULL, NULL, 0, NULL, NULL, '{"bold": true, "outline_level": 1}'),
+    ('BS', 260, NULL, 'accounts', 'Equity', NULL, 0, NULL, NULL, NULL),
+    ('BS', 270, 'TOTAL EQUITY', 'subtotal', 'Equity', NULL, 0, NULL, NULL,
+     '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
+    ('BS', 280, '', 'blank', NULL, NULL, 0, NULL, NULL, '{}'),
+    ('BS', 290, 'TOTAL LIABILITIES AND EQUITY', 'total', NULL, NULL, 0,
+     '[{"mapping_level_1": "Liabilities", "sign": 1}, {"mapping_level_1": "Equity", "sign": 1}]', NULL,
+     '{"bold": true, "border_bottom_double": true, "number_format": "#,##0"}');
+
+-- ============================================================================
+-- PART 3: SCHEDULE BUILDER
+-- ============================================================================
+
+-- Build the Income Statement and/or Balance Sheet rows for a deal from the
+-- schedule_template_name template in one set-based INSERT
+-- statement_type_param: 'IS', 'BS' or NULL for both
+CREATE OR REPLACE PROCEDURE build_schedules(deal_id_param VARCHAR, statement_type_param VARCHAR DEFAULT NULL, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -1527,6 +2701,8 @@ $$
 DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    template_var VARCHAR DEFAULT COALESCE(get_config_string('schedule_template_name'), 'STANDARD');
+    statement_var VARCHAR;
     rows_created NUMBER DEFAULT 0;
     session_id VARCHAR DEFAULT CURRENT_SESSION()::VARCHAR;
     error_msg VARCHAR;
@@ -1536,160 +2712,158 @@ BEGIN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
+    statement_var := UPPER(:statement_type_param);
+    IF (:statement_var IS NOT NULL AND :statement_var NOT IN ('IS', 'BS')) THEN
+        RETURN 'ERROR: Invalid statement_type ''' || :statement_var || '''. Use IS, BS or NULL.';
+    END IF;
+    
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, session_id)
-    VALUES (:log_id_var, 'generate_income_statement', :deal_id_param, :start_time_var, 'STARTED', :session_id);
-    
-    -- Create session-specific temp table (isolated per user/session)
-    CREATE OR REPLACE TEMPORARY TABLE temp_is_schedule (
-        row_num NUMBER AUTOINCREMENT,
-        row_label VARCHAR(500),
-        row_type VARCHAR(20),
-        account_filter VARCHAR(600),
-        formula_template VARCHAR(5000),
-        row_format_json VARCHAR(5000)
-    );
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, session_id)
+        VALUES (:log_id_var, 'build_schedules', :deal_id_param, :start_time_var, 'STARTED', :session_id);
+    END IF;
     
-    -- Header
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, formula_template, row_format_json)
-    VALUES 
-        ('Income Statement ($000s)', 'header', NULL, 'PERIOD_LABEL', 
-         '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
-        ('', 'blank', NULL, NULL, '{}'),
-        ('Revenue', 'section_header', NULL, NULL, '{"bold": true, "outline_level": 1}');
+    BEGIN TRANSACTION;
     
-    -- Revenue accounts (flexible mapping depth)
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'IS' 
-    AND mapping_level_1 = 'Revenue'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Total Revenue', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Cost of Goods Sold', 'section_header', NULL, '{"bold": true, "outline_level": 1}');
-    
-    -- COGS accounts
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'IS' 
-    AND mapping_level_1 = 'Cost of Goods Sold'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Total Cost of Goods Sold', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Gross Margin', 'calculated', NULL, 
-         '{"bold": true, "border_bottom": true, "number_format": "#,##0"}'),
-        ('', 'blank', NULL, '{}'),
-        ('Operating Expenses', 'section_header', NULL, '{"bold": true, "outline_level": 1}');
-    
-    -- OpEx accounts
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
+    DELETE FROM schedule_rows
+    WHERE deal_id = :deal_id_param
+    AND (:statement_var IS NULL OR statement_type = :statement_var);
+    
+    INSERT INTO schedule_rows (
+        deal_id, statement_type, row_num, template_name, line_order, row_label, row_type,
+        account_number, account_filter, mapping_level_1, mapping_level_2, formula_template, row_format_json
+    )
+    WITH template AS (
+        SELECT *
+        FROM schedule_templates
+        WHERE template_name = :template_var
+        AND (:statement_var IS NULL OR statement_type = :statement_var)
+    ),
+    -- Each active account lands on exactly one 'accounts' line
+    placed_accounts AS (
+        SELECT 
+            t.statement_type,
+            t.line_order,
+            m.account_number,
+            m.account_name,
+            m.mapping_level_1,
+            m.mapping_level_2,
+            m.mapping_level_3,
+            m.sort_order_l1,
+            m.sort_order_l2,
+            m.sort_order_l3
+        FROM template t
+        JOIN account_mappings m
+            ON m.statement_type = t.statement_type
+            AND m.mapping_level_1 = t.mapping_level_1
+            AND (t.mapping_level_2 IS NULL OR t.mapping_level_2 = m.mapping_level_2 OR t.includes_unassigned)
+        WHERE t.row_type = 'accounts'
+        AND m.deal_id = :deal_id_param
+        AND m.is_active = TRUE
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY t.statement_type, m.account_number
+            ORDER BY IFF(EQUAL_NULL(t.mapping_level_2, m.mapping_level_2), 0, 1),
+                     IFF(t.mapping_level_2 IS NULL, 0, 1),
+                     t.line_order
+        ) = 1
+    ),
+    schedule_lines AS (
+        SELECT 
+            statement_type, line_order,
+            0 AS sort_l1, 0 AS sort_l2, 0 AS sort_l3,
+            row_label, row_type,
+            NULL AS account_number, NULL AS account_filter,
+            mapping_level_1, mapping_level_2, formula_template, row_format_json
+        FROM template
+        WHERE row_type <> 'accounts'
+        
+        UNION ALL
+        
+        -- Data rows (flexible mapping depth)
+        SELECT 
+            statement_type, line_order,
+            sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999),
+            CASE 
+                WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
+                WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
+                ELSE account_name
+            END,
+            'data',
+            account_number,
+            account_number || ' - ' || account_name,
+            mapping_level_1, mapping_level_2, NULL,
+            OBJECT_CONSTRUCT(
+                'number_format', '#,##0',
+                'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
+                                     WHEN mapping_level_2 IS NOT NULL THEN 2
+                                     ELSE 1 END,
+                'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
+                              WHEN mapping_level_2 IS NOT NULL THEN 1
+                              ELSE 0 END
+            )::VARCHAR
+        FROM placed_accounts
+    )
     SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'IS' 
-    AND mapping_level_1 = 'Operating Expenses'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_is_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Total Operating Expenses', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Operating Income', 'total', NULL, 
-         '{"bold": true, "border_bottom_double": true, "number_format": "#,##0"}');
-    
-    SELECT COUNT(*) INTO :rows_created FROM temp_is_schedule;
+        :deal_id_param,
+        statement_type,
+        ROW_NUMBER() OVER (PARTITION BY statement_type ORDER BY line_order, sort_l1, sort_l2, sort_l3, account_number),
+        :template_var,
+        line_order, row_label, row_type, account_number, account_filter,
+        mapping_level_1, mapping_level_2, formula_template, row_format_json
+    FROM schedule_lines;
+    
+    rows_created := SQLROWCOUNT;
+    
+    COMMIT;
     
     -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :rows_created
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = IFF(:rows_created = 0, 'WARNING', 'SUCCESS'),
+            rows_affected = :rows_created,
+            message = 'Template ' || :template_var || ', ' || COALESCE(:statement_var, 'IS and BS')
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    IF (:rows_created = 0) THEN
+        RETURN 'WARNING: Schedule template ''' || :template_var || ''' has no lines for ' || COALESCE(:statement_var, 'IS or BS');
+    END IF;
     
-    RETURN 'SUCCESS: Generated Income Statement with ' || :rows_created || ' rows';
+    RETURN 'SUCCESS: Generated ' || COALESCE(:statement_var, 'IS and BS') || ' schedules with ' || :rows_created || ' rows';
     
 EXCEPTION
     WHEN OTHER THEN
         error_msg := SQLERRM;
         
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = :error_msg
-        WHERE log_id = :log_id_var;
+        ROLLBACK;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
         
         RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
--- ============================================================================
--- PART 3: BALANCE SHEET GENERATION
--- ============================================================================
+-- Single-statement entry points (kept for existing callers and runbooks)
+CREATE OR REPLACE PROCEDURE generate_income_statement(deal_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    result VARCHAR;
+BEGIN
+    CALL build_schedules(:deal_id_param, 'IS') INTO :result;
+    RETURN :result;
+END;
+$$;
 
 CREATE OR REPLACE PROCEDURE generate_balance_sheet(deal_id_param VARCHAR)
 RETURNS VARCHAR
@@ -1697,103 +2871,232 @@ LANGUAGE SQL
 AS
 $$
 DECLARE
-    log_id_var VARCHAR DEFAULT UUID_STRING();
-    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
-    rows_created NUMBER DEFAULT 0;
-    session_id VARCHAR DEFAULT CURRENT_SESSION()::VARCHAR;
-    error_msg VARCHAR;
+    result VARCHAR;
 BEGIN
-    -- Validate input
-    IF (NOT validate_deal_id(:deal_id_param)) THEN
-        RETURN 'ERROR: Invalid deal_id format';
-    END IF;
-    
-    -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, session_id)
-    VALUES (:log_id_var, 'generate_balance_sheet', :deal_id_param, :start_time_var, 'STARTED', :session_id);
-    
-    -- Create session-specific temp table
-    CREATE OR REPLACE TEMPORARY TABLE temp_bs_schedule (
-        row_num NUMBER AUTOINCREMENT,
-        row_label VARCHAR(500),
-        row_type VARCHAR(20),
-        account_filter VARCHAR(600),
-        row_format_json VARCHAR(5000)
-    );
-    
-    -- Header
-    INSERT INTO temp_bs_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('Balance Sheet ($000s)', 'header', NULL, 
-         '{"bold": true, "font_size": 12, "bg_color": "#4472C4", "font_color": "white"}'),
-        ('', 'blank', NULL, '{}'),
-        ('ASSETS', 'section_header', NULL, '{"bold": true, "outline_level": 1}'),
-        ('Current Assets', 'subsection_header', NULL, '{"bold": true, "outline_level": 2, "indent": 1}');
-    
-    -- Current Assets
-    INSERT INTO temp_bs_schedule (row_label, row_type, account_filter, row_format_json)
-    SELECT 
-        CASE 
-            WHEN mapping_level_3 IS NOT NULL THEN '    ' || mapping_level_3
-            WHEN mapping_level_2 IS NOT NULL THEN '  ' || mapping_level_2
-            ELSE account_name
-        END AS row_label,
-        'data',
-        account_number || ' - ' || account_name,
-        OBJECT_CONSTRUCT(
-            'number_format', '#,##0',
-            'outline_level', CASE WHEN mapping_level_3 IS NOT NULL THEN 3
-                                 WHEN mapping_level_2 IS NOT NULL THEN 2
-                                 ELSE 1 END,
-            'indent', CASE WHEN mapping_level_3 IS NOT NULL THEN 2
-                          WHEN mapping_level_2 IS NOT NULL THEN 1
-                          ELSE 0 END
-        )::VARCHAR
-    FROM account_mappings
-    WHERE deal_id = :deal_id_param 
-    AND statement_type = 'BS' 
-    AND mapping_level_1 = 'Assets' 
-    AND COALESCE(mapping_level_2, 'Current Assets') = 'Current Assets'
-    AND is_active = TRUE
-    ORDER BY sort_order_l1, COALESCE(sort_order_l2, 999), COALESCE(sort_order_l3, 999);
-    
-    INSERT INTO temp_bs_schedule (row_label, row_type, account_filter, row_format_json)
-    VALUES 
-        ('  Total Current Assets', 'subtotal', NULL, 
-         '{"bold": true, "border_top": true, "number_format": "#,##0", "outline_level": 2, "indent": 1}'),
-        ('', 'blank', NULL, '{}'),
-        ('Non-Current Assets', 'subsection_header', NULL, 
-         '{"bold": true, "outline_level": 2, "indent": 1}');
-    
-    -- Add remaining BS sections (Non-Current Assets, Liabilities, Equity)
-    -- ... (similar pattern as above)
-    
-    SELECT COUNT(*) INTO :rows_created FROM temp_bs_schedule;
-    
-    -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :rows_created
-    WHERE log_id = :log_id_var;
+    CALL build_schedules(:deal_id_param, 'BS') INTO :result;
+    RETURN :result;
+END;
+$$;
+
+GRANT SELECT ON TABLE schedule_templates TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE schedule_rows TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE schedule_rows TO ROLE FDD_READONLY_ROLE;
+
+-- ============================================================================
+-- PART 4: SCHEDULE VALUES
+-- ============================================================================
+-- Period amounts for every account and mapping level, computed with one
+-- ROLLUP over mapping_level_1..3 and cached per deal and data version
+-- (deal_data_versions). v_schedule_values lays them onto schedule_rows:
+-- data rows read the account, mapping_level_1 subtotals the level rollup,
+-- mapping_level_2 subtotals the data rows placed under them, calculated and
+-- total rows the signed sum of their calc_terms.
+
+CREATE TABLE IF NOT EXISTS schedule_values (
+    deal_id VARCHAR(50) NOT NULL,
+    data_version NUMBER NOT NULL,
+    statement_type VARCHAR(20) NOT NULL,
+    rollup_level VARCHAR(20) NOT NULL,     -- 'ACCOUNT', 'LEVEL_3', 'LEVEL_2', 'LEVEL_1', 'STATEMENT'
+    mapping_level_1 VARCHAR(200),
+    mapping_level_2 VARCHAR(200),
+    mapping_level_3 VARCHAR(200),
+    account_number VARCHAR(50),
+    period_date DATE NOT NULL,
+    amount NUMBER(18,2)
+);
+
+ALTER TABLE schedule_values CLUSTER BY (deal_id, statement_type);
+
+-- Data version each deal's schedule_values were computed from
+CREATE TABLE IF NOT EXISTS schedule_values_cache (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    data_version NUMBER NOT NULL,
+    value_count NUMBER,
+    computed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- Compute a deal's schedule values unless the cached ones match its data version
+CREATE OR REPLACE PROCEDURE refresh_schedule_values(deal_id_param VARCHAR, force_refresh BOOLEAN DEFAULT FALSE, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    current_version NUMBER DEFAULT 0;
+    cached_version NUMBER;
+    rows_created NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    IF (NOT validate_deal_id(:deal_id_param)) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    SELECT COALESCE(MAX(data_version), 0) INTO :current_version
+    FROM deal_data_versions
+    WHERE deal_id = :deal_id_param;
+    
+    SELECT MAX(data_version) INTO :cached_version
+    FROM schedule_values_cache
+    WHERE deal_id = :deal_id_param;
+    
+    IF (NOT :force_refresh AND :cached_version = :current_version) THEN
+        RETURN 'SUCCESS: Schedule values for ' || :deal_id_param || ' are current (data version ' || :current_version || ')';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+        VALUES (:log_id_var, 'refresh_schedule_values', :deal_id_param, :start_time_var, 'STARTED');
+    END IF;
+    
+    BEGIN TRANSACTION;
+    
+    DELETE FROM schedule_values WHERE deal_id = :deal_id_param;
+    DELETE FROM schedule_values_cache WHERE deal_id = :deal_id_param;
+    
+    INSERT INTO schedule_values (
+        deal_id, data_version, statement_type, rollup_level,
+        mapping_level_1, mapping_level_2, mapping_level_3, account_number, period_date, amount
+    )
+    SELECT 
+        deal_id,
+        :current_version,
+        statement_type,
+        CASE GROUPING_ID(mapping_level_1, mapping_level_2, mapping_level_3, account_number)
+            WHEN 0 THEN 'ACCOUNT'
+            WHEN 1 THEN 'LEVEL_3'
+            WHEN 3 THEN 'LEVEL_2'
+            WHEN 7 THEN 'LEVEL_1'
+            ELSE 'STATEMENT'
+        END,
+        mapping_level_1,
+        mapping_level_2,
+        mapping_level_3,
+        account_number,
+        period_date,
+        SUM(amount_for_display)
+    FROM trial_balance_for_schedules
+    WHERE deal_id = :deal_id_param
+    AND statement_type IN ('IS', 'BS')
+    GROUP BY deal_id, statement_type, period_date,
+             ROLLUP (mapping_level_1, mapping_level_2, mapping_level_3, account_number);
+    
+    rows_created := SQLROWCOUNT;
     
-    RETURN 'SUCCESS: Generated Balance Sheet with ' || :rows_created || ' rows';
+    INSERT INTO schedule_values_cache (deal_id, data_version, value_count)
+    VALUES (:deal_id_param, :current_version, :rows_created);
+    
+    COMMIT;
+    
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :rows_created,
+            message = 'Schedule values computed for data version ' || :current_version
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Computed ' || :rows_created || ' schedule values for ' || :deal_id_param ||
+           ' (data version ' || :current_version || ')';
     
 EXCEPTION
     WHEN OTHER THEN
         error_msg := SQLERRM;
         
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = :error_msg
-        WHERE log_id = :log_id_var;
+        ROLLBACK;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
         
         RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
+-- Schedule rows with their computed period amounts (headers and blanks carry no values)
+CREATE OR REPLACE VIEW v_schedule_values AS
+WITH row_terms AS (
+    -- Data rows: the account itself
+    SELECT deal_id, statement_type, row_num, row_label, row_type,
+           'ACCOUNT' AS rollup_level, mapping_level_1, NULL AS mapping_level_2, account_number, 1 AS sign
+    FROM schedule_rows
+    WHERE row_type = 'data'
+    
+    UNION ALL
+    
+    -- mapping_level_1 subtotals: the level rollup
+    SELECT deal_id, statement_type, row_num, row_label, row_type,
+           'LEVEL_1', mapping_level_1, NULL, NULL, 1
+    FROM schedule_rows
+    WHERE row_type = 'subtotal'
+    AND mapping_level_2 IS NULL
+    
+    UNION ALL
+    
+    -- mapping_level_2 subtotals: every data row placed on an 'accounts' line of
+    -- that mapping_level_2, so accounts placed there by includes_unassigned
+    -- (NULL or unmatched mapping_level_2) are counted where they are shown
+    SELECT s.deal_id, s.statement_type, s.row_num, s.row_label, s.row_type,
+           'ACCOUNT', d.mapping_level_1, NULL, d.account_number, 1
+    FROM schedule_rows s
+    JOIN schedule_rows d
+        ON d.deal_id = s.deal_id
+        AND d.statement_type = s.statement_type
+        AND d.row_type = 'data'
+    JOIN schedule_templates t
+        ON t.template_name = d.template_name
+        AND t.statement_type = d.statement_type
+        AND t.line_order = d.line_order
+    WHERE s.row_type = 'subtotal'
+    AND s.mapping_level_2 IS NOT NULL
+    AND t.mapping_level_1 = s.mapping_level_1
+    AND t.mapping_level_2 = s.mapping_level_2
+    
+    UNION ALL
+    
+    -- Calculated and total rows: signed mapping_level_1 rollups from the template
+    SELECT r.deal_id, r.statement_type, r.row_num, r.row_label, r.row_type,
+           'LEVEL_1', term.value:mapping_level_1::VARCHAR, NULL, NULL, term.value:sign::NUMBER
+    FROM schedule_rows r
+    JOIN schedule_templates t
+        ON t.template_name = r.template_name
+        AND t.statement_type = r.statement_type
+        AND t.line_order = r.line_order,
+    LATERAL FLATTEN(INPUT => t.calc_terms) term
+    WHERE r.row_type IN ('calculated', 'total')
+)
+SELECT 
+    rt.deal_id,
+    rt.statement_type,
+    rt.row_num,
+    rt.row_label,
+    rt.row_type,
+    v.period_date,
+    TO_CHAR(v.period_date, 'Mon-YYYY') AS period_label,
+    SUM(v.amount * rt.sign) AS amount,
+    v.data_version
+FROM row_terms rt
+JOIN schedule_values v
+    ON v.deal_id = rt.deal_id
+    AND v.statement_type = rt.statement_type
+    AND v.rollup_level = rt.rollup_level
+    AND v.mapping_level_1 = rt.mapping_level_1
+    AND (rt.mapping_level_2 IS NULL OR v.mapping_level_2 = rt.mapping_level_2)
+    AND (rt.account_number IS NULL OR v.account_number = rt.account_number)
+GROUP BY rt.deal_id, rt.statement_type, rt.row_num, rt.row_label, rt.row_type, v.period_date, v.data_version;
+
+GRANT SELECT ON TABLE schedule_values TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE schedule_values_cache TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_schedule_values TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_schedule_values TO ROLE FDD_READONLY_ROLE;
+
 SELECT 'Schedule generation procedures created successfully' AS status;
 
 
@@ -1813,7 +3116,63 @@ SELECT 'Schedule generation procedures created successfully' AS status;
 -- PART 1: AI INSIGHTS GENERATION
 -- ============================================================================
 
-CREATE OR REPLACE PROCEDURE generate_ai_insights(deal_id_param VARCHAR)
+-- Drop the pre-cache and pre-trace signatures; with DEFAULT parameters they
+-- would be ambiguous overloads
+EXECUTE IMMEDIATE $$
+BEGIN
+    DROP PROCEDURE IF EXISTS generate_ai_insights(VARCHAR);
+    DROP PROCEDURE IF EXISTS generate_ai_insights(VARCHAR, BOOLEAN);
+    DROP PROCEDURE IF EXISTS export_database_tab(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_income_statement_structure(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_balance_sheet_structure(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_schedule_values(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_ai_insights(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_fdd_workbook(VARCHAR);
+    DROP PROCEDURE IF EXISTS export_partitioned(VARCHAR, VARCHAR, VARCHAR);
+    DROP PROCEDURE IF EXISTS export_fdd_outputs_parallel(VARCHAR);
+EXCEPTION
+    WHEN OTHER THEN
+        -- Ignore errors if procedure doesn't exist
+        RETURN 'Procedures dropped or did not exist';
+END;
+$$;
+
+-- Estimated USD cost of a Cortex call from its token counts and a rate card
+-- (ai_cost_per_million_tokens_usd already resolved by the caller, falling back
+-- to its "default" rate)
+CREATE OR REPLACE FUNCTION estimate_cortex_cost_usd(model_name VARCHAR, prompt_tokens NUMBER, completion_tokens NUMBER, token_prices OBJECT)
+RETURNS NUMBER(10,4)
+LANGUAGE SQL
+AS
+$$
+    (COALESCE(prompt_tokens, 0) + COALESCE(completion_tokens, 0)) / 1000000
+    * COALESCE(token_prices[model_name]::FLOAT, token_prices:default::FLOAT)
+$$;
+
+-- Same estimate priced with the current ai_cost_per_million_tokens_usd
+CREATE OR REPLACE FUNCTION estimate_cortex_cost_usd(model_name VARCHAR, prompt_tokens NUMBER, completion_tokens NUMBER)
+RETURNS NUMBER(10,4)
+LANGUAGE SQL
+AS
+$$
+    SELECT estimate_cortex_cost_usd(model_name, prompt_tokens, completion_tokens,
+                                    config_values:ai_cost_per_million_tokens_usd::OBJECT)
+    FROM v_config_snapshot
+$$;
+
+-- Cortex completions are cached in ai_completion_cache by SHA2(model || '|' || prompt).
+-- Unchanged prompts reuse the stored answer; pass force_refresh => TRUE to re-ask Cortex.
+-- Cache writes happen outside the insight transaction so completed calls are kept
+-- even if the run fails later.
+--
+-- Models come from config: ai_model_variance (high/medium variances),
+-- ai_model_low_severity (low variances) and ai_model_trends (margin trend).
+-- Every Cortex call is recorded in ai_token_usage with its token counts. Calls
+-- are made within the day's token budgets (ai_deal_daily_token_budget per deal,
+-- ai_daily_token_budget across deals): cache misses are ranked high, medium,
+-- low severity and the lowest-severity prompts are skipped once the estimated
+-- tokens exceed what is left.
+CREATE OR REPLACE PROCEDURE generate_ai_insights(deal_id_param VARCHAR, force_refresh BOOLEAN DEFAULT FALSE, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -1822,135 +3181,460 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     insight_count NUMBER DEFAULT 0;
-    ai_model VARCHAR DEFAULT get_config_string('ai_model_variance');
-    max_insights NUMBER DEFAULT get_config_number('max_ai_insights');
+    config_version_var NUMBER;
+    run_config OBJECT;
+    variance_model VARCHAR;
+    bulk_model VARCHAR;
+    trends_model VARCHAR;
+    max_insights NUMBER;
+    completion_tokens_estimate NUMBER;
+    min_variance_amount FLOAT;
+    variance_threshold FLOAT;
+    deal_token_budget NUMBER;
+    daily_token_budget NUMBER;
+    token_prices OBJECT;
+    tokens_remaining NUMBER;
+    tokens_used NUMBER DEFAULT 0;
+    cache_hits NUMBER DEFAULT 0;
+    cache_misses NUMBER DEFAULT 0;
+    calls_skipped NUMBER DEFAULT 0;
+    invalid_models NUMBER DEFAULT 0;
+    call_model VARCHAR;
+    call_sql VARCHAR;
+    margin_data VARCHAR;
+    margin_prompt VARCHAR;
+    margin_key VARCHAR;
+    margin_analysis VARCHAR;
+    cache_summary VARCHAR;
     error_msg VARCHAR;
+    invalid_model EXCEPTION (-20017, 'Invalid Cortex model name in system_config');
+    call_models CURSOR FOR SELECT DISTINCT model_name FROM temp_ai_calls WHERE call_allowed;
 BEGIN
+    -- Settings for the whole run, resolved once and bound below
+    SELECT 
+        config_version,
+        config_values,
+        COALESCE(TRIM(config_values:ai_model_variance::VARCHAR, '"'), 'mistral-large'),
+        COALESCE(TRIM(config_values:ai_model_low_severity::VARCHAR, '"'), TRIM(config_values:ai_model_variance::VARCHAR, '"'), 'mistral-large'),
+        COALESCE(TRIM(config_values:ai_model_trends::VARCHAR, '"'), 'mistral-large'),
+        config_values:max_ai_insights::NUMBER,
+        COALESCE(config_values:ai_estimated_completion_tokens::NUMBER, 150),
+        config_values:min_variance_amount::FLOAT,
+        config_values:variance_threshold_pct::FLOAT,
+        config_values:ai_deal_daily_token_budget::NUMBER,
+        config_values:ai_daily_token_budget::NUMBER,
+        config_values:ai_cost_per_million_tokens_usd::OBJECT
+    INTO :config_version_var, :run_config, :variance_model, :bulk_model, :trends_model,
+         :max_insights, :completion_tokens_estimate, :min_variance_amount, :variance_threshold,
+         :deal_token_budget, :daily_token_budget, :token_prices
+    FROM v_config_snapshot;
+    
     -- Validate input
-    IF (NOT validate_deal_id(:deal_id_param)) THEN
+    IF (NOT validate_deal_id(:deal_id_param, :run_config)) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'generate_ai_insights', :deal_id_param, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'generate_ai_insights', :deal_id_param, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
+    
+    -- Step 1: Variance Analysis (period-over-period > threshold%)
+    -- Build and fingerprint the prompts first so Cortex is only called for cache misses
+    CREATE OR REPLACE TEMPORARY TABLE temp_variance_prompts AS
+    SELECT 
+        prompts.*,
+        CASE WHEN prompts.severity = 'low' THEN :bulk_model ELSE :variance_model END AS model_name,
+        SHA2(model_name || '|' || prompts.prompt_text, 256) AS cache_key
+    FROM (
+        SELECT 
+            variance_data.*,
+            CASE 
+                WHEN ABS(variance_data.var_pct) > 50 THEN 'high'
+                WHEN ABS(variance_data.var_pct) > 30 THEN 'medium'
+                ELSE 'low'
+            END AS severity,
+            'Analyze this financial variance for a due diligence review: Account "' || variance_data.account_name || 
+            '" changed from $' || TO_CHAR(ABS(variance_data.prior_net_amount), '999,999,999') || 
+            ' to $' || TO_CHAR(ABS(variance_data.net_amount), '999,999,999') || 
+            ' (' || ROUND(variance_data.var_pct, 1) || '% change) between ' || 
+            TO_CHAR(variance_data.prior_period_date, 'Mon YYYY') || ' and ' || TO_CHAR(variance_data.period_date, 'Mon YYYY') || 
+            '. Provide a 2-sentence explanation of potential business reasons for this variance that a due diligence analyst should investigate.' AS prompt_text
+        FROM (
+            SELECT 
+                deal_id, period_date, account_number, account_name, net_amount,
+                prior_net_amount, var_pct, prior_period_date
+            FROM v_variance_candidates
+            WHERE deal_id = :deal_id_param
+              AND prior_abs_amount > :min_variance_amount
+              AND variance_ratio > :variance_threshold
+        ) AS variance_data
+        ORDER BY ABS(variance_data.var_pct) DESC
+        LIMIT :max_insights
+    ) AS prompts;
+    
+    -- Step 2: Margin Trend Analysis prompt
+    -- Build margin trend data string
+    SELECT LISTAGG(
+        TO_CHAR(period_date, 'Mon-YY') || ': ' || TO_CHAR(ROUND(gross_margin_pct, 1), '990.0') || '%', 
+        ', '
+    ) WITHIN GROUP (ORDER BY period_date)
+    INTO :margin_data
+    FROM (
+        SELECT 
+            t.period_date,
+            (SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN t.net_amount ELSE 0 END) +
+             SUM(CASE WHEN m.mapping_level_1 = 'Cost of Goods Sold' THEN t.net_amount ELSE 0 END)) /
+            NULLIF(SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN ABS(t.net_amount) ELSE 0 END), 0) * 100 AS gross_margin_pct
+        FROM trial_balance_raw t
+        JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
+        WHERE t.deal_id = :deal_id_param
+        GROUP BY t.period_date
+        ORDER BY t.period_date
+    );
+    
+    IF (:margin_data IS NOT NULL) THEN
+        margin_prompt := 'Analyze the following gross margin trend over 24 months for a company undergoing due diligence: ' ||
+                         :margin_data ||
+                         '. Identify any concerning trends, seasonality patterns, or margin compression/expansion. Provide 3 specific questions for management in 150 words.';
+        margin_key := SHA2(:trends_model || '|' || :margin_prompt, 256);
+    END IF;
+    
+    -- Every completion the run needs, with its severity and estimated tokens
+    -- (about 4 characters per prompt token)
+    CREATE OR REPLACE TEMPORARY TABLE temp_ai_calls AS
+    SELECT 
+        cache_key, model_name, prompt_text, insight_type, severity, priority,
+        CEIL(LENGTH(prompt_text) / 4) + :completion_tokens_estimate AS estimated_tokens,
+        FALSE AS cached,
+        FALSE AS call_allowed
+    FROM (
+        SELECT cache_key, model_name, prompt_text, 'variance' AS insight_type, severity, MAX(ABS(var_pct)) AS priority
+        FROM temp_variance_prompts
+        GROUP BY cache_key, model_name, prompt_text, severity
+        UNION ALL
+        SELECT :margin_key, :trends_model, :margin_prompt, 'trend_analysis', 'medium', 0
+        WHERE :margin_prompt IS NOT NULL
+    );
+    
+    -- Cortex model names are spliced into the COMPLETE calls below
+    SELECT COUNT_IF(NOT REGEXP_LIKE(model_name, '[a-z0-9][a-z0-9._-]*')) INTO :invalid_models FROM temp_ai_calls;
+    IF (:invalid_models > 0) THEN
+        RAISE invalid_model;
+    END IF;
+    
+    IF (:force_refresh) THEN
+        DELETE FROM ai_completion_cache
+        WHERE cache_key IN (SELECT cache_key FROM temp_ai_calls);
+    END IF;
+    
+    UPDATE temp_ai_calls t
+    SET cached = TRUE
+    FROM ai_completion_cache c
+    WHERE c.cache_key = t.cache_key;
+    
+    SELECT COUNT_IF(cached), COUNT_IF(NOT cached)
+    INTO :cache_hits, :cache_misses
+    FROM temp_ai_calls;
+    
+    -- Mark hits as used (drives LRU eviction)
+    UPDATE ai_completion_cache
+    SET last_used_timestamp = CURRENT_TIMESTAMP(),
+        hit_count = hit_count + 1
+    WHERE cache_key IN (SELECT cache_key FROM temp_ai_calls WHERE cached);
+    
+    -- Tokens left today: the smaller of the deal's and the account-wide budget
+    SELECT GREATEST(LEAST(
+               COALESCE(:deal_token_budget - COALESCE(SUM(IFF(deal_id = :deal_id_param, total_tokens, 0)), 0), 1e15),
+               COALESCE(:daily_token_budget - COALESCE(SUM(total_tokens), 0), 1e15)
+           ), 0)
+    INTO :tokens_remaining
+    FROM ai_token_usage
+    WHERE call_date = CURRENT_DATE();
+    
+    -- Cache misses in severity order; the low-severity tail is cut at the budget
+    UPDATE temp_ai_calls t
+    SET call_allowed = TRUE
+    FROM (
+        SELECT 
+            cache_key,
+            SUM(estimated_tokens) OVER (
+                ORDER BY CASE severity WHEN 'high' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END, priority DESC, cache_key
+                ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ) AS running_tokens
+        FROM temp_ai_calls
+        WHERE NOT cached
+    ) r
+    WHERE r.cache_key = t.cache_key
+    AND r.running_tokens <= :tokens_remaining;
+    
+    SELECT COUNT_IF(NOT cached AND NOT call_allowed) INTO :calls_skipped FROM temp_ai_calls;
+    
+    -- Use Cortex AI for allowed misses, one statement per model (the model must be a
+    -- literal string per Snowflake Cortex requirements). The options argument makes
+    -- COMPLETE return the usage (token counts) with the answer.
+    FOR model_row IN call_models DO
+        call_model := model_row.model_name;
+        call_sql := 'INSERT INTO ai_completion_cache (cache_key, model_name, prompt_text, completion_text, prompt_tokens, completion_tokens) ' ||
+                    'SELECT cache_key, model_name, prompt_text, r:choices[0]:messages::VARCHAR, ' ||
+                    'r:usage:prompt_tokens::NUMBER, r:usage:completion_tokens::NUMBER ' ||
+                    'FROM (SELECT cache_key, model_name, prompt_text, TRY_PARSE_JSON(TO_VARCHAR(SNOWFLAKE.CORTEX.COMPLETE(''' ||
+                    :call_model || ''', ARRAY_CONSTRUCT(OBJECT_CONSTRUCT(''role'', ''user'', ''content'', prompt_text)), ' ||
+                    'OBJECT_CONSTRUCT()))) AS r ' ||
+                    'FROM temp_ai_calls WHERE call_allowed AND model_name = ''' || :call_model || ''')';
+        EXECUTE IMMEDIATE :call_sql;
+    END FOR;
+    
+    -- Token ledger: one row per Cortex call
+    INSERT INTO ai_token_usage (
+        deal_id, model_name, insight_type, severity, cache_key,
+        prompt_tokens, completion_tokens, total_tokens, estimated_cost_usd
+    )
+    SELECT 
+        :deal_id_param, t.model_name, t.insight_type, t.severity, t.cache_key,
+        c.prompt_tokens, c.completion_tokens,
+        COALESCE(c.prompt_tokens, 0) + COALESCE(c.completion_tokens, 0),
+        estimate_cortex_cost_usd(t.model_name, c.prompt_tokens, c.completion_tokens, :token_prices)
+    FROM temp_ai_calls t
+    JOIN ai_completion_cache c ON c.cache_key = t.cache_key
+    WHERE t.call_allowed;
+    
+    SELECT COALESCE(SUM(COALESCE(c.prompt_tokens, 0) + COALESCE(c.completion_tokens, 0)), 0) INTO :tokens_used
+    FROM temp_ai_calls t
+    JOIN ai_completion_cache c ON c.cache_key = t.cache_key
+    WHERE t.call_allowed;
+    
+    IF (:margin_key IS NOT NULL) THEN
+        SELECT MAX(completion_text) INTO :margin_analysis
+        FROM ai_completion_cache
+        WHERE cache_key = :margin_key;
+    END IF;
+    
+    cache_summary := 'cache: ' || :cache_hits || ' hits, ' || :cache_misses || ' misses; ' ||
+                     :tokens_used || ' tokens used' ||
+                     IFF(:calls_skipped > 0, ', ' || :calls_skipped || ' prompts skipped by token budget', '');
     
     BEGIN TRANSACTION;
     
-    -- Clear previous insights for this deal
+    -- Replace previous insights for this deal
     DELETE FROM ai_insights WHERE deal_id = :deal_id_param;
     
-    -- Step 1: Variance Analysis (period-over-period > threshold%)
     INSERT INTO ai_insights (
         deal_id, insight_type, severity, account_number, account_name, period_date,
         metric_value, comparison_value, variance_pct, insight_text, suggested_question, 
-        model_used, prompt_tokens, completion_tokens
+        model_used, prompt_tokens, completion_tokens, estimated_cost_usd, config_version
     )
     SELECT 
-        variance_data.deal_id,
+        p.deal_id,
         'variance',
-        CASE 
-            WHEN ABS(variance_data.var_pct) > 50 THEN 'high'
-            WHEN ABS(variance_data.var_pct) > 30 THEN 'medium'
-            ELSE 'low'
-        END,
-        variance_data.account_number,
-        variance_data.account_name,
-        variance_data.period_date,
-        variance_data.net_amount,
-        variance_data.prior_net_amount,
-        variance_data.var_pct,
-        -- Use Cortex AI to generate insights (model must be literal string per Snowflake Cortex requirements)
-        SNOWFLAKE.CORTEX.COMPLETE(
-            'mistral-large',
-            'Analyze this financial variance for a due diligence review: Account "' || variance_data.account_name || 
-            '" changed from $' || TO_CHAR(ABS(variance_data.prior_net_amount), '999,999,999') || 
-            ' to $' || TO_CHAR(ABS(variance_data.net_amount), '999,999,999') || 
-            ' (' || ROUND(variance_data.var_pct, 1) || '% change) between ' || 
-            TO_CHAR(variance_data.prior_period_date, 'Mon YYYY') || ' and ' || TO_CHAR(variance_data.period_date, 'Mon YYYY') || 
-            '. Provide a 2-sentence explanation of potential business reasons for this variance that a due diligence analyst should investigate.'
-        ),
-        'Why did ' || variance_data.account_name || ' change by ' || ROUND(ABS(variance_data.var_pct), 1) || '% from ' ||
-        TO_CHAR(variance_data.prior_period_date, 'Mon YYYY') || ' to ' || TO_CHAR(variance_data.period_date, 'Mon YYYY') || '?',
-        'mistral-large',
-        NULL,  -- Token counts would need to be calculated separately
-        NULL
-    FROM (
-        SELECT 
-            t1.deal_id, t1.period_date, t1.account_number, t1.account_name, t1.net_amount,
-            t2.net_amount AS prior_net_amount,
-            ROUND((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0) * 100, 2) AS var_pct,
-            t2.period_date AS prior_period_date
-        FROM trial_balance_raw t1
-        JOIN trial_balance_raw t2
-            ON t1.deal_id = t2.deal_id
-            AND t1.account_number = t2.account_number
-            AND t1.entity = t2.entity
-            AND t2.period_date = DATEADD(month, -1, t1.period_date)
-        WHERE t1.deal_id = :deal_id_param
-          AND ABS(t2.net_amount) > get_config_number('min_variance_amount')
-          AND ABS((t1.net_amount - t2.net_amount) / NULLIF(ABS(t2.net_amount), 0)) > get_config_number('variance_threshold_pct')
-    ) AS variance_data
-    ORDER BY ABS(variance_data.var_pct) DESC
-    LIMIT :max_insights;
+        p.severity,
+        p.account_number,
+        p.account_name,
+        p.period_date,
+        p.net_amount,
+        p.prior_net_amount,
+        p.var_pct,
+        c.completion_text,
+        'Why did ' || p.account_name || ' change by ' || ROUND(ABS(p.var_pct), 1) || '% from ' ||
+        TO_CHAR(p.prior_period_date, 'Mon YYYY') || ' to ' || TO_CHAR(p.period_date, 'Mon YYYY') || '?',
+        p.model_name,
+        c.prompt_tokens,
+        c.completion_tokens,
+        estimate_cortex_cost_usd(p.model_name, c.prompt_tokens, c.completion_tokens, :token_prices),
+        :config_version_var
+    FROM temp_variance_prompts p
+    JOIN ai_completion_cache c ON c.cache_key = p.cache_key
+    ORDER BY ABS(p.var_pct) DESC;
     
     SELECT COUNT(*) INTO :insight_count FROM ai_insights WHERE deal_id = :deal_id_param AND insight_type = 'variance';
     
-    -- Step 2: Margin Trend Analysis using Cortex
-    DECLARE
-        margin_analysis VARCHAR;
-        margin_data VARCHAR;
-    BEGIN
-        -- Build margin trend data string
-        SELECT LISTAGG(
-            TO_CHAR(period_date, 'Mon-YY') || ': ' || TO_CHAR(ROUND(gross_margin_pct, 1), '990.0') || '%', 
-            ', '
-        ) WITHIN GROUP (ORDER BY period_date)
-        INTO :margin_data
-        FROM (
-            SELECT 
-                t.period_date,
-                (SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN t.net_amount ELSE 0 END) +
-                 SUM(CASE WHEN m.mapping_level_1 = 'Cost of Goods Sold' THEN t.net_amount ELSE 0 END)) /
-                NULLIF(SUM(CASE WHEN m.mapping_level_1 = 'Revenue' THEN ABS(t.net_amount) ELSE 0 END), 0) * 100 AS gross_margin_pct
-            FROM trial_balance_raw t
-            JOIN account_mappings m ON t.deal_id = m.deal_id AND t.account_number = m.account_number
-            WHERE t.deal_id = :deal_id_param
-            GROUP BY t.period_date
-            ORDER BY t.period_date
-        );
+    IF (:margin_analysis IS NOT NULL) THEN
+        INSERT INTO ai_insights (deal_id, insight_type, severity, insight_text, model_used,
+                                 prompt_tokens, completion_tokens, estimated_cost_usd, config_version)
+        SELECT :deal_id_param, 'trend_analysis', 'medium', completion_text, model_name,
+               prompt_tokens, completion_tokens, estimate_cortex_cost_usd(model_name, prompt_tokens, completion_tokens, :token_prices),
+               :config_version_var
+        FROM ai_completion_cache
+        WHERE cache_key = :margin_key;
         
-        -- Generate AI analysis if we have data
-        IF (:margin_data IS NOT NULL) THEN
-            SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                'mistral-large',
-                'Analyze the following gross margin trend over 24 months for a company undergoing due diligence: ' ||
-                :margin_data ||
-                '. Identify any concerning trends, seasonality patterns, or margin compression/expansion. Provide 3 specific questions for management in 150 words.'
-            ) INTO :margin_analysis;
-            
-            INSERT INTO ai_insights (deal_id, insight_type, severity, insight_text, model_used)
-            VALUES (:deal_id_param, 'trend_analysis', 'medium', :margin_analysis, 'mistral-large');
-            
-            insight_count := :insight_count + 1;
-        END IF;
-    END;
+        insight_count := :insight_count + 1;
+    END IF;
     
     COMMIT;
     
+    -- Enforce cache age/size limits
+    CALL evict_ai_completion_cache();
+    
     -- Log success
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = IFF(:calls_skipped > 0, 'WARNING', 'SUCCESS'),
+            rows_affected = :insight_count,
+            message = 'Generated ' || :insight_count || ' AI insights (' || :cache_summary || ')'
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN IFF(:calls_skipped > 0, 'WARNING', 'SUCCESS') || ': Generated ' || :insight_count ||
+           ' AI insights for ' || :deal_id_param || ' (' || :cache_summary || ')';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Evict cached completions by age (ai_cache_max_age_days since last use),
+-- then by size (least recently used beyond ai_cache_max_entries)
+CREATE OR REPLACE PROCEDURE evict_ai_completion_cache()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    max_age_days NUMBER DEFAULT get_config_number('ai_cache_max_age_days');
+    max_entries NUMBER DEFAULT get_config_number('ai_cache_max_entries');
+    evicted_age NUMBER DEFAULT 0;
+    evicted_size NUMBER DEFAULT 0;
+BEGIN
+    DELETE FROM ai_completion_cache
+    WHERE last_used_timestamp < DATEADD(day, -1 * COALESCE(:max_age_days, 90), CURRENT_TIMESTAMP());
+    evicted_age := SQLROWCOUNT;
+    
+    DELETE FROM ai_completion_cache
+    WHERE cache_key IN (
+        SELECT cache_key
+        FROM ai_completion_cache
+        QUALIFY ROW_NUMBER() OVER (ORDER BY last_used_timestamp DESC, created_timestamp DESC) > COALESCE(:max_entries, 50000)
+    );
+    evicted_size := SQLROWCOUNT;
+    
+    RETURN 'SUCCESS: Evicted ' || :evicted_age || ' expired and ' || :evicted_size || ' least recently used completions';
+END;
+$$;
+
+-- Rebuild the variance distribution index for one deal (NULL = all deals).
+-- Grid: variance % edges every variance_index_pct_step up to 100%, prior amount
+-- edges every variance_index_amount_step up to $100,000 (the dashboard slider
+-- ranges). Candidates above the last edge are counted in the last cell.
+CREATE OR REPLACE PROCEDURE refresh_variance_index(deal_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    pct_step NUMBER(6,4) DEFAULT COALESCE(get_config_number('variance_index_pct_step'), 0.05);
+    amount_step NUMBER(18,2) DEFAULT COALESCE(get_config_number('variance_index_amount_step'), 1000);
+    pct_edges NUMBER;
+    amount_edges NUMBER;
+    deal_count NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    IF (:deal_id_param IS NOT NULL AND NOT validate_deal_id(:deal_id_param)) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+    VALUES (:log_id_var, 'refresh_variance_index', :deal_id_param, :start_time_var, 'STARTED');
+    
+    pct_edges := CEIL(1 / :pct_step) + 1;
+    amount_edges := CEIL(100000 / :amount_step) + 1;
+    
+    BEGIN TRANSACTION;
+    
+    DELETE FROM variance_distribution_index
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    INSERT INTO variance_distribution_index (
+        deal_id, min_variance_pct, min_prior_amount, cell_count, variance_count
+    )
+    WITH cells AS (
+        -- Highest grid edge each candidate is strictly above (matches the > tests in generate_ai_insights)
+        SELECT 
+            deal_id,
+            LEAST(CEIL(variance_ratio / :pct_step) - 1, :pct_edges - 1) AS pct_idx,
+            LEAST(CEIL(prior_abs_amount / :amount_step) - 1, :amount_edges - 1) AS amount_idx,
+            COUNT(*) AS candidates
+        FROM v_variance_candidates
+        WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param)
+        AND variance_ratio > 0
+        AND prior_abs_amount > 0
+        GROUP BY 1, 2, 3
+    ),
+    pct_grid AS (
+        SELECT ROW_NUMBER() OVER (ORDER BY SEQ4()) - 1 AS pct_idx
+        FROM TABLE(GENERATOR(ROWCOUNT => 1000))
+        QUALIFY pct_idx < :pct_edges
+    ),
+    amount_grid AS (
+        SELECT ROW_NUMBER() OVER (ORDER BY SEQ4()) - 1 AS amount_idx
+        FROM TABLE(GENERATOR(ROWCOUNT => 10000))
+        QUALIFY amount_idx < :amount_edges
+    ),
+    dense AS (
+        SELECT d.deal_id, p.pct_idx, a.amount_idx, COALESCE(c.candidates, 0) AS candidates
+        FROM (SELECT DISTINCT deal_id FROM cells) d
+        CROSS JOIN pct_grid p
+        CROSS JOIN amount_grid a
+        LEFT JOIN cells c
+            ON c.deal_id = d.deal_id AND c.pct_idx = p.pct_idx AND c.amount_idx = a.amount_idx
+    ),
+    above_amount AS (
+        SELECT 
+            dense.*,
+            SUM(candidates) OVER (
+                PARTITION BY deal_id, pct_idx ORDER BY amount_idx DESC
+                ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ) AS candidates_above_amount
+        FROM dense
+    )
+    SELECT 
+        deal_id,
+        pct_idx * :pct_step,
+        amount_idx * :amount_step,
+        candidates,
+        SUM(candidates_above_amount) OVER (
+            PARTITION BY deal_id, amount_idx ORDER BY pct_idx DESC
+            ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+        )
+    FROM above_amount;
+    
+    SELECT COUNT(DISTINCT deal_id) INTO :deal_count
+    FROM variance_distribution_index
+    WHERE (:deal_id_param IS NULL OR deal_id = :deal_id_param);
+    
+    COMMIT;
+    
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
         duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
         status = 'SUCCESS',
-        rows_affected = :insight_count,
-        message = 'Generated ' || :insight_count || ' AI insights'
+        rows_affected = :deal_count * :pct_edges * :amount_edges,
+        message = 'Variance index rebuilt for ' || :deal_count || ' deal(s)'
     WHERE log_id = :log_id_var;
     
-    RETURN 'SUCCESS: Generated ' || :insight_count || ' AI insights for ' || :deal_id_param;
+    RETURN 'SUCCESS: Variance index rebuilt for ' || :deal_count || ' deal(s)';
     
 EXCEPTION
     WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
         ROLLBACK;
         
         UPDATE audit_log 
@@ -1968,7 +3652,7 @@ $$;
 -- ============================================================================
 
 -- Export database tab to CSV
-CREATE OR REPLACE PROCEDURE export_database_tab(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_database_tab(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -1977,27 +3661,57 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
+    select_sql VARCHAR;
     copy_sql VARCHAR;
     error_msg VARCHAR;
 BEGIN
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
     -- Validate and sanitize deal_id
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format. Must be alphanumeric with underscores/hyphens only.';
     END IF;
     
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_database_tab', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_database_tab', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
     -- Build output path
-    output_path := '@' || get_config_string('output_stage_name') || '/database_tab_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/database_tab_' || :safe_deal_id || '.csv';
+    
+    -- Pivot from the materialized Database tab (built on first use)
+    CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    IF (:select_sql IS NULL) THEN
+        CALL refresh_database_tab(:safe_deal_id, :trace_id_param);
+        CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+    END IF;
+    
+    IF (:select_sql IS NULL) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = 'No trial balance data found for deal'
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: No trial balance data found for deal ' || :safe_deal_id;
+    END IF;
     
     -- Export using EXECUTE IMMEDIATE (COPY INTO doesn't support variable paths)
     copy_sql := 'COPY INTO ' || :output_path || 
-                    ' FROM (SELECT * FROM v_database_tab_pivoted WHERE deal_id = ''' || :safe_deal_id || ''') ' ||
+                    ' FROM (' || :select_sql || ') ' ||
                     ' FILE_FORMAT = (FORMAT_NAME = ''csv_format'' COMPRESSION = NONE) ' ||
                     ' HEADER = TRUE OVERWRITE = TRUE SINGLE = TRUE';
     
@@ -2006,13 +3720,15 @@ BEGIN
     file_count := SQLROWCOUNT;
     
     -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :file_count,
-        message = 'Exported to ' || :output_path
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count,
+            message = 'Exported to ' || :output_path
+        WHERE log_id = :log_id_var;
+    END IF;
     
     RETURN 'SUCCESS: Exported Database tab to ' || :output_path || ' (' || :file_count || ' rows)';
     
@@ -2020,18 +3736,20 @@ EXCEPTION
     WHEN OTHER THEN
         error_msg := SQLERRM;
         
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = :error_msg
-        WHERE log_id = :log_id_var;
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
         
         RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
 -- Export income statement structure
-CREATE OR REPLACE PROCEDURE export_income_statement_structure(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_income_statement_structure(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -2040,25 +3758,36 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
     copy_sql VARCHAR;
     error_msg VARCHAR;
 BEGIN
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
     -- Validate and sanitize deal_id
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
     -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_income_statement_structure', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_income_statement_structure', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
-    output_path := '@' || get_config_string('output_stage_name') || '/income_statement_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/income_statement_' || :safe_deal_id || '.csv';
     
     copy_sql := 'COPY INTO ' || :output_path || 
-                    ' FROM (SELECT row_num, row_label, row_type, account_filter, row_format_json FROM temp_is_schedule ORDER BY row_num) ' ||
+                    ' FROM (SELECT row_num, row_label, row_type, account_filter, row_format_json FROM schedule_rows ' ||
+                    ' WHERE deal_id = ''' || :safe_deal_id || ''' AND statement_type = ''IS'' ORDER BY row_num) ' ||
                     ' FILE_FORMAT = (FORMAT_NAME = ''csv_format'' COMPRESSION = NONE) ' ||
                     ' HEADER = TRUE OVERWRITE = TRUE SINGLE = TRUE';
     
@@ -2067,12 +3796,14 @@ BEGIN
     file_count := SQLROWCOUNT;
     
     -- Log success
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :file_count
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
+        WHERE log_id = :log_id_var;
+    END IF;
     
     RETURN 'SUCCESS: Exported Income Statement to ' || :output_path;
     
@@ -2080,18 +3811,20 @@ EXCEPTION
     WHEN OTHER THEN
         error_msg := SQLERRM;
         
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = :error_msg
-        WHERE log_id = :log_id_var;
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
         
         RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
 -- Export balance sheet structure
-CREATE OR REPLACE PROCEDURE export_balance_sheet_structure(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_balance_sheet_structure(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -2100,23 +3833,34 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
     copy_sql VARCHAR;
     error_msg VARCHAR;
 BEGIN
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_balance_sheet_structure', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_balance_sheet_structure', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
-    output_path := '@' || get_config_string('output_stage_name') || '/balance_sheet_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/balance_sheet_' || :safe_deal_id || '.csv';
     
     copy_sql := 'COPY INTO ' || :output_path || 
-                    ' FROM (SELECT row_num, row_label, row_type, account_filter, row_format_json FROM temp_bs_schedule ORDER BY row_num) ' ||
+                    ' FROM (SELECT row_num, row_label, row_type, account_filter, row_format_json FROM schedule_rows ' ||
+                    ' WHERE deal_id = ''' || :safe_deal_id || ''' AND statement_type = ''BS'' ORDER BY row_num) ' ||
                     ' FILE_FORMAT = (FORMAT_NAME = ''csv_format'' COMPRESSION = NONE) ' ||
                     ' HEADER = TRUE OVERWRITE = TRUE SINGLE = TRUE';
     
@@ -2124,12 +3868,14 @@ BEGIN
     
     file_count := SQLROWCOUNT;
     
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :file_count
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
+        WHERE log_id = :log_id_var;
+    END IF;
     
     RETURN 'SUCCESS: Exported Balance Sheet to ' || :output_path;
     
@@ -2137,18 +3883,108 @@ EXCEPTION
     WHEN OTHER THEN
         error_msg := SQLERRM;
         
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Export computed schedule values (long form: one row per schedule row and period)
+CREATE OR REPLACE PROCEDURE export_schedule_values(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
+    safe_deal_id VARCHAR;
+    file_count NUMBER;
+    refresh_result VARCHAR;
+    copy_sql VARCHAR;
+    error_msg VARCHAR;
+BEGIN
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_schedule_values', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
+    
+    -- No-op when the cached values match the deal's data version
+    CALL refresh_schedule_values(:safe_deal_id, FALSE, :trace_id_param) INTO :refresh_result;
+    IF (NOT STARTSWITH(:refresh_result, 'SUCCESS')) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :refresh_result
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN :refresh_result;
+    END IF;
+    
+    output_path := '@' || :output_stage || '/schedule_values_' || :safe_deal_id || '.csv';
+    
+    copy_sql := 'COPY INTO ' || :output_path || 
+                    ' FROM (SELECT statement_type, row_num, row_label, row_type, period_date, period_label, amount ' ||
+                    ' FROM v_schedule_values WHERE deal_id = ''' || :safe_deal_id || ''' ' ||
+                    ' ORDER BY statement_type, row_num, period_date) ' ||
+                    ' FILE_FORMAT = (FORMAT_NAME = ''csv_format'' COMPRESSION = NONE) ' ||
+                    ' HEADER = TRUE OVERWRITE = TRUE SINGLE = TRUE';
+    
+    EXECUTE IMMEDIATE :copy_sql;
+    
+    file_count := SQLROWCOUNT;
+    
+    IF (:trace_id_param IS NULL) THEN
         UPDATE audit_log 
         SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = :error_msg
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
         WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Exported schedule values to ' || :output_path;
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
         
         RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
 -- Export AI insights
-CREATE OR REPLACE PROCEDURE export_ai_insights(deal_id_param VARCHAR)
+CREATE OR REPLACE PROCEDURE export_ai_insights(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -2157,20 +3993,30 @@ DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
     output_path VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
     safe_deal_id VARCHAR;
     file_count NUMBER;
     copy_sql VARCHAR;
     error_msg VARCHAR;
 BEGIN
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    -- Settings for this export, resolved once
+    SELECT config_version, config_values, config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
         RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'export_ai_insights', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version)
+        VALUES (:log_id_var, 'export_ai_insights', :safe_deal_id, :start_time_var, 'STARTED', :config_version_var);
+    END IF;
     
-    output_path := '@' || get_config_string('output_stage_name') || '/ai_insights_' || :safe_deal_id || '.csv';
+    output_path := '@' || :output_stage || '/ai_insights_' || :safe_deal_id || '.csv';
     
     copy_sql := 'COPY INTO ' || :output_path || 
                     ' FROM (SELECT insight_type, severity, COALESCE(account_name, ''General'') AS account_name, ' ||
@@ -2184,12 +4030,14 @@ BEGIN
     
     file_count := SQLROWCOUNT;
     
-    UPDATE audit_log 
-    SET end_time = CURRENT_TIMESTAMP(),
-        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
-        status = 'SUCCESS',
-        rows_affected = :file_count
-    WHERE log_id = :log_id_var;
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :file_count
+        WHERE log_id = :log_id_var;
+    END IF;
     
     RETURN 'SUCCESS: Exported AI insights to ' || :output_path || ' (' || :file_count || ' insights)';
     
@@ -2197,91 +4045,731 @@ EXCEPTION
     WHEN OTHER THEN
         error_msg := SQLERRM;
         
-        UPDATE audit_log 
-        SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = :error_msg
-        WHERE log_id = :log_id_var;
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
         
         RETURN 'ERROR: ' || :error_msg;
 END;
 $$;
 
+-- Export the full FDD workbook (Database, Income Statement, Balance Sheet, AI Insights)
+-- as one .xlsx file. Query results are streamed in batches (to_local_iterator) into
+-- an xlsxwriter workbook in constant_memory mode, which flushes each row to disk once
+-- the next row starts, so memory stays flat however large the deal is. Schedule rows
+-- carry their row_format_json formatting and outline levels; schedule amounts come
+-- from v_schedule_values over the deal's Database tab period window.
+CREATE OR REPLACE PROCEDURE export_fdd_workbook(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.11'
+PACKAGES = ('snowflake-snowpark-python', 'xlsxwriter')
+HANDLER = 'export_fdd_workbook'
+EXECUTE AS CALLER
+AS
+$$
+import datetime
+import json
+import os
+import tempfile
+import uuid
+from decimal import Decimal
+
+import xlsxwriter
+
+EXCEL_MAX_ROWS = 1048576
+
+HEADER_FORMAT = {"bold": True, "bg_color": "#4472C4", "font_color": "white", "border": 1}
+
+
+def _write_value(sheet, row, col, value, cell_format=None):
+    if value is None:
+        return
+    if isinstance(value, (Decimal, int, float)) and not isinstance(value, bool):
+        sheet.write_number(row, col, float(value), cell_format)
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        sheet.write_string(row, col, value.isoformat(), cell_format)
+    else:
+        sheet.write_string(row, col, str(value), cell_format)
+
+
+class RowFormats:
+    """One xlsxwriter Format per distinct row_format_json, plus its outline level."""
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._cache = {}
+
+    def get(self, format_json):
+        if format_json not in self._cache:
+            spec = json.loads(format_json) if format_json else {}
+            props = {}
+            if spec.get("bold"):
+                props["bold"] = True
+            if spec.get("font_size"):
+                props["font_size"] = spec["font_size"]
+            if spec.get("bg_color"):
+                props["bg_color"] = spec["bg_color"]
+            if spec.get("font_color"):
+                props["font_color"] = spec["font_color"]
+            if spec.get("number_format"):
+                props["num_format"] = spec["number_format"]
+            if spec.get("indent"):
+                props["indent"] = spec["indent"]
+            if spec.get("border_top"):
+                props["top"] = 1
+            if spec.get("border_bottom"):
+                props["bottom"] = 1
+            if spec.get("border_bottom_double"):
+                props["bottom"] = 6
+            # Level-1 rows (sections, subtotals) stay visible; deeper rows group under them
+            level = max(int(spec.get("outline_level") or 1) - 1, 0)
+            self._cache[format_json] = (self.workbook.add_format(props) if props else None, level)
+        return self._cache[format_json]
+
+
+def _write_table(sheet, dataframe, header_format):
+    """Header plus every row of a Snowpark DataFrame, streamed batch by batch."""
+    columns = [name.strip('"').lower() for name in dataframe.columns]
+    sheet.write_row(0, 0, columns, header_format)
+    sheet.freeze_panes(1, 0)
+    row = 0
+    for record in dataframe.to_local_iterator():
+        row += 1
+        if row >= EXCEL_MAX_ROWS:
+            raise ValueError(f"sheet {sheet.get_name()} exceeds {EXCEL_MAX_ROWS} rows")
+        for col, value in enumerate(record):
+            _write_value(sheet, row, col, value)
+    return row
+
+
+def _write_schedule(session, sheet, formats, deal_id, statement_type, periods):
+    """Schedule rows in row_num order with their period amounts.
+
+    The template row whose formula_template is PERIOD_LABEL carries the period
+    labels. Rows arrive as (row, period) pairs and are folded on row_num, so only
+    the current row is ever held in memory.
+    """
+    period_columns = {period_key: col for col, (period_key, _) in enumerate(periods, start=1)}
+    records = session.sql(
+        """
+        SELECT r.row_num, r.row_label, r.formula_template, r.row_format_json,
+               TO_CHAR(v.period_date, 'YYYY-MM-DD') AS period_key, v.amount
+        FROM schedule_rows r
+        LEFT JOIN v_schedule_values v
+            ON v.deal_id = r.deal_id
+            AND v.statement_type = r.statement_type
+            AND v.row_num = r.row_num
+        WHERE r.deal_id = ? AND r.statement_type = ?
+        ORDER BY r.row_num, v.period_date
+        """,
+        params=[deal_id, statement_type],
+    )
+    sheet.set_column(0, 0, 45)
+    sheet.set_column(1, len(periods), 14)
+
+    row = -1
+    current_row_num = None
+    cell_format = None
+    for record in records.to_local_iterator():
+        if record["ROW_NUM"] != current_row_num:
+            row += 1
+            current_row_num = record["ROW_NUM"]
+            cell_format, level = formats.get(record["ROW_FORMAT_JSON"])
+            if level:
+                sheet.set_row(row, None, None, {"level": level})
+            sheet.write_string(row, 0, record["ROW_LABEL"] or "", cell_format)
+            if record["FORMULA_TEMPLATE"] == "PERIOD_LABEL":
+                for col, (_, label) in enumerate(periods, start=1):
+                    sheet.write_string(row, col, label, cell_format)
+        col = period_columns.get(record["PERIOD_KEY"])
+        if col is not None and record["AMOUNT"] is not None:
+            sheet.write_number(row, col, float(record["AMOUNT"]), cell_format)
+    return row + 1
+
+
+def export_fdd_workbook(session, deal_id_param, trace_id_param=None):
+    log_id = str(uuid.uuid4())
+    # Settings for this export, resolved once from the config snapshot
+    config_version, stage, safe_deal_id = session.sql(
+        "SELECT config_version, config_values:output_stage_name::VARCHAR, sanitize_deal_id(?, config_values) "
+        "FROM v_config_snapshot",
+        params=[deal_id_param],
+    ).collect()[0]
+    if safe_deal_id is None:
+        return "ERROR: Invalid deal_id format"
+
+    # In a traced run the run's span records this export instead of audit_log
+    audited = trace_id_param is None
+    if audited:
+        session.sql(
+            "INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, config_version) "
+            "VALUES (?, 'export_fdd_workbook', ?, CURRENT_TIMESTAMP(), 'STARTED', ?)",
+            params=[log_id, safe_deal_id, config_version],
+        ).collect()
+
+    try:
+        # Same inputs as the CSV exports: the Database tab (built on first use) and schedule values
+        database_sql = session.call("build_database_tab_sql", safe_deal_id)
+        if database_sql is None:
+            session.call("refresh_database_tab", safe_deal_id, trace_id_param)
+            database_sql = session.call("build_database_tab_sql", safe_deal_id)
+        if database_sql is None:
+            raise ValueError("No trial balance data found for deal")
+        refresh_result = session.call("refresh_schedule_values", safe_deal_id, False, trace_id_param)
+        if not str(refresh_result).startswith("SUCCESS"):
+            raise RuntimeError(refresh_result)
+
+        periods = [
+            (r["PERIOD_KEY"], r["PERIOD_LABEL"])
+            for r in session.sql(
+                "SELECT TO_CHAR(period_date, 'YYYY-MM-DD') AS period_key, period_label "
+                "FROM database_tab_periods WHERE deal_id = ? ORDER BY period_rank",
+                params=[safe_deal_id],
+            ).collect()
+        ]
+
+        file_name = f"fdd_workbook_{safe_deal_id}.xlsx"
+        local_path = os.path.join(tempfile.mkdtemp(), file_name)
+        workbook = xlsxwriter.Workbook(local_path, {"constant_memory": True})
+        workbook.set_properties({"comments": f"config_version {config_version}"})
+        header_format = workbook.add_format(HEADER_FORMAT)
+        formats = RowFormats(workbook)
+        rows_written = 0
+
+        rows_written += _write_table(workbook.add_worksheet("Database"), session.sql(database_sql), header_format)
+
+        rows_written += _write_schedule(session, workbook.add_worksheet("Income Statement"),
+                                        formats, safe_deal_id, "IS", periods)
+        rows_written += _write_schedule(session, workbook.add_worksheet("Balance Sheet"),
+                                        formats, safe_deal_id, "BS", periods)
+
+        insights = session.sql(
+            """
+            SELECT insight_type, severity, COALESCE(account_name, 'General') AS account_name,
+                   TO_CHAR(period_date, 'Mon YYYY') AS period, metric_value, comparison_value,
+                   variance_pct, insight_text, suggested_question, model_used
+            FROM ai_insights
+            WHERE deal_id = ?
+            ORDER BY CASE severity WHEN 'high' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END,
+                     ABS(variance_pct) DESC
+            """,
+            params=[safe_deal_id],
+        )
+        rows_written += _write_table(workbook.add_worksheet("AI Insights"), insights, header_format)
+
+        workbook.close()
+        size_bytes = os.path.getsize(local_path)
+
+        session.file.put(local_path, f"@{stage}", auto_compress=False, overwrite=True)
+        os.remove(local_path)
+
+        if audited:
+            session.sql(
+                "UPDATE audit_log SET end_time = CURRENT_TIMESTAMP(), "
+                "duration_seconds = DATEDIFF(second, start_time, CURRENT_TIMESTAMP()), "
+                "status = 'SUCCESS', rows_affected = ?, message = ? WHERE log_id = ?",
+                params=[rows_written, f"{file_name}: {size_bytes} bytes", log_id],
+            ).collect()
+        return f"SUCCESS: Exported workbook to @{stage}/{file_name} ({rows_written} rows, {size_bytes} bytes)"
+
+    except Exception as exc:
+        error_msg = str(exc)[:5000]
+        if audited:
+            session.sql(
+                "UPDATE audit_log SET end_time = CURRENT_TIMESTAMP(), status = 'ERROR', error_message = ? "
+                "WHERE log_id = ?",
+                params=[error_msg, log_id],
+            ).collect()
+        return "ERROR: " + error_msg
+$$;
+
 -- ============================================================================
--- PART 3: MASTER ORCHESTRATION PROCEDURES
+-- PART 3: PARTITIONED EXPORT MODE
 -- ============================================================================
+-- export_mode = 'PARTITIONED' replaces the SINGLE = TRUE CSV unloads with
+-- multi-file unloads under @<output_stage>/exports/<deal>/<export>/, run as
+-- concurrent child jobs. Files are gzip CSV or Parquet (export_file_format),
+-- the Database tab is partitioned by entity, and manifest.json lists every
+-- file with its row count, size and MD5 checksum.
+
+-- One row per unloaded file (the manifest is built from these rows)
+CREATE TABLE IF NOT EXISTS export_files (
+    export_run_id VARCHAR(50) NOT NULL,
+    deal_id VARCHAR(50) NOT NULL,
+    export_name VARCHAR(50) NOT NULL,  -- 'database_tab', 'income_statement', 'balance_sheet', 'schedule_values', 'ai_insights'
+    file_name VARCHAR(1000) NOT NULL,  -- path relative to the output stage
+    row_count NUMBER,
+    size_bytes NUMBER,
+    md5 VARCHAR(64),  -- as reported by LIST
+    exported_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
 
--- Master procedure for generating all FDD schedules for a deal
-CREATE OR REPLACE PROCEDURE generate_fdd_schedules(deal_id_param VARCHAR)
+-- v_config_snapshot version the file was exported under
+ALTER TABLE export_files ADD COLUMN IF NOT EXISTS config_version NUMBER;
+
+-- Unload one export for a deal as multiple files and record them in export_files
+CREATE OR REPLACE PROCEDURE export_partitioned(deal_id_param VARCHAR, export_name VARCHAR, export_run_id VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
 RETURNS VARCHAR
 LANGUAGE SQL
+EXECUTE AS CALLER
 AS
 $$
 DECLARE
     log_id_var VARCHAR DEFAULT UUID_STRING();
     start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
-    result VARCHAR;
-    tb_row_count NUMBER;
-    insight_count NUMBER;
-    copy_sql VARCHAR;  -- For dynamic COPY INTO statement
     safe_deal_id VARCHAR;
+    stage_path VARCHAR;
+    select_sql VARCHAR;
+    partition_sql VARCHAR DEFAULT '';
+    format_sql VARCHAR;
+    copy_sql VARCHAR;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
+    export_format VARCHAR;
+    max_file_bytes NUMBER;
+    file_count NUMBER DEFAULT 0;
+    row_count NUMBER DEFAULT 0;
     error_msg VARCHAR;
 BEGIN
-    -- Validate and sanitize input
-    safe_deal_id := sanitize_deal_id(:deal_id_param);
+    -- Settings for this export, resolved once
+    SELECT 
+        config_version,
+        config_values,
+        config_values:output_stage_name::VARCHAR,
+        config_values:export_file_format::VARCHAR,
+        COALESCE(config_values:export_max_file_size_mb::NUMBER, 64) * 1024 * 1024
+    INTO :config_version_var, :run_config, :output_stage, :export_format, :max_file_bytes
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
     IF (safe_deal_id IS NULL) THEN
-        RETURN 'ERROR: Invalid deal_id format. Must be alphanumeric with underscores/hyphens only.';
+        RETURN 'ERROR: Invalid deal_id format';
     END IF;
     
-    -- Log start
-    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
-    VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, 'STARTED');
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message, config_version)
+        VALUES (:log_id_var, 'export_partitioned', :safe_deal_id, :start_time_var, 'STARTED',
+                :export_name || ' (export run ' || :export_run_id || ')', :config_version_var);
+    END IF;
     
-    -- Validate deal exists
-    SELECT COUNT(*) INTO :tb_row_count 
-    FROM trial_balance_raw 
-    WHERE deal_id = :safe_deal_id;
+    stage_path := :output_stage || '/exports/' || :safe_deal_id || '/' || :export_name || '/';
+    
+    CASE (:export_name)
+        WHEN 'database_tab' THEN
+            CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+            IF (:select_sql IS NULL) THEN
+                CALL refresh_database_tab(:safe_deal_id, :trace_id_param);
+                CALL build_database_tab_sql(:safe_deal_id) INTO :select_sql;
+            END IF;
+            partition_sql := ' PARTITION BY (''entity='' || COALESCE(entity, ''UNASSIGNED''))';
+        WHEN 'income_statement' THEN
+            select_sql := 'SELECT row_num, row_label, row_type, account_filter, row_format_json FROM schedule_rows ' ||
+                          'WHERE deal_id = ''' || :safe_deal_id || ''' AND statement_type = ''IS'' ORDER BY row_num';
+        WHEN 'balance_sheet' THEN
+            select_sql := 'SELECT row_num, row_label, row_type, account_filter, row_format_json FROM schedule_rows ' ||
+                          'WHERE deal_id = ''' || :safe_deal_id || ''' AND statement_type = ''BS'' ORDER BY row_num';
+        WHEN 'schedule_values' THEN
+            select_sql := 'SELECT statement_type, row_num, row_label, row_type, period_date, period_label, amount ' ||
+                          'FROM v_schedule_values WHERE deal_id = ''' || :safe_deal_id || ''' ' ||
+                          'ORDER BY statement_type, row_num, period_date';
+        WHEN 'ai_insights' THEN
+            select_sql := 'SELECT insight_type, severity, COALESCE(account_name, ''General'') AS account_name, ' ||
+                          'TO_CHAR(period_date, ''Mon YYYY'') AS period, metric_value, comparison_value, variance_pct, ' ||
+                          'insight_text, suggested_question, model_used FROM ai_insights ' ||
+                          'WHERE deal_id = ''' || :safe_deal_id || ''' ' ||
+                          'ORDER BY CASE severity WHEN ''high'' THEN 1 WHEN ''medium'' THEN 2 ELSE 3 END, ABS(variance_pct) DESC';
+        ELSE
+            select_sql := NULL;
+    END CASE;
+    
+    IF (:select_sql IS NULL) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = 'Nothing to export for ' || :export_name
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: Nothing to export for deal ' || :safe_deal_id;
+    END IF;
     
-    IF (:tb_row_count = 0) THEN
+    format_sql := CASE :export_format
+        WHEN 'PARQUET' THEN ' FILE_FORMAT = (FORMAT_NAME = ''parquet_format'')'
+        ELSE ' FILE_FORMAT = (FORMAT_NAME = ''csv_format'' COMPRESSION = GZIP)'
+    END;
+    
+    -- PARTITION BY does not support OVERWRITE, so clear the previous run's files first
+    copy_sql := 'REMOVE @' || :stage_path;
+    EXECUTE IMMEDIATE :copy_sql;
+    
+    copy_sql := 'COPY INTO @' || :stage_path || ' FROM (' || :select_sql || ')' ||
+                :partition_sql || :format_sql ||
+                ' HEADER = TRUE MAX_FILE_SIZE = ' || :max_file_bytes || ' DETAILED_OUTPUT = TRUE';
+    EXECUTE IMMEDIATE :copy_sql;
+    
+    -- DETAILED_OUTPUT returns one row per file written
+    INSERT INTO export_files (export_run_id, deal_id, export_name, file_name, row_count, size_bytes, config_version)
+    SELECT :export_run_id, :safe_deal_id, :export_name,
+           'exports/' || :safe_deal_id || '/' || :export_name || '/' || "FILE_NAME",
+           "ROW_COUNT", "FILE_SIZE", :config_version_var
+    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()))
+    WHERE "FILE_NAME" IS NOT NULL;
+    
+    SELECT COUNT(*), COALESCE(SUM(row_count), 0) INTO :file_count, :row_count
+    FROM export_files
+    WHERE export_run_id = :export_run_id AND export_name = :export_name;
+    
+    IF (:trace_id_param IS NULL) THEN
         UPDATE audit_log 
         SET end_time = CURRENT_TIMESTAMP(),
-            status = 'ERROR',
-            error_message = 'No trial balance data found for deal'
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :row_count
+        WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Exported ' || :export_name || ' to @' || :stage_path || ' (' || :file_count || ' files, ' || :row_count || ' rows)';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Run all exports for a deal as concurrent child jobs, then write manifest.json
+CREATE OR REPLACE PROCEDURE export_fdd_outputs_parallel(deal_id_param VARCHAR, trace_id_param VARCHAR DEFAULT NULL)
+RETURNS VARCHAR
+LANGUAGE SQL
+EXECUTE AS CALLER
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    export_run_id VARCHAR DEFAULT UUID_STRING();
+    safe_deal_id VARCHAR;
+    export_root VARCHAR;
+    database_job RESULTSET;
+    income_statement_job RESULTSET;
+    balance_sheet_job RESULTSET;
+    schedule_values_job RESULTSET;
+    ai_insights_job RESULTSET;
+    failures VARCHAR DEFAULT '';
+    manifest_sql VARCHAR;
+    period_count NUMBER;
+    schedule_row_count NUMBER;
+    prepare_result VARCHAR;
+    file_count NUMBER;
+    row_count NUMBER;
+    total_bytes NUMBER;
+    config_version_var NUMBER;
+    run_config OBJECT;
+    output_stage VARCHAR;
+    export_format VARCHAR;
+    error_msg VARCHAR;
+BEGIN
+    -- Settings for this export run, resolved once
+    SELECT 
+        config_version,
+        config_values,
+        config_values:output_stage_name::VARCHAR,
+        config_values:export_file_format::VARCHAR
+    INTO :config_version_var, :run_config, :output_stage, :export_format
+    FROM v_config_snapshot;
+    
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
+    
+    IF (:trace_id_param IS NULL) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status, message, config_version)
+        VALUES (:log_id_var, 'export_fdd_outputs_parallel', :safe_deal_id, :start_time_var, 'STARTED',
+                'export run ' || :export_run_id, :config_version_var);
+    END IF;
+    
+    export_root := :output_stage || '/exports/' || :safe_deal_id || '/';
+    
+    -- Build the Database tab up front so the child jobs only read
+    SELECT COUNT(*) INTO :period_count FROM database_tab_periods WHERE deal_id = :safe_deal_id;
+    IF (:period_count = 0) THEN
+        CALL refresh_database_tab(:safe_deal_id, :trace_id_param);
+    END IF;
+    
+    -- Same for the schedules: rows on first use, values unless current for the
+    -- deal's data version (as export_schedule_values and export_fdd_workbook do)
+    SELECT COUNT(*) INTO :schedule_row_count FROM schedule_rows WHERE deal_id = :safe_deal_id;
+    IF (:schedule_row_count = 0) THEN
+        CALL build_schedules(:safe_deal_id, NULL, :trace_id_param) INTO :prepare_result;
+    END IF;
+    IF (NOT STARTSWITH(COALESCE(:prepare_result, ''), 'ERROR')) THEN
+        CALL refresh_schedule_values(:safe_deal_id, FALSE, :trace_id_param) INTO :prepare_result;
+    END IF;
+    
+    IF (STARTSWITH(:prepare_result, 'ERROR')) THEN
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :prepare_result
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN :prepare_result;
+    END IF;
+    
+    database_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'database_tab', :export_run_id, :trace_id_param));
+    income_statement_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'income_statement', :export_run_id, :trace_id_param));
+    balance_sheet_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'balance_sheet', :export_run_id, :trace_id_param));
+    schedule_values_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'schedule_values', :export_run_id, :trace_id_param));
+    ai_insights_job := ASYNC (CALL export_partitioned(:safe_deal_id, 'ai_insights', :export_run_id, :trace_id_param));
+    AWAIT ALL;
+    
+    -- A RESULTSET can be looped over but not queried: read each child's
+    -- result and tag failures with the export that failed
+    FOR r IN database_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; database_tab: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN income_statement_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; income_statement: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN balance_sheet_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; balance_sheet: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN schedule_values_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; schedule_values: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    FOR r IN ai_insights_job DO
+        IF (NOT STARTSWITH(COALESCE(r.export_partitioned, ''), 'SUCCESS')) THEN
+            failures := :failures || '; ai_insights: ' || COALESCE(r.export_partitioned, 'no result');
+        END IF;
+    END FOR;
+    
+    IF (:failures <> '') THEN
+        failures := SUBSTR(:failures, 3);
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :failures
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :failures;
+    END IF;
+    
+    -- Checksums for the manifest
+    manifest_sql := 'LIST @' || :export_root;
+    EXECUTE IMMEDIATE :manifest_sql;
+    UPDATE export_files f
+    SET md5 = l."md5"
+    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID())) l
+    WHERE f.export_run_id = :export_run_id
+      AND ENDSWITH(l."name", '/' || f.file_name);
+    
+    manifest_sql :=
+        'COPY INTO @' || :export_root || 'manifest.json FROM (' ||
+        'SELECT OBJECT_CONSTRUCT(' ||
+        '''deal_id'', deal_id, ''export_run_id'', export_run_id, ' ||
+        '''config_version'', ' || :config_version_var || ', ''file_format'', ''' || :export_format || ''', ' ||
+        '''generated_at'', MAX(exported_at), ''file_count'', COUNT(*), ''row_count'', SUM(row_count), ' ||
+        '''size_bytes'', SUM(size_bytes), ' ||
+        '''files'', ARRAY_AGG(OBJECT_CONSTRUCT(''export'', export_name, ''file'', file_name, ' ||
+        '''rows'', row_count, ''bytes'', size_bytes, ''md5'', md5)) WITHIN GROUP (ORDER BY export_name, file_name)) ' ||
+        'FROM export_files WHERE export_run_id = ''' || :export_run_id || ''' GROUP BY deal_id, export_run_id) ' ||
+        'FILE_FORMAT = (TYPE = JSON COMPRESSION = NONE) OVERWRITE = TRUE SINGLE = TRUE';
+    EXECUTE IMMEDIATE :manifest_sql;
+    
+    SELECT COUNT(*), COALESCE(SUM(row_count), 0), COALESCE(SUM(size_bytes), 0)
+    INTO :file_count, :row_count, :total_bytes
+    FROM export_files
+    WHERE export_run_id = :export_run_id;
+    
+    IF (:trace_id_param IS NULL) THEN
+        UPDATE audit_log 
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'SUCCESS',
+            rows_affected = :row_count,
+            message = 'export run ' || :export_run_id || ': ' || :file_count || ' files, ' || :total_bytes || ' bytes'
         WHERE log_id = :log_id_var;
+    END IF;
+    
+    RETURN 'SUCCESS: Exported ' || :file_count || ' files (' || :row_count || ' rows, ' || :total_bytes ||
+           ' bytes) to @' || :export_root || ' with manifest.json';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
         
-        RETURN 'ERROR: No trial balance data found for deal ' || :safe_deal_id || 
-               '. Please load data first using load_trial_balance().';
+        IF (:trace_id_param IS NULL) THEN
+            UPDATE audit_log 
+            SET end_time = CURRENT_TIMESTAMP(),
+                status = 'ERROR',
+                error_message = :error_msg
+            WHERE log_id = :log_id_var;
+        END IF;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+GRANT SELECT, INSERT, UPDATE ON TABLE export_files TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE export_files TO ROLE FDD_READONLY_ROLE;
+
+-- ============================================================================
+-- PART 4: STAGE HOUSEKEEPING
+-- ============================================================================
+
+-- Whether a stage file is one of a deal's outputs, by the names the exports
+-- write: exports/<deal>/... and <export>_<deal>.<ext> at the stage root.
+-- Exact comparisons, so deal HL_001 never matches DEAL_HL_001's files.
+CREATE OR REPLACE FUNCTION stage_file_deal_match(relative_path VARCHAR, deal_id VARCHAR)
+RETURNS BOOLEAN
+LANGUAGE SQL
+AS
+$$
+    STARTSWITH(relative_path, 'exports/' || deal_id || '/')
+    OR (NOT CONTAINS(relative_path, '/')
+        AND SPLIT_PART(relative_path, '.', 1) IN (
+            'database_tab_' || deal_id,
+            'income_statement_' || deal_id,
+            'balance_sheet_' || deal_id,
+            'schedule_values_' || deal_id,
+            'ai_insights_' || deal_id,
+            'fdd_workbook_' || deal_id))
+$$;
+
+-- Remove files older than retention_days (default output_retention_days) from
+-- an FDD stage, optionally only one deal's files. Expired files are read from
+-- the stage directory table and removed with one regex-pattern REMOVE per
+-- stage_purge_files_per_remove files instead of one REMOVE per file.
+-- dry_run => TRUE only reports what would be removed.
+CREATE OR REPLACE PROCEDURE purge_stage_files(
+    stage_name_param VARCHAR,
+    retention_days NUMBER DEFAULT NULL,
+    deal_id_param VARCHAR DEFAULT NULL,
+    dry_run BOOLEAN DEFAULT FALSE
+)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    stage_name VARCHAR DEFAULT LOWER(stage_name_param);
+    keep_days NUMBER;
+    files_per_remove NUMBER DEFAULT COALESCE(get_config_number('stage_purge_files_per_remove'), 200);
+    refresh_sql VARCHAR;
+    expired_sql VARCHAR;
+    remove_sql VARCHAR;
+    expired_files NUMBER DEFAULT 0;
+    expired_mb NUMBER(18,2) DEFAULT 0;
+    remove_calls NUMBER DEFAULT 0;
+    purge_summary VARCHAR;
+    remove_patterns RESULTSET;
+    error_msg VARCHAR;
+BEGIN
+    -- Stage names are spliced into the statements below
+    IF (:stage_name NOT IN ('fdd_input_stage', 'fdd_output_stage')) THEN
+        RETURN 'ERROR: Unknown stage ' || :stage_name_param;
     END IF;
     
-    -- Step 1: Generate schedules (session-isolated temp tables)
-    CALL generate_income_statement(:safe_deal_id);
-    CALL generate_balance_sheet(:safe_deal_id);
+    IF (:deal_id_param IS NOT NULL AND NOT validate_deal_id(:deal_id_param)) THEN
+        RETURN 'ERROR: Invalid deal_id format';
+    END IF;
     
-    -- Step 2: Generate AI insights
-    CALL generate_ai_insights(:safe_deal_id);
+    keep_days := FLOOR(COALESCE(:retention_days, get_config_number('output_retention_days'), 30));
+    IF (:keep_days < 1) THEN
+        RETURN 'ERROR: retention_days must be at least 1';
+    END IF;
     
-    -- Step 3: Export everything with deal-specific filenames
-    CALL export_database_tab(:safe_deal_id);
-    CALL export_income_statement_structure(:safe_deal_id);
-    CALL export_balance_sheet_structure(:safe_deal_id);
-    CALL export_ai_insights(:safe_deal_id);
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, status)
+    VALUES (:log_id_var, 'purge_stage_files', :deal_id_param, :start_time_var, 'STARTED');
     
-    -- Get counts for confirmation
-    SELECT COUNT(*) INTO :insight_count FROM ai_insights WHERE deal_id = :safe_deal_id;
+    -- Directory tables of internal stages are refreshed on demand
+    refresh_sql := 'ALTER STAGE ' || :stage_name || ' REFRESH';
+    EXECUTE IMMEDIATE :refresh_sql;
     
-    result := :tb_row_count::VARCHAR || ' TB rows processed, ' ||
-              :insight_count::VARCHAR || ' AI insights generated for ' || :safe_deal_id;
+    expired_sql := 'CREATE OR REPLACE TEMPORARY TABLE temp_expired_stage_files AS ' ||
+                   'SELECT relative_path, size, last_modified FROM DIRECTORY(@' || :stage_name || ') ' ||
+                   'WHERE last_modified < DATEADD(day, -' || :keep_days || ', CURRENT_TIMESTAMP())';
+    EXECUTE IMMEDIATE :expired_sql;
+    
+    IF (:deal_id_param IS NOT NULL) THEN
+        DELETE FROM temp_expired_stage_files
+        WHERE NOT stage_file_deal_match(relative_path, :deal_id_param);
+    END IF;
+    
+    SELECT COUNT(*), COALESCE(SUM(size), 0) / POWER(1024, 2)
+    INTO :expired_files, :expired_mb
+    FROM temp_expired_stage_files;
+    
+    IF (NOT :dry_run AND :expired_files > 0) THEN
+        -- Paths are regex-escaped (backslash first, then the other metacharacters)
+        -- and OR-ed together, files_per_remove paths per pattern. REMOVE matches
+        -- the full path, which starts with the stage name segment.
+        remove_patterns := (
+            SELECT '[^/]+/(' || LISTAGG(escaped_path, '|') || ')' AS remove_pattern
+            FROM (
+                SELECT 
+                    REGEXP_REPLACE(REPLACE(relative_path, '\\', '\\\\'), '([]().*+?{}|$^[])', '\\\\\\1') AS escaped_path,
+                    FLOOR((ROW_NUMBER() OVER (ORDER BY relative_path) - 1) / :files_per_remove) AS batch_number
+                FROM temp_expired_stage_files
+            )
+            GROUP BY batch_number
+        );
+        
+        FOR pattern_row IN remove_patterns DO
+            remove_sql := 'REMOVE @' || :stage_name || ' PATTERN = ''' ||
+                          REPLACE(REPLACE(pattern_row.remove_pattern, '\\', '\\\\'), '''', '\\''') || '''';
+            EXECUTE IMMEDIATE :remove_sql;
+            remove_calls := :remove_calls + 1;
+        END FOR;
+        
+        EXECUTE IMMEDIATE :refresh_sql;
+    END IF;
+    
+    purge_summary := :expired_files || ' files (' || :expired_mb || ' MB) older than ' || :keep_days ||
+                     ' days in @' || :stage_name || IFF(:deal_id_param IS NULL, '', ' for ' || :deal_id_param);
     
-    -- Log success
     UPDATE audit_log 
     SET end_time = CURRENT_TIMESTAMP(),
         duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
         status = 'SUCCESS',
-        rows_affected = :tb_row_count,
-        message = :result
+        rows_affected = IFF(:dry_run, 0, :expired_files),
+        message = IFF(:dry_run, 'Dry run: would remove ', 'Removed ') || :purge_summary ||
+                  IFF(:dry_run, '', ' with ' || :remove_calls || ' REMOVE calls')
     WHERE log_id = :log_id_var;
     
-    RETURN 'SUCCESS: ' || :result || '. Outputs available at @' || get_config_string('output_stage_name') || '/*_' || :safe_deal_id || '.csv';
+    RETURN IFF(:dry_run, 'DRY RUN: Would remove ', 'SUCCESS: Removed ') || :purge_summary ||
+           IFF(:dry_run, '', ' with ' || :remove_calls || ' REMOVE calls');
     
 EXCEPTION
     WHEN OTHER THEN
@@ -2297,12 +4785,1493 @@ EXCEPTION
 END;
 $$;
 
-SELECT 'AI insights and export procedures created successfully' AS status;
+-- ============================================================================
+-- PART 5: MASTER ORCHESTRATION PROCEDURES
+-- ============================================================================
+
+-- Master procedure for generating all FDD schedules for a deal
+CREATE OR REPLACE PROCEDURE generate_fdd_schedules(deal_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();  -- also the trace_id of the run's spans
+    root_span_id VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    result VARCHAR;
+    tb_row_count NUMBER;
+    insight_count NUMBER;
+    safe_deal_id VARCHAR;
+    outputs_var VARCHAR;
+    run_status VARCHAR DEFAULT 'SUCCESS';
+    failed_steps NUMBER;
+    warning_steps NUMBER;
+    step_errors VARCHAR;
+    step_warnings VARCHAR;
+    spans ARRAY DEFAULT ARRAY_CONSTRUCT();  -- buffered step spans, written once by record_spans
+    step_name VARCHAR;
+    step_start TIMESTAMP;
+    step_result VARCHAR;
+    copy_sql VARCHAR;  -- For dynamic COPY INTO statement
+    config_version_var NUMBER;
+    run_config OBJECT;
+    export_mode VARCHAR;
+    export_workbook BOOLEAN;
+    output_stage VARCHAR;
+    error_msg VARCHAR;
+BEGIN
+    -- Settings for the whole run, resolved once; every audit row of the run is
+    -- stamped with this config_version
+    SELECT 
+        config_version,
+        config_values,
+        config_values:export_mode::VARCHAR,
+        COALESCE(config_values:export_xlsx_workbook::BOOLEAN, FALSE),
+        config_values:output_stage_name::VARCHAR
+    INTO :config_version_var, :run_config, :export_mode, :export_workbook, :output_stage
+    FROM v_config_snapshot;
+    
+    -- Validate and sanitize input
+    safe_deal_id := sanitize_deal_id(:deal_id_param, :run_config);
+    IF (safe_deal_id IS NULL) THEN
+        RETURN 'ERROR: Invalid deal_id format. Must be alphanumeric with underscores/hyphens only.';
+    END IF;
+    
+    -- Validate deal exists
+    SELECT COUNT(*) INTO :tb_row_count 
+    FROM trial_balance_raw 
+    WHERE deal_id = :safe_deal_id;
+    
+    IF (:tb_row_count = 0) THEN
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, end_time, status, error_message, config_version)
+        VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, CURRENT_TIMESTAMP(),
+                'ERROR', 'No trial balance data found for deal', :config_version_var);
+        
+        RETURN 'ERROR: No trial balance data found for deal ' || :safe_deal_id || 
+               '. Please load data first using load_trial_balance().';
+    END IF;
+    
+    -- Each step is timed into a span: step_name is set first so the error
+    -- handler can close the span of the step that failed, and cleared once
+    -- the span is buffered. Steps are called with the run's trace id, so they
+    -- skip their own audit_log rows and the step span (with the step's return
+    -- value) is their only record.
+    
+    -- Step 1: Generate schedules (Income Statement and Balance Sheet in one pass)
+    step_name := 'build_schedules';
+    step_start := CURRENT_TIMESTAMP();
+    CALL build_schedules(:safe_deal_id, NULL, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
+    
+    step_name := 'refresh_database_tab';
+    step_start := CURRENT_TIMESTAMP();
+    CALL refresh_database_tab(:safe_deal_id, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
+    
+    step_name := 'refresh_schedule_values';
+    step_start := CURRENT_TIMESTAMP();
+    CALL refresh_schedule_values(:safe_deal_id, FALSE, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
+    
+    -- Step 2: Generate AI insights
+    step_name := 'generate_ai_insights';
+    step_start := CURRENT_TIMESTAMP();
+    CALL generate_ai_insights(:safe_deal_id, FALSE, :log_id_var) INTO :step_result;
+    spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+    step_name := NULL;
+    
+    -- Step 3: Export everything with deal-specific filenames
+    IF (:export_mode = 'PARTITIONED') THEN
+        step_name := 'export_fdd_outputs_parallel';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_fdd_outputs_parallel(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        outputs_var := '/exports/' || :safe_deal_id || '/';
+    ELSE
+        step_name := 'export_database_tab';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_database_tab(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_income_statement_structure';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_income_statement_structure(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_balance_sheet_structure';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_balance_sheet_structure(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_schedule_values';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_schedule_values(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        
+        step_name := 'export_ai_insights';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_ai_insights(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+        outputs_var := '/*_' || :safe_deal_id || '.csv';
+    END IF;
+    IF (:export_workbook) THEN
+        step_name := 'export_fdd_workbook';
+        step_start := CURRENT_TIMESTAMP();
+        CALL export_fdd_workbook(:safe_deal_id, :log_id_var) INTO :step_result;
+        spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, :step_result));
+        step_name := NULL;
+    END IF;
+    
+    -- Get counts for confirmation
+    SELECT COUNT(*) INTO :insight_count FROM ai_insights WHERE deal_id = :safe_deal_id;
+    
+    result := :tb_row_count::VARCHAR || ' TB rows processed, ' ||
+              :insight_count::VARCHAR || ' AI insights generated for ' || :safe_deal_id;
+    
+    -- Steps report failures in their return value (now only in their span),
+    -- so the run's status is the worst step status
+    SELECT 
+        COUNT_IF(s.value:status::VARCHAR = 'ERROR'),
+        COUNT_IF(s.value:status::VARCHAR = 'WARNING'),
+        LISTAGG(IFF(s.value:status::VARCHAR = 'ERROR', s.value:span_name::VARCHAR || ': ' || s.value:message::VARCHAR, NULL), '; '),
+        LISTAGG(IFF(s.value:status::VARCHAR = 'WARNING', s.value:span_name::VARCHAR || ': ' || s.value:message::VARCHAR, NULL), '; ')
+    INTO :failed_steps, :warning_steps, :step_errors, :step_warnings
+    FROM TABLE(FLATTEN(input => :spans)) s;
+    
+    IF (:failed_steps > 0) THEN
+        run_status := 'ERROR';
+        result := :failed_steps || ' step(s) failed: ' || :step_errors || '. ' || :result;
+    ELSEIF (:warning_steps > 0) THEN
+        run_status := 'WARNING';
+        result := :warning_steps || ' step(s) with warnings: ' || :step_warnings || '. ' || :result;
+    END IF;
+    
+    -- Root span, then one INSERT for all spans and one audit_log row for the run.
+    -- The root span is not buffered, so a failure here is recorded once by the handler.
+    CALL record_spans(:log_id_var, :safe_deal_id, ARRAY_APPEND(:spans, OBJECT_INSERT(
+        span_record(NULL, 'generate_fdd_schedules', :start_time_var, :run_status || ': ' || :result), 'span_id', :root_span_id)));
+    
+    INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, end_time, duration_seconds, status, rows_affected, message, error_message, config_version)
+    VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, CURRENT_TIMESTAMP(),
+            DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()), :run_status, :tb_row_count, LEFT(:result, 5000),
+            LEFT(:step_errors, 5000), :config_version_var);
+    
+    RETURN :run_status || ': ' || :result || '. Outputs available at @' || :output_stage || :outputs_var ||
+           ' (config version ' || :config_version_var || ')';
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        -- Flush what was buffered: the failed step and the root span close with the error
+        IF (:step_name IS NOT NULL) THEN
+            spans := ARRAY_APPEND(:spans, span_record(:root_span_id, :step_name, :step_start, 'ERROR: ' || :error_msg));
+        END IF;
+        spans := ARRAY_APPEND(:spans, OBJECT_INSERT(
+            span_record(NULL, 'generate_fdd_schedules', :start_time_var, 'ERROR: ' || :error_msg), 'span_id', :root_span_id));
+        CALL record_spans(:log_id_var, :safe_deal_id, :spans);
+        
+        INSERT INTO audit_log (log_id, procedure_name, deal_id, start_time, end_time, status, error_message, config_version)
+        VALUES (:log_id_var, 'generate_fdd_schedules', :safe_deal_id, :start_time_var, CURRENT_TIMESTAMP(),
+                'ERROR', :error_msg, :config_version_var);
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Build the variance index for data already loaded
+CALL refresh_variance_index();
+
+SELECT 'AI insights and export procedures created successfully' AS status;
+
+
+
+-- ============================================================================
+-- STEP 8: OPERATIONAL ROLLUPS (from 06_operational_rollups.sql)
+-- ============================================================================
+
+-- Houlihan Lokey FDD Automation - Operational Rollups
+-- ============================================================================
+-- Description: Hourly rollups of audit_log and data_quality_checks, maintained
+--              incrementally from a high-water mark, for the admin dashboard,
+--              and a metadata-based system health probe
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: ROLLUP TABLES
+-- ============================================================================
+
+-- Procedure executions per hour (by start_time), procedure and deal
+CREATE TABLE IF NOT EXISTS audit_hourly_rollup (
+    hour_bucket TIMESTAMP_NTZ NOT NULL,
+    procedure_name VARCHAR(200) NOT NULL,
+    deal_id VARCHAR(50),
+
+    -- Counts
+    executions NUMBER DEFAULT 0,
+    successes NUMBER DEFAULT 0,
+    errors NUMBER DEFAULT 0,
+    warnings NUMBER DEFAULT 0,
+    running NUMBER DEFAULT 0,  -- still 'STARTED' when the bucket was last rebuilt
+
+    -- Timing
+    timed_executions NUMBER DEFAULT 0,
+    total_duration_seconds NUMBER(18,2) DEFAULT 0,
+    max_duration_seconds NUMBER(10,2),
+    duration_digest VARIANT,  -- APPROX_PERCENTILE_ACCUMULATE state, combine across buckets
+
+    -- Results
+    rows_affected NUMBER DEFAULT 0,
+    last_error_time TIMESTAMP_NTZ,
+
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (hour_bucket);
+
+-- Data quality check outcomes per hour (by check_timestamp), deal and check type
+CREATE TABLE IF NOT EXISTS dq_hourly_rollup (
+    hour_bucket TIMESTAMP_NTZ NOT NULL,
+    deal_id VARCHAR(50) NOT NULL,
+    check_type VARCHAR(50),
+    severity VARCHAR(20),
+
+    total_checks NUMBER DEFAULT 0,
+    passed_checks NUMBER DEFAULT 0,
+    failed_checks NUMBER DEFAULT 0,
+
+    refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (hour_bucket);
+
+-- High-water marks for incremental maintenance
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    rollup_name VARCHAR(100) PRIMARY KEY,
+    high_water_mark TIMESTAMP_NTZ NOT NULL,
+    last_refresh_time TIMESTAMP_NTZ,
+    buckets_refreshed NUMBER
+);
+
+-- ============================================================================
+-- PART 2: INCREMENTAL REFRESH
+-- ============================================================================
+
+-- Rebuilds only the hour buckets touched by rows that completed since the last
+-- high-water mark. An audit_log row is picked up once its status leaves
+-- 'STARTED'; the bucket it belongs to (its start hour) is then recomputed from
+-- the raw rows of that hour, so late completions and updates are never
+-- double-counted. Rows newer than rollup_lag_minutes are left for the next run
+-- so that transactions still in flight are not skipped.
+CREATE OR REPLACE PROCEDURE refresh_operational_rollups()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    lag_minutes NUMBER DEFAULT get_config_number('rollup_lag_minutes');
+    refresh_to TIMESTAMP_NTZ;
+    audit_from TIMESTAMP_NTZ;
+    dq_from TIMESTAMP_NTZ;
+    audit_buckets NUMBER DEFAULT 0;
+    dq_buckets NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    -- Log start
+    INSERT INTO audit_log (log_id, procedure_name, start_time, status)
+    VALUES (:log_id_var, 'refresh_operational_rollups', :start_time_var, 'STARTED');
+
+    refresh_to := DATEADD(minute, -1 * COALESCE(:lag_minutes, 5), CURRENT_TIMESTAMP())::TIMESTAMP_NTZ;
+
+    SELECT COALESCE(MAX(CASE WHEN rollup_name = 'audit_hourly_rollup' THEN high_water_mark END), '1970-01-01'::TIMESTAMP_NTZ),
+           COALESCE(MAX(CASE WHEN rollup_name = 'dq_hourly_rollup' THEN high_water_mark END), '1970-01-01'::TIMESTAMP_NTZ)
+    INTO :audit_from, :dq_from
+    FROM rollup_watermarks;
+
+    -- Hour buckets affected since the last refresh
+    -- (start_time bound prunes partitions; no procedure runs longer than a day)
+    CREATE OR REPLACE TEMPORARY TABLE temp_audit_buckets AS
+    SELECT DISTINCT DATE_TRUNC('hour', start_time) AS hour_bucket
+    FROM audit_log
+    WHERE status <> 'STARTED'
+    AND start_time IS NOT NULL
+    AND start_time > DATEADD(day, -1, :audit_from)
+    AND COALESCE(end_time, log_timestamp) > :audit_from
+    AND COALESCE(end_time, log_timestamp) <= :refresh_to;
+
+    CREATE OR REPLACE TEMPORARY TABLE temp_dq_buckets AS
+    SELECT DISTINCT DATE_TRUNC('hour', check_timestamp) AS hour_bucket
+    FROM data_quality_checks
+    WHERE check_timestamp > :dq_from
+    AND check_timestamp <= :refresh_to;
+
+    SELECT COUNT(*) INTO :audit_buckets FROM temp_audit_buckets;
+    SELECT COUNT(*) INTO :dq_buckets FROM temp_dq_buckets;
+
+    BEGIN TRANSACTION;
+
+    -- Recompute affected audit buckets
+    DELETE FROM audit_hourly_rollup
+    WHERE hour_bucket IN (SELECT hour_bucket FROM temp_audit_buckets);
+
+    INSERT INTO audit_hourly_rollup (
+        hour_bucket, procedure_name, deal_id,
+        executions, successes, errors, warnings, running,
+        timed_executions, total_duration_seconds, max_duration_seconds, duration_digest,
+        rows_affected, last_error_time
+    )
+    SELECT
+        DATE_TRUNC('hour', a.start_time) AS hour_bucket,
+        a.procedure_name,
+        a.deal_id,
+        COUNT(*),
+        COUNT_IF(a.status = 'SUCCESS'),
+        COUNT_IF(a.status = 'ERROR'),
+        COUNT_IF(a.status = 'WARNING'),
+        COUNT_IF(a.status = 'STARTED'),
+        COUNT(a.duration_seconds),
+        COALESCE(SUM(a.duration_seconds), 0),
+        MAX(a.duration_seconds),
+        APPROX_PERCENTILE_ACCUMULATE(a.duration_seconds),
+        SUM(COALESCE(a.rows_affected, 0)),
+        MAX(CASE WHEN a.status = 'ERROR' THEN a.start_time END)
+    FROM audit_log a
+    WHERE a.start_time >= (SELECT MIN(hour_bucket) FROM temp_audit_buckets)
+    AND DATE_TRUNC('hour', a.start_time) IN (SELECT hour_bucket FROM temp_audit_buckets)
+    GROUP BY 1, 2, 3;
+
+    -- Recompute affected data quality buckets
+    DELETE FROM dq_hourly_rollup
+    WHERE hour_bucket IN (SELECT hour_bucket FROM temp_dq_buckets);
+
+    INSERT INTO dq_hourly_rollup (
+        hour_bucket, deal_id, check_type, severity,
+        total_checks, passed_checks, failed_checks
+    )
+    SELECT
+        DATE_TRUNC('hour', d.check_timestamp) AS hour_bucket,
+        d.deal_id,
+        d.check_type,
+        d.severity,
+        COUNT(*),
+        COUNT_IF(d.passed = TRUE),
+        COUNT_IF(d.passed = FALSE)
+    FROM data_quality_checks d
+    WHERE d.check_timestamp >= (SELECT MIN(hour_bucket) FROM temp_dq_buckets)
+    AND DATE_TRUNC('hour', d.check_timestamp) IN (SELECT hour_bucket FROM temp_dq_buckets)
+    GROUP BY 1, 2, 3, 4;
+
+    -- Advance high-water marks
+    MERGE INTO rollup_watermarks w
+    USING (
+        SELECT 'audit_hourly_rollup' AS rollup_name, :audit_buckets AS buckets
+        UNION ALL
+        SELECT 'dq_hourly_rollup', :dq_buckets
+    ) s
+    ON w.rollup_name = s.rollup_name
+    WHEN MATCHED THEN UPDATE SET
+        high_water_mark = :refresh_to,
+        last_refresh_time = CURRENT_TIMESTAMP(),
+        buckets_refreshed = s.buckets
+    WHEN NOT MATCHED THEN INSERT (rollup_name, high_water_mark, last_refresh_time, buckets_refreshed)
+        VALUES (s.rollup_name, :refresh_to, CURRENT_TIMESTAMP(), s.buckets);
+
+    COMMIT;
+
+    -- Log success
+    UPDATE audit_log
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = 'SUCCESS',
+        rows_affected = :audit_buckets + :dq_buckets,
+        message = 'Refreshed ' || :audit_buckets || ' audit and ' || :dq_buckets || ' data quality hour buckets'
+    WHERE log_id = :log_id_var;
+
+    RETURN 'SUCCESS: Refreshed ' || :audit_buckets || ' audit and ' || :dq_buckets ||
+           ' data quality hour buckets up to ' || :refresh_to;
+
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+
+        ROLLBACK;
+
+        UPDATE audit_log
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Rebuild all rollups from scratch (e.g. after purging audit_log)
+CREATE OR REPLACE PROCEDURE rebuild_operational_rollups()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+BEGIN
+    TRUNCATE TABLE audit_hourly_rollup;
+    TRUNCATE TABLE dq_hourly_rollup;
+    DELETE FROM rollup_watermarks
+    WHERE rollup_name IN ('audit_hourly_rollup', 'dq_hourly_rollup');
+
+    CALL refresh_operational_rollups();
+
+    RETURN 'SUCCESS: Operational rollups rebuilt';
+END;
+$$;
+
+-- ============================================================================
+-- PART 3: HEALTH PROBE
+-- ============================================================================
+
+-- System health checks for the admin dashboard and external monitoring:
+--   CALL system_health_check();
+-- Object and row counts come from INFORMATION_SCHEMA metadata, mappings are
+-- checked with a LIMIT 1 probe and errors from audit_hourly_rollup, so no check
+-- scans trial_balance_raw or evaluates v_database_tab_pivoted. The independent
+-- probes run as concurrent child jobs.
+CREATE OR REPLACE PROCEDURE system_health_check()
+RETURNS TABLE(check_name VARCHAR, category VARCHAR, observed NUMBER, passed BOOLEAN, severity VARCHAR, message VARCHAR)
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    objects_job RESULTSET;
+    row_counts_job RESULTSET;
+    mappings_job RESULTSET;
+    errors_job RESULTSET;
+    checks ARRAY DEFAULT ARRAY_CONSTRUCT();
+    result_cursor RESULTSET;
+BEGIN
+    -- Tables, views and procedures in this schema
+    objects_job := ASYNC (
+        SELECT check_order, check_name, 'Database Objects' AS category, observed,
+               observed >= minimum AS passed, 'ERROR' AS severity,
+               observed || ' found, at least ' || minimum || ' expected' AS message
+        FROM (
+            SELECT 1 AS check_order, 'Tables' AS check_name, COUNT(*) AS observed, 14 AS minimum
+            FROM information_schema.tables
+            WHERE table_schema = CURRENT_SCHEMA() AND table_type = 'BASE TABLE'
+            UNION ALL
+            SELECT 2, 'Views', COUNT(*), 5
+            FROM information_schema.views
+            WHERE table_schema = CURRENT_SCHEMA()
+            UNION ALL
+            SELECT 3, 'Procedures', COUNT(*), 16
+            FROM information_schema.procedures
+            WHERE procedure_schema = CURRENT_SCHEMA()
+        )
+    );
+    
+    -- Row counts from table metadata; the two views read the materialized tables
+    row_counts_job := ASYNC (
+        SELECT t.check_order, t.check_name, t.category, COALESCE(i.row_count, 0) AS observed,
+               COALESCE(i.row_count, 0) > 0 AS passed, 'ERROR' AS severity,
+               COALESCE(i.row_count, 0) || ' rows in ' || LOWER(t.table_name) AS message
+        FROM (
+            SELECT column1 AS check_order, column2 AS check_name, column3 AS category, column4 AS table_name
+            FROM VALUES
+                (4, 'Trial Balance Rows', 'Data Integrity', 'TRIAL_BALANCE_RAW'),
+                (5, 'Account Mappings', 'Data Integrity', 'ACCOUNT_MAPPINGS'),
+                (7, 'v_trial_balance_for_schedules', 'View Health', 'TRIAL_BALANCE_FOR_SCHEDULES'),
+                (8, 'v_database_tab_pivoted', 'View Health', 'DATABASE_TAB_CACHE')
+        ) t
+        LEFT JOIN information_schema.tables i
+            ON i.table_schema = CURRENT_SCHEMA()
+            AND i.table_name = t.table_name
+    );
+    
+    -- Stops at the first inactive mapping
+    mappings_job := ASYNC (
+        SELECT 6 AS check_order, 'Inactive Mappings' AS check_name, 'Data Integrity' AS category,
+               COUNT(*) AS observed, COUNT(*) = 0 AS passed, 'WARNING' AS severity,
+               IFF(COUNT(*) = 0, 'All account mappings are active', 'At least one account mapping is inactive') AS message
+        FROM (
+            SELECT 1 FROM account_mappings
+            WHERE NOT COALESCE(is_active, FALSE)
+            LIMIT 1
+        )
+    );
+    
+    errors_job := ASYNC (
+        SELECT 9 AS check_order, 'Recent Errors' AS check_name, 'Recent Execution' AS category,
+               COALESCE(SUM(errors), 0) AS observed, COALESCE(SUM(errors), 0) = 0 AS passed, 'WARNING' AS severity,
+               COALESCE(SUM(errors), 0) || ' procedure errors in the last 24 hours (audit_hourly_rollup)' AS message
+        FROM audit_hourly_rollup
+        WHERE hour_bucket >= DATE_TRUNC('hour', DATEADD(hour, -24, CURRENT_TIMESTAMP()))
+    );
+    
+    AWAIT ALL;
+    
+    -- A RESULTSET can be looped over but not queried, so the checks are
+    -- gathered into one ARRAY and returned in check order
+    FOR r IN objects_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    FOR r IN row_counts_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    FOR r IN mappings_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    FOR r IN errors_job DO
+        checks := ARRAY_APPEND(:checks, OBJECT_CONSTRUCT_KEEP_NULL(
+            'check_order', r.check_order, 'check_name', r.check_name, 'category', r.category,
+            'observed', r.observed, 'passed', r.passed, 'severity', r.severity, 'message', r.message));
+    END FOR;
+    
+    result_cursor := (
+        SELECT
+            c.value:check_name::VARCHAR AS check_name,
+            c.value:category::VARCHAR AS category,
+            c.value:observed::NUMBER AS observed,
+            c.value:passed::BOOLEAN AS passed,
+            c.value:severity::VARCHAR AS severity,
+            c.value:message::VARCHAR AS message
+        FROM TABLE(FLATTEN(input => :checks)) c
+        ORDER BY c.value:check_order::NUMBER
+    );
+    RETURN TABLE(result_cursor);
+END;
+$$;
+
+-- ============================================================================
+-- PART 4: SCHEDULED REFRESH
+-- ============================================================================
+
+-- Serverless task; resumed here so rollups start filling immediately
+CREATE OR REPLACE TASK refresh_operational_rollups_task
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = 'XSMALL'
+    SCHEDULE = '15 MINUTE'
+    COMMENT = 'Incremental refresh of audit_hourly_rollup and dq_hourly_rollup'
+AS
+    CALL refresh_operational_rollups();
+
+ALTER TASK refresh_operational_rollups_task RESUME;
+
+-- ============================================================================
+-- PART 5: GRANTS
+-- ============================================================================
+
+GRANT SELECT ON TABLE audit_hourly_rollup TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE dq_hourly_rollup TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE rollup_watermarks TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE audit_hourly_rollup TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON TABLE dq_hourly_rollup TO ROLE FDD_READONLY_ROLE;
+GRANT USAGE ON PROCEDURE refresh_operational_rollups() TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE system_health_check() TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE system_health_check() TO ROLE FDD_ANALYST_ROLE;
+
+-- Initial backfill
+CALL refresh_operational_rollups();
+
+SELECT 'Operational rollups created and backfilled' AS status;
+
+
+
+-- ============================================================================
+-- STEP 9: PORTFOLIO RUNS (from 07_portfolio_runs.sql)
+-- ============================================================================
+
+-- Houlihan Lokey FDD Automation - Portfolio Runs
+-- ============================================================================
+-- Description: Run and per-deal status tracking for portfolio-wide
+--              generate_fdd_schedules refreshes (driven by fdd_tools.portfolio)
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: RUN TRACKING TABLES
+-- ============================================================================
+
+-- One row per portfolio refresh
+CREATE TABLE IF NOT EXISTS portfolio_runs (
+    run_id VARCHAR(50) DEFAULT UUID_STRING() PRIMARY KEY,
+    requested_by VARCHAR(100) DEFAULT CURRENT_USER(),
+
+    -- Settings
+    concurrency_limit NUMBER,
+    max_retries NUMBER,
+
+    -- Timing
+    start_time TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    end_time TIMESTAMP_NTZ,
+    elapsed_seconds NUMBER(10,2),
+
+    -- Results
+    status VARCHAR(20) DEFAULT 'RUNNING',  -- 'RUNNING', 'SUCCESS', 'PARTIAL', 'ERROR'
+    deals_total NUMBER,
+    deals_succeeded NUMBER,
+    deals_failed NUMBER,
+    total_attempts NUMBER,
+    deal_seconds NUMBER(18,2),  -- sum of per-deal durations; deal_seconds / elapsed_seconds = effective parallelism
+    message VARCHAR(5000)
+);
+
+-- One row per generate_fdd_schedules attempt
+CREATE TABLE IF NOT EXISTS portfolio_run_deals (
+    run_id VARCHAR(50) NOT NULL,
+    deal_id VARCHAR(50) NOT NULL,
+    attempt NUMBER NOT NULL,
+
+    start_time TIMESTAMP_NTZ,
+    end_time TIMESTAMP_NTZ,
+    duration_seconds NUMBER(10,2),
+
+    status VARCHAR(20),  -- 'SUCCESS', 'WARNING', 'ERROR'
+    result_message VARCHAR(5000),
+    session_id VARCHAR(100),
+
+    PRIMARY KEY (run_id, deal_id, attempt)
+);
+
+-- ============================================================================
+-- PART 2: STATUS VIEWS
+-- ============================================================================
+
+-- Final outcome per deal (last attempt) for each run
+CREATE OR REPLACE VIEW v_portfolio_run_status AS
+SELECT
+    d.run_id,
+    r.start_time AS run_start_time,
+    d.deal_id,
+    d.status,
+    d.attempt AS attempts,
+    d.start_time,
+    d.end_time,
+    d.duration_seconds,
+    d.result_message
+FROM portfolio_run_deals d
+JOIN portfolio_runs r ON r.run_id = d.run_id
+QUALIFY ROW_NUMBER() OVER (PARTITION BY d.run_id, d.deal_id ORDER BY d.attempt DESC) = 1;
+
+-- ============================================================================
+-- PART 3: RUN COMPLETION
+-- ============================================================================
+
+-- Summarize a run from its attempt rows (called by the runner when all deals finish)
+CREATE OR REPLACE PROCEDURE finish_portfolio_run(run_id_param VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    deals_total NUMBER DEFAULT 0;
+    deals_succeeded NUMBER DEFAULT 0;
+    deals_failed NUMBER DEFAULT 0;
+    run_status VARCHAR;
+BEGIN
+    SELECT COUNT(*), COUNT_IF(status = 'SUCCESS'), COUNT_IF(status <> 'SUCCESS')
+    INTO :deals_total, :deals_succeeded, :deals_failed
+    FROM v_portfolio_run_status
+    WHERE run_id = :run_id_param;
+
+    run_status := CASE
+        WHEN :deals_failed = 0 THEN 'SUCCESS'
+        WHEN :deals_succeeded = 0 THEN 'ERROR'
+        ELSE 'PARTIAL'
+    END;
+
+    UPDATE portfolio_runs r
+    SET end_time = CURRENT_TIMESTAMP(),
+        elapsed_seconds = DATEDIFF(millisecond, r.start_time, CURRENT_TIMESTAMP()) / 1000,
+        status = :run_status,
+        deals_succeeded = :deals_succeeded,
+        deals_failed = :deals_failed,
+        total_attempts = a.attempts,
+        deal_seconds = a.deal_seconds,
+        message = :deals_succeeded || ' of ' || r.deals_total || ' deals succeeded'
+    FROM (
+        SELECT COUNT(*) AS attempts, COALESCE(SUM(duration_seconds), 0) AS deal_seconds
+        FROM portfolio_run_deals
+        WHERE run_id = :run_id_param
+    ) a
+    WHERE r.run_id = :run_id_param;
+
+    INSERT INTO audit_log (procedure_name, start_time, end_time, status, rows_affected, message)
+    SELECT 'portfolio_run', start_time, end_time,
+           CASE status WHEN 'PARTIAL' THEN 'WARNING' ELSE status END,
+           deals_succeeded, message || ' (run ' || run_id || ')'
+    FROM portfolio_runs
+    WHERE run_id = :run_id_param;
+
+    RETURN :run_status || ': ' || :deals_succeeded || ' of ' || :deals_total || ' deals succeeded';
+END;
+$$;
+
+-- ============================================================================
+-- PART 4: GRANTS
+-- ============================================================================
+
+GRANT SELECT, INSERT, UPDATE ON TABLE portfolio_runs TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT, INSERT ON TABLE portfolio_run_deals TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_portfolio_run_status TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE portfolio_runs TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON VIEW v_portfolio_run_status TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT, INSERT, UPDATE ON TABLE portfolio_runs TO ROLE FDD_SERVICE_ROLE;
+GRANT SELECT, INSERT ON TABLE portfolio_run_deals TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE finish_portfolio_run(VARCHAR) TO ROLE FDD_SERVICE_ROLE;
+GRANT USAGE ON PROCEDURE finish_portfolio_run(VARCHAR) TO ROLE FDD_ANALYST_ROLE;
+
+SELECT 'Portfolio run tracking created successfully' AS status;
+
+
+
+-- ============================================================================
+-- STEP 10: EXECUTION TRACING (from 08_execution_tracing.sql)
+-- ============================================================================
+
+-- Houlihan Lokey FDD Automation - Execution Tracing
+-- ============================================================================
+-- Description: Trace/span records for generate_fdd_schedules runs. Step spans
+--              are buffered in the run and written with one INSERT; per-step
+--              query statistics are collected from ACCOUNT_USAGE
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: SPAN TABLE
+-- ============================================================================
+
+-- One row per step of a run, plus a root span for the run itself
+CREATE TABLE IF NOT EXISTS execution_spans (
+    trace_id VARCHAR(50) NOT NULL,  -- the run's audit_log log_id
+    span_id VARCHAR(50) NOT NULL,
+    parent_span_id VARCHAR(50),  -- NULL for the root span
+    deal_id VARCHAR(50),
+    span_name VARCHAR(200) NOT NULL,  -- procedure called by the step
+
+    -- Timing
+    start_time TIMESTAMP_NTZ NOT NULL,
+    end_time TIMESTAMP_NTZ,
+    duration_ms NUMBER,
+
+    -- Results
+    status VARCHAR(20),  -- 'SUCCESS', 'WARNING', 'ERROR'
+    message VARCHAR(5000),  -- the step's return value
+
+    user_name VARCHAR(100) DEFAULT CURRENT_USER(),
+    session_id VARCHAR(100) DEFAULT CURRENT_SESSION()::VARCHAR,
+    recorded_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),  -- when record_spans wrote the run
+
+    PRIMARY KEY (trace_id, span_id)
+)
+CLUSTER BY (TO_DATE(start_time));
+
+ALTER TABLE execution_spans ADD COLUMN IF NOT EXISTS recorded_at TIMESTAMP_NTZ;
+
+-- ============================================================================
+-- PART 2: SPAN BUFFERING
+-- ============================================================================
+
+-- A finished span as an OBJECT, appended to the caller's spans ARRAY. The
+-- status is read from the step's return value ('ERROR: ...', 'WARNING: ...').
+CREATE OR REPLACE FUNCTION span_record(
+    parent_span_id VARCHAR,
+    span_name VARCHAR,
+    start_time TIMESTAMP_NTZ,
+    step_result VARCHAR
+)
+RETURNS OBJECT
+LANGUAGE SQL
+AS
+$$
+    OBJECT_CONSTRUCT(
+        'parent_span_id', parent_span_id,
+        'span_name', span_name,
+        'start_time', start_time,
+        'end_time', CURRENT_TIMESTAMP()::TIMESTAMP_NTZ,
+        'status', CASE
+            WHEN STARTSWITH(step_result, 'ERROR') THEN 'ERROR'
+            WHEN STARTSWITH(step_result, 'WARNING') THEN 'WARNING'
+            ELSE 'SUCCESS'
+        END,
+        'message', LEFT(step_result, 5000)
+    )
+$$;
+
+-- Write a run's buffered spans in one INSERT (on completion and on error)
+CREATE OR REPLACE PROCEDURE record_spans(trace_id_param VARCHAR, deal_id_param VARCHAR, spans ARRAY)
+RETURNS NUMBER
+LANGUAGE SQL
+AS
+$$
+BEGIN
+    INSERT INTO execution_spans (
+        trace_id, span_id, parent_span_id, deal_id, span_name,
+        start_time, end_time, duration_ms, status, message, recorded_at
+    )
+    SELECT
+        :trace_id_param,
+        COALESCE(s.value:span_id::VARCHAR, UUID_STRING()),
+        s.value:parent_span_id::VARCHAR,
+        :deal_id_param,
+        s.value:span_name::VARCHAR,
+        s.value:start_time::TIMESTAMP_NTZ,
+        s.value:end_time::TIMESTAMP_NTZ,
+        DATEDIFF(millisecond, s.value:start_time::TIMESTAMP_NTZ, s.value:end_time::TIMESTAMP_NTZ),
+        s.value:status::VARCHAR,
+        s.value:message::VARCHAR,
+        CURRENT_TIMESTAMP()
+    FROM TABLE(FLATTEN(input => :spans)) s;
+    
+    RETURN SQLROWCOUNT;
+END;
+$$;
+
+-- ============================================================================
+-- PART 3: TRACE VIEWS
+-- ============================================================================
+
+-- One row per run (root span), newest first in the dashboard
+CREATE OR REPLACE VIEW v_execution_traces AS
+SELECT
+    r.trace_id,
+    r.deal_id,
+    r.start_time,
+    r.end_time,
+    r.duration_ms,
+    r.status,
+    r.user_name,
+    COUNT(c.span_id) AS steps,
+    COUNT_IF(c.status = 'ERROR') AS failed_steps,
+    MAX_BY(c.span_name, c.duration_ms) AS slowest_step
+FROM execution_spans r
+LEFT JOIN execution_spans c
+    ON c.trace_id = r.trace_id
+    AND c.parent_span_id = r.span_id
+WHERE r.parent_span_id IS NULL
+GROUP BY r.trace_id, r.deal_id, r.start_time, r.end_time, r.duration_ms, r.status, r.user_name;
+
+-- Spans with their offset from the start of the run (waterfall layout)
+CREATE OR REPLACE VIEW v_execution_waterfall AS
+SELECT
+    trace_id,
+    span_id,
+    parent_span_id,
+    deal_id,
+    span_name,
+    IFF(parent_span_id IS NULL, 0, 1) AS depth,
+    DATEDIFF(millisecond, MIN(start_time) OVER (PARTITION BY trace_id), start_time) AS offset_ms,
+    duration_ms,
+    start_time,
+    end_time,
+    status,
+    message
+FROM execution_spans;
+
+-- ============================================================================
+-- PART 4: STEP QUERY PERFORMANCE
+-- ============================================================================
+
+-- Query statistics per step span, summed over the queries the step ran
+CREATE TABLE IF NOT EXISTS step_performance (
+    trace_id VARCHAR(50) NOT NULL,
+    span_id VARCHAR(50) NOT NULL,
+    deal_id VARCHAR(50),
+    span_name VARCHAR(200),
+    step_start_time TIMESTAMP_NTZ,
+
+    -- Queries issued inside the step (CALL statements excluded, their children are counted)
+    query_count NUMBER,
+    slowest_query_id VARCHAR(100),
+
+    -- Pruning
+    bytes_scanned NUMBER,
+    partitions_scanned NUMBER,
+    partitions_total NUMBER,
+
+    -- Spilling
+    bytes_spilled_local NUMBER,
+    bytes_spilled_remote NUMBER,
+
+    -- Time (milliseconds)
+    queued_ms NUMBER,  -- provisioning + repair + overload
+    compilation_ms NUMBER,
+    execution_ms NUMBER,
+
+    credits_used NUMBER(18,6),  -- compute credits attributed to the step's queries
+    collected_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+
+    PRIMARY KEY (trace_id, span_id)
+)
+CLUSTER BY (TO_DATE(step_start_time));
+
+-- Joins finished step spans to SNOWFLAKE.ACCOUNT_USAGE query history. A step's
+-- queries are the ones its session started between the span's start and end,
+-- since owner's rights procedures cannot set QUERY_TAG for their child
+-- queries. Account usage views lag by up to query_history_latency_minutes,
+-- so only spans recorded before that are collected, from a high-water mark on
+-- recorded_at in rollup_watermarks (spans are written when the run ends, so a
+-- long run's spans are recorded after their end_time). QUERY_ATTRIBUTION_HISTORY
+-- lags by hours more: steps that started in the last step_credits_backfill_hours
+-- and still have no credits are collected again until their credits appear. Also fills
+-- audit_log.credits_used and query_id for the run.
+CREATE OR REPLACE PROCEDURE collect_step_performance()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    latency_minutes NUMBER DEFAULT get_config_number('query_history_latency_minutes');
+    backfill_hours NUMBER DEFAULT get_config_number('step_credits_backfill_hours');
+    collect_to TIMESTAMP_NTZ;
+    collect_from TIMESTAMP_NTZ;
+    query_from TIMESTAMP_NTZ;
+    steps_collected NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    INSERT INTO audit_log (log_id, procedure_name, start_time, status)
+    VALUES (:log_id_var, 'collect_step_performance', :start_time_var, 'STARTED');
+    
+    collect_to := DATEADD(minute, -1 * COALESCE(:latency_minutes, 45), CURRENT_TIMESTAMP())::TIMESTAMP_NTZ;
+    
+    SELECT COALESCE(MAX(high_water_mark), DATEADD(day, -7, :collect_to))
+    INTO :collect_from
+    FROM rollup_watermarks
+    WHERE rollup_name = 'step_performance';
+    
+    -- Runs recorded since the last collection, plus runs still missing credits
+    CREATE OR REPLACE TEMPORARY TABLE temp_perf_spans AS
+    SELECT trace_id, span_id, parent_span_id, deal_id, span_name, session_id, start_time, end_time
+    FROM execution_spans
+    WHERE (COALESCE(recorded_at, end_time) > :collect_from
+           AND COALESCE(recorded_at, end_time) <= :collect_to)
+    OR trace_id IN (
+        SELECT trace_id
+        FROM step_performance
+        WHERE credits_used IS NULL
+        AND step_start_time >= DATEADD(hour, -1 * COALESCE(:backfill_hours, 24), CURRENT_TIMESTAMP())
+    );
+    
+    SELECT COALESCE(MIN(start_time), :collect_from) INTO :query_from FROM temp_perf_spans;
+    
+    BEGIN TRANSACTION;
+    
+    MERGE INTO step_performance p
+    USING (
+        SELECT
+            s.trace_id,
+            s.span_id,
+            s.deal_id,
+            s.span_name,
+            s.start_time AS step_start_time,
+            COUNT(q.query_id) AS query_count,
+            MAX_BY(q.query_id, q.execution_time) AS slowest_query_id,
+            SUM(q.bytes_scanned) AS bytes_scanned,
+            SUM(q.partitions_scanned) AS partitions_scanned,
+            SUM(q.partitions_total) AS partitions_total,
+            SUM(q.bytes_spilled_to_local_storage) AS bytes_spilled_local,
+            SUM(q.bytes_spilled_to_remote_storage) AS bytes_spilled_remote,
+            SUM(q.queued_provisioning_time + q.queued_repair_time + q.queued_overload_time) AS queued_ms,
+            SUM(q.compilation_time) AS compilation_ms,
+            SUM(q.execution_time) AS execution_ms,
+            SUM(a.credits_attributed_compute) AS credits_used
+        FROM temp_perf_spans s
+        JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY q
+            ON q.session_id::VARCHAR = s.session_id
+            AND q.start_time::TIMESTAMP_NTZ >= s.start_time
+            AND q.start_time::TIMESTAMP_NTZ < s.end_time
+        LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_ATTRIBUTION_HISTORY a
+            ON a.query_id = q.query_id
+        WHERE s.parent_span_id IS NOT NULL
+        AND q.start_time >= :query_from
+        AND q.query_type <> 'CALL'
+        GROUP BY 1, 2, 3, 4, 5
+    ) src
+    ON p.trace_id = src.trace_id AND p.span_id = src.span_id
+    WHEN MATCHED THEN UPDATE SET
+        query_count = src.query_count,
+        slowest_query_id = src.slowest_query_id,
+        bytes_scanned = src.bytes_scanned,
+        partitions_scanned = src.partitions_scanned,
+        partitions_total = src.partitions_total,
+        bytes_spilled_local = src.bytes_spilled_local,
+        bytes_spilled_remote = src.bytes_spilled_remote,
+        queued_ms = src.queued_ms,
+        compilation_ms = src.compilation_ms,
+        execution_ms = src.execution_ms,
+        credits_used = src.credits_used,
+        collected_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (
+        trace_id, span_id, deal_id, span_name, step_start_time, query_count, slowest_query_id,
+        bytes_scanned, partitions_scanned, partitions_total, bytes_spilled_local, bytes_spilled_remote,
+        queued_ms, compilation_ms, execution_ms, credits_used
+    ) VALUES (
+        src.trace_id, src.span_id, src.deal_id, src.span_name, src.step_start_time, src.query_count, src.slowest_query_id,
+        src.bytes_scanned, src.partitions_scanned, src.partitions_total, src.bytes_spilled_local, src.bytes_spilled_remote,
+        src.queued_ms, src.compilation_ms, src.execution_ms, src.credits_used
+    );
+    
+    steps_collected := SQLROWCOUNT;
+    
+    -- Run totals on the run's audit_log row: credits, and the CALL that started the run
+    UPDATE audit_log l
+    SET credits_used = r.credits_used,
+        query_id = COALESCE(r.call_query_id, l.query_id)
+    FROM (
+        SELECT
+            s.trace_id,
+            MAX(c.credits_used) AS credits_used,
+            MAX_BY(q.query_id, q.start_time) AS call_query_id
+        FROM temp_perf_spans s
+        LEFT JOIN (
+            SELECT trace_id, SUM(credits_used) AS credits_used
+            FROM step_performance
+            GROUP BY trace_id
+        ) c
+            ON c.trace_id = s.trace_id
+        LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY q
+            ON q.session_id::VARCHAR = s.session_id
+            AND q.query_type = 'CALL'
+            AND q.start_time >= DATEADD(day, -1, :query_from)
+            AND q.start_time::TIMESTAMP_NTZ <= s.start_time
+            AND q.end_time::TIMESTAMP_NTZ >= s.end_time
+            AND q.query_text ILIKE '%generate_fdd_schedules%'
+        WHERE s.parent_span_id IS NULL
+        GROUP BY s.trace_id
+    ) r
+    WHERE l.log_id = r.trace_id;
+    
+    MERGE INTO rollup_watermarks w
+    USING (SELECT 'step_performance' AS rollup_name) s
+    ON w.rollup_name = s.rollup_name
+    WHEN MATCHED THEN UPDATE SET
+        high_water_mark = :collect_to,
+        last_refresh_time = CURRENT_TIMESTAMP(),
+        buckets_refreshed = :steps_collected
+    WHEN NOT MATCHED THEN INSERT (rollup_name, high_water_mark, last_refresh_time, buckets_refreshed)
+        VALUES (s.rollup_name, :collect_to, CURRENT_TIMESTAMP(), :steps_collected);
+    
+    COMMIT;
+    
+    UPDATE audit_log
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = 'SUCCESS',
+        rows_affected = :steps_collected,
+        message = 'Collected query statistics for ' || :steps_collected || ' steps'
+    WHERE log_id = :log_id_var;
+    
+    RETURN 'SUCCESS: Collected query statistics for ' || :steps_collected || ' steps up to ' || :collect_to;
+    
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+        
+        ROLLBACK;
+        
+        UPDATE audit_log
+        SET end_time = CURRENT_TIMESTAMP(),
+            duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+        
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Per-step averages: pruning ratio, spill and queuing show where a slow step loses time
+CREATE OR REPLACE VIEW v_step_performance AS
+SELECT
+    p.trace_id,
+    p.deal_id,
+    p.span_name,
+    p.step_start_time,
+    s.duration_ms AS step_ms,
+    p.query_count,
+    p.execution_ms,
+    p.compilation_ms,
+    p.queued_ms,
+    p.bytes_scanned,
+    p.partitions_scanned,
+    p.partitions_total,
+    ROUND(p.partitions_scanned / NULLIF(p.partitions_total, 0), 4) AS scan_ratio,  -- 1.0 = no pruning
+    p.bytes_spilled_local,
+    p.bytes_spilled_remote,
+    p.credits_used,
+    p.slowest_query_id
+FROM step_performance p
+LEFT JOIN execution_spans s
+    ON s.trace_id = p.trace_id
+    AND s.span_id = p.span_id;
+
+-- Hourly, after account usage has caught up
+CREATE OR REPLACE TASK collect_step_performance_task
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = 'XSMALL'
+    SCHEDULE = '60 MINUTE'
+    COMMENT = 'Collect ACCOUNT_USAGE query statistics for generate_fdd_schedules step spans'
+AS
+    CALL collect_step_performance();
+
+ALTER TASK collect_step_performance_task RESUME;
+
+-- ============================================================================
+-- PART 5: GRANTS
+-- ============================================================================
+
+GRANT SELECT, INSERT ON TABLE execution_spans TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_execution_traces TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_execution_waterfall TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_execution_traces TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT ON VIEW v_execution_waterfall TO ROLE FDD_READONLY_ROLE;
+GRANT SELECT, INSERT ON TABLE execution_spans TO ROLE FDD_SERVICE_ROLE;
+GRANT SELECT ON TABLE step_performance TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_step_performance TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_step_performance TO ROLE FDD_READONLY_ROLE;
+GRANT USAGE ON PROCEDURE collect_step_performance() TO ROLE FDD_SERVICE_ROLE;
+
+SELECT 'Execution tracing created successfully' AS status;
+
+
+
+-- ============================================================================
+-- STEP 11: DATA RETENTION (from 09_data_retention.sql)
+-- ============================================================================
+
+-- Houlihan Lokey FDD Automation - Data Retention
+-- ============================================================================
+-- Description: Scheduled enforcement of audit_retention_days,
+--              error_log_retention_days, dq_check_retention_days and
+--              output_retention_days, in bounded batches with optional
+--              archiving and a record of every run
+-- Version: 1.0.0
+-- Last Updated: 2026-10-16
+-- ============================================================================
+
+-- ============================================================================
+-- PART 1: RETENTION TABLES
+-- ============================================================================
+
+-- One row per table (or stage) per retention run
+CREATE TABLE IF NOT EXISTS retention_runs (
+    run_id VARCHAR(50) NOT NULL,
+    table_name VARCHAR(100) NOT NULL,  -- 'audit_log', 'load_errors', 'data_quality_checks', '@fdd_output_stage'
+
+    -- Settings
+    retention_days NUMBER,
+    cutoff_time TIMESTAMP_NTZ,  -- rows older than this were removed
+    archived BOOLEAN,
+
+    -- Timing
+    start_time TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    end_time TIMESTAMP_NTZ,
+
+    -- Results
+    batches NUMBER DEFAULT 0,
+    rows_archived NUMBER DEFAULT 0,
+    rows_deleted NUMBER DEFAULT 0,
+    status VARCHAR(20),  -- 'SUCCESS', 'PARTIAL' (batch limit reached), 'ERROR'
+    message VARCHAR(5000),
+
+    PRIMARY KEY (run_id, table_name)
+);
+
+-- Expired rows kept when retention_archive_enabled is true: one compact
+-- VARIANT row per source row, so a single table serves all sources
+CREATE TABLE IF NOT EXISTS retention_archive (
+    source_table VARCHAR(100) NOT NULL,
+    record_timestamp TIMESTAMP_NTZ,
+    deal_id VARCHAR(50),
+    record OBJECT,
+    run_id VARCHAR(50),
+    archived_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+)
+CLUSTER BY (source_table, TO_DATE(record_timestamp));
+
+-- ============================================================================
+-- PART 2: BATCHED PURGE
+-- ============================================================================
+
+-- Delete (and optionally archive) rows older than the table's retention
+-- setting, oldest first, retention_batch_rows rows per transaction and at
+-- most retention_max_batches batches per call; a run that stops at the limit
+-- is recorded as PARTIAL and the next run continues.
+-- audit_log and data_quality_checks are never purged past what the hourly
+-- rollups and the step performance collector may still re-read (their
+-- watermarks, less a day).
+CREATE OR REPLACE PROCEDURE purge_expired_rows(
+    table_name_param VARCHAR,
+    run_id_param VARCHAR DEFAULT NULL,
+    archive BOOLEAN DEFAULT NULL
+)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    run_id VARCHAR DEFAULT COALESCE(run_id_param, UUID_STRING());
+    table_name VARCHAR DEFAULT LOWER(table_name_param);
+    time_column VARCHAR;
+    retention_key VARCHAR;
+    retention_days NUMBER;
+    cutoff_time TIMESTAMP_NTZ;
+    archive_rows BOOLEAN DEFAULT COALESCE(archive, get_config_boolean('retention_archive_enabled'), FALSE);
+    batch_rows NUMBER DEFAULT COALESCE(get_config_number('retention_batch_rows'), 100000);
+    max_batches NUMBER DEFAULT COALESCE(get_config_number('retention_max_batches'), 100);
+    batch_end TIMESTAMP_NTZ;
+    batch_sql VARCHAR;
+    archive_sql VARCHAR;
+    delete_sql VARCHAR;
+    batches NUMBER DEFAULT 0;
+    rows_archived NUMBER DEFAULT 0;
+    rows_deleted NUMBER DEFAULT 0;
+    run_status VARCHAR DEFAULT 'SUCCESS';
+    run_message VARCHAR;
+    error_msg VARCHAR;
+BEGIN
+    -- Table and column names are spliced into the statements below
+    CASE (:table_name)
+        WHEN 'audit_log' THEN
+            time_column := 'log_timestamp';
+            retention_key := 'audit_retention_days';
+        WHEN 'load_errors' THEN
+            time_column := 'error_timestamp';
+            retention_key := 'error_log_retention_days';
+        WHEN 'data_quality_checks' THEN
+            time_column := 'check_timestamp';
+            retention_key := 'dq_check_retention_days';
+        ELSE
+            RETURN 'ERROR: No retention rule for table ' || :table_name_param;
+    END CASE;
+
+    retention_days := get_config_number(:retention_key);
+    IF (:retention_days IS NULL OR :retention_days < 1) THEN
+        RETURN 'ERROR: ' || :retention_key || ' must be at least 1';
+    END IF;
+
+    cutoff_time := DATEADD(day, -1 * :retention_days, CURRENT_TIMESTAMP())::TIMESTAMP_NTZ;
+
+    -- Keep rows the incremental rollups/collector can still look back to
+    IF (:table_name IN ('audit_log', 'data_quality_checks')) THEN
+        SELECT LEAST(:cutoff_time, COALESCE(MIN(DATEADD(day, -1, high_water_mark)), :cutoff_time))
+        INTO :cutoff_time
+        FROM rollup_watermarks
+        WHERE rollup_name IN (
+            IFF(:table_name = 'audit_log', 'audit_hourly_rollup', 'dq_hourly_rollup'),
+            IFF(:table_name = 'audit_log', 'step_performance', NULL)
+        );
+    END IF;
+
+    INSERT INTO retention_runs (run_id, table_name, retention_days, cutoff_time, archived, status)
+    VALUES (:run_id, :table_name, :retention_days, :cutoff_time, :archive_rows, 'RUNNING');
+
+    batch_sql := 'CREATE OR REPLACE TEMPORARY TABLE temp_retention_batch AS ' ||
+                 'SELECT MAX(' || :time_column || ') AS batch_end FROM (' ||
+                 'SELECT ' || :time_column || ' FROM ' || :table_name ||
+                 ' WHERE ' || :time_column || ' < ? ORDER BY ' || :time_column || ' LIMIT ' || :batch_rows || ')';
+    archive_sql := 'INSERT INTO retention_archive (source_table, record_timestamp, deal_id, record, run_id) ' ||
+                   'SELECT ''' || :table_name || ''', ' || :time_column || ', deal_id, OBJECT_CONSTRUCT(*), ? ' ||
+                   'FROM ' || :table_name || ' WHERE ' || :time_column || ' <= ?';
+    delete_sql := 'DELETE FROM ' || :table_name || ' WHERE ' || :time_column || ' <= ?';
+
+    LOOP
+        -- Upper bound of the oldest batch_rows expired rows
+        EXECUTE IMMEDIATE :batch_sql USING (cutoff_time);
+        SELECT batch_end INTO :batch_end FROM temp_retention_batch;
+
+        IF (:batch_end IS NULL) THEN
+            BREAK;
+        END IF;
+
+        IF (:batches >= :max_batches) THEN
+            run_status := 'PARTIAL';
+            BREAK;
+        END IF;
+
+        BEGIN TRANSACTION;
+
+        IF (:archive_rows) THEN
+            EXECUTE IMMEDIATE :archive_sql USING (run_id, batch_end);
+            rows_archived := :rows_archived + SQLROWCOUNT;
+        END IF;
+
+        EXECUTE IMMEDIATE :delete_sql USING (batch_end);
+        rows_deleted := :rows_deleted + SQLROWCOUNT;
+
+        COMMIT;
+
+        batches := :batches + 1;
+    END LOOP;
+
+    run_message := 'Deleted ' || :rows_deleted || ' rows older than ' || :cutoff_time || ' in ' || :batches || ' batches' ||
+                   IFF(:archive_rows, ' (' || :rows_archived || ' archived)', '') ||
+                   IFF(:run_status = 'PARTIAL', '; batch limit reached, the next run continues', '');
+
+    UPDATE retention_runs
+    SET end_time = CURRENT_TIMESTAMP(),
+        batches = :batches,
+        rows_archived = :rows_archived,
+        rows_deleted = :rows_deleted,
+        status = :run_status,
+        message = :run_message
+    WHERE run_id = :run_id AND table_name = :table_name;
+
+    RETURN :run_status || ': ' || :table_name || ': ' || :run_message;
+
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+
+        ROLLBACK;
+
+        UPDATE retention_runs
+        SET end_time = CURRENT_TIMESTAMP(),
+            batches = :batches,
+            rows_archived = :rows_archived,
+            rows_deleted = :rows_deleted,
+            status = 'ERROR',
+            message = :error_msg
+        WHERE run_id = :run_id AND table_name = :table_name;
+
+        RETURN 'ERROR: ' || :table_name || ': ' || :error_msg;
+END;
+$$;
+
+-- Apply every retention rule: the three operational tables, then expired
+-- files on the output stage (purge_stage_files)
+CREATE OR REPLACE PROCEDURE enforce_retention()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    log_id_var VARCHAR DEFAULT UUID_STRING();
+    start_time_var TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    run_id VARCHAR DEFAULT UUID_STRING();
+    step_result VARCHAR;
+    results VARCHAR DEFAULT '';
+    failures NUMBER DEFAULT 0;
+    rows_deleted NUMBER DEFAULT 0;
+    error_msg VARCHAR;
+BEGIN
+    INSERT INTO audit_log (log_id, procedure_name, start_time, status)
+    VALUES (:log_id_var, 'enforce_retention', :start_time_var, 'STARTED');
+
+    CALL purge_expired_rows('audit_log', :run_id) INTO :step_result;
+    results := :results || :step_result || '; ';
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    CALL purge_expired_rows('load_errors', :run_id) INTO :step_result;
+    results := :results || :step_result || '; ';
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    CALL purge_expired_rows('data_quality_checks', :run_id) INTO :step_result;
+    results := :results || :step_result || '; ';
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    CALL purge_stage_files('fdd_output_stage') INTO :step_result;
+    INSERT INTO retention_runs (run_id, table_name, retention_days, end_time, status, message)
+    SELECT :run_id, '@fdd_output_stage', get_config_number('output_retention_days'), CURRENT_TIMESTAMP(),
+           IFF(STARTSWITH(:step_result, 'ERROR'), 'ERROR', 'SUCCESS'), :step_result;
+    results := :results || :step_result;
+    failures := :failures + IFF(STARTSWITH(:step_result, 'ERROR'), 1, 0);
+
+    SELECT COALESCE(SUM(rows_deleted), 0) INTO :rows_deleted
+    FROM retention_runs
+    WHERE run_id = :run_id;
+
+    UPDATE audit_log
+    SET end_time = CURRENT_TIMESTAMP(),
+        duration_seconds = DATEDIFF(second, :start_time_var, CURRENT_TIMESTAMP()),
+        status = IFF(:failures > 0, 'WARNING', 'SUCCESS'),
+        rows_affected = :rows_deleted,
+        message = LEFT(:results || ' (run ' || :run_id || ')', 5000)
+    WHERE log_id = :log_id_var;
+
+    RETURN IFF(:failures > 0, 'WARNING', 'SUCCESS') || ': Deleted ' || :rows_deleted ||
+           ' expired rows (retention run ' || :run_id || ')';
+
+EXCEPTION
+    WHEN OTHER THEN
+        error_msg := SQLERRM;
+
+        UPDATE audit_log
+        SET end_time = CURRENT_TIMESTAMP(),
+            status = 'ERROR',
+            error_message = :error_msg
+        WHERE log_id = :log_id_var;
+
+        RETURN 'ERROR: ' || :error_msg;
+END;
+$$;
+
+-- Latest retention run per table
+CREATE OR REPLACE VIEW v_retention_status AS
+SELECT
+    table_name,
+    run_id,
+    start_time,
+    end_time,
+    retention_days,
+    cutoff_time,
+    archived,
+    batches,
+    rows_archived,
+    rows_deleted,
+    status,
+    message
+FROM retention_runs
+QUALIFY ROW_NUMBER() OVER (PARTITION BY table_name ORDER BY start_time DESC) = 1;
+
+-- ============================================================================
+-- PART 3: SCHEDULED RETENTION
+-- ============================================================================
+
+-- Serverless task, daily outside business hours
+CREATE OR REPLACE TASK enforce_retention_task
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = 'XSMALL'
+    SCHEDULE = 'USING CRON 0 3 * * * UTC'
+    COMMENT = 'Delete rows and output files older than the retention settings in system_config'
+AS
+    CALL enforce_retention();
+
+ALTER TASK enforce_retention_task RESUME;
+
+-- ============================================================================
+-- PART 4: GRANTS
+-- ============================================================================
+
+GRANT SELECT ON TABLE retention_runs TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON TABLE retention_archive TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_retention_status TO ROLE FDD_ANALYST_ROLE;
+GRANT SELECT ON VIEW v_retention_status TO ROLE FDD_READONLY_ROLE;
+GRANT USAGE ON PROCEDURE enforce_retention() TO ROLE FDD_SERVICE_ROLE;
+
+SELECT 'Data retention created successfully' AS status;
 
 
 
 -- ============================================================================
--- STEP 8: POST-DEPLOYMENT VALIDATION
+-- STEP 12: POST-DEPLOYMENT VALIDATION
 -- ============================================================================
 
 SELECT 'Step 2: All SQL modules executed successfully' AS status;
@@ -2351,7 +6320,7 @@ WHERE function_schema = $SCHEMA_NAME;
 -- Use SHOW ROLES command manually to verify FDD roles were created
 
 -- ============================================================================
--- STEP 9: HELPER PROCEDURES FOR POC/DEMO
+-- STEP 13: HELPER PROCEDURES FOR POC/DEMO
 -- ============================================================================
 
 -- Sample data loading procedure
@@ -2407,7 +6376,7 @@ END;
 $$;
 
 -- ============================================================================
--- STEP 10: FINALIZE DEPLOYMENT
+-- STEP 14: FINALIZE DEPLOYMENT
 -- ============================================================================
 
 -- Update migration record
@@ -2439,7 +6408,7 @@ SELECT
 SELECT * FROM v_system_config;
 
 -- ============================================================================
--- STEP 11: STREAMLIT ADMIN DASHBOARD (OPTIONAL)
+-- STEP 15: STREAMLIT ADMIN DASHBOARD (OPTIONAL)
 -- ============================================================================
 
 -- Create stage for Streamlit files
@@ -0,0 +1,203 @@
+"""AI Threshold Tuning page: variance thresholds, model settings, impact preview and token usage."""
+
+import streamlit as st
+import plotly.express as px
+
+import fdd_data
+
+st.markdown('<p class="main-header">🎯 AI Variance Threshold Tuning</p>', unsafe_allow_html=True)
+
+st.markdown("""
+Fine-tune AI insight generation thresholds to optimize the relevance and volume of insights generated.
+Adjusting these parameters affects which variances trigger AI analysis.
+""")
+
+# Load current AI settings
+ai_config = fdd_data.ai_config()
+
+# Current Settings Display
+st.markdown('<p class="section-header">Current AI Settings</p>', unsafe_allow_html=True)
+st.dataframe(ai_config, use_container_width=True, hide_index=True)
+
+
+@st.fragment
+def variance_settings():
+    """Variance threshold and minimum amount; the slider reruns only this fragment."""
+    st.markdown("### Variance Detection")
+    
+    current_threshold = float(fdd_data.config_value('variance_threshold_pct'))
+    
+    new_threshold = st.slider(
+        "Variance Threshold (%)",
+        min_value=0.05,
+        max_value=1.00,
+        value=current_threshold,
+        step=0.05,
+        help="Minimum percentage change to flag as variance. Lower = more insights"
+    )
+    
+    current_min_amount = float(fdd_data.config_value('min_variance_amount'))
+    
+    new_min_amount = st.number_input(
+        "Minimum Variance Amount ($)",
+        min_value=0.0,
+        max_value=100000.0,
+        value=current_min_amount,
+        step=1000.0,
+        help="Minimum dollar amount to trigger variance analysis"
+    )
+    
+    if st.button("💾 Save Variance Settings", type="primary"):
+        try:
+            fdd_data.set_config('variance_threshold_pct', f"TO_VARIANT({new_threshold})")
+            fdd_data.set_config('min_variance_amount', f"TO_VARIANT({new_min_amount})")
+    
+            st.success(f"✅ Thresholds updated! Variance: {new_threshold*100:.0f}%, Min Amount: ${new_min_amount:,.2f}")
+        except Exception as e:
+            st.error(f"❌ Error: {str(e)}")
+
+
+@st.fragment
+def ai_model_settings():
+    """Variance model and per-deal insight cap."""
+    st.markdown("### AI Model Configuration")
+    
+    current_model = fdd_data.config_value('ai_model_variance').strip('"')
+    
+    new_model = st.selectbox(
+        "AI Model for Variance Analysis",
+        ["claude-4-sonnet", "claude-3.5-sonnet", "mistral-large", "llama3-70b"],
+        index=["claude-4-sonnet", "claude-3.5-sonnet", "mistral-large", "llama3-70b"].index(current_model) if current_model in ["claude-4-sonnet", "claude-3.5-sonnet", "mistral-large", "llama3-70b"] else 0,
+        help="Select the Snowflake Cortex model for AI insights"
+    )
+    
+    current_max_insights = int(float(fdd_data.config_value('max_ai_insights')))
+    
+    new_max_insights = st.number_input(
+        "Maximum AI Insights per Deal",
+        min_value=5,
+        max_value=50,
+        value=current_max_insights,
+        step=5,
+        help="Limit the number of AI insights to control costs"
+    )
+    
+    if st.button("💾 Save AI Model Settings", type="primary"):
+        try:
+            fdd_data.set_config('ai_model_variance', f"TO_VARIANT('\"{new_model}\"')")
+            fdd_data.set_config('max_ai_insights', f"TO_VARIANT({new_max_insights})")
+    
+            st.success(f"✅ AI settings updated! Model: {new_model}, Max Insights: {new_max_insights}")
+        except Exception as e:
+            st.error(f"❌ Error: {str(e)}")
+
+
+@st.fragment
+def threshold_impact_preview():
+    """What-if counts and cost for test thresholds, read from variance_distribution_index."""
+    st.info("""
+    **Preview how changing thresholds would affect insight generation:**
+    - Lower thresholds = More insights (higher cost, more detail)
+    - Higher thresholds = Fewer insights (lower cost, high-impact only)
+    """)
+    
+    # Start from the saved settings
+    test_threshold = st.slider("Test Threshold (%)", 0.05, 1.0,
+                               float(fdd_data.config_value('variance_threshold_pct')), 0.05)
+    test_min_amount = st.number_input("Test Min Amount ($)", 0.0, 100000.0,
+                                      float(fdd_data.config_value('min_variance_amount')), 1000.0)
+    
+    impact_result = fdd_data.threshold_impact(
+        test_threshold, test_min_amount,
+        fdd_data.config_value('max_ai_insights') or 15,
+        fdd_data.config_value('ai_estimated_cost_per_call_usd') or 0,
+    )
+    
+    if impact_result.empty:
+        st.warning("Variance index is empty. Load trial balance data or run CALL refresh_variance_index();")
+    else:
+        impact_deal = st.selectbox("Deal", ["All Deals"] + impact_result['DEAL_ID'].tolist())
+        if impact_deal != "All Deals":
+            impact_result = impact_result[impact_result['DEAL_ID'] == impact_deal]
+    
+        total_variances = int(impact_result['TOTAL_VARIANCES'].sum())
+        qualifying = int(impact_result['INSIGHTS_THAT_WOULD_GENERATE'].sum())
+    
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Total Variances", f"{total_variances:,}")
+        with col2:
+            st.metric("Above Thresholds", f"{qualifying:,}",
+                      f"{qualifying * 100.0 / total_variances:.1f}% of total" if total_variances else None,
+                      delta_color="off")
+        with col3:
+            st.metric("Cortex Calls", f"{int(impact_result['CORTEX_CALLS'].sum()):,}",
+                      help="Variance insights per deal are capped at max_ai_insights; cached prompts are not re-billed")
+        with col4:
+            st.metric("Estimated Cost", f"${impact_result['ESTIMATED_COST_USD'].sum():,.2f}")
+    
+        grid_threshold = float(impact_result['GRID_THRESHOLD'].iloc[0])
+        grid_min_amount = float(impact_result['GRID_MIN_AMOUNT'].iloc[0])
+        if abs(grid_threshold - test_threshold) > 1e-6 or abs(grid_min_amount - test_min_amount) > 1e-6:
+            st.caption(f"Counted at the nearest index grid point: {grid_threshold*100:.0f}% / ${grid_min_amount:,.0f}")
+        st.caption(f"Variance index refreshed {impact_result['REFRESHED_AT'].min()}")
+    
+        if impact_deal == "All Deals":
+            st.dataframe(
+                impact_result[['DEAL_ID', 'TOTAL_VARIANCES', 'INSIGHTS_THAT_WOULD_GENERATE', 'CORTEX_CALLS', 'ESTIMATED_COST_USD']],
+                use_container_width=True,
+                hide_index=True
+            )
+
+
+@st.fragment
+def token_usage():
+    """Cortex tokens and estimated cost from the ai_token_usage ledger."""
+    cost_days = st.selectbox("Period", [7, 30, 90], index=1, format_func=lambda d: f"Last {d} days")
+    cost_data = fdd_data.ai_cost_by_deal_model(cost_days)
+    
+    if not cost_data.empty:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Cortex Calls", f"{int(cost_data['CORTEX_CALLS'].sum()):,}")
+        with col2:
+            st.metric("Tokens", f"{int(cost_data['TOTAL_TOKENS'].sum()):,}")
+        with col3:
+            st.metric("Estimated Cost", f"${cost_data['ESTIMATED_COST_USD'].sum():,.2f}",
+                      help="Token counts priced with ai_cost_per_million_tokens_usd")
+    
+        st.dataframe(cost_data, use_container_width=True, hide_index=True)
+    
+        daily_tokens = fdd_data.ai_daily_tokens(cost_days)
+        fig = px.bar(daily_tokens, x='CALL_DATE', y='TOTAL_TOKENS', color='MODEL_NAME',
+                    title='Cortex Tokens per Day',
+                    labels={'CALL_DATE': 'Date', 'TOTAL_TOKENS': 'Tokens', 'MODEL_NAME': 'Model'})
+        daily_budget = fdd_data.config_value('ai_daily_token_budget')
+        if daily_budget is not None:
+            fig.add_hline(y=float(daily_budget), line_dash='dash', annotation_text='Daily budget')
+        st.plotly_chart(fig, use_container_width=True)
+    
+        st.caption(f"Per-deal daily budget: {int(float(fdd_data.config_value('ai_deal_daily_token_budget') or 0)):,} tokens. "
+                   "When a deal's budget runs out, generate_ai_insights skips low-severity prompts first.")
+    else:
+        st.info(f"No Cortex calls in the last {cost_days} days")
+
+
+# Threshold Tuner
+st.markdown('<p class="section-header">Threshold Configuration</p>', unsafe_allow_html=True)
+
+col1, col2 = st.columns(2)
+
+with col1:
+    variance_settings()
+
+with col2:
+    ai_model_settings()
+
+# Impact Analysis
+st.markdown('<p class="section-header">Threshold Impact Analysis</p>', unsafe_allow_html=True)
+threshold_impact_preview()
+
+# Token accounting (ai_token_usage ledger, one row per Cortex call)
+st.markdown('<p class="section-header">Cortex Token Usage & Cost</p>', unsafe_allow_html=True)
+token_usage()
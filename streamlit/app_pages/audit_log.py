@@ -0,0 +1,106 @@
+"""Audit Log Viewer page: keyset-paged audit_log with entry details and CSV export."""
+
+from datetime import datetime
+
+import streamlit as st
+
+import fdd_data
+
+
+@st.fragment
+def audit_log_table(audit_filters):
+    """Page of entries with pagination, row details and export; these rerun only this fragment."""
+    audit_cursors = st.session_state['audit_cursors']
+    
+    audit_df = fdd_data.audit_log_page(*audit_filters, after=audit_cursors[-1])
+    has_older = len(audit_df) > fdd_data.AUDIT_PAGE_SIZE
+    audit_df = audit_df.head(fdd_data.AUDIT_PAGE_SIZE)
+
+    if not audit_df.empty:
+        st.markdown(f"**Page {len(audit_cursors)}** ({len(audit_df)} entries, newest first)")
+        
+        selection = st.dataframe(
+            audit_df.drop(columns=['LOG_ID', 'CURSOR_TIME']),
+            use_container_width=True,
+            hide_index=True,
+            on_select="rerun",
+            selection_mode="single-row"
+        )
+        
+        col1, col2, col3 = st.columns([1, 1, 4])
+        with col1:
+            if st.button("◀ Newer", disabled=len(audit_cursors) == 1):
+                audit_cursors.pop()
+                st.rerun(scope="fragment")
+        with col2:
+            if st.button("Older ▶", disabled=not has_older):
+                last_row = audit_df.iloc[-1]
+                audit_cursors.append((str(last_row['CURSOR_TIME']), str(last_row['LOG_ID'])))
+                st.rerun(scope="fragment")
+        
+        # Full entry only for the selected row
+        if selection.selection.rows:
+            entry = fdd_data.audit_entry(audit_df.iloc[selection.selection.rows[0]]['LOG_ID'])
+            if entry:
+                with st.expander(f"{entry['PROCEDURE_NAME']} - {entry['START_TIME']} ({entry['STATUS']})", expanded=True):
+                    st.json({k: None if v is None else str(v) for k, v in entry.items() if k not in ('MESSAGE', 'ERROR_MESSAGE')})
+                    if entry['MESSAGE']:
+                        st.markdown("**Message**")
+                        st.code(entry['MESSAGE'], language=None)
+                    if entry['ERROR_MESSAGE']:
+                        st.markdown("**Error**")
+                        st.code(entry['ERROR_MESSAGE'], language=None)
+        else:
+            st.caption("Select a row to see the full entry")
+        
+        # Export option (all matching rows, not just this page)
+        if st.button("📥 Export to CSV"):
+            if fdd_data.audit_log_export_rows(*audit_filters) <= fdd_data.AUDIT_EXPORT_MAX_ROWS:
+                csv = fdd_data.audit_log_csv(*audit_filters)
+                st.download_button(
+                    label="Download CSV",
+                    data=csv,
+                    file_name=f"audit_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv"
+                )
+            else:
+                with st.spinner("Unloading to stage..."):
+                    path = fdd_data.unload_audit_log(*audit_filters)
+                st.warning(
+                    f"More than {fdd_data.AUDIT_EXPORT_MAX_ROWS:,} entries match, too many to download "
+                    f"in the browser. They were unloaded to `{path}`; download the file with "
+                    f"`GET {path} file:///tmp/` (SnowSQL), or narrow the filters."
+                )
+    else:
+        st.info("No audit log entries match the selected filters")
+
+
+st.markdown('<p class="main-header">📜 Audit Log Viewer</p>', unsafe_allow_html=True)
+
+# Filters
+col1, col2, col3, col4 = st.columns(4)
+
+with col1:
+    time_filter = st.selectbox("Time Range", ["Last Hour", "Last 24 Hours", "Last 7 Days", "Last 30 Days", "All"])
+
+with col2:
+    status_filter = st.selectbox("Status", ["All", "SUCCESS", "ERROR", "WARNING", "STARTED"])
+
+# Unique procedures and deal_ids
+procedures, deals = fdd_data.audit_dimensions()
+
+with col3:
+    procedure_filter = st.selectbox("Procedure", ["All"] + procedures)
+
+with col4:
+    deal_filter = st.selectbox("Deal ID", ["All"] + deals)
+
+# Load one page of audit logs (keyset pagination; cursors of visited pages kept in session state)
+hours_map = {"Last Hour": 1, "Last 24 Hours": 24, "Last 7 Days": 168, "Last 30 Days": 720, "All": None}
+audit_filters = (hours_map[time_filter], status_filter, procedure_filter, deal_filter)
+
+if st.session_state.get('audit_filters') != audit_filters:
+    st.session_state['audit_filters'] = audit_filters
+    st.session_state['audit_cursors'] = [None]
+
+audit_log_table(audit_filters)
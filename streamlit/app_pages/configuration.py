@@ -0,0 +1,107 @@
+"""Configuration Management page: system_config browser and editor."""
+
+import streamlit as st
+
+import fdd_data
+
+
+@st.fragment
+def config_editor(config_df):
+    """Key picker and editor; choosing a key or typing a value reruns only this fragment."""
+    selected_config = st.selectbox(
+        "Select Configuration to Update",
+        options=config_df['CONFIG_KEY'].tolist()
+    )
+    
+    # Get current value and description
+    current_row = config_df[config_df['CONFIG_KEY'] == selected_config].iloc[0]
+    current_value = current_row['CONFIG_VALUE']
+    description = current_row['DESCRIPTION']
+    
+    st.info(f"**Description:** {description}")
+    st.markdown(f"**Current Value:** `{current_value}`")
+    
+    new_value = st.text_input("New Value", value=current_value)
+    
+    if st.button("💾 Update Configuration", type="primary"):
+        try:
+            # Determine the data type and convert appropriately
+            if selected_config in ['enable_row_level_security']:
+                # Boolean
+                value_sql = f"TO_VARIANT({new_value.lower()})"
+            elif selected_config in ['ai_model_variance', 'ai_model_trends', 'ai_model_low_severity', 'warehouse_size_default', 
+                                    'input_stage_name', 'output_stage_name', 'default_file_format',
+                                    'deal_id_validation_regex', 'environment', 'schema_version']:
+                # String
+                value_sql = f"TO_VARIANT('{new_value}')"
+            else:
+                # Number
+                value_sql = f"TO_VARIANT({new_value})"
+            
+            fdd_data.set_config(selected_config, value_sql)
+            st.success(f"✅ Configuration '{selected_config}' updated to: {new_value}")
+            # Full rerun so the configuration table above shows the new value
+            st.rerun()
+        except Exception as e:
+            st.error(f"❌ Error updating configuration: {str(e)}")
+
+
+st.markdown('<p class="main-header">⚙️ Configuration Management</p>', unsafe_allow_html=True)
+
+# Load current configuration
+config_df = fdd_data.system_config()
+
+# Configuration categories
+st.markdown('<p class="section-header">System Configuration</p>', unsafe_allow_html=True)
+
+category = st.selectbox("Filter by Category", [
+    "All",
+    "Data Validation",
+    "AI Settings",
+    "Warehouse Settings",
+    "File Settings",
+    "Retention Policies",
+    "Other"
+])
+
+# Filter configurations by category
+if category != "All":
+    category_keywords = {
+        "Data Validation": ["tolerance", "threshold", "variance", "error_rate"],
+        "AI Settings": ["ai_", "max_ai"],
+        "Warehouse Settings": ["warehouse", "suspend"],
+        "File Settings": ["stage", "file_format"],
+        "Retention Policies": ["retention"],
+    }
+    keywords = category_keywords.get(category, [])
+    if keywords:
+        mask = config_df['CONFIG_KEY'].str.contains('|'.join(keywords), case=False)
+        filtered_df = config_df[mask]
+    else:
+        filtered_df = config_df
+else:
+    filtered_df = config_df
+
+# Display configuration table
+st.dataframe(filtered_df, use_container_width=True, hide_index=True)
+st.caption(f"Config version {fdd_data.config_version()} (stamped on audit_log rows and outputs of runs using these settings)")
+
+# Configuration Editor
+st.markdown('<p class="section-header">Update Configuration</p>', unsafe_allow_html=True)
+
+col1, col2 = st.columns([2, 1])
+
+with col1:
+    config_editor(config_df)
+
+with col2:
+    st.markdown("### Quick Presets")
+    
+    if st.button("🔧 Development Settings"):
+        st.info("Apply development-friendly settings (lower thresholds, more logging)")
+    
+    if st.button("🚀 Production Settings"):
+        st.info("Apply production-optimized settings")
+    
+    if st.button("🔄 Reset to Defaults"):
+        st.warning("This will reset all configuration to default values")
@@ -0,0 +1,56 @@
+"""Data Quality Dashboard page: check results and the dq_rules registry."""
+
+import streamlit as st
+import plotly.express as px
+
+import fdd_data
+
+st.markdown('<p class="main-header">✅ Data Quality Dashboard</p>', unsafe_allow_html=True)
+
+# Quality Overview
+st.markdown('<p class="section-header">Quality Check Summary</p>', unsafe_allow_html=True)
+
+quality_summary = fdd_data.quality_summary()
+
+if not quality_summary.empty:
+    col1, col2, col3 = st.columns(3)
+    
+    total_checks = quality_summary['TOTAL_CHECKS'].sum()
+    total_passed = quality_summary['PASSED'].sum()
+    total_failed = quality_summary['FAILED'].sum()
+    
+    with col1:
+        st.metric("Total Quality Checks", total_checks)
+    with col2:
+        st.metric("Passed", total_passed, delta=None)
+    with col3:
+        st.metric("Failed", total_failed, delta=None, delta_color="inverse")
+    
+    st.dataframe(quality_summary, use_container_width=True, hide_index=True)
+    
+    # Quality by severity
+    severity_data = fdd_data.failed_checks_by_severity()
+    
+    if not severity_data.empty:
+        fig = px.pie(severity_data, values='COUNT', names='SEVERITY',
+                    title='Failed Checks by Severity',
+                    color='SEVERITY',
+                    color_discrete_map={'ERROR': 'red', 'WARNING': 'orange', 'INFO': 'blue'})
+        st.plotly_chart(fig, use_container_width=True)
+
+# Recent Failed Checks
+st.markdown('<p class="section-header">Recent Failed Checks</p>', unsafe_allow_html=True)
+
+failed_checks = fdd_data.recent_failed_checks()
+
+if not failed_checks.empty:
+    st.dataframe(failed_checks, use_container_width=True, hide_index=True)
+else:
+    st.success("✅ No failed quality checks! All validations passing.")
+
+# Rule registry
+st.markdown('<p class="section-header">Validation Rules</p>', unsafe_allow_html=True)
+st.caption("A rule passes when its metric lies between MIN_PASS and MAX_PASS. "
+           "CALL validate_data_quality('<deal>') re-checks only periods loaded since the last check; "
+           "pass full_check => TRUE to re-scan the whole deal.")
+st.dataframe(fdd_data.dq_rules(), use_container_width=True, hide_index=True)
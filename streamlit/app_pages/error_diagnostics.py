@@ -0,0 +1,47 @@
+"""Error Diagnostics page: error summary, trend and load errors."""
+
+import streamlit as st
+import plotly.express as px
+
+import fdd_data
+
+st.markdown('<p class="main-header">🚨 Error Diagnostics</p>', unsafe_allow_html=True)
+
+# Error Summary
+st.markdown('<p class="section-header">Error Summary (Last 7 Days)</p>', unsafe_allow_html=True)
+
+error_summary = fdd_data.error_summary()
+
+if not error_summary.empty:
+    st.dataframe(error_summary, use_container_width=True, hide_index=True)
+    
+    # Error trend
+    error_trend = fdd_data.error_trend()
+    
+    if not error_trend.empty:
+        fig = px.line(error_trend, x='HOUR', y='ERROR_COUNT',
+                     title='Error Trend (Last 7 Days)',
+                     labels={'ERROR_COUNT': 'Errors', 'HOUR': 'Time'})
+        st.plotly_chart(fig, use_container_width=True)
+else:
+    st.success("✅ No errors in the last 7 days!")
+
+# Recent Errors Detail
+st.markdown('<p class="section-header">Recent Errors (Details)</p>', unsafe_allow_html=True)
+
+recent_errors = fdd_data.recent_errors()
+
+if not recent_errors.empty:
+    st.dataframe(recent_errors, use_container_width=True, hide_index=True)
+else:
+    st.success("✅ No errors found!")
+
+# Load Errors
+st.markdown('<p class="section-header">Data Load Errors</p>', unsafe_allow_html=True)
+
+load_errors = fdd_data.load_errors()
+
+if not load_errors.empty:
+    st.dataframe(load_errors, use_container_width=True, hide_index=True)
+else:
+    st.success("✅ No load errors!")
@@ -0,0 +1,94 @@
+"""System Health Check page: system_health_check() probe results with an overall score."""
+
+import streamlit as st
+
+import fdd_data
+
+
+SECTIONS = [
+    ("1️⃣ Database Objects", 'Database Objects'),
+    ("2️⃣ Data Integrity", 'Data Integrity'),
+    ("3️⃣ View Health", 'View Health'),
+    ("4️⃣ Recent Execution Success", 'Recent Execution'),
+]
+
+
+def _status_icon(check):
+    if check['PASSED']:
+        return "✅"
+    return "⚠️" if check['SEVERITY'] == 'WARNING' else "❌"
+
+
+@st.fragment
+def complete_health_check():
+    """Runs all checks and the score; the button reruns only this fragment."""
+    # The sidebar Quick Action switches here with run_health_check set
+    if st.button("▶️ Run Complete Health Check", type="primary") or st.session_state.pop('run_health_check', False):
+        with st.spinner("Running health check..."):
+            try:
+                checks, recent_success = fdd_data.health_probe()
+            except Exception as e:
+                st.error(f"❌ Health check failed: {str(e)}")
+                return
+            
+            for title, category in SECTIONS:
+                st.markdown(f"### {title}")
+                
+                section = checks[checks['CATEGORY'] == category]
+                for col, (_, check) in zip(st.columns(len(section)), section.iterrows()):
+                    with col:
+                        st.metric(check['CHECK_NAME'], int(check['OBSERVED']),
+                                  delta=_status_icon(check),
+                                  help=check['MESSAGE'])
+            
+            if not recent_success.empty:
+                st.dataframe(recent_success, use_container_width=True, hide_index=True)
+            
+            # Overall Health Score
+            st.markdown("### 🎯 Overall Health Score")
+            
+            health_score = checks['PASSED'].mean() * 100
+            
+            if health_score >= 90:
+                st.success(f"✅ **System Health: EXCELLENT** ({health_score:.0f}%)")
+            elif health_score >= 70:
+                st.warning(f"⚠️ **System Health: GOOD** ({health_score:.0f}%)")
+            else:
+                st.error(f"❌ **System Health: NEEDS ATTENTION** ({health_score:.0f}%)")
+            
+            for _, check in checks[~checks['PASSED']].iterrows():
+                st.caption(f"{_status_icon(check)} {check['CHECK_NAME']}: {check['MESSAGE']}")
+
+
+@st.fragment
+def quick_diagnostics():
+    """Single-purpose checks that rerun only this fragment."""
+    if st.button("🔍 Check if database_tab Will Generate"):
+        checks = fdd_data.health_probe()[0]
+        view_count = int(checks.loc[checks['CHECK_NAME'] == 'v_database_tab_pivoted', 'OBSERVED'].iloc[0])
+        
+        if view_count > 0:
+            st.success(f"✅ v_database_tab_pivoted reads {view_count} materialized rows - database_tab CSV will generate!")
+        else:
+            st.error("❌ v_database_tab_pivoted is EMPTY - database_tab CSV will be empty!")
+            st.markdown("**Troubleshooting Steps:**")
+            st.code("""
+1. Check account_mappings:
+   SELECT COUNT(*) FROM account_mappings WHERE is_active = TRUE;
+
+2. If 0, reload:
+   CALL load_account_mappings();
+
+3. Verify fix worked:
+   SELECT COUNT(*) FROM v_database_tab_pivoted;
+            """)
+
+
+st.markdown('<p class="main-header">🧪 System Health Check</p>', unsafe_allow_html=True)
+
+complete_health_check()
+
+# Quick Diagnostics
+st.markdown('<p class="section-header">Quick Diagnostics</p>', unsafe_allow_html=True)
+
+quick_diagnostics()
@@ -0,0 +1,102 @@
+"""Monitoring & Performance page: procedure statistics, trends and run waterfalls."""
+
+import streamlit as st
+import plotly.express as px
+
+import fdd_data
+
+st.markdown('<p class="main-header">📊 Monitoring & Performance</p>', unsafe_allow_html=True)
+
+# Time range selector
+time_range = st.selectbox("Time Range", ["Last Hour", "Last 24 Hours", "Last 7 Days", "Last 30 Days", "All Time"])
+
+hours_map = {
+    "Last Hour": 1,
+    "Last 24 Hours": 24,
+    "Last 7 Days": 168,
+    "Last 30 Days": 720,
+    "All Time": None
+}
+
+hours = hours_map[time_range]
+
+rollup_as_of = fdd_data.rollup_freshness()
+if rollup_as_of is not None:
+    st.caption(f"Statistics from hourly rollups, complete up to {rollup_as_of:%Y-%m-%d %H:%M}")
+
+# Procedure execution stats
+st.markdown('<p class="section-header">Procedure Execution Statistics</p>', unsafe_allow_html=True)
+
+proc_stats = fdd_data.procedure_stats(hours).copy()
+
+if not proc_stats.empty:
+    st.dataframe(proc_stats, use_container_width=True, hide_index=True)
+    
+    # Success rate chart
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("**Success Rate by Procedure**")
+        proc_stats['success_rate'] = (proc_stats['SUCCESSFUL'] / proc_stats['TOTAL_EXECUTIONS'] * 100).round(1)
+        fig = px.bar(proc_stats, x='PROCEDURE_NAME', y='success_rate', 
+                    title='Success Rate (%)',
+                    labels={'success_rate': 'Success Rate (%)', 'PROCEDURE_NAME': 'Procedure'},
+                    color='success_rate',
+                    color_continuous_scale=['red', 'yellow', 'green'])
+        st.plotly_chart(fig, use_container_width=True)
+    
+    with col2:
+        st.markdown("**Average Execution Time**")
+        fig = px.bar(proc_stats, x='PROCEDURE_NAME', y='AVG_DURATION_SEC',
+                    title='Average Duration (seconds)',
+                    labels={'AVG_DURATION_SEC': 'Duration (s)', 'PROCEDURE_NAME': 'Procedure'},
+                    color='AVG_DURATION_SEC',
+                    color_continuous_scale='Blues')
+        st.plotly_chart(fig, use_container_width=True)
+else:
+    st.info(f"No procedure executions in the {time_range.lower()}")
+
+# Performance trend over time
+st.markdown('<p class="section-header">Performance Trend</p>', unsafe_allow_html=True)
+
+trend_data = fdd_data.performance_trend(hours)
+
+if not trend_data.empty:
+    fig = px.line(trend_data, x='HOUR', y='AVG_DURATION', color='PROCEDURE_NAME',
+                 title='Execution Time Trend',
+                 labels={'AVG_DURATION': 'Duration (seconds)', 'HOUR': 'Time'})
+    st.plotly_chart(fig, use_container_width=True)
+
+
+@st.fragment
+def run_waterfall(labels):
+    """Step timeline of the selected run; picking another run reruns only this fragment."""
+    selected_run = st.selectbox("Run", list(labels))
+    spans = fdd_data.trace_waterfall(labels[selected_run])
+    
+    if not spans.empty:
+        fig = px.bar(spans, x='DURATION_MS', y='SPAN_NAME', base='OFFSET_MS', orientation='h',
+                    color='STATUS',
+                    color_discrete_map={'SUCCESS': '#2ca02c', 'WARNING': '#ff7f0e', 'ERROR': '#d62728'},
+                    hover_data=['MESSAGE'],
+                    title='Step Timeline (ms from run start)',
+                    labels={'DURATION_MS': 'Milliseconds', 'SPAN_NAME': 'Step'})
+        fig.update_yaxes(categoryorder='array', categoryarray=spans['SPAN_NAME'].tolist()[::-1])
+        st.plotly_chart(fig, use_container_width=True)
+
+
+# Step waterfall of one generate_fdd_schedules run
+st.markdown('<p class="section-header">Run Waterfall</p>', unsafe_allow_html=True)
+
+traces = fdd_data.recent_traces(hours)
+
+if not traces.empty:
+    st.dataframe(traces.drop(columns=['TRACE_ID']), use_container_width=True, hide_index=True)
+    
+    labels = {
+        f"{row.START_TIME}  {row.DEAL_ID}  ({row.DURATION_SEC}s, {row.STATUS})": row.TRACE_ID
+        for row in traces.itertuples()
+    }
+    run_waterfall(labels)
+else:
+    st.info(f"No traced runs in the {time_range.lower()}")
@@ -0,0 +1,59 @@
+"""Overview page: key metrics, recent activity and a health summary."""
+
+import streamlit as st
+
+import fdd_data
+
+st.markdown('<p class="main-header">📊 FDD Automation Admin Dashboard</p>', unsafe_allow_html=True)
+st.markdown("Welcome to the Houlihan Lokey Financial Due Diligence Automation Admin Portal")
+
+# Key Metrics Row
+col1, col2, col3, col4 = st.columns(4)
+
+# Get quick stats (single round trip)
+metrics = fdd_data.overview_metrics()
+total_deals = metrics['TOTAL_DEALS']
+total_tb_rows = metrics['TOTAL_TB_ROWS']
+total_insights = metrics['TOTAL_INSIGHTS']
+recent_errors = metrics['RECENT_ERRORS']
+
+with col1:
+    st.metric("Total Deals", total_deals, delta=None)
+with col2:
+    st.metric("Trial Balance Rows", f"{total_tb_rows:,}", delta=None)
+with col3:
+    st.metric("AI Insights Generated", total_insights, delta=None)
+with col4:
+    st.metric("Errors (7 days)", recent_errors, delta=None, delta_color="inverse")
+
+st.markdown("---")
+
+# Recent Activity
+st.markdown('<p class="section-header">Recent Activity (Last 24 Hours)</p>', unsafe_allow_html=True)
+
+recent_activity = fdd_data.recent_activity()
+
+if not recent_activity.empty:
+    st.dataframe(recent_activity, use_container_width=True, hide_index=True)
+else:
+    st.info("No activity in the last 24 hours")
+
+# System Health Summary
+st.markdown('<p class="section-header">System Health Summary</p>', unsafe_allow_html=True)
+
+col1, col2 = st.columns(2)
+
+with col1:
+    st.markdown("**📈 Performance Metrics**")
+    avg_duration = metrics['AVG_SCHEDULE_DURATION']
+    
+    if avg_duration:
+        st.metric("Avg Schedule Generation Time", f"{avg_duration:.1f}s")
+    else:
+        st.info("No recent schedule generations")
+
+with col2:
+    st.markdown("**✅ Data Quality**")
+    failed_checks = metrics['FAILED_CHECKS']
+    
+    st.metric("Failed Quality Checks (7 days)", failed_checks, delta=None, delta_color="inverse")
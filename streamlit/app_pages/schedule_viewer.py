@@ -0,0 +1,69 @@
+"""Schedule Viewer page: computed Income Statement and Balance Sheet values."""
+
+import streamlit as st
+
+import fdd_data
+
+st.markdown('<p class="main-header">📑 Schedule Viewer</p>', unsafe_allow_html=True)
+
+st.markdown("""
+Income Statement and Balance Sheet with computed period amounts, including subtotals,
+Gross Margin and Operating Income. Values are computed per deal and data version; after a
+load changes the deal, recompute them here or run generate_fdd_schedules.
+""")
+
+deals = fdd_data.schedule_deals()
+
+if not deals:
+    st.warning("No schedules generated yet. Run CALL build_schedules('<deal_id>'); or generate_fdd_schedules.")
+else:
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        schedule_deal = st.selectbox("Deal", deals)
+    with col2:
+        statement = st.radio("Statement", ["Income Statement", "Balance Sheet"], horizontal=True)
+    with col3:
+        period_count = st.number_input("Periods", min_value=1, max_value=60, value=12, step=1)
+    
+    computed_version, current_version = fdd_data.schedule_values_versions(schedule_deal)
+    if computed_version != current_version:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.warning(f"Schedule values were computed for data version {computed_version or 'none'}; "
+                       f"the deal is at version {current_version}.")
+        with col2:
+            if st.button("🔄 Recompute Values"):
+                with st.spinner("Computing schedule values..."):
+                    result = fdd_data.refresh_schedule_values(schedule_deal)
+                if result.startswith("ERROR"):
+                    st.error(result)
+                else:
+                    st.rerun()
+    
+    values = fdd_data.schedule_values(schedule_deal, "IS" if statement == "Income Statement" else "BS")
+    
+    periods = (
+        values.dropna(subset=['PERIOD_DATE'])
+        .drop_duplicates('PERIOD_DATE')
+        .sort_values('PERIOD_DATE')['PERIOD_LABEL']
+        .tolist()[-int(period_count):]
+    )
+    
+    if not periods:
+        st.info("No trial balance amounts for this deal's schedule rows.")
+    else:
+        rows = values[['ROW_NUM', 'ROW_LABEL']].drop_duplicates().set_index('ROW_NUM')
+        amounts = (
+            values.dropna(subset=['PERIOD_LABEL'])
+            .pivot(index='ROW_NUM', columns='PERIOD_LABEL', values='AMOUNT')[periods]
+            .astype(float)
+        )
+        schedule = rows.join(amounts).rename(columns={'ROW_LABEL': 'Line'})
+        
+        st.dataframe(
+            schedule.style.format("{:,.0f}", subset=periods, na_rep=""),
+            use_container_width=True,
+            height=min(35 * (len(schedule) + 1) + 3, 900)
+        )
+        st.caption(f"Data version {int(values['DATA_VERSION'].max())} · {len(periods)} of "
+                   f"{values['PERIOD_DATE'].nunique()} periods")
@@ -0,0 +1,123 @@
+"""Stage File Management page: directory-table listings, file removal and bulk cleanup."""
+
+import streamlit as st
+
+import fdd_data
+
+
+@st.fragment
+def bulk_cleanup(stage_name, stage_deal):
+    """Age picker and confirmation; changing them reruns only this fragment."""
+    retention_default = int(float(fdd_data.config_value('output_retention_days') or 30))
+    days_old = st.number_input("Remove files older than (days)", min_value=1, max_value=3650,
+                               value=retention_default,
+                               help="Defaults to output_retention_days; limited to the selected deal when one is chosen")
+    
+    expired = fdd_data.stage_summary(stage_name, stage_deal, int(days_old))
+    expired_files = int(expired['TOTAL_FILES'])
+    st.markdown(f"**{expired_files:,} files** ({float(expired['TOTAL_MB']):,.2f} MB) in @{stage_name} are older than {days_old} days")
+    
+    confirm_purge = st.checkbox(f"I understand these {expired_files:,} files will be permanently removed",
+                                disabled=expired_files == 0)
+    
+    if st.button("🗑️ Remove Old Files", type="secondary", disabled=not confirm_purge or expired_files == 0):
+        try:
+            result = fdd_data.purge_stage_files(stage_name, days_old,
+                                                None if stage_deal == "All" else stage_deal)
+            if result.startswith("SUCCESS"):
+                st.success(f"✅ {result}")
+            else:
+                st.error(f"❌ {result}")
+        except Exception as e:
+            st.error(f"❌ Error: {str(e)}")
+
+
+st.markdown('<p class="main-header">📁 Stage File Management</p>', unsafe_allow_html=True)
+
+# Stage selector and filters (applied in Snowflake against the stage directory table)
+col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
+
+with col1:
+    stage_name = st.selectbox("Select Stage", list(fdd_data.STAGES))
+
+with col2:
+    stage_deal = st.selectbox("Deal ID", ["All"] + fdd_data.audit_dimensions()[1])
+
+with col3:
+    min_age_days = st.number_input("Older than (days)", min_value=0, max_value=3650, value=0,
+                                   help="0 shows files of any age")
+
+with col4:
+    st.markdown("##")  # Spacing
+    if st.button("🔄 Refresh Listing"):
+        fdd_data.refresh_stage_directory(stage_name)
+        st.rerun()
+
+stage_filters = (stage_name, stage_deal, int(min_age_days))
+if st.session_state.get('stage_filters') != stage_filters:
+    st.session_state['stage_filters'] = stage_filters
+    st.session_state['stage_page'] = 0
+
+# List files in stage
+st.markdown(f'<p class="section-header">Files in @{stage_name}</p>', unsafe_allow_html=True)
+
+try:
+    summary = fdd_data.stage_summary(*stage_filters)
+    total_files = int(summary['TOTAL_FILES'])
+    
+    if total_files:
+        # Statistics
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Total Files", f"{total_files:,}")
+        with col2:
+            st.metric("Total Size (MB)", f"{float(summary['TOTAL_MB']):,.2f}")
+        with col3:
+            st.metric("Avg File Size (KB)", f"{float(summary['AVG_KB']):,.2f}")
+        
+        # Display one page of the file list
+        page_count = (total_files - 1) // fdd_data.STAGE_PAGE_SIZE + 1
+        stage_page = min(st.session_state['stage_page'], page_count - 1)
+        files_df = fdd_data.stage_files_page(*stage_filters, stage_page)
+        
+        st.dataframe(files_df, use_container_width=True, hide_index=True)
+        
+        col1, col2, col3 = st.columns([1, 1, 4])
+        with col1:
+            if st.button("◀ Previous", disabled=stage_page == 0):
+                st.session_state['stage_page'] = stage_page - 1
+                st.rerun()
+        with col2:
+            if st.button("Next ▶", disabled=stage_page >= page_count - 1):
+                st.session_state['stage_page'] = stage_page + 1
+                st.rerun()
+        with col3:
+            st.caption(f"Page {stage_page + 1} of {page_count}. Listing reflects the last directory refresh.")
+        
+        # File Management Actions
+        st.markdown('<p class="section-header">File Management</p>', unsafe_allow_html=True)
+        
+        col1, col2 = st.columns([2, 1])
+        
+        with col1:
+            file_to_remove = st.selectbox("Select File to Remove", files_df['RELATIVE_PATH'].tolist())
+        
+        with col2:
+            st.markdown("##")  # Spacing
+            if st.button("🗑️ Remove File", type="secondary"):
+                try:
+                    fdd_data.remove_stage_file(stage_name, file_to_remove)
+                    st.success(f"✅ File removed: {file_to_remove}")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
+    
+    else:
+        st.info(f"No files in @{stage_name} match the selected filters")
+    
+    # Bulk cleanup (batched pattern REMOVEs in purge_stage_files)
+    st.markdown("### Bulk Cleanup")
+    bulk_cleanup(stage_name, stage_deal)
+
+except Exception as e:
+    st.error(f"❌ Error listing files: {str(e)}")
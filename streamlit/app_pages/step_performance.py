@@ -0,0 +1,52 @@
+"""Step Performance page: ACCOUNT_USAGE query statistics per generate_fdd_schedules step."""
+
+import streamlit as st
+import plotly.express as px
+
+import fdd_data
+
+st.markdown('<p class="main-header">⏱️ Step Performance</p>', unsafe_allow_html=True)
+st.caption("Query statistics per generate_fdd_schedules step from ACCOUNT_USAGE "
+           "(collected hourly, about 45 minutes behind)")
+
+
+@st.fragment
+def step_detail(hours, steps):
+    """Per-run statistics of one step; picking another step reruns only this fragment."""
+    step = st.selectbox("Step", steps)
+    st.dataframe(fdd_data.step_performance_detail(hours, step), use_container_width=True, hide_index=True)
+
+
+time_range = st.selectbox("Time Range", ["Last 24 Hours", "Last 7 Days", "Last 30 Days", "All Time"])
+hours = {"Last 24 Hours": 24, "Last 7 Days": 168, "Last 30 Days": 720, "All Time": None}[time_range]
+
+summary = fdd_data.step_performance_summary(hours)
+
+if not summary.empty:
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("**Where Step Time Goes**")
+        time_split = summary.melt(
+            id_vars='SPAN_NAME',
+            value_vars=['AVG_EXECUTION_SEC', 'AVG_COMPILATION_SEC', 'AVG_QUEUED_SEC'],
+            var_name='phase', value_name='seconds'
+        )
+        fig = px.bar(time_split, x='seconds', y='SPAN_NAME', color='phase', orientation='h',
+                    title='Average Seconds per Run',
+                    labels={'SPAN_NAME': 'Step', 'seconds': 'Seconds'})
+        st.plotly_chart(fig, use_container_width=True)
+    
+    with col2:
+        st.markdown("**Pruning and Spilling**")
+        fig = px.scatter(summary, x='SCAN_RATIO', y='GB_SPILLED', size='AVG_STEP_SEC', hover_name='SPAN_NAME',
+                        title='Partitions Scanned / Total vs. Spill',
+                        labels={'SCAN_RATIO': 'Partitions scanned / total', 'GB_SPILLED': 'GB spilled'})
+        st.plotly_chart(fig, use_container_width=True)
+    
+    step_detail(hours, summary['SPAN_NAME'].tolist())
+else:
+    st.info(f"No collected step statistics in the {time_range.lower()}. "
+            "Statistics appear about an hour after a run (CALL collect_step_performance() to collect now).")
@@ -24,12 +24,15 @@ SELECT 'Streamlit stage created' AS status;
 -- NOTE: You need to upload the files manually using PUT command or Snowsight UI
 -- From SnowSQL, run:
 --   PUT file:///path/to/streamlit/fdd_admin_dashboard.py @streamlit_stage OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
+--   PUT file:///path/to/streamlit/fdd_data.py @streamlit_stage OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
+--   PUT file:///path/to/streamlit/app_pages/*.py @streamlit_stage/app_pages OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
 --   PUT file:///path/to/streamlit/environment.yml @streamlit_stage OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
 --
 -- From Snowsight:
 --   1. Go to Data → Databases → HL_FDD_POC → TRIAL_BALANCE → Stages → STREAMLIT_STAGE
 --   2. Click "+ Files" button
---   3. Upload fdd_admin_dashboard.py and environment.yml
+--   3. Upload fdd_admin_dashboard.py, fdd_data.py and environment.yml
+--   4. Upload the app_pages/*.py files with "Specify the path" set to app_pages
 
 -- Verify files uploaded
 -- LIST @streamlit_stage;
@@ -39,10 +42,14 @@ SELECT '
 ------------------------
 Upload the following files to @streamlit_stage:
 1. streamlit/fdd_admin_dashboard.py
-2. streamlit/environment.yml
+2. streamlit/fdd_data.py
+3. streamlit/app_pages/*.py (into the app_pages folder of the stage)
+4. streamlit/environment.yml
 
 Using SnowSQL:
 PUT file:///full/path/to/production/streamlit/fdd_admin_dashboard.py @streamlit_stage OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
+PUT file:///full/path/to/production/streamlit/fdd_data.py @streamlit_stage OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
+PUT file:///full/path/to/production/streamlit/app_pages/*.py @streamlit_stage/app_pages OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
 PUT file:///full/path/to/production/streamlit/environment.yml @streamlit_stage OVERWRITE=TRUE AUTO_COMPRESS=FALSE;
 
 Using Snowsight:
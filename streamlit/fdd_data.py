@@ -0,0 +1,837 @@
+"""
+Houlihan Lokey FDD Automation - Dashboard Data Access
+======================================================
+Cached query layer for the admin dashboard. Every page query lives here as
+an ``st.cache_data`` function with a TTL, keyed by the page filters passed in
+as arguments, so Streamlit reruns (widget clicks) are served from cache
+instead of resuming the warehouse.
+
+Write operations (configuration updates, stage file removal) go through the
+helpers at the bottom of this module, which clear exactly the cached
+functions whose results they change.
+"""
+
+import io
+import json
+import re
+from datetime import datetime
+
+import streamlit as st
+
+# Cache lifetimes (seconds)
+TTL_LIVE = 60          # operational metrics that change with every procedure run
+TTL_STANDARD = 300     # configuration, quality checks, stage listings
+TTL_DIMENSION = 900    # dropdown option lists
+
+
+@st.cache_resource
+def get_session():
+    """Snowpark session shared by all reruns of the app."""
+    return st.connection('snowflake').session()
+
+
+def _to_pandas(query):
+    return get_session().sql(query).to_pandas()
+
+
+# =====================================================
+# OVERVIEW
+# =====================================================
+
+@st.cache_data(ttl=TTL_LIVE)
+def overview_metrics():
+    """All Overview scalars in a single round trip."""
+    row = get_session().sql("""
+        SELECT
+            (SELECT COUNT(DISTINCT deal_id) FROM trial_balance_raw) AS total_deals,
+            (SELECT COUNT(*) FROM trial_balance_raw) AS total_tb_rows,
+            (SELECT COUNT(*) FROM ai_insights) AS total_insights,
+            (SELECT COALESCE(SUM(errors), 0)
+             FROM audit_hourly_rollup
+             WHERE hour_bucket >= DATE_TRUNC('hour', DATEADD(day, -7, CURRENT_TIMESTAMP()))) AS recent_errors,
+            (SELECT SUM(total_duration_seconds) / NULLIF(SUM(timed_executions), 0)
+             FROM audit_hourly_rollup
+             WHERE procedure_name = 'generate_fdd_schedules'
+             AND hour_bucket >= DATE_TRUNC('hour', DATEADD(day, -7, CURRENT_TIMESTAMP()))) AS avg_schedule_duration,
+            (SELECT COALESCE(SUM(failed_checks), 0)
+             FROM dq_hourly_rollup
+             WHERE hour_bucket >= DATE_TRUNC('hour', DATEADD(day, -7, CURRENT_TIMESTAMP()))) AS failed_checks
+    """).collect()[0]
+    return row.as_dict()
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def recent_activity():
+    return _to_pandas("""
+        SELECT
+            TO_CHAR(start_time, 'HH24:MI:SS') AS time,
+            procedure_name,
+            deal_id,
+            status,
+            duration_seconds,
+            rows_affected,
+            SUBSTRING(message, 1, 100) AS message
+        FROM audit_log
+        WHERE start_time > DATEADD(hour, -24, CURRENT_TIMESTAMP())
+        ORDER BY start_time DESC
+        LIMIT 20
+    """)
+
+
+# =====================================================
+# MONITORING & PERFORMANCE
+# =====================================================
+
+def _hour_filter(hours):
+    """Rollup predicate for the last ``hours`` hours; None means all time."""
+    if hours is None:
+        return "1=1"
+    return f"hour_bucket >= DATE_TRUNC('hour', DATEADD(hour, -{int(hours)}, CURRENT_TIMESTAMP()))"
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def rollup_freshness():
+    """High-water mark of the audit rollup (rows newer than this are not yet counted)."""
+    rows = get_session().sql("""
+        SELECT high_water_mark
+        FROM rollup_watermarks
+        WHERE rollup_name = 'audit_hourly_rollup'
+    """).collect()
+    return rows[0][0] if rows else None
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def procedure_stats(hours):
+    return _to_pandas(f"""
+        SELECT
+            procedure_name,
+            SUM(executions) AS total_executions,
+            SUM(successes) AS successful,
+            SUM(errors) AS failed,
+            ROUND(SUM(total_duration_seconds) / NULLIF(SUM(timed_executions), 0), 2) AS avg_duration_sec,
+            ROUND(APPROX_PERCENTILE_ESTIMATE(APPROX_PERCENTILE_COMBINE(duration_digest), 0.95), 2) AS p95_duration_sec,
+            ROUND(MAX(max_duration_seconds), 2) AS max_duration_sec,
+            SUM(rows_affected) AS total_rows_affected
+        FROM audit_hourly_rollup
+        WHERE {_hour_filter(hours)}
+        GROUP BY procedure_name
+        ORDER BY total_executions DESC
+    """)
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def performance_trend(hours):
+    return _to_pandas(f"""
+        SELECT
+            hour_bucket AS hour,
+            procedure_name,
+            SUM(total_duration_seconds) / NULLIF(SUM(timed_executions), 0) AS avg_duration
+        FROM audit_hourly_rollup
+        WHERE {_hour_filter(hours)}
+        AND procedure_name IN ('generate_fdd_schedules', 'run_complete_poc', 'load_trial_balance')
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """)
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def recent_traces(hours):
+    """generate_fdd_schedules runs with a span trace, newest first."""
+    time_filter = "1=1" if hours is None else f"start_time > DATEADD(hour, -{int(hours)}, CURRENT_TIMESTAMP())"
+    return _to_pandas(f"""
+        SELECT
+            trace_id,
+            deal_id,
+            TO_CHAR(start_time, 'YYYY-MM-DD HH24:MI:SS') AS start_time,
+            ROUND(duration_ms / 1000, 1) AS duration_sec,
+            status,
+            steps,
+            failed_steps,
+            slowest_step
+        FROM v_execution_traces
+        WHERE {time_filter}
+        ORDER BY start_time DESC
+        LIMIT 200
+    """)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def trace_waterfall(trace_id):
+    """Spans of one run with their offset from the run start (spans never change once written)."""
+    return get_session().sql("""
+        SELECT span_name, depth, offset_ms, duration_ms, status, message
+        FROM v_execution_waterfall
+        WHERE trace_id = ?
+        ORDER BY depth, offset_ms
+    """, params=[trace_id]).to_pandas()
+
+
+# =====================================================
+# STEP PERFORMANCE
+# =====================================================
+
+def _step_filter(hours):
+    if hours is None:
+        return "1=1"
+    return f"step_start_time > DATEADD(hour, -{int(hours)}, CURRENT_TIMESTAMP())"
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def step_performance_summary(hours):
+    """Per-step totals from collected query history (refreshed hourly by collect_step_performance_task)."""
+    return _to_pandas(f"""
+        SELECT
+            span_name,
+            COUNT(*) AS runs,
+            ROUND(AVG(step_ms) / 1000, 2) AS avg_step_sec,
+            ROUND(AVG(execution_ms) / 1000, 2) AS avg_execution_sec,
+            ROUND(AVG(compilation_ms) / 1000, 2) AS avg_compilation_sec,
+            ROUND(AVG(queued_ms) / 1000, 2) AS avg_queued_sec,
+            ROUND(SUM(partitions_scanned) / NULLIF(SUM(partitions_total), 0), 3) AS scan_ratio,
+            ROUND(SUM(bytes_scanned) / POWER(1024, 3), 2) AS gb_scanned,
+            ROUND(SUM(bytes_spilled_local + bytes_spilled_remote) / POWER(1024, 3), 2) AS gb_spilled,
+            ROUND(SUM(credits_used), 4) AS credits
+        FROM v_step_performance
+        WHERE {_step_filter(hours)}
+        GROUP BY span_name
+        ORDER BY AVG(step_ms) DESC NULLS LAST
+    """)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def step_performance_detail(hours, span_name):
+    return get_session().sql(f"""
+        SELECT
+            TO_CHAR(step_start_time, 'YYYY-MM-DD HH24:MI:SS') AS step_start_time,
+            deal_id,
+            ROUND(step_ms / 1000, 2) AS step_sec,
+            query_count,
+            ROUND(execution_ms / 1000, 2) AS execution_sec,
+            ROUND(queued_ms / 1000, 2) AS queued_sec,
+            scan_ratio,
+            ROUND((bytes_spilled_local + bytes_spilled_remote) / POWER(1024, 2), 1) AS mb_spilled,
+            credits_used,
+            slowest_query_id
+        FROM v_step_performance
+        WHERE {_step_filter(hours)}
+        AND span_name = ?
+        ORDER BY step_start_time DESC
+        LIMIT 500
+    """, params=[span_name]).to_pandas()
+
+
+# =====================================================
+# CONFIGURATION
+# =====================================================
+
+@st.cache_data(ttl=TTL_STANDARD)
+def system_config():
+    return _to_pandas("""
+        SELECT
+            config_key,
+            config_value::VARCHAR AS config_value,
+            description,
+            is_sensitive,
+            last_updated
+        FROM system_config
+        ORDER BY config_key
+    """)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def ai_config():
+    return _to_pandas("""
+        SELECT config_key, config_value::VARCHAR AS value, description
+        FROM system_config
+        WHERE config_key LIKE 'ai_%' OR config_key LIKE '%variance%' OR config_key LIKE '%threshold%'
+        ORDER BY config_key
+    """)
+
+
+# In-process copy of v_config_snapshot: (config_version, {key: typed value}).
+# Shared by every session of the app and reloaded only when config_version()
+# reports a different version.
+_config_snapshot = (None, {})
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def config_version():
+    """Current config_version (a hash over system_config; changes with any update)."""
+    return get_session().sql("SELECT config_version FROM v_config_snapshot").collect()[0][0]
+
+
+def config_snapshot():
+    """Every non-sensitive setting as typed Python values, as the procedures resolve them."""
+    global _config_snapshot
+    version = config_version()
+    if _config_snapshot[0] != version:
+        row = get_session().sql("SELECT config_version, config_values FROM v_config_snapshot").collect()[0]
+        _config_snapshot = (row[0], json.loads(row[1]))
+    return _config_snapshot[1]
+
+
+def config_value(key):
+    """Current value of one setting, served from the in-process config_snapshot()."""
+    return config_snapshot().get(key)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def threshold_impact(test_threshold, test_min_amount, max_insights, cost_per_call):
+    """Per-deal preview from variance_distribution_index (refreshed on every load).
+
+    Thresholds are snapped down to the index grid, so counts are exact on grid
+    values and an upper bound between them. Cortex calls are capped at
+    ``max_insights`` per deal, as generate_ai_insights does with max_ai_insights.
+    """
+    return get_session().sql("""
+        WITH edges AS (
+            SELECT
+                MAX(IFF(min_variance_pct <= ? + 0.000001, min_variance_pct, NULL)) AS pct_edge,
+                MAX(IFF(min_prior_amount <= ? + 0.000001, min_prior_amount, NULL)) AS amount_edge
+            FROM variance_distribution_index
+        )
+        SELECT
+            v.deal_id,
+            e.pct_edge AS grid_threshold,
+            e.amount_edge AS grid_min_amount,
+            base.variance_count AS total_variances,
+            v.variance_count AS insights_that_would_generate,
+            LEAST(v.variance_count, ?) AS cortex_calls,
+            LEAST(v.variance_count, ?) * ? AS estimated_cost_usd,
+            v.refreshed_at
+        FROM variance_distribution_index v
+        JOIN edges e
+            ON v.min_variance_pct = e.pct_edge
+            AND v.min_prior_amount = e.amount_edge
+        JOIN variance_distribution_index base
+            ON base.deal_id = v.deal_id
+            AND base.min_variance_pct = 0
+            AND base.min_prior_amount = 0
+        ORDER BY v.deal_id
+    """, params=[float(test_threshold), float(test_min_amount),
+                 int(max_insights), int(max_insights), float(cost_per_call)]).to_pandas()
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def ai_cost_by_deal_model(days):
+    """Cortex calls, tokens and estimated cost per deal and model (from the ai_token_usage ledger)."""
+    return _to_pandas(f"""
+        SELECT
+            deal_id,
+            model_name,
+            SUM(cortex_calls) AS cortex_calls,
+            SUM(prompt_tokens) AS prompt_tokens,
+            SUM(completion_tokens) AS completion_tokens,
+            SUM(total_tokens) AS total_tokens,
+            ROUND(SUM(estimated_cost_usd), 2) AS estimated_cost_usd
+        FROM v_ai_cost_by_deal_model
+        WHERE call_date > DATEADD(day, -{int(days)}, CURRENT_DATE())
+        GROUP BY deal_id, model_name
+        ORDER BY estimated_cost_usd DESC NULLS LAST
+    """)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def ai_daily_tokens(days):
+    """Cortex tokens per day and model."""
+    return _to_pandas(f"""
+        SELECT
+            call_date,
+            model_name,
+            SUM(total_tokens) AS total_tokens
+        FROM v_ai_cost_by_deal_model
+        WHERE call_date > DATEADD(day, -{int(days)}, CURRENT_DATE())
+        GROUP BY call_date, model_name
+        ORDER BY call_date
+    """)
+
+
+# =====================================================
+# SCHEDULES
+# =====================================================
+
+@st.cache_data(ttl=TTL_DIMENSION)
+def schedule_deals():
+    """Deals with generated schedule rows."""
+    return _to_pandas("SELECT DISTINCT deal_id FROM schedule_rows ORDER BY deal_id")['DEAL_ID'].tolist()
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def schedule_values_versions(deal_id):
+    """(computed, current) data version of a deal's schedule values.
+
+    The computed version is None until the values are first computed; when it
+    trails the current one, a load has changed the deal since
+    (refresh_schedule_values() recomputes them).
+    """
+    row = get_session().sql("""
+        SELECT
+            (SELECT MAX(data_version) FROM schedule_values_cache WHERE deal_id = ?) AS computed_version,
+            (SELECT COALESCE(MAX(data_version), 0) FROM deal_data_versions WHERE deal_id = ?) AS current_version
+    """, params=[deal_id, deal_id]).collect()[0]
+    return row['COMPUTED_VERSION'], row['CURRENT_VERSION']
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def schedule_values(deal_id, statement_type):
+    """Schedule rows with their computed period amounts, one row per schedule row and period."""
+    return get_session().sql("""
+        SELECT
+            r.row_num,
+            r.row_label,
+            r.row_type,
+            v.period_date,
+            v.period_label,
+            v.amount,
+            v.data_version
+        FROM schedule_rows r
+        LEFT JOIN v_schedule_values v
+            ON v.deal_id = r.deal_id
+            AND v.statement_type = r.statement_type
+            AND v.row_num = r.row_num
+        WHERE r.deal_id = ? AND r.statement_type = ?
+        ORDER BY r.row_num, v.period_date
+    """, params=[deal_id, statement_type]).to_pandas()
+
+
+# =====================================================
+# DATA QUALITY
+# =====================================================
+
+@st.cache_data(ttl=TTL_STANDARD)
+def quality_summary():
+    return _to_pandas("""
+        SELECT
+            check_type,
+            SUM(total_checks) AS total_checks,
+            SUM(passed_checks) AS passed,
+            SUM(failed_checks) AS failed,
+            ROUND(SUM(passed_checks) * 100.0 / NULLIF(SUM(total_checks), 0), 1) AS pass_rate
+        FROM dq_hourly_rollup
+        GROUP BY check_type
+        ORDER BY check_type
+    """)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def failed_checks_by_severity():
+    return _to_pandas("""
+        SELECT
+            severity,
+            SUM(failed_checks) AS count
+        FROM dq_hourly_rollup
+        WHERE failed_checks > 0
+        GROUP BY severity
+        ORDER BY CASE severity WHEN 'ERROR' THEN 1 WHEN 'WARNING' THEN 2 ELSE 3 END
+    """)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def recent_failed_checks():
+    return _to_pandas("""
+        SELECT
+            deal_id,
+            check_name,
+            check_type,
+            severity,
+            message,
+            TO_CHAR(check_timestamp, 'YYYY-MM-DD HH24:MI:SS') AS checked_at
+        FROM data_quality_checks
+        WHERE passed = FALSE
+        ORDER BY check_timestamp DESC
+        LIMIT 50
+    """)
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def dq_rules():
+    """Rules evaluated by validate_data_quality, in evaluation order."""
+    return _to_pandas("""
+        SELECT
+            rule_name,
+            check_type,
+            metric_name,
+            min_pass,
+            max_pass,
+            fail_severity,
+            escalate_at,
+            escalated_severity,
+            is_enabled
+        FROM dq_rules
+        ORDER BY rule_order, rule_name
+    """)
+
+
+# =====================================================
+# STAGE FILES
+# =====================================================
+
+STAGES = ("fdd_input_stage", "fdd_output_stage")
+STAGE_PAGE_SIZE = 100
+
+
+def _stage_filter(stage_name, deal_id, min_age_days):
+    """FROM/WHERE over the stage directory table, with bind parameters.
+
+    A deal's files are matched by stage_file_deal_match (exports/<deal>/...
+    and <export>_<deal>.<ext> at the stage root), as in purge_stage_files.
+    """
+    if stage_name not in STAGES:
+        raise ValueError(f"Unknown stage: {stage_name}")
+    clauses = ["1=1"]
+    params = []
+
+    if deal_id != "All":
+        clauses.append("stage_file_deal_match(relative_path, ?)")
+        params.append(deal_id)
+
+    if min_age_days:
+        clauses.append("last_modified < DATEADD(day, -?, CURRENT_TIMESTAMP())")
+        params.append(int(min_age_days))
+
+    return f"DIRECTORY(@{stage_name}) WHERE {' AND '.join(clauses)}", params
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def stage_summary(stage_name, deal_id, min_age_days):
+    """File count and size of the filtered listing (directory table, no LIST)."""
+    source, params = _stage_filter(stage_name, deal_id, min_age_days)
+    row = get_session().sql(f"""
+        SELECT
+            COUNT(*) AS total_files,
+            COALESCE(SUM(size), 0) / POWER(1024, 2) AS total_mb,
+            COALESCE(AVG(size), 0) / 1024 AS avg_kb,
+            MIN(last_modified) AS oldest_file
+        FROM {source}
+    """, params=params).collect()[0]
+    return row.as_dict()
+
+
+@st.cache_data(ttl=TTL_STANDARD)
+def stage_files_page(stage_name, deal_id, min_age_days, page):
+    """One page of the filtered listing, newest first."""
+    source, params = _stage_filter(stage_name, deal_id, min_age_days)
+    return get_session().sql(f"""
+        SELECT
+            relative_path,
+            size,
+            ROUND(size / 1024, 2) AS size_kb,
+            last_modified
+        FROM {source}
+        ORDER BY last_modified DESC, relative_path
+        LIMIT {STAGE_PAGE_SIZE} OFFSET {int(page) * STAGE_PAGE_SIZE}
+    """, params=params).to_pandas()
+
+
+# =====================================================
+# AUDIT LOG
+# =====================================================
+
+AUDIT_PAGE_SIZE = 50
+AUDIT_EXPORT_MAX_ROWS = 100_000  # larger exports are unloaded to the output stage
+
+
+@st.cache_data(ttl=TTL_DIMENSION)
+def audit_dimensions():
+    """Procedure and deal dropdown options from audit_hourly_rollup (no audit_log scan)."""
+    dims = _to_pandas("""
+        SELECT 'PROCEDURE' AS dimension, procedure_name AS value FROM audit_hourly_rollup GROUP BY procedure_name
+        UNION ALL
+        SELECT 'DEAL', deal_id FROM audit_hourly_rollup WHERE deal_id IS NOT NULL GROUP BY deal_id
+        ORDER BY 1, 2
+    """)
+    procedures = dims[dims['DIMENSION'] == 'PROCEDURE']['VALUE'].tolist()
+    deals = dims[dims['DIMENSION'] == 'DEAL']['VALUE'].tolist()
+    return procedures, deals
+
+
+def _audit_filter(hours, status, procedure, deal_id):
+    """WHERE clause and bind parameters for the Audit Log Viewer filters."""
+    clauses = ["start_time IS NOT NULL"]
+    params = []
+
+    if hours is not None:
+        clauses.append("start_time > DATEADD(hour, -?, CURRENT_TIMESTAMP())")
+        params.append(int(hours))
+
+    if status != "All":
+        clauses.append("status = ?")
+        params.append(status)
+
+    if procedure != "All":
+        clauses.append("procedure_name = ?")
+        params.append(procedure)
+
+    if deal_id != "All":
+        clauses.append("deal_id = ?")
+        params.append(deal_id)
+
+    return " AND ".join(clauses), params
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def audit_log_page(hours, status, procedure, deal_id, after=None):
+    """One page of audit entries, newest first.
+
+    Keyset pagination on (start_time, log_id): ``after`` is the (CURSOR_TIME,
+    LOG_ID) of the last row of the previous page, so every page is a bounded
+    top-N read however deep the user pages. One extra row is fetched to tell
+    whether an older page exists. Messages are 100-character previews; the
+    full entry comes from audit_entry().
+    """
+    where_clause, params = _audit_filter(hours, status, procedure, deal_id)
+    if after is not None:
+        where_clause += (" AND (start_time < ?::TIMESTAMP_NTZ"
+                         " OR (start_time = ?::TIMESTAMP_NTZ AND log_id < ?))")
+        params += [after[0], after[0], after[1]]
+
+    return get_session().sql(f"""
+        SELECT
+            log_id,
+            TO_CHAR(start_time, 'YYYY-MM-DD HH24:MI:SS.FF9') AS cursor_time,
+            TO_CHAR(start_time, 'YYYY-MM-DD HH24:MI:SS') AS started,
+            procedure_name,
+            deal_id,
+            status,
+            duration_seconds,
+            rows_affected,
+            LEFT(message, 100) AS message,
+            LEFT(error_message, 100) AS error_message
+        FROM audit_log
+        WHERE {where_clause}
+        ORDER BY audit_log.start_time DESC, log_id DESC
+        LIMIT {AUDIT_PAGE_SIZE + 1}
+    """, params=params).to_pandas()
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def audit_entry(log_id):
+    """Full audit row, fetched when an entry is selected."""
+    rows = get_session().sql("""
+        SELECT
+            log_id, procedure_name, deal_id, status,
+            TO_CHAR(start_time, 'YYYY-MM-DD HH24:MI:SS') AS start_time,
+            TO_CHAR(end_time, 'YYYY-MM-DD HH24:MI:SS') AS end_time,
+            duration_seconds, rows_affected,
+            user_name, role_name, warehouse_name, session_id, query_id, credits_used,
+            message, error_message
+        FROM audit_log
+        WHERE log_id = ?
+    """, params=[log_id]).collect()
+    return rows[0].as_dict() if rows else None
+
+
+def _audit_export(hours, status, procedure, deal_id):
+    """Snowpark DataFrame of every matching entry, with full messages."""
+    where_clause, params = _audit_filter(hours, status, procedure, deal_id)
+    return get_session().sql(f"""
+        SELECT
+            log_id, start_time, end_time, procedure_name, deal_id, status,
+            duration_seconds, rows_affected, user_name, message, error_message
+        FROM audit_log
+        WHERE {where_clause}
+        ORDER BY start_time DESC, log_id DESC
+    """, params=params)
+
+
+def audit_log_export_rows(hours, status, procedure, deal_id):
+    """Matching entries, counted up to AUDIT_EXPORT_MAX_ROWS + 1."""
+    where_clause, params = _audit_filter(hours, status, procedure, deal_id)
+    return get_session().sql(f"""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM audit_log WHERE {where_clause} LIMIT {AUDIT_EXPORT_MAX_ROWS + 1}
+        )
+    """, params=params).collect()[0][0]
+
+
+def audit_log_csv(hours, status, procedure, deal_id):
+    """Matching entries as CSV text for the download button.
+
+    The text is held in memory, so at most AUDIT_EXPORT_MAX_ROWS entries are
+    read (check audit_log_export_rows() first; unload_audit_log() exports any
+    number). Rows are read with to_pandas_batches() and written batch by batch.
+    Not cached: only built on request.
+    """
+    batches = _audit_export(hours, status, procedure, deal_id).limit(AUDIT_EXPORT_MAX_ROWS).to_pandas_batches()
+
+    buffer = io.StringIO()
+    for batch_number, batch in enumerate(batches):
+        batch.to_csv(buffer, index=False, header=batch_number == 0)
+    return buffer.getvalue()
+
+
+def unload_audit_log(hours, status, procedure, deal_id):
+    """Unload every matching entry to the output stage as one gzip CSV.
+
+    The COPY INTO runs in the warehouse, so nothing passes through the app.
+    Returns the file's stage path; files under audit_exports/ age out with
+    the rest of the stage (purge_stage_files).
+    """
+    path = f"@fdd_output_stage/audit_exports/audit_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.gz"
+    _audit_export(hours, status, procedure, deal_id).write.copy_into_location(
+        path,
+        file_format_type="csv",
+        format_type_options={"COMPRESSION": "GZIP", "FIELD_OPTIONALLY_ENCLOSED_BY": '"'},
+        header=True,
+        overwrite=True,
+        single=True,
+        max_file_size=5 * 1024 ** 3,
+    )
+    return path
+
+
+# =====================================================
+# ERROR DIAGNOSTICS
+# =====================================================
+
+@st.cache_data(ttl=TTL_LIVE)
+def error_summary():
+    return _to_pandas("""
+        SELECT
+            procedure_name,
+            SUM(errors) AS error_count,
+            COUNT(DISTINCT deal_id) AS affected_deals,
+            MAX(last_error_time) AS last_error_time
+        FROM audit_hourly_rollup
+        WHERE errors > 0
+        AND hour_bucket >= DATE_TRUNC('hour', DATEADD(day, -7, CURRENT_TIMESTAMP()))
+        GROUP BY procedure_name
+        ORDER BY error_count DESC
+    """)
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def error_trend():
+    return _to_pandas("""
+        SELECT
+            hour_bucket AS hour,
+            SUM(errors) AS error_count
+        FROM audit_hourly_rollup
+        WHERE errors > 0
+        AND hour_bucket >= DATE_TRUNC('hour', DATEADD(day, -7, CURRENT_TIMESTAMP()))
+        GROUP BY 1
+        ORDER BY 1
+    """)
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def recent_errors():
+    return _to_pandas("""
+        SELECT
+            TO_CHAR(start_time, 'YYYY-MM-DD HH24:MI:SS') AS error_time,
+            procedure_name,
+            deal_id,
+            error_message,
+            duration_seconds
+        FROM audit_log
+        WHERE status = 'ERROR'
+        ORDER BY start_time DESC
+        LIMIT 50
+    """)
+
+
+@st.cache_data(ttl=TTL_LIVE)
+def load_errors():
+    return _to_pandas("""
+        SELECT
+            deal_id,
+            file_name,
+            error_type,
+            error_message,
+            line_content,
+            TO_CHAR(error_timestamp, 'YYYY-MM-DD HH24:MI:SS') AS error_time
+        FROM load_errors
+        ORDER BY error_timestamp DESC
+        LIMIT 100
+    """)
+
+
+# =====================================================
+# SYSTEM HEALTH CHECK
+# =====================================================
+
+@st.cache_data(ttl=TTL_LIVE)
+def health_probe():
+    """system_health_check() results and 24-hour success rates, queried concurrently.
+
+    The procedure reads metadata row counts and LIMIT 1 probes instead of
+    scanning tables (see 06_operational_rollups.sql).
+    """
+    session = get_session()
+    checks_job = session.sql("CALL system_health_check()").to_pandas(block=False)
+    success_job = session.sql(f"""
+        SELECT
+            procedure_name,
+            SUM(executions) AS executions,
+            SUM(successes) AS successful,
+            ROUND(SUM(successes) * 100.0 / NULLIF(SUM(executions), 0), 1) AS success_rate
+        FROM audit_hourly_rollup
+        WHERE {_hour_filter(24)}
+        GROUP BY 1
+        ORDER BY 1
+    """).to_pandas(block=False)
+    return checks_job.result(), success_job.result()
+
+
+# =====================================================
+# WRITES AND CACHE INVALIDATION
+# =====================================================
+
+def invalidate_config():
+    """Drop cached results that depend on system_config."""
+    config_version.clear()
+    system_config.clear()
+    ai_config.clear()
+    threshold_impact.clear()
+
+
+def invalidate_stage():
+    stage_summary.clear()
+    stage_files_page.clear()
+
+
+def set_config(config_key, value_sql):
+    """Update one system_config entry. ``value_sql`` is a SQL VARIANT expression."""
+    get_session().sql(f"""
+        UPDATE system_config
+        SET config_value = {value_sql},
+            last_updated = CURRENT_TIMESTAMP()
+        WHERE config_key = '{config_key}'
+    """).collect()
+    invalidate_config()
+
+
+def refresh_schedule_values(deal_id):
+    """Recompute a deal's schedule values if a load changed the deal (refresh_schedule_values)."""
+    result = get_session().sql("CALL refresh_schedule_values(?)", params=[deal_id]).collect()[0][0]
+    schedule_values_versions.clear()
+    schedule_values.clear()
+    return result
+
+
+def refresh_stage_directory(stage_name):
+    """Sync the stage directory table with the files on the stage."""
+    if stage_name not in STAGES:
+        raise ValueError(f"Unknown stage: {stage_name}")
+    get_session().sql(f"ALTER STAGE {stage_name} REFRESH").collect()
+    invalidate_stage()
+
+
+def remove_stage_file(stage_name, relative_path):
+    """Remove exactly one file (regex-escaped match below the stage name segment)."""
+    if stage_name not in STAGES:
+        raise ValueError(f"Unknown stage: {stage_name}")
+    pattern = "[^/]+/" + re.sub(r"([]().*+?{}|$^[\\])", r"\\\1", relative_path)
+    pattern_sql = pattern.replace("\\", "\\\\").replace("'", "\\'")
+    get_session().sql(f"REMOVE @{stage_name} PATTERN = '{pattern_sql}'").collect()
+    refresh_stage_directory(stage_name)
+
+
+def purge_stage_files(stage_name, retention_days, deal_id=None, dry_run=False):
+    """Remove files older than ``retention_days`` with batched pattern REMOVEs (purge_stage_files)."""
+    result = get_session().sql(
+        "CALL purge_stage_files(?, ?, ?, ?)",
+        params=[stage_name, int(retention_days), deal_id, dry_run],
+    ).collect()[0][0]
+    invalidate_stage()
+    return result
@@ -117,8 +117,8 @@ CALL generate_income_statement('DEAL_HL_001');
 SELECT 'Income Statement Generation' AS validation,
        COUNT(*) AS row_count,
        CASE WHEN COUNT(*) >= 10 THEN '✅ PASS' ELSE '❌ FAIL' END AS status
-FROM income_statement_structure
-WHERE deal_id = 'DEAL_HL_001';
+FROM schedule_rows
+WHERE deal_id = 'DEAL_HL_001' AND statement_type = 'IS';
 
 -- Generate Balance Sheet
 CALL generate_balance_sheet('DEAL_HL_001');
@@ -127,8 +127,8 @@ CALL generate_balance_sheet('DEAL_HL_001');
 SELECT 'Balance Sheet Generation' AS validation,
        COUNT(*) AS row_count,
        CASE WHEN COUNT(*) >= 5 THEN '✅ PASS' ELSE '❌ FAIL' END AS status
-FROM balance_sheet_structure
-WHERE deal_id = 'DEAL_HL_001';
+FROM schedule_rows
+WHERE deal_id = 'DEAL_HL_001' AND statement_type = 'BS';
 
 -- =====================================================
 -- PHASE 5: AI Insights Validation
@@ -408,6 +408,1252 @@ EXCEPTION
 END;
 $$;
 
+-- ============================================================================
+-- TEST 8: OPERATIONAL ROLLUPS
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_operational_rollups()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    refresh_result VARCHAR;
+    watermark TIMESTAMP_NTZ;
+    rollup_completed NUMBER;
+    raw_completed NUMBER;
+BEGIN
+    CALL TRIAL_BALANCE.refresh_operational_rollups() INTO :refresh_result;
+    
+    SELECT high_water_mark INTO :watermark
+    FROM TRIAL_BALANCE.rollup_watermarks
+    WHERE rollup_name = 'audit_hourly_rollup';
+    
+    -- Hours that ended more than a day before the watermark are final
+    SELECT COALESCE(SUM(successes + errors + warnings), 0) INTO :rollup_completed
+    FROM TRIAL_BALANCE.audit_hourly_rollup
+    WHERE hour_bucket >= DATE_TRUNC('hour', DATEADD(day, -8, :watermark))
+    AND hour_bucket < DATE_TRUNC('hour', DATEADD(day, -1, :watermark));
+    
+    SELECT COUNT(*) INTO :raw_completed
+    FROM TRIAL_BALANCE.audit_log
+    WHERE status IN ('SUCCESS', 'ERROR', 'WARNING')
+    AND start_time >= DATE_TRUNC('hour', DATEADD(day, -8, :watermark))
+    AND start_time < DATE_TRUNC('hour', DATEADD(day, -1, :watermark));
+    
+    IF (STARTSWITH(:refresh_result, 'SUCCESS') AND :rollup_completed = :raw_completed) THEN
+        CALL log_test_result(
+            'Operational Rollups Reconcile',
+            'Observability',
+            'PASS',
+            'Rollup totals match audit_log',
+            :rollup_completed || ' completed executions in both',
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Operational Rollups Reconcile',
+            'Observability',
+            'FAIL',
+            'Rollup totals match audit_log',
+            'Rollup: ' || :rollup_completed || ', audit_log: ' || :raw_completed,
+            :refresh_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Operational Rollups Reconcile', 'Observability', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 9: AI COMPLETION CACHE EVICTION
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_ai_cache_eviction()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    stale_key VARCHAR DEFAULT SHA2('test-model|stale prompt', 256);
+    fresh_key VARCHAR DEFAULT SHA2('test-model|fresh prompt', 256);
+    evict_result VARCHAR;
+    remaining VARCHAR;
+BEGIN
+    DELETE FROM TRIAL_BALANCE.ai_completion_cache WHERE cache_key IN (:stale_key, :fresh_key);
+    
+    INSERT INTO TRIAL_BALANCE.ai_completion_cache (cache_key, model_name, prompt_text, completion_text, last_used_timestamp)
+    VALUES 
+        (:stale_key, 'test-model', 'stale prompt', 'stale answer', DATEADD(day, -10000, CURRENT_TIMESTAMP())),
+        (:fresh_key, 'test-model', 'fresh prompt', 'fresh answer', CURRENT_TIMESTAMP());
+    
+    CALL TRIAL_BALANCE.evict_ai_completion_cache() INTO :evict_result;
+    
+    SELECT LISTAGG(prompt_text, ',') INTO :remaining
+    FROM TRIAL_BALANCE.ai_completion_cache
+    WHERE cache_key IN (:stale_key, :fresh_key);
+    
+    -- Cleanup
+    DELETE FROM TRIAL_BALANCE.ai_completion_cache WHERE cache_key IN (:stale_key, :fresh_key);
+    
+    IF (:remaining = 'fresh prompt') THEN
+        CALL log_test_result(
+            'AI Cache Eviction',
+            'AI Insights',
+            'PASS',
+            'Only the stale completion is evicted',
+            :evict_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'AI Cache Eviction',
+            'AI Insights',
+            'FAIL',
+            'Only the stale completion is evicted',
+            'Remaining: ' || COALESCE(:remaining, 'none'),
+            :evict_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('AI Cache Eviction', 'AI Insights', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 10: VARIANCE INDEX MATCHES INSIGHT SELECTION
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_variance_index()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    refresh_result VARCHAR;
+    mismatched_deals NUMBER;
+BEGIN
+    CALL TRIAL_BALANCE.refresh_variance_index() INTO :refresh_result;
+    
+    -- Index counts at a grid point must equal a direct count with the generator's filters
+    SELECT COUNT(*) INTO :mismatched_deals
+    FROM TRIAL_BALANCE.variance_distribution_index i
+    LEFT JOIN (
+        SELECT deal_id, COUNT(*) AS candidates
+        FROM TRIAL_BALANCE.v_variance_candidates
+        WHERE variance_ratio > 0.20
+        AND prior_abs_amount > 5000
+        GROUP BY deal_id
+    ) c ON c.deal_id = i.deal_id
+    WHERE i.min_variance_pct = 0.20
+    AND i.min_prior_amount = 5000
+    AND i.variance_count <> COALESCE(c.candidates, 0);
+    
+    IF (STARTSWITH(:refresh_result, 'SUCCESS') AND :mismatched_deals = 0) THEN
+        CALL log_test_result(
+            'Variance Index Reconciles',
+            'AI Insights',
+            'PASS',
+            'Index counts match v_variance_candidates',
+            :refresh_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Variance Index Reconciles',
+            'AI Insights',
+            'FAIL',
+            'Index counts match v_variance_candidates',
+            :mismatched_deals || ' deal(s) differ',
+            :refresh_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Variance Index Reconciles', 'AI Insights', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 11: PER-DEAL DATABASE TAB PERIOD WINDOW
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_database_tab_periods()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    refresh_result VARCHAR;
+    mismatched_deals NUMBER;
+BEGIN
+    CALL TRIAL_BALANCE.refresh_database_tab() INTO :refresh_result;
+    
+    -- Every deal gets min(its own period count, max_pivot_periods) columns, ending at its latest period
+    SELECT COUNT(*) INTO :mismatched_deals
+    FROM (
+        SELECT deal_id, COUNT(DISTINCT period_date) AS deal_periods, MAX(period_date) AS last_period
+        FROM TRIAL_BALANCE.trial_balance_raw
+        GROUP BY deal_id
+    ) t
+    LEFT JOIN (
+        SELECT deal_id, COUNT(*) AS window_periods, MAX(period_date) AS last_period
+        FROM TRIAL_BALANCE.database_tab_periods
+        GROUP BY deal_id
+    ) p ON p.deal_id = t.deal_id
+    WHERE COALESCE(p.window_periods, 0) <> LEAST(t.deal_periods, TRIAL_BALANCE.get_config_number('max_pivot_periods'))
+    OR p.last_period IS DISTINCT FROM t.last_period;
+    
+    IF (STARTSWITH(:refresh_result, 'SUCCESS') AND :mismatched_deals = 0) THEN
+        CALL log_test_result(
+            'Database Tab Period Window',
+            'Schedules',
+            'PASS',
+            'Each deal pivots its own most recent periods',
+            :refresh_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Database Tab Period Window',
+            'Schedules',
+            'FAIL',
+            'Each deal pivots its own most recent periods',
+            :mismatched_deals || ' deal(s) with a wrong window',
+            :refresh_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Database Tab Period Window', 'Schedules', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 12: MATERIALIZED SCHEDULE TRIAL BALANCE
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_schedule_trial_balance()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    refresh_result VARCHAR;
+    mismatched_rows NUMBER;
+BEGIN
+    BEGIN TRANSACTION;
+    CALL TRIAL_BALANCE.refresh_schedule_trial_balance() INTO :refresh_result;
+    COMMIT;
+    
+    -- The table must match trial_balance_raw joined to the active mappings with signs applied
+    SELECT COUNT(*) INTO :mismatched_rows
+    FROM (
+        SELECT 
+            t.deal_id, t.account_number, t.period_date, t.entity,
+            CASE TRIAL_BALANCE.classify_display_sign(m.statement_type, m.mapping_level_1, m.account_name)
+                WHEN 'NEGATE' THEN t.net_amount * -1
+                WHEN 'AS_IS' THEN t.net_amount
+                ELSE ABS(t.net_amount)
+            END AS expected_amount
+        FROM TRIAL_BALANCE.trial_balance_raw t
+        JOIN TRIAL_BALANCE.account_mappings m 
+            ON t.deal_id = m.deal_id AND t.account_number = m.account_number
+        WHERE m.is_active = TRUE
+    ) e
+    FULL OUTER JOIN TRIAL_BALANCE.trial_balance_for_schedules s
+        ON s.deal_id = e.deal_id
+        AND s.account_number = e.account_number
+        AND s.period_date = e.period_date
+        AND EQUAL_NULL(s.entity, e.entity)
+    WHERE e.deal_id IS NULL
+    OR s.deal_id IS NULL
+    OR NOT EQUAL_NULL(s.amount_for_display, e.expected_amount);
+    
+    IF (STARTSWITH(:refresh_result, 'SUCCESS') AND :mismatched_rows = 0) THEN
+        CALL log_test_result(
+            'Schedule Trial Balance Reconciles',
+            'Schedules',
+            'PASS',
+            'Materialized display amounts match the raw trial balance',
+            :refresh_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Schedule Trial Balance Reconciles',
+            'Schedules',
+            'FAIL',
+            'Materialized display amounts match the raw trial balance',
+            :mismatched_rows || ' mismatched rows',
+            :refresh_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        ROLLBACK;
+        CALL log_test_result('Schedule Trial Balance Reconciles', 'Schedules', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 13: TEMPLATE-DRIVEN SCHEDULE BUILDER
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_schedule_builder()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    test_deal VARCHAR;
+    build_result VARCHAR;
+    mapped_accounts NUMBER;
+    placed_accounts NUMBER;
+    bs_sections NUMBER;
+BEGIN
+    SELECT MIN(deal_id) INTO :test_deal FROM TRIAL_BALANCE.account_mappings WHERE is_active = TRUE;
+    
+    CALL TRIAL_BALANCE.build_schedules(:test_deal) INTO :build_result;
+    
+    -- Every active IS/BS account appears exactly once
+    SELECT COUNT(*) INTO :mapped_accounts
+    FROM TRIAL_BALANCE.account_mappings
+    WHERE deal_id = :test_deal AND is_active = TRUE AND statement_type IN ('IS', 'BS');
+    
+    SELECT COUNT(DISTINCT statement_type || account_number) INTO :placed_accounts
+    FROM TRIAL_BALANCE.schedule_rows
+    WHERE deal_id = :test_deal AND row_type = 'data';
+    
+    -- The balance sheet carries Liabilities and Equity, not just Current Assets
+    SELECT COUNT(DISTINCT mapping_level_1) INTO :bs_sections
+    FROM TRIAL_BALANCE.schedule_rows
+    WHERE deal_id = :test_deal AND statement_type = 'BS' AND row_type = 'subtotal';
+    
+    IF (STARTSWITH(:build_result, 'SUCCESS') AND :placed_accounts = :mapped_accounts AND :bs_sections = 3) THEN
+        CALL log_test_result(
+            'Schedule Builder Places All Accounts',
+            'Schedules',
+            'PASS',
+            :mapped_accounts || ' accounts, Assets/Liabilities/Equity subtotals',
+            :build_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Schedule Builder Places All Accounts',
+            'Schedules',
+            'FAIL',
+            :mapped_accounts || ' accounts, Assets/Liabilities/Equity subtotals',
+            :placed_accounts || ' accounts placed, ' || :bs_sections || ' BS sections',
+            :build_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Schedule Builder Places All Accounts', 'Schedules', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 14: SCHEDULE VALUE ROLLUPS
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_schedule_values()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    test_deal VARCHAR;
+    first_result VARCHAR;
+    second_result VARCHAR;
+    bad_periods NUMBER;
+    bad_bs_periods NUMBER;
+BEGIN
+    SELECT MIN(deal_id) INTO :test_deal FROM TRIAL_BALANCE.schedule_rows;
+    
+    CALL TRIAL_BALANCE.refresh_schedule_values(:test_deal, TRUE) INTO :first_result;
+    CALL TRIAL_BALANCE.refresh_schedule_values(:test_deal) INTO :second_result;
+    
+    -- Gross Margin = Total Revenue - Total Cost of Goods Sold, and each subtotal = sum of its data rows
+    SELECT COUNT(*) INTO :bad_periods
+    FROM (
+        SELECT period_date
+        FROM TRIAL_BALANCE.v_schedule_values
+        WHERE deal_id = :test_deal AND statement_type = 'IS'
+        GROUP BY period_date
+        HAVING ABS(SUM(CASE row_label WHEN 'Gross Margin' THEN amount
+                                      WHEN 'Total Revenue' THEN -amount
+                                      WHEN 'Total Cost of Goods Sold' THEN amount
+                                      ELSE 0 END)) > 0.005
+        OR ABS(SUM(IFF(row_type = 'data', amount, 0))
+               - SUM(IFF(row_type = 'subtotal', amount, 0))) > 0.005
+    );
+    
+    -- Current + Non-Current = TOTAL, including unassigned accounts placed under Current
+    SELECT COUNT(*) INTO :bad_bs_periods
+    FROM (
+        SELECT period_date
+        FROM TRIAL_BALANCE.v_schedule_values
+        WHERE deal_id = :test_deal AND statement_type = 'BS'
+        GROUP BY period_date
+        HAVING ABS(SUM(CASE TRIM(row_label) WHEN 'Total Current Assets' THEN amount
+                                            WHEN 'Total Non-Current Assets' THEN amount
+                                            WHEN 'TOTAL ASSETS' THEN -amount
+                                            ELSE 0 END)) > 0.005
+        OR ABS(SUM(CASE TRIM(row_label) WHEN 'Total Current Liabilities' THEN amount
+                                        WHEN 'Total Non-Current Liabilities' THEN amount
+                                        WHEN 'TOTAL LIABILITIES' THEN -amount
+                                        ELSE 0 END)) > 0.005
+    );
+    bad_periods := :bad_periods + :bad_bs_periods;
+    
+    IF (STARTSWITH(:first_result, 'SUCCESS: Computed') AND CONTAINS(:second_result, 'are current') AND :bad_periods = 0) THEN
+        CALL log_test_result(
+            'Schedule Values Roll Up',
+            'Schedules',
+            'PASS',
+            'Subtotals, Gross Margin and Balance Sheet totals reconcile; second call served from cache',
+            :first_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Schedule Values Roll Up',
+            'Schedules',
+            'FAIL',
+            'Subtotals, Gross Margin and Balance Sheet totals reconcile; second call served from cache',
+            :bad_periods || ' periods out of balance; ' || :second_result,
+            :first_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Schedule Values Roll Up', 'Schedules', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 15: XLSX WORKBOOK EXPORT
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_workbook_export()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    test_deal VARCHAR;
+    export_result VARCHAR;
+    list_sql VARCHAR;
+    file_count NUMBER;
+BEGIN
+    SELECT MIN(deal_id) INTO :test_deal FROM TRIAL_BALANCE.schedule_rows;
+    
+    CALL TRIAL_BALANCE.export_fdd_workbook(:test_deal) INTO :export_result;
+    
+    list_sql := 'LIST @TRIAL_BALANCE.' || TRIAL_BALANCE.get_config_string('output_stage_name') ||
+                ' PATTERN = ''.*fdd_workbook_' || :test_deal || '[.]xlsx''';
+    EXECUTE IMMEDIATE :list_sql;
+    SELECT COUNT(*) INTO :file_count FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+    
+    IF (STARTSWITH(:export_result, 'SUCCESS') AND :file_count = 1) THEN
+        CALL log_test_result(
+            'XLSX Workbook Export',
+            'Export',
+            'PASS',
+            'fdd_workbook_<deal>.xlsx written to the output stage',
+            :export_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'XLSX Workbook Export',
+            'Export',
+            'FAIL',
+            'fdd_workbook_<deal>.xlsx written to the output stage',
+            :file_count || ' files on stage',
+            :export_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('XLSX Workbook Export', 'Export', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 16: PARTITIONED EXPORT MANIFEST
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_partitioned_export()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    test_deal VARCHAR;
+    export_result VARCHAR;
+    run_id VARCHAR;
+    file_count NUMBER;
+    missing_checksums NUMBER;
+    exported_rows NUMBER;
+    expected_rows NUMBER;
+BEGIN
+    SELECT MIN(deal_id) INTO :test_deal FROM TRIAL_BALANCE.schedule_rows;
+    
+    CALL TRIAL_BALANCE.export_fdd_outputs_parallel(:test_deal) INTO :export_result;
+    
+    SELECT MAX_BY(export_run_id, exported_at) INTO :run_id
+    FROM TRIAL_BALANCE.export_files
+    WHERE deal_id = :test_deal;
+    
+    SELECT COUNT(*), COUNT_IF(md5 IS NULL), COALESCE(SUM(IFF(export_name = 'income_statement', row_count, 0)), 0)
+    INTO :file_count, :missing_checksums, :exported_rows
+    FROM TRIAL_BALANCE.export_files
+    WHERE export_run_id = :run_id;
+    
+    SELECT COUNT(*) INTO :expected_rows
+    FROM TRIAL_BALANCE.schedule_rows
+    WHERE deal_id = :test_deal AND statement_type = 'IS';
+    
+    IF (STARTSWITH(:export_result, 'SUCCESS') AND :file_count > 0 AND :missing_checksums = 0
+        AND :exported_rows = :expected_rows) THEN
+        CALL log_test_result(
+            'Partitioned Export Manifest',
+            'Export',
+            'PASS',
+            'Every exported file has a row count and checksum',
+            :export_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Partitioned Export Manifest',
+            'Export',
+            'FAIL',
+            'Every exported file has a row count and checksum',
+            :missing_checksums || ' of ' || :file_count || ' files without checksum; ' ||
+                :exported_rows || ' of ' || :expected_rows || ' IS rows',
+            :export_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Partitioned Export Manifest', 'Export', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 17: EXECUTION SPANS
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_execution_spans()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    test_trace_id VARCHAR DEFAULT UUID_STRING();
+    root_span_id VARCHAR DEFAULT UUID_STRING();
+    run_start TIMESTAMP DEFAULT DATEADD(second, -3, CURRENT_TIMESTAMP());
+    spans ARRAY;
+    spans_written NUMBER;
+    trace_steps NUMBER;
+    trace_failures NUMBER;
+    root_parent_links NUMBER;
+BEGIN
+    -- One root span with a successful and a failed step, buffered then written once
+    spans := ARRAY_CONSTRUCT(
+        TRIAL_BALANCE.span_record(:root_span_id, 'test_step_ok', :run_start, 'SUCCESS: step one'),
+        TRIAL_BALANCE.span_record(:root_span_id, 'test_step_failed', DATEADD(second, 1, :run_start), 'ERROR: step two'),
+        OBJECT_INSERT(TRIAL_BALANCE.span_record(NULL, 'test_run', :run_start, 'SUCCESS: run'), 'span_id', :root_span_id)
+    );
+    CALL TRIAL_BALANCE.record_spans(:test_trace_id, 'TEST_DEAL_001', :spans) INTO :spans_written;
+    
+    SELECT steps, failed_steps INTO :trace_steps, :trace_failures
+    FROM TRIAL_BALANCE.v_execution_traces
+    WHERE trace_id = :test_trace_id;
+    
+    SELECT COUNT(*) INTO :root_parent_links
+    FROM TRIAL_BALANCE.v_execution_waterfall
+    WHERE trace_id = :test_trace_id AND parent_span_id = :root_span_id AND offset_ms >= 0;
+    
+    DELETE FROM TRIAL_BALANCE.execution_spans WHERE trace_id = :test_trace_id;
+    
+    IF (:spans_written = 3 AND :trace_steps = 2 AND :trace_failures = 1 AND :root_parent_links = 2) THEN
+        CALL log_test_result(
+            'Execution Spans Recorded',
+            'Observability',
+            'PASS',
+            '3 spans in one insert; 2 steps under the root, 1 failed',
+            :spans_written || ' spans, ' || :trace_steps || ' steps, ' || :trace_failures || ' failed',
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Execution Spans Recorded',
+            'Observability',
+            'FAIL',
+            '3 spans in one insert; 2 steps under the root, 1 failed',
+            :spans_written || ' spans, ' || COALESCE(:trace_steps, 0) || ' steps, ' ||
+                COALESCE(:trace_failures, 0) || ' failed, ' || :root_parent_links || ' linked',
+            'Span trace does not match the buffered spans'
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Execution Spans Recorded', 'Observability', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 18: STEP PERFORMANCE COLLECTOR
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_step_performance()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    collect_result VARCHAR;
+    watermark_lag_minutes NUMBER;
+    orphan_steps NUMBER;
+BEGIN
+    CALL TRIAL_BALANCE.collect_step_performance() INTO :collect_result;
+    
+    SELECT DATEDIFF(minute, high_water_mark, CURRENT_TIMESTAMP()) INTO :watermark_lag_minutes
+    FROM TRIAL_BALANCE.rollup_watermarks
+    WHERE rollup_name = 'step_performance';
+    
+    -- Every collected step belongs to a recorded span
+    SELECT COUNT(*) INTO :orphan_steps
+    FROM TRIAL_BALANCE.step_performance p
+    LEFT JOIN TRIAL_BALANCE.execution_spans s
+        ON s.trace_id = p.trace_id AND s.span_id = p.span_id
+    WHERE s.span_id IS NULL;
+    
+    IF (STARTSWITH(:collect_result, 'SUCCESS') AND :watermark_lag_minutes <= TRIAL_BALANCE.get_config_number('query_history_latency_minutes') + 5
+        AND :orphan_steps = 0) THEN
+        CALL log_test_result(
+            'Step Performance Collector',
+            'Observability',
+            'PASS',
+            'Collector advances its watermark; every step row matches a span',
+            :collect_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Step Performance Collector',
+            'Observability',
+            'FAIL',
+            'Collector advances its watermark; every step row matches a span',
+            'watermark ' || COALESCE(:watermark_lag_minutes::VARCHAR, 'missing') || ' minutes behind, ' ||
+                :orphan_steps || ' orphan steps',
+            :collect_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Step Performance Collector', 'Observability', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 19: CORTEX TOKEN BUDGET
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_ai_token_budget()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    saved_budget VARIANT;
+    insights_result VARCHAR;
+    ledger_rows NUMBER;
+    cost_per_million NUMBER(10,4);
+BEGIN
+    SELECT config_value INTO :saved_budget
+    FROM TRIAL_BALANCE.system_config
+    WHERE config_key = 'ai_deal_daily_token_budget';
+    
+    -- Two months of revenue/COGS: no variances, one margin trend prompt
+    DELETE FROM TRIAL_BALANCE.trial_balance_raw WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.account_mappings WHERE deal_id = 'TEST_DEAL_001';
+    
+    INSERT INTO TRIAL_BALANCE.trial_balance_raw (
+        deal_id, deal_name, entity, period_date, account_number, account_name,
+        debit_amount, credit_amount, net_amount
+    )
+    VALUES 
+        ('TEST_DEAL_001', 'Test Company', 'TestCo', '2024-01-31', '4000', 'Revenue', 0.00, 10000.00, -10000.00),
+        ('TEST_DEAL_001', 'Test Company', 'TestCo', '2024-01-31', '5000', 'Cost of Sales', 6000.00, 0.00, 6000.00),
+        ('TEST_DEAL_001', 'Test Company', 'TestCo', '2024-02-29', '4000', 'Revenue', 0.00, 10000.00, -10000.00),
+        ('TEST_DEAL_001', 'Test Company', 'TestCo', '2024-02-29', '5000', 'Cost of Sales', 6000.00, 0.00, 6000.00);
+    
+    INSERT INTO TRIAL_BALANCE.account_mappings (deal_id, account_number, account_name, mapping_level_1)
+    VALUES 
+        ('TEST_DEAL_001', '4000', 'Revenue', 'Revenue'),
+        ('TEST_DEAL_001', '5000', 'Cost of Sales', 'Cost of Goods Sold');
+    
+    -- With no tokens left the uncached prompt is skipped, so Cortex is never called
+    UPDATE TRIAL_BALANCE.system_config
+    SET config_value = TO_VARIANT(0)
+    WHERE config_key = 'ai_deal_daily_token_budget';
+    
+    CALL TRIAL_BALANCE.generate_ai_insights('TEST_DEAL_001', TRUE) INTO :insights_result;
+    
+    UPDATE TRIAL_BALANCE.system_config
+    SET config_value = :saved_budget
+    WHERE config_key = 'ai_deal_daily_token_budget';
+    
+    SELECT COUNT(*) INTO :ledger_rows
+    FROM TRIAL_BALANCE.ai_token_usage
+    WHERE deal_id = 'TEST_DEAL_001';
+    
+    SELECT TRIAL_BALANCE.estimate_cortex_cost_usd('no-such-model', 600000, 400000) INTO :cost_per_million;
+    
+    DELETE FROM TRIAL_BALANCE.ai_insights WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.account_mappings WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.trial_balance_raw WHERE deal_id = 'TEST_DEAL_001';
+    
+    IF (STARTSWITH(:insights_result, 'WARNING') AND CONTAINS(:insights_result, '1 prompts skipped by token budget')
+        AND :ledger_rows = 0
+        AND :cost_per_million = TRIAL_BALANCE.get_config('ai_cost_per_million_tokens_usd'):default::NUMBER(10,4)) THEN
+        CALL log_test_result(
+            'Cortex Token Budget',
+            'AI Insights',
+            'PASS',
+            'Prompts over the deal budget are skipped; unlisted models use the default rate',
+            :insights_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Cortex Token Budget',
+            'AI Insights',
+            'FAIL',
+            'Prompts over the deal budget are skipped; unlisted models use the default rate',
+            :insights_result || ' (' || :ledger_rows || ' ledger rows, $' || COALESCE(:cost_per_million::VARCHAR, 'NULL') || ' per million)',
+            NULL
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        UPDATE TRIAL_BALANCE.system_config
+        SET config_value = :saved_budget
+        WHERE config_key = 'ai_deal_daily_token_budget'
+        AND :saved_budget IS NOT NULL;
+        DELETE FROM TRIAL_BALANCE.account_mappings WHERE deal_id = 'TEST_DEAL_001';
+        DELETE FROM TRIAL_BALANCE.trial_balance_raw WHERE deal_id = 'TEST_DEAL_001';
+        CALL log_test_result('Cortex Token Budget', 'AI Insights', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 20: STAGE PURGE
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_stage_purge()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    dry_run_result VARCHAR;
+    bad_stage_result VARCHAR;
+    expected_files NUMBER;
+BEGIN
+    CALL TRIAL_BALANCE.purge_stage_files('fdd_output_stage', 30, NULL, TRUE) INTO :dry_run_result;
+    CALL TRIAL_BALANCE.purge_stage_files('fdd_output_stage; DROP TABLE audit_log', 30, NULL, TRUE) INTO :bad_stage_result;
+    
+    -- The dry run refreshed the directory table, so it should count the same files
+    SELECT COUNT(*) INTO :expected_files
+    FROM DIRECTORY(@TRIAL_BALANCE.fdd_output_stage)
+    WHERE last_modified < DATEADD(day, -30, CURRENT_TIMESTAMP());
+    
+    IF (STARTSWITH(:dry_run_result, 'DRY RUN: Would remove ' || :expected_files || ' files')
+        AND STARTSWITH(:bad_stage_result, 'ERROR: Unknown stage')) THEN
+        CALL log_test_result(
+            'Stage Purge',
+            'Export',
+            'PASS',
+            'Dry run counts expired directory-table files; unknown stages rejected',
+            :dry_run_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Stage Purge',
+            'Export',
+            'FAIL',
+            'Dry run counts ' || :expected_files || ' expired files; unknown stages rejected',
+            :dry_run_result || ' / ' || :bad_stage_result,
+            NULL
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Stage Purge', 'Export', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 21: DATA RETENTION
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_data_retention()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    test_run_id VARCHAR DEFAULT UUID_STRING();
+    purge_result VARCHAR;
+    expired_left NUMBER;
+    current_left NUMBER;
+    archived_rows NUMBER;
+    run_status VARCHAR;
+BEGIN
+    DELETE FROM TRIAL_BALANCE.load_errors WHERE deal_id = 'TEST_DEAL_001';
+    
+    -- One row far past error_log_retention_days, one current
+    INSERT INTO TRIAL_BALANCE.load_errors (error_timestamp, deal_id, error_type, error_message)
+    VALUES 
+        (DATEADD(year, -10, CURRENT_TIMESTAMP()), 'TEST_DEAL_001', 'VALIDATION_ERROR', 'retention test: expired'),
+        (CURRENT_TIMESTAMP(), 'TEST_DEAL_001', 'VALIDATION_ERROR', 'retention test: current');
+    
+    CALL TRIAL_BALANCE.purge_expired_rows('load_errors', :test_run_id, TRUE) INTO :purge_result;
+    
+    SELECT COUNT_IF(error_message = 'retention test: expired'), COUNT_IF(error_message = 'retention test: current')
+    INTO :expired_left, :current_left
+    FROM TRIAL_BALANCE.load_errors
+    WHERE deal_id = 'TEST_DEAL_001';
+    
+    SELECT COUNT(*) INTO :archived_rows
+    FROM TRIAL_BALANCE.retention_archive
+    WHERE run_id = :test_run_id
+    AND source_table = 'load_errors'
+    AND record:ERROR_MESSAGE::VARCHAR = 'retention test: expired';
+    
+    SELECT MAX(status) INTO :run_status
+    FROM TRIAL_BALANCE.retention_runs
+    WHERE run_id = :test_run_id AND table_name = 'load_errors';
+    
+    DELETE FROM TRIAL_BALANCE.load_errors WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.retention_archive WHERE run_id = :test_run_id AND deal_id = 'TEST_DEAL_001';
+    
+    IF (:expired_left = 0 AND :current_left = 1 AND :archived_rows = 1 AND :run_status IN ('SUCCESS', 'PARTIAL')) THEN
+        CALL log_test_result(
+            'Data Retention',
+            'Data',
+            'PASS',
+            'Expired row archived and deleted, current row kept, run recorded',
+            :purge_result,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Data Retention',
+            'Data',
+            'FAIL',
+            'Expired row archived and deleted, current row kept, run recorded',
+            'expired left ' || :expired_left || ', current left ' || :current_left || ', archived ' || :archived_rows ||
+                ', run ' || COALESCE(:run_status, 'not recorded'),
+            :purge_result
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        DELETE FROM TRIAL_BALANCE.load_errors WHERE deal_id = 'TEST_DEAL_001';
+        CALL log_test_result('Data Retention', 'Data', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 22: CONFIG SNAPSHOT
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_config_snapshot()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    original_version NUMBER;
+    changed_version NUMBER;
+    restored_version NUMBER;
+    original_value VARIANT;
+    snapshot_value NUMBER;
+    bound_check BOOLEAN;
+    udf_check BOOLEAN;
+BEGIN
+    SELECT config_version, config_values:max_ai_insights::NUMBER
+    INTO :original_version, :snapshot_value
+    FROM TRIAL_BALANCE.v_config_snapshot;
+    
+    SELECT TRIAL_BALANCE.get_config('max_ai_insights') INTO :original_value;
+    
+    -- Validation against a resolved snapshot matches the self-resolving overload
+    SELECT TRIAL_BALANCE.validate_deal_id('DEAL@INVALID', config_values), TRIAL_BALANCE.validate_deal_id('DEAL@INVALID')
+    INTO :bound_check, :udf_check
+    FROM TRIAL_BALANCE.v_config_snapshot;
+    
+    -- Any change gets a new version; restoring the value restores the version
+    CALL TRIAL_BALANCE.update_config('max_ai_insights', TO_VARIANT(:original_value::NUMBER + 1), 'config snapshot test');
+    SELECT config_version INTO :changed_version FROM TRIAL_BALANCE.v_config_snapshot;
+    
+    CALL TRIAL_BALANCE.update_config('max_ai_insights', :original_value, 'config snapshot test');
+    SELECT config_version INTO :restored_version FROM TRIAL_BALANCE.v_config_snapshot;
+    
+    IF (:snapshot_value = :original_value::NUMBER AND :bound_check = :udf_check AND NOT :bound_check
+        AND :changed_version <> :original_version AND :restored_version = :original_version) THEN
+        CALL log_test_result(
+            'Config Snapshot',
+            'Configuration',
+            'PASS',
+            'Snapshot values match system_config and config_version tracks changes',
+            'version ' || :original_version || ' -> ' || :changed_version || ' -> ' || :restored_version,
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Config Snapshot',
+            'Configuration',
+            'FAIL',
+            'Snapshot values match system_config and config_version tracks changes',
+            'max_ai_insights ' || COALESCE(:snapshot_value::VARCHAR, 'NULL') || ' vs ' || COALESCE(:original_value::VARCHAR, 'NULL') ||
+                ', version ' || :original_version || ' -> ' || COALESCE(:changed_version::VARCHAR, 'NULL') ||
+                ' -> ' || COALESCE(:restored_version::VARCHAR, 'NULL'),
+            NULL
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL TRIAL_BALANCE.update_config('max_ai_insights', :original_value, 'config snapshot test');
+        CALL log_test_result('Config Snapshot', 'Configuration', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 23: DATA QUALITY RULES
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_dq_rule_engine()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    enabled_rules NUMBER;
+    checks_written NUMBER;
+    period_rows NUMBER;
+    gap_metric NUMBER;
+    unmapped_metric NUMBER;
+BEGIN
+    DELETE FROM TRIAL_BALANCE.trial_balance_raw WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.account_mappings WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.data_quality_checks WHERE deal_id = 'TEST_DEAL_001';
+    
+    -- January and March only (one missing month); account 9999 has no mapping
+    INSERT INTO TRIAL_BALANCE.trial_balance_raw (
+        deal_id, deal_name, entity, period_date, account_number, account_name,
+        debit_amount, credit_amount, net_amount
+    )
+    VALUES 
+        ('TEST_DEAL_001', 'Test Company', 'TestCo', '2024-01-31', '4000', 'Revenue', 0.00, 10000.00, -10000.00),
+        ('TEST_DEAL_001', 'Test Company', 'TestCo', '2024-01-31', '9999', 'Suspense', 500.00, 0.00, 500.00),
+        ('TEST_DEAL_001', 'Test Company', 'TestCo', '2024-03-31', '4000', 'Revenue', 0.00, 12000.00, -12000.00);
+    
+    INSERT INTO TRIAL_BALANCE.account_mappings (deal_id, account_number, account_name, mapping_level_1)
+    VALUES ('TEST_DEAL_001', '4000', 'Revenue', 'Revenue');
+    
+    CALL TRIAL_BALANCE.validate_data_quality('TEST_DEAL_001', TRUE);
+    
+    SELECT COUNT(*) INTO :enabled_rules FROM TRIAL_BALANCE.dq_rules WHERE is_enabled;
+    
+    SELECT 
+        COUNT(*),
+        MAX(IFF(check_name = 'Period Continuity', actual_value:value::NUMBER, NULL)),
+        MAX(IFF(check_name = 'Account Mapping Completeness', actual_value:value::NUMBER, NULL))
+    INTO :checks_written, :gap_metric, :unmapped_metric
+    FROM TRIAL_BALANCE.data_quality_checks
+    WHERE deal_id = 'TEST_DEAL_001';
+    
+    SELECT COUNT(*) INTO :period_rows FROM TRIAL_BALANCE.dq_period_metrics WHERE deal_id = 'TEST_DEAL_001';
+    
+    -- Cleanup
+    DELETE FROM TRIAL_BALANCE.trial_balance_raw WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.account_mappings WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.data_quality_checks WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.dq_period_metrics WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.dq_account_baselines WHERE deal_id = 'TEST_DEAL_001';
+    DELETE FROM TRIAL_BALANCE.dq_check_state WHERE deal_id = 'TEST_DEAL_001';
+    
+    IF (:checks_written = :enabled_rules AND :period_rows = 2 AND :gap_metric = 1 AND :unmapped_metric = 1) THEN
+        CALL log_test_result(
+            'Data Quality Rules',
+            'Data',
+            'PASS',
+            'One check per enabled rule, metrics per period',
+            :checks_written || ' checks, ' || :period_rows || ' periods',
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Data Quality Rules',
+            'Data',
+            'FAIL',
+            :enabled_rules || ' checks, 2 periods, 1 missing month, 1 unmapped account',
+            :checks_written || ' checks, ' || :period_rows || ' periods, ' ||
+                COALESCE(:gap_metric::VARCHAR, 'NULL') || ' missing months, ' ||
+                COALESCE(:unmapped_metric::VARCHAR, 'NULL') || ' unmapped accounts',
+            NULL
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        DELETE FROM TRIAL_BALANCE.trial_balance_raw WHERE deal_id = 'TEST_DEAL_001';
+        DELETE FROM TRIAL_BALANCE.account_mappings WHERE deal_id = 'TEST_DEAL_001';
+        CALL log_test_result('Data Quality Rules', 'Data', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 24: HEALTH PROBE
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_health_probe()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    check_count NUMBER;
+    check_names NUMBER;
+    incomplete_checks NUMBER;
+    objects_passed BOOLEAN;
+    probe_tb_rows NUMBER;
+    actual_tb_rows NUMBER;
+BEGIN
+    -- Runs the probe end to end: the four concurrent jobs and their collection
+    CALL TRIAL_BALANCE.system_health_check();
+    
+    SELECT 
+        COUNT(*),
+        COUNT(DISTINCT "CHECK_NAME"),
+        COUNT_IF("CATEGORY" IS NULL OR "PASSED" IS NULL OR "SEVERITY" IS NULL OR "MESSAGE" IS NULL),
+        BOOLAND_AGG(IFF("CATEGORY" = 'Database Objects', "PASSED", TRUE)),
+        MAX(IFF("CHECK_NAME" = 'Trial Balance Rows', "OBSERVED", NULL))
+    INTO :check_count, :check_names, :incomplete_checks, :objects_passed, :probe_tb_rows
+    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+    
+    -- The metadata row count must match a real count
+    SELECT COUNT(*) INTO :actual_tb_rows FROM TRIAL_BALANCE.trial_balance_raw;
+    
+    IF (:check_count = 9 AND :check_names = 9 AND :incomplete_checks = 0
+        AND :objects_passed AND :probe_tb_rows = :actual_tb_rows) THEN
+        CALL log_test_result(
+            'Health Probe',
+            'Observability',
+            'PASS',
+            '9 complete checks, object checks pass, metadata row count matches',
+            :check_count || ' checks, ' || :probe_tb_rows || ' trial balance rows',
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Health Probe',
+            'Observability',
+            'FAIL',
+            '9 complete checks, object checks pass, ' || :actual_tb_rows || ' trial balance rows',
+            :check_count || ' checks (' || :check_names || ' distinct, ' || :incomplete_checks || ' incomplete), ' ||
+                'object checks ' || IFF(:objects_passed, 'pass', 'fail') || ', ' ||
+                COALESCE(:probe_tb_rows::VARCHAR, 'NULL') || ' trial balance rows',
+            NULL
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Health Probe', 'Observability', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 25: STAGE FILE DEAL MATCHING
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_stage_file_deal_match()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    mismatches NUMBER;
+BEGIN
+    -- HL_001 is a suffix of DEAL_HL_001; neither deal may match the other's files
+    SELECT COUNT_IF(TRIAL_BALANCE.stage_file_deal_match(path, deal) <> expected)
+    INTO :mismatches
+    FROM (
+        SELECT column1 AS path, column2 AS deal, column3 AS expected
+        FROM VALUES
+            ('database_tab_DEAL_HL_001.csv', 'DEAL_HL_001', TRUE),
+            ('database_tab_DEAL_HL_001.csv', 'HL_001', FALSE),
+            ('database_tab_HL_001.csv', 'HL_001', TRUE),
+            ('database_tab_HL_001.csv', 'DEAL_HL_001', FALSE),
+            ('fdd_workbook_HL_001.xlsx', 'HL_001', TRUE),
+            ('exports/DEAL_HL_001/database_tab/data_0_0_0.csv.gz', 'DEAL_HL_001', TRUE),
+            ('exports/DEAL_HL_001/database_tab/data_0_0_0.csv.gz', 'HL_001', FALSE),
+            ('exports/HL_001/manifest.json', 'HL_001', TRUE),
+            ('archive/database_tab_HL_001.csv', 'HL_001', FALSE),
+            ('notes_HL_001.csv', 'HL_001', FALSE)
+    );
+    
+    IF (:mismatches = 0) THEN
+        CALL log_test_result(
+            'Stage File Deal Matching',
+            'Export',
+            'PASS',
+            'Deal filters match only that deal''s export names',
+            '0 mismatches',
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Stage File Deal Matching',
+            'Export',
+            'FAIL',
+            '0 mismatches',
+            :mismatches || ' mismatches',
+            NULL
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Stage File Deal Matching', 'Export', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
+-- ============================================================================
+-- TEST 26: TRACED STEP AUDIT ROWS
+-- ============================================================================
+
+CREATE OR REPLACE PROCEDURE test_traced_step_audit()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    test_deal VARCHAR;
+    test_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP();
+    traced_result VARCHAR;
+    untraced_result VARCHAR;
+    traced_rows NUMBER;
+    untraced_rows NUMBER;
+BEGIN
+    SELECT MIN(deal_id) INTO :test_deal FROM TRIAL_BALANCE.account_mappings WHERE is_active = TRUE;
+    
+    -- Called with a trace id (as generate_fdd_schedules does), the step leaves no audit_log row
+    CALL TRIAL_BALANCE.build_schedules(:test_deal, NULL, UUID_STRING()) INTO :traced_result;
+    SELECT COUNT(*) INTO :traced_rows
+    FROM TRIAL_BALANCE.audit_log
+    WHERE procedure_name = 'build_schedules' AND deal_id = :test_deal AND start_time >= :test_start;
+    
+    CALL TRIAL_BALANCE.build_schedules(:test_deal) INTO :untraced_result;
+    SELECT COUNT(*) INTO :untraced_rows
+    FROM TRIAL_BALANCE.audit_log
+    WHERE procedure_name = 'build_schedules' AND deal_id = :test_deal AND start_time >= :test_start;
+    
+    IF (STARTSWITH(:traced_result, 'SUCCESS') AND STARTSWITH(:untraced_result, 'SUCCESS')
+        AND :traced_rows = 0 AND :untraced_rows = 1) THEN
+        CALL log_test_result(
+            'Traced Steps Skip Audit Rows',
+            'Observability',
+            'PASS',
+            'No audit_log row when traced, one when called directly',
+            :traced_rows || ' traced, ' || :untraced_rows || ' direct',
+            NULL
+        );
+        RETURN 'PASS';
+    ELSE
+        CALL log_test_result(
+            'Traced Steps Skip Audit Rows',
+            'Observability',
+            'FAIL',
+            'No audit_log row when traced, one when called directly',
+            :traced_rows || ' after traced call (' || :traced_result || '), ' ||
+                :untraced_rows || ' after direct call (' || :untraced_result || ')',
+            NULL
+        );
+        RETURN 'FAIL';
+    END IF;
+EXCEPTION
+    WHEN OTHER THEN
+        CALL log_test_result('Traced Steps Skip Audit Rows', 'Observability', 'ERROR', NULL, NULL, SQLERRM);
+        RETURN 'ERROR';
+END;
+$$;
+
 -- ============================================================================
 -- MASTER TEST RUNNER
 -- ============================================================================
@@ -431,6 +1677,25 @@ BEGIN
     CALL test_sql_injection_prevention();
     CALL test_audit_logging();
     CALL test_configuration_functions();
+    CALL test_operational_rollups();
+    CALL test_ai_cache_eviction();
+    CALL test_variance_index();
+    CALL test_database_tab_periods();
+    CALL test_schedule_trial_balance();
+    CALL test_schedule_builder();
+    CALL test_schedule_values();
+    CALL test_workbook_export();
+    CALL test_partitioned_export();
+    CALL test_execution_spans();
+    CALL test_step_performance();
+    CALL test_ai_token_budget();
+    CALL test_stage_purge();
+    CALL test_data_retention();
+    CALL test_config_snapshot();
+    CALL test_dq_rule_engine();
+    CALL test_health_probe();
+    CALL test_stage_file_deal_match();
+    CALL test_traced_step_audit();
     
     -- Return summary
     result_cursor := (
@@ -492,6 +1757,25 @@ EXPECTED OUTPUT:
 ✓ SQL Injection Prevention - PASSED
 ✓ Audit Logging Functionality - PASSED
 ✓ Configuration Functions - PASSED
+✓ Operational Rollups Reconcile - PASSED
+✓ AI Cache Eviction - PASSED
+✓ Variance Index Reconciles - PASSED
+✓ Database Tab Period Window - PASSED
+✓ Schedule Trial Balance Reconciles - PASSED
+✓ Schedule Builder Places All Accounts - PASSED
+✓ Schedule Values Roll Up - PASSED
+✓ XLSX Workbook Export - PASSED
+✓ Partitioned Export Manifest - PASSED
+✓ Execution Spans Recorded - PASSED
+✓ Step Performance Collector - PASSED
+✓ Cortex Token Budget - PASSED
+✓ Stage Purge - PASSED
+✓ Data Retention - PASSED
+✓ Config Snapshot - PASSED
+✓ Data Quality Rules - PASSED
+✓ Health Probe - PASSED
+✓ Stage File Deal Matching - PASSED
+✓ Traced Steps Skip Audit Rows - PASSED
 
 All tests should PASS for production-ready deployment.
 